@@ -1,3 +1,17 @@
-from . import bot, ccs, codes
+import importlib
 
-__all__ = ['bot', 'ccs', 'codes']
\ No newline at end of file
+from . import codes
+
+__all__ = ['bot', 'ccs', 'codes']
+
+
+# bot (websocket-client, rel) and ccs (websockets, asyncio) are imported on first use,
+# so that importing one doesn't load the other
+def __getattr__(name):
+    if name in ('bot', 'ccs'):
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
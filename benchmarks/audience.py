@@ -0,0 +1,59 @@
+"""
+Cost of finding the recipients of a send, from the `DatabaseAgent` roster
+as the send helpers did (a read of the agent, then a set difference for
+"everyone but the sender") against the cached segments of `Audience`.
+
+The channel has `n_members` members and is one of 200 channels of
+`n_members` in the dbfile. Each sender in turn is "the sender", as in a
+game where everyone plays; with more members than cached all-but-one
+segments, those are rebuilt, by slicing the roster, on every call.
+
+Run with `python -m socialization.benchmarks.audience [n_members]`.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+from ..ccs.audience import Audience
+from ..ccs.database_agent import DatabaseAgent
+
+N_CALLS = 20000
+
+
+def _per_call(function, n=N_CALLS):
+    started_at = time.perf_counter()
+    for i in range(n):
+        function(i)
+    return (time.perf_counter() - started_at) / n
+
+
+def main(n_members=200):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'goddess.json')
+        user_list = {f'CH{c:04}': [f'user{c}-{m}' for m in range(n_members)] for c in range(200)}
+        with open(path, 'w') as f:
+            json.dump({'user_list': user_list, 'whistle': {}}, f)
+        agent = DatabaseAgent(path)
+        audience = Audience(agent)
+        channel_id = 'CH0000'
+        members = user_list[channel_id]
+
+        def sender(i):
+            return members[i % n_members]
+
+        rows = [
+            ('everyone, agent', lambda i: agent.get_channel_user_list(channel_id)),
+            ('everyone, audience', lambda i: audience.everyone(channel_id)),
+            ('all but sender, agent', lambda i: list(set(agent.get_channel_user_list(channel_id)) - {sender(i)})),
+            ('all but sender, audience', lambda i: audience.all_except(channel_id, sender(i))),
+        ]
+        print(f'{n_members} members, {audience.MAX_EXCEPTS} all-but-one segments cached per channel')
+        print(f'{"recipients":<26} {"us/call":>9}')
+        for name, function in rows:
+            print(f'{name:<26} {_per_call(function) * 1e6:>9.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
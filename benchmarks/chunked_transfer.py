@@ -0,0 +1,77 @@
+"""
+Peak memory of a `GoddessService` forwarding a MESSAGE_UP_FILE body of
+`size_mb` MB, sent whole against sent in chunks (see `transfer`).
+
+Whole, the body is in memory as the text of the frame, in the parsed dict
+and in the frame sent down. In chunks, the service never holds more than
+one chunk; the frames are made and fed one at a time, as they would come
+from the socket. Peaks are measured with tracemalloc, from the frame text
+received to the frames sent, which are dropped at once.
+
+Run with `python -m socialization.benchmarks.chunked_transfer [size_mb]`.
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .. import codes
+from ..ccs import GoddessService
+from ..transfer import OutgoingTransfer
+
+
+class _Socket:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send(self, data):
+        self.bytes_sent += len(data)
+
+
+def _frame(extra):
+    return json.dumps({'code': codes.MESSAGE_TO_CCS, 'extra': dict(
+        extra, type_code=codes.MESSAGE_UP_FILE, channel_id='CH0000', from_user_id='user0',
+        to_user_ids=['user0', 'user1'], msg_id=1, origin='Bot')})
+
+
+async def _forward(service, messages):
+    ws = _Socket()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    for message in messages:
+        await service._handle_data_dict_core(json.loads(message), ws, '')
+    elapsed = time.perf_counter() - started_at
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed, ws.bytes_sent
+
+
+def main(size_mb=20):
+    body = os.urandom(size_mb * 1024 * 1024 * 3 // 4).hex()[:size_mb * 1024 * 1024]
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            service = GoddessService(0, uri='', token='', dbfile=os.path.join(directory, 'goddess.json'))
+        # the sender reads the body as it sends, encoded beforehand
+        transfer = OutgoingTransfer(body, window=10 ** 9)
+        # messages are made lazily, so that only the one being handled is in memory
+        rows = [
+            ('whole', lambda: iter([_frame({'msg_body': body})])),
+            (f'{transfer.count} chunks', lambda: (_frame({'msg_body': msg_body, 'transfer': chunk})
+                                                  for msg_body, chunk in transfer.chunks())),
+        ]
+        print(f'{size_mb} MB body')
+        print(f'{"sent":<12} {"peak MB":>8} {"ms":>8} {"MB down":>8}')
+        # the service prints the frames it handles, so output must not be kept
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results = [(name, asyncio.run(_forward(service, messages()))) for name, messages in rows]
+        for name, (peak, elapsed, sent) in results:
+            print(f'{name:<12} {peak / 1e6:>8.1f} {elapsed * 1e3:>8.1f} {sent / 1e6:>8.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
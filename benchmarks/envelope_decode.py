@@ -0,0 +1,66 @@
+"""
+Cost of receiving a frame with full `json.loads` versus envelope-first
+decoding (`envelope.decode`), for frames that are dropped because no handler
+wants them and for frames that are handled.
+
+Frames are `COMMAND_TO_CCS` with a small extra, and `MESSAGE_TO_CCS`
+carrying a large `msg_body` (e.g. an inlined image).
+
+Run with `python -m socialization.benchmarks.envelope_decode [n_frames]`.
+"""
+import json
+import sys
+import time
+
+from .. import codes
+from ..envelope import decode
+
+
+def _frames(n, body_size):
+    if body_size:
+        return [json.dumps({
+            'code': codes.MESSAGE_TO_CCS,
+            'extra': {
+                'type_code': codes.MESSAGE_UP_IMAGE,
+                'channel_id': f'CH{i % 50:04d}',
+                'from_user_id': f'user{i % 1000}',
+                'to_user_ids': [f'user{j}' for j in range(10)],
+                'temp_msg_id': i,
+                'msg_body': 'x' * body_size,
+                'origin': 'Bot',
+            }
+        }) for i in range(n)]
+    return [json.dumps({
+        'code': codes.COMMAND_TO_CCS,
+        'extra': {
+            'type_code': codes.NOTICE_USER_JOINED,
+            'channel_id': f'CH{i % 50:04d}',
+            'user_id': f'user{i % 1000}',
+        }
+    }) for i in range(n)]
+
+
+def _time(frames, receive):
+    start = time.perf_counter()
+    for frame in frames:
+        receive(frame)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+def _handle(data):
+    return data['extra']['channel_id']
+
+
+def main(n=20000):
+    print(f'{n} frames, us/frame')
+    print(f'{"frame":<16} {"json.loads":>11} {"drop":>8} {"handle":>8}')
+    for name, body_size in (('command', 0), ('image 64KB', 64 * 1024)):
+        frames = _frames(n, body_size)
+        full = _time(frames, lambda frame: _handle(json.loads(frame)))
+        drop = _time(frames, lambda frame: decode(frame, lambda code, type_code: False))
+        handle = _time(frames, lambda frame: _handle(decode(frame)))
+        print(f'{name:<16} {full:>11.2f} {drop:>8.2f} {handle:>8.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,123 @@
+"""
+Throughput of a Goddess run by `GoddessSupervisor` on 1, 2, 4... worker
+processes, up to the number of CPU cores (at least 2).
+
+Client processes pose as Social: each opens several connections to the
+shared port and keeps a window of text messages (MESSAGE_TO_CCS /
+MESSAGE_UP_TEXT) in flight on each, counting the MESSAGE_FROM_CCS coming
+back. The kernel spreads the connections across workers. Output of the
+services is silenced; clients run on the same machine, so they take
+cores from the workers.
+
+Run with `python -m socialization.benchmarks.goddess_workers [seconds]`.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import websockets
+
+from .. import codes
+from ..ccs import GoddessService, GoddessSupervisor
+
+N_CONNECTIONS = 8   # per client process
+WINDOW = 16         # messages in flight per connection
+
+
+class _Factory:
+    # picklable factory of silenced services sharing one dbfile
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, index):
+        sys.stdout = open(os.devnull, 'w')
+        return GoddessService(0, uri='', token='', dbfile=os.path.join(self.directory, 'goddess.json'),
+                              shared_db=True)
+
+
+def _message(client, connection, n):
+    return json.dumps({'code': codes.MESSAGE_TO_CCS, 'extra': {
+        'type_code': codes.MESSAGE_UP_TEXT, 'channel_id': f'CH{client}-{connection}', 'from_user_id': 'u0',
+        'to_user_ids': ['u0', 'u1', 'u2'], 'origin': 'benchmark', 'msg_id': n, 'msg_body': 'hello ' * 8,
+    }})
+
+
+async def _connection(uri, client, connection, start_at, end_at):
+    async with websockets.connect(uri, ping_interval=None) as ws:
+        await asyncio.sleep(max(start_at - time.time(), 0))
+        n = 0
+        for _ in range(WINDOW):
+            n += 1
+            await ws.send(_message(client, connection, n))
+        replies = 0
+        while time.time() < end_at:
+            try:
+                await asyncio.wait_for(ws.recv(), end_at - time.time())
+            except asyncio.TimeoutError:
+                break
+            replies += 1
+            n += 1
+            await ws.send(_message(client, connection, n))
+        return replies
+
+
+def _client(uri, client, start_at, end_at, results):
+    async def run():
+        counts = await asyncio.gather(*(_connection(uri, client, i, start_at, end_at) for i in range(N_CONNECTIONS)))
+        return sum(counts)
+    results.put(asyncio.run(run()))
+
+
+def _measure(n_workers, n_clients, duration, directory):
+    supervisor = GoddessSupervisor(_Factory(directory), n_workers=n_workers, port=0, stats_interval=0.5)
+    supervisor.on_stats = lambda stats: None
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            supervisor.start()
+            time.sleep(1)   # workers listening
+            uri = f'ws://localhost:{supervisor.port}'
+            results = multiprocessing.Queue()
+            start_at = time.time() + 1
+            end_at = start_at + duration
+            clients = [multiprocessing.Process(target=_client, args=(uri, i, start_at, end_at, results))
+                       for i in range(n_clients)]
+            for process in clients:
+                process.start()
+            while time.time() < end_at + 0.5:
+                supervisor.poll(0.2)
+            replies = sum(results.get(timeout=30) for _ in clients)
+            for process in clients:
+                process.join()
+            supervisor.poll(1)
+            stats = supervisor.get_stats()
+        finally:
+            supervisor.shutdown()
+            sys.stdout = stdout
+    frames = [stats['workers'].get(i, {}).get('frames_received', 0) for i in range(n_workers)]
+    return replies / duration, frames
+
+
+def main(duration=5):
+    cores = multiprocessing.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 <= max(cores, 2):
+        counts.append(counts[-1] * 2)
+    n_clients = max(cores // 2, 1)
+    print(f'{cores} cores, {n_clients} client processes x {N_CONNECTIONS} connections x {WINDOW} in flight, '
+          f'{duration}s per run')
+    print(f'{"workers":>8} {"msg/s":>10} {"speedup":>8}  frames per worker')
+    base = None
+    with tempfile.TemporaryDirectory() as directory:
+        for n_workers in counts:
+            rate, frames = _measure(n_workers, n_clients, duration, directory)
+            base = base or rate
+            print(f'{n_workers:>8} {rate:>10.0f} {rate / base:>7.2f}x  {frames}')
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5)
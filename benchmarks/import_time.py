@@ -0,0 +1,64 @@
+"""
+Import time of the entry points of the package, each in a fresh
+interpreter run with `-X importtime`: total time, number of modules loaded
+and which of the heavy stacks (websockets/asyncio for GoddessService and
+AsyncBaseBot, websocket-client/rel for GodService and BaseBot) came along.
+What the interpreter imports at startup (`-c pass`) is left out. Best of
+`runs` runs per statement.
+
+Run with `python -m socialization.benchmarks.import_time [runs]`.
+"""
+import os
+import subprocess
+import sys
+
+PACKAGE = __package__.split('.')[0]
+STATEMENTS = [
+    f'import {PACKAGE}',
+    f'from {PACKAGE}.ccs import GoddessService',
+    f'from {PACKAGE}.ccs import GodService',
+    f'from {PACKAGE}.bot import BaseBot',
+    f'from {PACKAGE}.bot import AsyncBaseBot',
+    f'from {PACKAGE}.frames import decode_frame',
+]
+STACKS = ['websockets', 'asyncio', 'websocket', 'rel', 'multiprocessing']
+
+
+def _import_time(statement):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            env=env, capture_output=True, text=True, check=True)
+    total = 0
+    modules = set()
+    # lines are 'import time: self [us] | cumulative | name', nested names indented
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('   '):
+            total += int(cumulative)
+        modules.add(name.strip())
+    return total, modules
+
+
+def _best(statement, runs):
+    best = None
+    for _ in range(runs):
+        total, modules = _import_time(statement)
+        best = (total, modules) if best is None or total < best[0] else best
+    return best
+
+
+def main(runs=5):
+    startup_total, startup_modules = _best('pass', runs)
+    print(f'{"statement":<46} {"ms":>7} {"modules":>8}  stacks loaded')
+    for statement in STATEMENTS:
+        total, modules = _best(statement, runs)
+        total -= startup_total
+        modules -= startup_modules
+        stacks = [stack for stack in STACKS if stack in modules]
+        print(f'{statement:<46} {total / 1e3:>7.1f} {len(modules):>8}  {", ".join(stacks) or "-"}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
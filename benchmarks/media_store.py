@@ -0,0 +1,72 @@
+"""
+Bytes a `GoddessService` sends down for image broadcasts, the images sent
+inline every time against sent by hash to users who already got them (see
+`media`).
+
+A game in a channel of `n_members` shows images from a deck of 12 (cards,
+boards...) of 20 kB each, 500 times in random order, a member joining
+every 50 broadcasts. Inline, from a service keeping no media, every frame
+carries the image; by hash, from one with a `media_dir`, only the first one
+for each member does.
+
+Run with `python -m socialization.benchmarks.media_store [n_members]`.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from ..ccs import GoddessService
+
+N_IMAGES = 12
+N_BROADCASTS = 500
+
+
+class _Socket:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send(self, data):
+        self.bytes_sent += len(data)
+
+
+async def _broadcast(service, images):
+    ws = _Socket()
+    rng = random.Random(0)
+    started_at = time.perf_counter()
+    for i in range(N_BROADCASTS):
+        if i and i % 50 == 0:
+            service.agent.join_channel('CH0000', f'late{i}')
+        await service.broadcast_command_image('CH0000', ws, rng.choice(images))
+    return ws.bytes_sent, time.perf_counter() - started_at
+
+
+def main(n_members=50):
+    images = [os.urandom(20 * 1024) for _ in range(N_IMAGES)]
+    print(f'{n_members} members, {N_BROADCASTS} broadcasts of {N_IMAGES} images of 20 kB')
+    print(f'{"sent":<10} {"MB down":>8} {"ms":>8} {"hit ratio":>10} {"MB saved":>9}')
+    for by_hash in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'goddess.json')
+            with open(path, 'w') as f:
+                json.dump({'user_list': {'CH0000': [f'user{m}' for m in range(n_members)]}, 'whistle': {}}, f)
+            # the service prints the frames it handles, so output must not be kept
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                media_dir = os.path.join(directory, 'media') if by_hash else None
+                service = GoddessService(0, uri='', token='', dbfile=path, media_dir=media_dir)
+                sent, elapsed = asyncio.run(_broadcast(service, images))
+            if by_hash:
+                stats = service.media.get_stats()
+                hit_ratio, saved = f'{stats["hit_ratio"]:.2f}', f'{stats["bytes_saved"] / 1e6:.1f}'
+            else:
+                hit_ratio, saved = '-', '0.0'
+            print(f'{"by hash" if by_hash else "inline":<10} {sent / 1e6:>8.1f} {elapsed * 1e3:>8.1f} '
+                  f'{hit_ratio:>10} {saved:>9}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,97 @@
+"""
+Allocation benchmark of inbound messages for a bot receiving 100k messages
+per minute.
+
+Each message goes through the bot receive path (`json.loads` then
+`message_from_raw`) and a handler reading `body`, `sender` and `channel`.
+The benchmark measures the time per message and the memory a minute of
+messages keeps alive. It compares three cases:
+
+    eager   : the previous `Message`, seven fields copied into a `__dict__` plus `raw`
+    lazy    : slotted `Message` reading fields from the raw frame on access
+    decoded : lazy, then `decode()` to drop the raw frame
+
+Run with `python -m socialization.benchmarks.message_alloc [n_messages]`.
+"""
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from .. import codes
+from ..bot.message import MessageType, message_from_raw
+
+
+class _EagerMessage():
+    # the previous Message, kept here as baseline
+    def __init__(self, type, body=None, channel='', to=[], sender='', recipient_count=0,
+                 id='', origin='Bot', raw=None) -> None:
+        self.type = type
+        self.body = body
+        self.channel = channel
+        self.to = to
+        self.sender = sender
+        self.recipient_count = recipient_count
+        self.id = id
+        self.origin = origin
+        self.raw = raw
+
+
+def _eager_message_from_raw(raw_data):
+    return _EagerMessage(type=MessageType.TEXT, body=raw_data['extra']['msg_body'], channel=raw_data['extra']['channel_id'],
+                         sender=raw_data['extra']['from_user_id'], recipient_count=raw_data['extra']['n_recipients'],
+                         id=raw_data['extra']['msg_id'], origin=raw_data['extra']['origin'], raw=raw_data)
+
+
+def _frames(n):
+    return [json.dumps({
+        'code': codes.MESSAGE_DOWN_TEXT,
+        'extra': {
+            'channel_id': f'CH{i % 50:04d}',
+            'from_user_id': f'user{i % 1000}',
+            'to_user_ids': [],
+            'msg_id': f'msg{i}',
+            'msg_body': f'hello number {i}, how are you doing today?',
+            'n_recipients': 12,
+            'origin': 'Bot',
+        }
+    }) for i in range(n)]
+
+
+def _handle(msg):
+    return len(msg.body) + len(msg.sender) + len(msg.channel)
+
+
+def _run(frames, wrap):
+    kept = []
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for frame in frames:
+        msg = wrap(json.loads(frame))
+        _handle(msg)
+        kept.append(msg)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, current, peak, kept
+
+
+def main(n=100000):
+    frames = _frames(n)
+    cases = (
+        ('eager', _eager_message_from_raw),
+        ('lazy', message_from_raw),
+        ('decoded', lambda raw: message_from_raw(raw).decode()),
+    )
+    print(f'{n} messages (one minute at 100k/min), fields read: body, sender, channel')
+    print(f'{"case":<8} {"us/msg":>8} {"retained MB":>12} {"peak MB":>9} {"bytes/msg":>10}')
+    for name, wrap in cases:
+        elapsed, current, peak, kept = _run(frames, wrap)
+        print(f'{name:<8} {elapsed / n * 1e6:>8.2f} {current / 2**20:>12.2f} {peak / 2**20:>9.2f} {current / n:>10.0f}')
+        del kept
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
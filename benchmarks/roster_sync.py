@@ -0,0 +1,102 @@
+"""
+Login-to-ready time of a `BaseBot` in `n_channels` channels: from `start`
+(login, then the channel list) until the user list of every channel has
+arrived (`on_user_lists_ready`).
+
+The bot talks to a `StandInSocial` fronting a `GoddessService`, both in
+a thread of this process, each channel having the bot and 5 other
+members. One channel at a time, the bot sends a COMMAND_UP_FETCH_CHANNEL_USER_LIST
+per channel, answered by the Goddess through Social; in bulk, Social
+answers OPERATION_GET_CHANNEL_USER_LISTS by pages of 200 channels. The
+first row goes through a send queue rate limited to 50 frames per second
+after a burst of 100, as a bot sparing a throttling server would; the
+others through the default one, without limits, to tell the round trips
+from the rate limit.
+
+Run with `python -m socialization.benchmarks.roster_sync [n_channels]`.
+"""
+import asyncio
+import contextlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import rel
+
+from ..bot import BaseBot
+from ..bot.send_scheduler import SendScheduler
+from ..ccs import GoddessService
+from ..loadtest.social import StandInSocial
+
+
+class _Bot(BaseBot):
+    def on_user_lists_ready(self):
+        self.ready_at = time.perf_counter()
+        self.close()
+        rel.abort()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def _serve(n_channels, directory, started):
+    loop = asyncio.new_event_loop()
+
+    async def start():
+        social = StandInSocial(channels=[f'CH{c:04}' for c in range(n_channels)])
+        for members in social.channels.values():
+            members.update(dict.fromkeys(['bot'] + [f'user{m}' for m in range(5)]))
+        await social.start()
+        port = _free_port()
+        goddess = GoddessService(port, uri='', token='', dbfile=os.path.join(directory, 'goddess.json'))
+        await goddess.get_server_coroutine()
+        await social.connect_ccs(f'ws://localhost:{port}')
+        # the user list and command list the Goddess sends down on each take-over, before the bot logs in
+        while sum(histogram.count for histogram in social.fanout.values()) < 2 * n_channels:
+            await asyncio.sleep(0.05)
+        started.append(social)
+
+    loop.run_until_complete(start())
+    loop.run_forever()
+
+
+def _login_to_ready(uri, roster_page_size, limited=False):
+    bot = _Bot('bot', 'password', path=uri, roster_page_size=roster_page_size, ping_interval=0)
+    if limited:
+        bot.send_scheduler = SendScheduler(rate=50, burst=100)
+    started_at = time.perf_counter()
+    bot.start()
+    rel.dispatch()
+    return bot.ready_at - started_at, len(bot.user_lists)
+
+
+def main(n_channels=1000):
+    rows = [
+        ('one at a time, 50 per s', 0, True),
+        ('one channel at a time', 0, False),
+        ('bulk, 200 per page', 200, False),
+    ]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # services and bots print every frame, so output must not be kept
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = []
+            threading.Thread(target=_serve, args=(n_channels, directory, started), daemon=True).start()
+            while not started:
+                time.sleep(0.05)
+            for name, roster_page_size, limited in rows:
+                results.append((name, _login_to_ready(started[0].uri, roster_page_size, limited)))
+    print(f'bot in {n_channels} channels of 6 members')
+    print(f'{"user lists fetched":<30} {"s to ready":>10} {"lists":>6}')
+    for name, (elapsed, n_lists) in results:
+        print(f'{name:<30} {elapsed:>10.2f} {n_lists:>6}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,163 @@
+"""
+Dispatch cost of `Router` against the if/elif chains it replaces.
+
+    services : the former `GodService._handle_command_to_ccs`, range checks on
+               `type_code` then a lookup in one of the `*_func_map` dicts
+    bot      : the former `JSONSocketUser._handle_data_dict`, range checks on `code`
+
+Each is run with the router alone, then with `Timing` and `CatchErrors`
+middlewares. Codes are drawn evenly from the registered handlers; the best
+of 5 runs is reported. The time `compile` takes, after each change of the
+routes, and the memory its tables hold are reported too.
+
+Run with `python -m socialization.benchmarks.router_dispatch [n_dispatches]`.
+"""
+import sys
+import time
+import tracemalloc
+
+from .. import codes
+from ..router import CatchErrors, Router, Timing
+
+
+def _handler(*args):
+    return None
+
+
+class _ChainService:
+    # the former dispatch of GodService, kept here as baseline
+    def __init__(self):
+        self.basic_command_func_map = {
+            codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST: _handler,
+            codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST: _handler,
+            codes.COMMAND_UP_FETCH_RECIPIENT_LIST: _handler,
+        }
+        self.notice_func_map = {
+            codes.NOTICE_USER_JOINED: _handler,
+            codes.NOTICE_USER_LEFT: _handler,
+            codes.NOTICE_GET_CHANNEL_USER_LIST: _handler,
+            codes.NOTICE_TAKE_OVER: _handler,
+            codes.NOTICE_RELEASE: _handler,
+            codes.NOTICE_COPY_CCS: _handler,
+        }
+        self.feature_func_map = {90000 + i: _handler for i in range(1, 11)}
+
+    def _handle_command_to_ccs(self, type_code, data, ws, path):
+        if 20000 <= type_code <= 29999:
+            self._handle_basic_command(type_code, data, ws, path)
+        elif 80000 <= type_code <= 89999:
+            self._handle_notice(type_code, data, ws, path)
+        elif 90000 <= type_code <= 99999:
+            self._handle_feature(type_code, data, ws, path)
+        else:
+            pass
+
+    def _handle_basic_command(self, type_code, data, ws, path):
+        if type_code in self.basic_command_func_map:
+            self.basic_command_func_map[type_code](self, data, ws, path)
+
+    def _handle_notice(self, type_code, data, ws, path):
+        if type_code in self.notice_func_map:
+            self.notice_func_map[type_code](self, data, ws, path)
+
+    def _handle_feature(self, type_code, data, ws, path):
+        if type_code in self.feature_func_map:
+            self.feature_func_map[type_code](self, data, ws, path)
+
+
+def _chain_bot(code, data):
+    # the former JSONSocketUser._handle_data_dict
+    if code >= 40000 and code < 50000:
+        _handler(data)
+    elif code >= 50000 and code < 60000:
+        _handler(data)
+    elif code >= 60000 and code < 70000:
+        _handler(data)
+    else:
+        _handler(data)
+
+
+def _service_router(service, middlewares):
+    router = Router(fallback=_handler)
+    router.add_range(20000, 29999, _handler)
+    router.add_range(80000, 89999, _handler)
+    router.add_range(90000, 99999, _handler)
+    for func_map in (service.basic_command_func_map, service.notice_func_map, service.feature_func_map):
+        for code, func in func_map.items():
+            router.add(code, func)
+    for middleware in middlewares:
+        router.use(middleware)
+    router.compile()
+    return router
+
+
+def _bot_router(middlewares):
+    router = Router(fallback=_handler)
+    for family in (4, 5, 6):
+        router.add_family(family, _handler)
+    for middleware in middlewares:
+        router.use(middleware)
+    router.compile()
+    return router
+
+
+def _time(n, calls, dispatch, repeat=5):
+    # best of `repeat` runs, the others being disturbed by the machine
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(n):
+            dispatch(calls[i % len(calls)])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / n * 1e9
+
+
+def _compile_cost(make, repeat=100):
+    # us per compile, and kB held by the tables of one compile
+    router = make()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        router.compile()
+    elapsed = (time.perf_counter() - start) / repeat
+    router._table = router._families = None
+    tracemalloc.start()
+    router.compile()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed * 1e6, size / 1e3
+
+
+def main(n=1000000):
+    service = _ChainService()
+    type_codes = list(service.basic_command_func_map) + list(service.notice_func_map) + list(service.feature_func_map)
+    bot_codes = [codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST, codes.MESSAGE_DOWN_TEXT, codes.STATUS_INFO_LOGIN_SUCCESS]
+    data = {}
+
+    print(f'{n} dispatches, ns/dispatch')
+    print(f'{"case":<10} {"if/elif":>8} {"router":>8} {"+timing+errors":>15}')
+
+    plain = _service_router(service, ())
+    wrapped = _service_router(service, (Timing(), CatchErrors()))
+    print('{:<10} {:>8.0f} {:>8.0f} {:>15.0f}'.format(
+        'services',
+        _time(n, type_codes, lambda code: service._handle_command_to_ccs(code, data, None, '')),
+        _time(n, type_codes, lambda code: plain.dispatch(code, service, data, None, '')),
+        _time(n, type_codes, lambda code: wrapped.dispatch(code, service, data, None, ''))))
+
+    plain = _bot_router(())
+    wrapped = _bot_router((Timing(), CatchErrors()))
+    print('{:<10} {:>8.0f} {:>8.0f} {:>15.0f}'.format(
+        'bot',
+        _time(n, bot_codes, lambda code: _chain_bot(code, data)),
+        _time(n, bot_codes, lambda code: plain.dispatch(code, data)),
+        _time(n, bot_codes, lambda code: wrapped.dispatch(code, data))))
+
+    print()
+    print(f'{"case":<10} {"us/compile":>11} {"kB":>6}')
+    for name, make in (('services', lambda: _service_router(service, ())), ('bot', lambda: _bot_router(()))):
+        print('{:<10} {:>11.1f} {:>6.1f}'.format(name, *_compile_cost(make)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
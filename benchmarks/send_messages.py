@@ -0,0 +1,56 @@
+"""
+Cost per message of a `BaseBot` sending `n` personalised text messages,
+one user each, with `send_message` in a loop against one `send_messages`
+call (see `MessageIds`), from the call to the frame written on the socket.
+
+The send queue has no rate limit here, and the socket only counts what it
+is given.
+
+Run with `python -m socialization.benchmarks.send_messages [n]`.
+"""
+import contextlib
+import os
+import sys
+import time
+
+from ..bot import BaseBot, Message, MessageType
+
+
+class _Socket:
+    def __init__(self):
+        self.frames = 0
+
+    def send(self, data):
+        self.frames += 1
+
+
+def _bot():
+    bot = BaseBot('bot', 'password')
+    bot.ws = _Socket()
+    bot.connected = True
+    bot.send_scheduler.max_queue = 10 ** 9
+    return bot
+
+
+def main(n=10000):
+    messages = [Message(MessageType.TEXT, f'Your hand: {i % 13} of {i % 4}', 'CH0000', [f'user{i}'], 'bot')
+                for i in range(n)]
+    rows = [
+        ('send_message', lambda bot: [bot.send_message(message) for message in messages]),
+        ('send_messages', lambda bot: bot.send_messages(messages)),
+    ]
+    print(f'{n} messages')
+    print(f'{"sent with":<16} {"us/message":>11}')
+    for name, send in rows:
+        # the bot prints what it sends, so output must not be kept
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            bot = _bot()
+            started_at = time.perf_counter()
+            send(bot)
+            elapsed = time.perf_counter() - started_at
+        assert bot.ws.frames == n
+        print(f'{name:<16} {elapsed / n * 1e6:>11.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,100 @@
+"""
+Typed frames (`frames`) against the dict path, for the frames a Goddess
+service handles most: a text message coming up and the message going down.
+
+    decode : received json text to a handler reading four fields,
+             `json.loads` + `data['extra'][...]` vs `decode_frame` + attributes
+    encode : fields to json text,
+             `json.dumps(_make_data_dict(...))` vs `MessageDownText(...).encode()`,
+             validation included
+    relay  : both, as `handle_message_up_text` does: receive the message going
+             up and send it down to the channel
+
+Typed decode is slower than the dict path, since it is `json.loads` plus
+building the frame; that is why handlers get dicts unless they are
+decorated with `typed`. The `typed/dict` column gives the ratio.
+
+Run with `python -m socialization.benchmarks.typed_frames [n_frames]`.
+"""
+import json
+import sys
+import time
+
+from .. import codes
+from ..frames import MessageDownText, decode_frame
+
+
+def _time(n, run, repeat=5):
+    # best of `repeat` runs, the others being disturbed by the machine
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(n)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / n * 1e6
+
+
+def _make_data_dict(code, **extra_args):
+    return {
+        'code': code,
+        'extra': extra_args
+    }
+
+
+def main(n=100000):
+    up = json.dumps(_make_data_dict(
+        codes.MESSAGE_TO_CCS, type_code=codes.MESSAGE_UP_TEXT, channel_id='CH0001', from_user_id='user1',
+        to_user_ids=['user2', 'user3'], msg_body='hello, how are you doing today?', origin='Bot', msg_id='m1'))
+    to_user_ids = ['user1', 'user2', 'user3']
+
+    def decode_dict(n):
+        for _ in range(n):
+            data = json.loads(up)
+            extra = data['extra']
+            (extra['channel_id'], extra['from_user_id'], extra['to_user_ids'], extra['msg_body'])
+
+    def decode_typed(n):
+        for _ in range(n):
+            frame = decode_frame(up)
+            (frame.channel_id, frame.from_user_id, frame.to_user_ids, frame.msg_body)
+
+    def encode_dict(n):
+        for i in range(n):
+            json.dumps(_make_data_dict(
+                codes.MESSAGE_FROM_CCS, type_code=codes.MESSAGE_DOWN_TEXT, channel_id='CH0001', from_user_id='user1',
+                to_user_ids=to_user_ids, origin='Bot', temp_msg_id=i, msg_body='hello, how are you doing today?'))
+
+    def encode_typed(n):
+        for i in range(n):
+            MessageDownText(
+                code=codes.MESSAGE_FROM_CCS, channel_id='CH0001', from_user_id='user1', to_user_ids=to_user_ids,
+                origin='Bot', temp_msg_id=i, msg_body='hello, how are you doing today?').encode()
+
+    def relay_dict(n):
+        for _ in range(n):
+            data = json.loads(up)
+            extra = data['extra']
+            json.dumps(_make_data_dict(
+                codes.MESSAGE_FROM_CCS, type_code=extra['type_code'] + 20000, channel_id=extra['channel_id'],
+                from_user_id=extra['from_user_id'], to_user_ids=extra['to_user_ids'], origin=extra['origin'],
+                temp_msg_id=extra['msg_id'], msg_body=extra['msg_body']))
+
+    def relay_typed(n):
+        for _ in range(n):
+            frame = decode_frame(up)
+            MessageDownText(
+                code=codes.MESSAGE_FROM_CCS, channel_id=frame.channel_id, from_user_id=frame.from_user_id,
+                to_user_ids=frame.to_user_ids, origin=frame.origin, temp_msg_id=frame.msg_id,
+                msg_body=frame.msg_body).encode()
+
+    print(f'{n} frames, us/frame')
+    print(f'{"path":<8} {"dict":>7} {"typed":>7} {"typed/dict":>11}')
+    for name, run_dict, run_typed in [('decode', decode_dict, decode_typed), ('encode', encode_dict, encode_typed),
+                                      ('relay', relay_dict, relay_typed)]:
+        by_dict, by_frame = _time(n, run_dict), _time(n, run_typed)
+        print(f'{name:<8} {by_dict:>7.2f} {by_frame:>7.2f} {by_frame / by_dict:>11.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
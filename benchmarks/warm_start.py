@@ -0,0 +1,99 @@
+"""
+Time to first response of a restarted `GoddessService`, cold (rosters read
+from its `DatabaseAgent` file) against warm (`load_snapshot` first).
+
+The state is `n_channels` channels of 50 members, each with 20 whistle
+messages, 10 features and 500 pending acks. A restart is a new service on
+the same dbfile; the first response is the answer to
+COMMAND_UP_FETCH_CHANNEL_USER_LIST, timed from the creation of the
+service. Files are in the page cache: cold means parsing the json file,
+not reading the disk. Best of 5 runs.
+
+Run with `python -m socialization.benchmarks.warm_start [n_channels]`.
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from .. import codes
+from ..ccs import GoddessService
+
+
+class _Socket:
+    # records when the first frame is sent
+    def __init__(self):
+        self.first_sent_at = None
+
+    async def send(self, data):
+        if self.first_sent_at is None:
+            self.first_sent_at = time.perf_counter()
+
+
+def _make_state(directory, n_channels):
+    dbfile = os.path.join(directory, 'goddess.json')
+    user_list = {f'CH{i:05}': [f'user{i}-{j}' for j in range(50)] for i in range(n_channels)}
+    whistle = {channel_id: {str(m): user_ids[:5] for m in range(20)} for channel_id, user_ids in user_list.items()}
+    with open(dbfile, 'w') as f:
+        json.dump({'user_list': user_list, 'whistle': whistle}, f)
+    service = _new_service(dbfile)
+    for n in range(10):
+        service.add_feature(f'feature{n}', 90001 + n, [f'prompt {n}'])
+    for n in range(500):
+        service.temp_msg_map[(f'CH{n % n_channels:05}', n)] = ['user0-0']
+    return dbfile, service
+
+
+def _new_service(dbfile):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return GoddessService(0, uri='', token='', dbfile=dbfile)
+
+
+def _first_response(dbfile, snapshot_path, channel_id):
+    frame = {'code': codes.COMMAND_TO_CCS, 'extra': {
+        'type_code': codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST, 'channel_id': channel_id, 'user_id': 'user0-0'}}
+
+    async def restart():
+        ws = _Socket()
+        started_at = time.perf_counter()
+        service = _new_service(dbfile)
+        if snapshot_path:
+            service.load_snapshot(snapshot_path)
+        restored_at = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            await service._handle_data_dict_core(json.loads(json.dumps(frame)), ws, '')
+            first = ws.first_sent_at - started_at
+            ws.first_sent_at = None
+            next_at = time.perf_counter()
+            await service._handle_data_dict_core(json.loads(json.dumps(frame)), ws, '')
+        return restored_at - started_at, first, ws.first_sent_at - next_at
+
+    best = None
+    for _ in range(5):
+        result = asyncio.run(restart())
+        best = result if best is None or result[1] < best[1] else best
+    return best
+
+
+def main(n_channels=2000):
+    with tempfile.TemporaryDirectory() as directory:
+        dbfile, service = _make_state(directory, n_channels)
+        snapshot_path = os.path.join(directory, 'goddess.snapshot')
+        started_at = time.perf_counter()
+        service.save_snapshot(snapshot_path)
+        saved = time.perf_counter() - started_at
+        print(f'{n_channels} channels: dbfile {os.path.getsize(dbfile) / 1e6:.1f} MB, '
+              f'snapshot {os.path.getsize(snapshot_path) / 1e6:.1f} MB written in {saved * 1e3:.1f} ms')
+        channel_id = f'CH{n_channels - 1:05}'
+        print(f'{"restart":<6} {"restore ms":>11} {"first response ms":>18} {"next response ms":>17}')
+        for name, path in (('cold', None), ('warm', snapshot_path)):
+            restore, first, following = _first_response(dbfile, path, channel_id)
+            print(f'{name:<6} {restore * 1e3:>11.2f} {first * 1e3:>18.2f} {following * 1e3:>17.3f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
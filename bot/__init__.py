@@ -1,5 +1,32 @@
-from .base_bot import BaseBot
+import importlib
+
 from .. import codes
-from .json_socket_user import JSONSocketUser, MessageType, Message, rel
 
-__all__ = ['BaseBot', 'codes', 'JSONSocketUser', 'Message', 'MessageType', 'rel']
\ No newline at end of file
+# name -> submodule defining it. Submodules are imported on first use, so that
+# AsyncBaseBot doesn't load websocket-client and rel, nor BaseBot websockets.
+_SUBMODULES = {
+    'BaseBot': 'base_bot',
+    'AsyncBaseBot': 'async_bot',
+    'StatusError': 'async_bot',
+    'JSONSocketUser': 'json_socket_user',
+    'MessageType': 'json_socket_user',
+    'Message': 'json_socket_user',
+    'rel': 'json_socket_user',
+    'BotSupervisor': 'supervisor',
+    'MessageIds': 'message_ids',
+}
+
+__all__ = ['AsyncBaseBot', 'BaseBot', 'BotSupervisor', 'codes', 'JSONSocketUser', 'Message', 'MessageIds', 'MessageType', 'StatusError',
+           'rel']
+
+
+def __getattr__(name):
+    submodule = _SUBMODULES.get(name)
+    if submodule is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = getattr(importlib.import_module(f'.{submodule}', __name__), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
\ No newline at end of file
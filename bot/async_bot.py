@@ -0,0 +1,511 @@
+import websockets
+import asyncio
+import json
+import traceback
+from collections import deque
+
+from .. import codes
+from ..router import Router
+from .message import Message, MessageType, message_from_raw
+from .message_ids import MessageIds
+
+
+class StatusError(Exception):
+    """
+    Raised by an awaited request when the server answers with an error status.
+    """
+    def __init__(self, code:int, data:dict) -> None:
+        super().__init__(f'request failed with status {code}: {data}')
+        self.code = code
+        self.data = data
+
+
+class AsyncBaseBot:
+    """
+    This is the asyncio flavour of `BaseBot`.
+    Requests like `fetch_bot_channels` return awaitables resolved by the
+    matching response code, so bot code can simply write
+
+        channels = await bot.fetch_bot_channels()
+        commands = await bot.fetch_channel_command_list(channels[0])
+
+    instead of a state machine around `on_receive_status`/`on_receive_command`.
+    Every request takes a `timeout`, and any number of requests may be in
+    flight concurrently: responses are matched by code and by the id they
+    carry (channel_id, msg_id), in order of sending for equal keys.
+    Error statuses are matched the same way, an error carrying no id
+    failing the oldest request waiting for it.
+    Unsolicited frames, and answered ones as well, still go to the
+    `on_receive_*` callbacks, each run as a task.
+    """
+
+    def __init__(self, user_id:str, password:str, path:str=None, timeout:float=10, pre_analyse:bool=True,
+                 offline_page_size:int=0) -> None:
+        """
+        Args:
+            user_id : str
+                User ID of the account you wanna set as a bot.
+            password : str
+                Password of that account referred above.
+            path : str : optional
+                Location of server the bot will be running on.
+            timeout : float : optional
+                Default seconds to wait for the answer of a request.
+            pre_analyse : bool : optional
+                Trigger for pre-analysing message by wrapping it into a Message object.
+            offline_page_size : int : optional
+                Offline messages fetched per page, see `offline_messages`.
+                0, the default, to get them all at once, as servers without
+                STATUS_INFO_OFFLINE_MESSAGES send them.
+        """
+        self.path = path if path else 'wss://frog.4fun.chat/social'
+        self.timeout = timeout
+        self.pre_analyse = pre_analyse
+        self.codes = codes
+        self.user_id = user_id
+        self.password = password
+        self.ws = None
+        self.channel_list = []
+        self.user_lists = {}
+        # channel_id -> {'version': commands_version, 'commands': feature commands}
+        self.command_lists = {}
+        self.message_ids = MessageIds()
+        self.offline_page_size = offline_page_size
+
+        # (response code, key) -> futures waiting for it, oldest first
+        self._pending = {}
+        # (error status code, key) -> futures that fail on it, oldest first
+        self._pending_errors = {}
+        self._receiver = None
+        # callbacks running, see `_dispatch`
+        self._tasks = set()
+
+        # frames by code family, add middlewares with `self.router.use`
+        self.router = Router(fallback=self._on_other_frame)
+        self.router.add_family(4, self._on_command_frame)
+        self.router.add_family(5, self._on_message_frame)
+        self.router.add_family(6, self._on_status_frame)
+
+    async def connect(self):
+        """
+        Open the websocket connection and start receiving frames.
+        """
+        self.ws = await websockets.connect(self.path)
+        self._receiver = asyncio.ensure_future(self._receive_forever())
+        await self.on_open()
+
+    async def close(self):
+        """
+        Close the connection, failing every request still in flight.
+        """
+        if self.ws:
+            await self.ws.close()
+        if self._receiver:
+            await asyncio.gather(self._receiver, return_exceptions=True)
+        self._fail_all(ConnectionError('connection closed'))
+
+    async def _receive_forever(self):
+        try:
+            async for message in self.ws:
+                self._safe_handle(message)
+        except websockets.ConnectionClosed as e:
+            print(f'AsyncBot: connection closed: {e}')
+        finally:
+            self._fail_all(ConnectionError('connection closed'))
+            await self.on_close()
+
+    @staticmethod
+    def _make_data_dict(code:int, **extra_args) -> dict:
+        return {
+            'code': code,
+            'extra': extra_args
+        }
+
+    async def _safe_send(self, data:dict):
+        try:
+            if isinstance(data, dict):
+                data = json.dumps(data)
+            await self.ws.send(data)
+            return True
+        except websockets.ConnectionClosed as e:
+            print('AsyncBot: _safe_send: Connection Closed Exception', e)
+            return False
+        except Exception as e:
+            traceback.print_exc()
+            print('AsyncBot: _safe_send: Exception Occurs', e)
+            return False
+
+    async def _send_data_to_ws(self, code:int, **extra_args):
+        if not self.ws:
+            raise Exception(f'error: send {code} before connection created!')
+        return await self._safe_send(self._make_data_dict(code=code, **extra_args))
+
+    async def request(self, code:int, response_code:int, key=None, errors:tuple=(), timeout:float=None, **extra_args):
+        """
+        Send a request and wait for its answer.
+
+        Args:
+            code : int
+                Type code of the request.
+            response_code : int
+                Type code of the answer resolving this request.
+            key : str : optional
+                channel_id or msg_id the answer carries, used to tell concurrent
+                requests of the same kind apart.
+            errors : tuple : optional
+                Error status codes failing this request with `StatusError`.
+            timeout : float : optional
+                Seconds to wait, default to `self.timeout`. Raises `asyncio.TimeoutError`.
+            **extra_args : key-value pair of params : optional
+                Params of the request.
+
+        Return:
+            The answer frame, as a dict.
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._pending.setdefault((response_code, key), deque())
+        waiters.append(future)
+        error_keys = [(error, key) for error in errors]
+        for error_key in error_keys:
+            self._pending_errors.setdefault(error_key, deque()).append(future)
+
+        try:
+            if not await self._send_data_to_ws(code, **extra_args):
+                raise ConnectionError(f'failed to send request {code}')
+            return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+        finally:
+            self._forget(future, waiters, (response_code, key), error_keys)
+
+    def _forget(self, future, waiters, pending_key, error_keys):
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters and self._pending.get(pending_key) is waiters:
+            del self._pending[pending_key]
+        for error_key in error_keys:
+            queue = self._pending_errors.get(error_key)
+            if queue and future in queue:
+                queue.remove(future)
+            if queue is not None and not queue:
+                self._pending_errors.pop(error_key, None)
+
+    @staticmethod
+    def _pop_waiter(queue):
+        while queue:
+            future = queue.popleft()
+            if not future.done():
+                return future
+        return None
+
+    def _resolve(self, data:dict):
+        code = data['code']
+        extra = data.get('extra') or {}
+
+        keys = (extra.get('channel_id'), extra.get('msg_id'), None)
+        for key in keys:
+            future = self._pop_waiter(self._pending.get((code, key)))
+            if future:
+                future.set_result(data)
+                return True
+
+        for key in keys:
+            future = self._pop_waiter(self._pending_errors.get((code, key)))
+            if future:
+                future.set_exception(StatusError(code, data))
+                return True
+        if keys[0] is None and keys[1] is None:
+            # e.g. STATUS_ERROR_NO_CCS_SERVICE, which says nothing of the request it answers
+            for (error, key), queue in self._pending_errors.items():
+                future = self._pop_waiter(queue) if error == code else None
+                if future:
+                    future.set_exception(StatusError(code, data))
+                    return True
+        return False
+
+    def _fail_all(self, error):
+        for queue in list(self._pending.values()) + list(self._pending_errors.values()):
+            for future in queue:
+                if not future.done():
+                    future.set_exception(error)
+        self._pending.clear()
+        self._pending_errors.clear()
+
+    def _safe_handle(self, message:str):
+        try:
+            data = json.loads(message)
+            self._resolve(data)
+            self._handle_data_dict(data)
+        except ValueError:
+            print(f'AsyncBot: _safe_handle received non-json message: {message}')
+        except Exception as e:
+            print('AsyncBot: Server function error!', e)
+            traceback.print_exc()
+
+    def _handle_data_dict(self, data:dict):
+        self.router.dispatch(data['code'], data)
+
+    def _on_command_frame(self, data:dict):
+        extra = data['extra']
+        if data['code'] == self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST:
+            self.user_lists[extra['channel_id']] = extra['user_ids']
+        elif data['code'] == self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST and not extra.get('not_modified'):
+            self.command_lists[extra['channel_id']] = {'version': extra.get('commands_version'), 'commands': extra['commands']}
+        self._dispatch(self.on_receive_command(data))
+
+    def _on_message_frame(self, data:dict):
+        self._dispatch(self.on_receive_message(message_from_raw(data) if self.pre_analyse else data))
+
+    def _on_status_frame(self, data:dict):
+        code = data['code']
+        if code == self.codes.STATUS_INFO_USER_CHANNEL_LIST:
+            self.channel_list = data['extra']['channel_ids']
+        elif code == self.codes.STATUS_INFO_CREATE_CHANNEL_SUCCESS or code == self.codes.STATUS_INFO_JOIN_SUCCESS:
+            self.channel_list.append(data['extra']['channel_id'])
+        elif code == self.codes.STATUS_INFO_LEAVE_SUCCESS:
+            if data['extra']['channel_id'] in self.channel_list:
+                self.channel_list.remove(data['extra']['channel_id'])
+            self.user_lists.pop(data['extra']['channel_id'], None)
+            self.command_lists.pop(data['extra']['channel_id'], None)
+        self._dispatch(self.on_receive_status(data))
+
+    def _on_other_frame(self, data:dict):
+        self._dispatch(self.on_receive_other(data))
+
+    def _dispatch(self, coroutine):
+        # callbacks run as tasks so a slow one never blocks answers to awaited requests;
+        # they are kept until done, a task only weakly referenced by the loop could be collected
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        error = None if task.cancelled() else task.exception()
+        if error is not None:
+            print('AsyncBot: callback error!', error)
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    async def on_open(self):
+        """
+        Callback that is called when connection is open.
+        """
+        print('AsyncBot.open')
+
+    async def on_close(self):
+        """
+        Callback that is called when connection is closed.
+        """
+        print('AsyncBot.close')
+
+    async def on_receive_command(self, data:dict):
+        """
+        Callback that is called when receive command (4xxxx) from connection.
+        """
+        print(f'Default on_receive_command: {data}')
+
+    async def on_receive_message(self, data):
+        """
+        Callback that is called when receive message (5xxxx) from connection.
+        Override this to customize what to do when receives a message!
+
+        Args:
+            data : Message || dict
+                Wrapped Message object, or raw dict if pre-analyse is turned off.
+        """
+        print(f'Default on_receive_message: {data}')
+
+    async def on_receive_status(self, data:dict):
+        """
+        Callback that is called when receive status (6xxxx) from connection.
+        """
+        print(f'Default on_receive_status: {data}')
+
+    async def on_receive_other(self, data:dict):
+        """
+        Callback that is called when receive something that is not command,
+        message or status from connection.
+        """
+        print(f'Default on_receive_other: {data}')
+
+    async def login(self, timeout:float=None) -> dict:
+        """
+        Login with the account of this bot.
+        """
+        return await self.request(
+            self.codes.OPERATION_LOGIN, self.codes.STATUS_INFO_LOGIN_SUCCESS,
+            errors=(self.codes.STATUS_ERROR_LOGIN_FAIL_NO_SUCH_USER,
+                    self.codes.STATUS_ERROR_LOGIN_FAIL_WRONG_PASSWORD,
+                    self.codes.STATUS_ERROR_LOGIN_FAIL_REPETITIVE_LOGIN),
+            timeout=timeout, user_id=self.user_id, password=self.password
+        )
+
+    async def logout(self, timeout:float=None) -> dict:
+        """
+        Logout the account of this bot.
+        """
+        return await self.request(
+            self.codes.OPERATION_LOGOUT, self.codes.STATUS_INFO_LOGOUT_SUCCESS,
+            timeout=timeout, user_id=self.user_id
+        )
+
+    async def join_channel(self, channel_id:str, timeout:float=None) -> dict:
+        """
+        Join an existing channel.
+        """
+        return await self.request(
+            self.codes.OPERATION_JOIN_CHANNEL, self.codes.STATUS_INFO_JOIN_SUCCESS, key=channel_id,
+            errors=(self.codes.STATUS_ERROR_JOIN_FAIL_NO_SUCH_CHANNEL,
+                    self.codes.STATUS_ERROR_JOIN_FAIL_REPETITIVE_JOIN),
+            timeout=timeout, user_id=self.user_id, channel_id=channel_id
+        )
+
+    async def leave_channel(self, channel_id:str, timeout:float=None) -> dict:
+        """
+        Leave a channel that contains this bot.
+        """
+        return await self.request(
+            self.codes.OPERATION_LEAVE_CHANNEL, self.codes.STATUS_INFO_LEAVE_SUCCESS, key=channel_id,
+            errors=(self.codes.STATUS_ERROR_LEAVE_FAIL_REPETITIVE_LEAVE,),
+            timeout=timeout, user_id=self.user_id, channel_id=channel_id
+        )
+
+    async def create_channel(self, channel_id:str, timeout:float=None) -> dict:
+        """
+        Create a new channel.
+        """
+        return await self.request(
+            self.codes.OPERATION_CREATE_CHANNEL, self.codes.STATUS_INFO_CREATE_CHANNEL_SUCCESS, key=channel_id,
+            errors=(self.codes.STATUS_ERROR_DUPLICATE_CHANNEL_ID,),
+            timeout=timeout, user_id=self.user_id, channel_id=channel_id
+        )
+
+    async def fetch_bot_channels(self, timeout:float=None) -> list:
+        """
+        Fetch the list of channels that contains this bot.
+
+        Return:
+            List of channel ids.
+        """
+        data = await self.request(
+            self.codes.OPERATION_GET_USER_CHANNEL_LIST, self.codes.STATUS_INFO_USER_CHANNEL_LIST,
+            timeout=timeout, user_id=self.user_id
+        )
+        return data['extra']['channel_ids']
+
+    async def fetch_channel_user_list(self, channel_id:str, timeout:float=None) -> list:
+        """
+        Fetch the list of users in a channel.
+
+        Return:
+            List of user ids.
+        """
+        data = await self.request(
+            self.codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
+            key=channel_id, errors=(self.codes.STATUS_ERROR_NO_CCS_SERVICE,), timeout=timeout, user_id=self.user_id, channel_id=channel_id
+        )
+        return data['extra']['user_ids']
+
+    async def fetch_channel_command_list(self, channel_id:str, timeout:float=None) -> list:
+        """
+        Fetch the list of features in a channel. The version of the list
+        cached in `command_lists` is sent along: an unchanged list is
+        answered with `not_modified` and served from the cache.
+
+        Return:
+            List of feature commands.
+        """
+        cached = self.command_lists.get(channel_id)
+        versions = {'commands_version': cached['version']} if cached else {}
+        data = await self.request(
+            self.codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
+            key=channel_id, errors=(self.codes.STATUS_ERROR_NO_CCS_SERVICE,), timeout=timeout, user_id=self.user_id, channel_id=channel_id, **versions
+        )
+        if data['extra'].get('not_modified') and cached:
+            return cached['commands']
+        return data['extra']['commands']
+
+    async def fetch_recipients(self, message_id:str, timeout:float=None) -> list:
+        """
+        Fetch the recipients of a message.
+
+        Return:
+            List of recipient user ids.
+        """
+        data = await self.request(
+            self.codes.COMMAND_UP_FETCH_RECIPIENT_LIST, self.codes.COMMAND_DOWN_UPDATE_RECIPIENT_LIST,
+            key=message_id, errors=(self.codes.STATUS_ERROR_NO_CCS_SERVICE,), timeout=timeout, user_id=self.user_id, msg_id=message_id
+        )
+        return data['extra']['recipients']
+
+    async def offline_messages(self, page_size:int=None, timeout:float=None):
+        """
+        Messages sent to this bot while it was offline, as an async iterator:
+
+            async for message in bot.offline_messages():
+                ...
+
+        With a page size, they are fetched `page_size` at a time, the next
+        page being asked for once every message of the current one was
+        taken, so that a long backlog is never held at once. Fetching a page
+        acknowledges the one before: messages of a page left before its end
+        come again on the next fetch. Paging needs a server answering with
+        STATUS_INFO_OFFLINE_MESSAGES.
+        Without, they are asked for all at once and come as message frames,
+        to `on_receive_message`, and the iterator yields nothing.
+
+        Args:
+            page_size : int : optional
+                Messages per page, default to `offline_page_size`. 0 to get
+                them all at once.
+
+        Yields:
+            Message, or raw dict if pre-analyse is turned off.
+        """
+        page_size = self.offline_page_size if page_size is None else page_size
+        if not page_size:
+            await self._send_data_to_ws(self.codes.OPERATION_FETCH_OFFLINE_MESSAGES, user_id=self.user_id)
+            return
+        cursor = None
+        while True:
+            cursors = {} if cursor is None else {'cursor': cursor}
+            data = await self.request(
+                self.codes.OPERATION_FETCH_OFFLINE_MESSAGES, self.codes.STATUS_INFO_OFFLINE_MESSAGES,
+                timeout=timeout, user_id=self.user_id, limit=page_size, **cursors
+            )
+            messages = data['extra']['messages']
+            if not messages:
+                return
+            for message in messages:
+                yield message_from_raw(message) if self.pre_analyse else message
+            cursor = data['extra']['cursor']
+
+    async def send_message(self, message:Message, temp_msg_id:str=None) -> str:
+        """
+        Send a text message, without waiting for any answer.
+
+        Return:
+            Temporary ID of the message, taken from `message_ids` if not given.
+        """
+        if message.type != MessageType.TEXT:
+            raise Exception(f'unsupported message type: {message.type}')
+        if temp_msg_id is None:
+            temp_msg_id = self.message_ids.next()
+        await self._send_data_to_ws(
+            self.codes.MESSAGE_UP_TEXT, channel_id=message.channel, from_user_id=message.sender,
+            to_user_ids=message.to, temp_msg_id=temp_msg_id, msg_body=message.body, origin=message.origin
+        )
+        return temp_msg_id
+
+    async def start(self):
+        """
+        Connect, login and fetch the channels of this bot.
+        """
+        await self.connect()
+        await self.login()
+        await self.fetch_bot_channels()
+
+    async def run(self):
+        """
+        Start the bot and serve until the connection closes.
+        """
+        await self.start()
+        await self._receiver
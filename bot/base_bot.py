@@ -1,7 +1,11 @@
 from .json_socket_user import JSONSocketUser, MessageType, Message, rel
+from .send_scheduler import SendScheduler
+from ..reconnect import ReconnectPolicy
+from ..media import MediaStore
+from .message_ids import MessageIds
 
 from .. import codes
-import websocket, datetime, random
+import websocket, base64
 
 class BaseBot(JSONSocketUser):
 	"""
@@ -16,8 +20,15 @@ class BaseBot(JSONSocketUser):
 	We wraps the message data into a Message object.
     For better performance(not indeed), you could set
     `pre_analyse` to be `False` to get raw data of message(dict).
+
+	Images the CCS sends by hash (args type 'media', see `media`) are kept
+	in `media`, and those missing fetched, before `on_receive_command` gets
+	the command with the image in base64.
 	"""
-	def __init__(self, user_id:str, password:str, path:str=None, reconnect:int=None, pre_analyse:bool=True) -> None:
+	def __init__(self, user_id:str, password:str, path:str=None, reconnect:int=None, pre_analyse:bool=True,
+				 send_scheduler:SendScheduler=None, reconnect_policy:ReconnectPolicy=None, ping_interval:float=20,
+				 lazy_decode:bool=False, ignore_codes=(), media_dir:str=None, media_max_bytes:int=64 << 20,
+				 offline_page_size:int=0, roster_page_size:int=0, roster_timeout:float=10, chunk_size:int=0) -> None:
 		"""
 		Initialize a Bot instance.
 
@@ -29,19 +40,68 @@ class BaseBot(JSONSocketUser):
 			path : str : optional
 				Location of server the bot will be running on.
 			reconnect : int : optional
-				Max pending time for stalling. Reconnection will launch if stalls
-				outlong this time.
+				Max pending time for stalling. Reconnection will launch if nothing
+				is received this long after a heartbeat ping.
 			pre_analyse : bool : optional
 				Trigger for pre-analysing message by wrapping it into a Message object.
 				If turned off, data param in on_receive_data() will be raw dict!
+			send_scheduler : SendScheduler : optional
+				Outbound queue with the rate limits and drop policy to use.
+				A default one, without rate limits, is created if not given.
+			reconnect_policy : ReconnectPolicy : optional
+				Backoff and jitter between reconnection attempts.
+			ping_interval : float : optional
+				Seconds between heartbeat pings, 0 to disable them.
+			lazy_decode : bool : optional
+				Read the code of a frame first and parse the rest only when needed.
+			ignore_codes : iterable : optional
+				Codes of frames dropped unparsed, with `lazy_decode` only.
+			media_dir : str : optional
+				Directory to keep media received in, in memory if not given.
+			media_max_bytes : int : optional
+				Size of the media kept, least recently used media dropped beyond it.
+			offline_page_size : int : optional
+				Offline messages fetched per page, see `fetch_offline_message`.
+				0, the default, to get them all at once, as servers without
+				STATUS_INFO_OFFLINE_MESSAGES send them.
+			roster_page_size : int : optional
+				Channels per page when fetching the user lists of every channel
+				at once from Social, see `_update_channel_list`. 0, the default,
+				to fetch them one channel at a time from the CCS.
+			roster_timeout : float : optional
+				Seconds to wait for a page of user lists before fetching those
+				still missing one channel at a time.
+			chunk_size : int : optional
+				Bytes per chunk of image and file bodies sent in chunked mode,
+				0, the default, to send them whole, see `JSONSocketUser`.
 		"""
 		self.cached = False
-		super().__init__(path=path, reconnect=reconnect, pre_analyse=pre_analyse)
+		self._resync_pending = False
+		super().__init__(path=path, reconnect=reconnect, pre_analyse=pre_analyse, send_scheduler=send_scheduler,
+						 reconnect_policy=reconnect_policy, ping_interval=ping_interval, lazy_decode=lazy_decode,
+						 ignore_codes=ignore_codes, chunk_size=chunk_size)
 		self.codes = codes
 		self.channel_list = []
 		self.user_lists = {}
+		# channel_id -> {'version': commands_version, 'commands': feature commands}
+		self.command_lists = {}
 		self.user_id = user_id
 		self.password = password
+		self.message_ids = MessageIds()
+		self.offline_page_size = offline_page_size
+		self._offline_limit = offline_page_size or None		# page size of the fetch going on
+		self.roster_page_size = roster_page_size
+		self.roster_timeout = roster_timeout
+		self._bulk_rosters = bool(roster_page_size)		# turned off if the server doesn't know the operation
+		self._roster_timer = None		# armed while a page of user lists is awaited
+		self._rosters_pending = set()		# channels of channel_list whose user list is awaited
+		self.media = MediaStore(media_dir, media_max_bytes)
+		# media_hash -> image commands waiting for the media
+		self._media_waiting = {}
+		self.router.add(self.codes.COMMAND_DOWN_DISPLAY_IMAGE, self._on_display_image)
+		self.router.add(self.codes.COMMAND_DOWN_MEDIA, self._on_media)
+		self.router.add(self.codes.STATUS_INFO_OFFLINE_MESSAGES, self._on_offline_messages)
+		self.router.add(self.codes.STATUS_INFO_CHANNEL_USER_LISTS, self._update_user_lists_page)
 
 	def on_receive_status(self, data):
 		"""
@@ -59,12 +119,19 @@ class BaseBot(JSONSocketUser):
 		"""
 		code = data['code']
 
-		if code == self.codes.STATUS_INFO_USER_CHANNEL_LIST:
+		if code == self.codes.STATUS_INFO_LOGIN_SUCCESS and self._resync_pending:
+			self._resync_pending = False
+			self.resync()
+		elif code == self.codes.STATUS_INFO_USER_CHANNEL_LIST:
 			self._update_channel_list(data)
 		elif code == self.codes.STATUS_INFO_CREATE_CHANNEL_SUCCESS or code == self.codes.STATUS_INFO_JOIN_SUCCESS:
 			self._append_channel_list(data)
 		elif code == self.codes.STATUS_INFO_LEAVE_SUCCESS:
 			self._pop_channel_list(data)
+		elif (code == self.codes.STATUS_ERROR_UNSUPPORTED_CODE and self._roster_timer is not None
+			  and data['extra'].get('type_code') == self.codes.OPERATION_GET_CHANNEL_USER_LISTS):
+			print('Bot: user lists of every channel unsupported, fetching them one channel at a time')
+			self._bulk_rosters_fallback()
 		else:
 			super().on_receive_status(data)
 
@@ -98,18 +165,23 @@ class BaseBot(JSONSocketUser):
 
 		if code == self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST:
 			self._update_user_lists(data)
+		elif code == self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST:
+			self._update_command_lists(data)
 		else:
 			super().on_receive_command(data)
 
 	def on_open(self, ws):
 		"""
 		Behaviour at the time websocket connection is created.
+		On a reconnection, it logs in again and resyncs once
+		the login succeeds.
 
 		Args:
 			ws : websocket.WebSocketApp
                 Connection object.
 		"""
 		if self.cached:
+			self._resync_pending = True
 			self.login()
 		print('Bot.open!')
 	
@@ -149,6 +221,46 @@ class BaseBot(JSONSocketUser):
 		print(f'Bot.message: {message}')
 		self._safe_handle(ws, message)
 
+	def _on_display_image(self, data):
+		args = data['extra']['args']
+		if args.get('type') != 'media':
+			self.on_receive_command(data)
+			return
+		media_hash = args['media_hash']
+		if 'image' in args:
+			self.media.put(base64.b64decode(args['image']))
+		else:
+			image = self.media.get(media_hash)
+			if image is None:
+				waiting = self._media_waiting.setdefault(media_hash, [])
+				waiting.append(data)
+				if len(waiting) == 1:
+					self._command_fetch_media(self.user_id, data['extra']['channel_id'], media_hash)
+				return
+			args['image'] = base64.b64encode(image).decode('ascii')
+		self.on_receive_command(data)
+
+	def _on_media(self, data):
+		# image None if the CCS no longer has the media
+		extra = data['extra']
+		media = extra.get('media')
+		if media is not None:
+			self.media.put(base64.b64decode(media))
+		for waiting in self._media_waiting.pop(extra['media_hash'], ()):
+			waiting['extra']['args']['image'] = media
+			self.on_receive_command(waiting)
+
+	def _on_offline_messages(self, data):
+		# fetching the next page acknowledges this one, an empty page ends the backlog
+		extra = data['extra']
+		messages = extra['messages']
+		if not messages:
+			self.on_offline_messages_done()
+			return
+		for message in messages:
+			self._on_receive_message_frame(message)
+		self._command_fetch_offline_message(self.user_id, cursor=extra['cursor'], limit=self._offline_limit or len(messages))
+
 	def _update_channel_list(self, data):
 		"""
 		Utility function to update current channel_list.
@@ -161,9 +273,70 @@ class BaseBot(JSONSocketUser):
 				WS data in the format definde by `codes.md`
 		"""
 		self.channel_list = data['extra']['channel_ids']
+		for channel_id in list(self.user_lists):
+			if channel_id not in self.channel_list:
+				self.user_lists.pop(channel_id)
+		for channel_id in list(self.command_lists):
+			if channel_id not in self.channel_list:
+				self.command_lists.pop(channel_id)
+
+		self._rosters_pending = set(self.channel_list)
+		if self._rosters_pending:
+			self._fetch_user_lists(self.channel_list)
+		else:
+			self.on_user_lists_ready()
 
-		for channel_id in self.channel_list:
-			self._command_fetch_channel_user_list(self.user_id, channel_id)
+	def _fetch_user_lists(self, channel_ids):
+		# every channel in one go, a page at a time, or one request per channel
+		self._stop_roster_timer()
+		if self._bulk_rosters:
+			self._fetch_user_lists_page()
+		else:
+			for channel_id in channel_ids:
+				self._command_fetch_channel_user_list(self.user_id, channel_id)
+
+	def _fetch_user_lists_page(self, cursor=None):
+		self._command_fetch_channel_user_lists(self.user_id, cursor=cursor, limit=self.roster_page_size)
+		self._roster_timer = rel.timeout(self.roster_timeout, self._on_roster_timeout)
+
+	def _stop_roster_timer(self):
+		if self._roster_timer is not None:
+			self._roster_timer.delete()
+			self._roster_timer = None
+
+	def close(self):
+		"""
+		Close the connection for good, without waiting for user lists
+		any longer.
+		"""
+		self._stop_roster_timer()
+		super().close()
+
+	def _on_roster_timeout(self):
+		self._roster_timer = None
+		print(f'Bot: no user lists {self.roster_timeout}s after asking, fetching them one channel at a time')
+		self._bulk_rosters_fallback()
+		return False
+
+	def _bulk_rosters_fallback(self):
+		# the server doesn't answer the bulk request: ask for the missing lists one by one from now on
+		self._stop_roster_timer()
+		self._bulk_rosters = False
+		self._fetch_user_lists([channel_id for channel_id in self.channel_list if channel_id in self._rosters_pending])
+
+	def _user_list_done(self, channel_id):
+		pending = self._rosters_pending
+		if channel_id in pending:
+			pending.discard(channel_id)
+			if not pending:
+				self.on_user_lists_ready()
+
+	def on_user_lists_ready(self):
+		"""
+		Behaviour when the user list of every channel in channel_list
+		has arrived, after login or a resync.
+		"""
+		print('Bot user lists ready: {} channels'.format(len(self.channel_list)))
 
 	def _update_user_lists(self, data):
 		"""
@@ -177,6 +350,46 @@ class BaseBot(JSONSocketUser):
 				WS data in the format definde by `codes.md`
 		"""
 		self.user_lists[data['extra']['channel_id']] = data['extra']['user_ids']
+		self._user_list_done(data['extra']['channel_id'])
+
+	def _update_user_lists_page(self, data):
+		"""
+		Utility function to update current user_lists from a page
+		of the user lists of every channel, and fetch the next page.
+
+		Args:
+			data : dict
+				WS data in the format definde by `codes.md`
+		"""
+		extra = data['extra']
+		for channel_id, user_ids in extra['user_lists'].items():
+			self.user_lists[channel_id] = user_ids
+			self._user_list_done(channel_id)
+		if self._roster_timer is None:
+			return		# a page late, after falling back to one channel at a time
+		self._stop_roster_timer()
+		cursor = extra.get('cursor')
+		if cursor is not None:
+			self._fetch_user_lists_page(cursor)
+			return
+		# channels the pages missed, e.g. joined meanwhile
+		for channel_id in self.channel_list:
+			if channel_id in self._rosters_pending:
+				self._command_fetch_channel_user_list(self.user_id, channel_id)
+
+	def _update_command_lists(self, data):
+		"""
+		Utility function to update current command_lists. A
+		`not_modified` answer keeps the cached list.
+
+		Args:
+			data : dict
+				WS data in the format definde by `codes.md`
+		"""
+		extra = data['extra']
+		if extra.get('not_modified'):
+			return
+		self.command_lists[extra['channel_id']] = {'version': extra.get('commands_version'), 'commands': extra['commands']}
 
 	def _append_channel_list(self, data):
 		"""
@@ -204,7 +417,9 @@ class BaseBot(JSONSocketUser):
 				WS data in the format definde by `codes.md`
 		"""
 		self.channel_list.remove(data['extra']['channel_id'])
-		self.user_lists.pop(data['extra']['channel_id'])
+		self.user_lists.pop(data['extra']['channel_id'], None)
+		self.command_lists.pop(data['extra']['channel_id'], None)
+		self._user_list_done(data['extra']['channel_id'])
 
 	def login(self):
 		"""
@@ -281,14 +496,44 @@ class BaseBot(JSONSocketUser):
 		print("Bot leave channel: {}".format(channel_id))
 		self._command_leave_channel(self.user_id, channel_id)
 
-	def fetch_offline_message(self):
+	def fetch_offline_message(self, page_size:int=None):
 		"""
 		Wrapped fetch ofl-message function. Call this to fetch ofl-message.
 		If you wanna customize fetch ofl-message behaviour, call
 		`_command_fetch_offline_message()` to send command to fetch ofl-message.
+		Messages go to `on_receive_message`. They all come at once, unless
+		a page size is given: then they are fetched a page at a time, the
+		next page being asked for once those of the page are handled, so
+		that a long backlog is never held at once, and
+		`on_offline_messages_done` is called after the last page. Paging
+		needs a server answering with STATUS_INFO_OFFLINE_MESSAGES.
+
+		Args:
+			page_size : int : optional
+				Messages per page, default to `offline_page_size`. 0 to get
+				them all at once.
 		"""
 		print("Bot fetch offline message!")
-		self._command_fetch_offline_message(self.user_id)
+		page_size = self.offline_page_size if page_size is None else page_size
+		self._offline_limit = page_size or None
+		self._command_fetch_offline_message(self.user_id, limit=self._offline_limit)
+
+	def on_offline_messages_done(self):
+		"""
+		Behaviour when the last page of offline messages was handled.
+		"""
+		print('Bot fetched every offline message')
+
+	def resync(self):
+		"""
+		Bring channel_list, user_lists and offline messages up
+		to date after a reconnection.
+		The user list of each channel is fetched once the channel
+		list arrives.
+		"""
+		print('Bot resync!')
+		self.fetch_bot_channels()
+		self.fetch_offline_message()
 
 	def fetch_bot_channels(self):
 		"""
@@ -317,13 +562,16 @@ class BaseBot(JSONSocketUser):
 		Wrapped fetch channel cmd list function. Call this to fetch channel cmd list.
 		If you wanna customize fetch channel cmd list behaviour, call
 		`_command_fetch_channel_command_list()` to send command to fetch channel cmd list.
+		The version of the list in `command_lists` is sent along, so an
+		unchanged list is answered with `not_modified` and kept.
 
 		Args:
 			channel_id : str
 				ID of the channel to fetch command list.
 		"""
 		print('Bot fetch command list of channel : {}'.format(channel_id))
-		self._command_fetch_channel_command_list(self.user_id, channel_id)
+		cached = self.command_lists.get(channel_id)
+		self._command_fetch_channel_command_list(self.user_id, channel_id, cached['version'] if cached else None)
 
 	def fetch_recipients(self, message_id):
 		"""
@@ -349,10 +597,39 @@ class BaseBot(JSONSocketUser):
 				Wrapped message object contains message body, receivers,
 				target channel and sender information.
 		"""
-		temp_msg_id = f"temp_{datetime.datetime.now().timestamp()}_{str(random.randint(0, 100000)).zfill(5)}"
+		temp_msg_id = self.message_ids.next()
 		print('Bot send message: {}\nto: {}\n at channel: {}'.format(message.body, message.to, message.channel))
 		self._command_send_message(temp_msg_id=temp_msg_id, message=message)
 
+	def send_messages(self, messages):
+		"""
+		Send many messages at once, e.g. one per user personalised for each.
+		IDs are taken for all of them in one go and their frames queued
+		together, see `_command_send_messages()`. Bodies are not printed.
+
+		Args:
+			messages : iterable of Message
+				Messages to send, in order.
+
+		Return:
+			Temporary IDs of the messages, in the same order.
+		"""
+		messages = list(messages)
+		temp_msg_ids = self.message_ids.take(len(messages))
+		print('Bot send {} messages'.format(len(messages)))
+		self._command_send_messages(temp_msg_ids, messages)
+		return temp_msg_ids
+
+	def start(self):
+		"""
+		Login and update several properties of bot like 
+		channel_list .etc without blocking. Use this instead
+		of `run()` when the event loop is driven by someone
+		else, e.g. a `BotSupervisor` worker hosting many bots.
+		"""
+		self.login()
+		self.fetch_bot_channels()
+
 	def run(self):
 		"""
 		Behaviour to run bot. 
@@ -363,7 +640,5 @@ class BaseBot(JSONSocketUser):
 		Warning:
 			Don't re-write this if you have no idea what will happen!
 		"""
-		self.login()
-		self.fetch_bot_channels()
-		rel.signal(2, rel.abort)
-		rel.dispatch()
+		self.start()
+		super().run()
@@ -2,9 +2,28 @@ import websocket
 import rel
 from enum import Enum
 from .. import codes
-
-import json, traceback, datetime
+from ..envelope import decode
+from ..frames import Frame
+from ..reconnect import ReconnectPolicy
+from ..router import Router
+from ..stats import Histogram
+from ..transfer import SPILL_SIZE, IncomingTransfer, OutgoingTransfer
+
+import json, traceback, datetime, signal, socket, time
+from json.encoder import encode_basestring_ascii
+from collections import OrderedDict
 from .message import Message, MessageType, message_from_raw
+from .send_scheduler import SendScheduler, EncodedFrame
+
+
+def _encode(value):
+    # as json.dumps, faster for strings and lists of them
+    if value.__class__ is str:
+        return encode_basestring_ascii(value)
+    if value.__class__ is list and all(item.__class__ is str for item in value):
+        return '[' + ', '.join(map(encode_basestring_ascii, value)) + ']'
+    return json.dumps(value)
+
 
 class JSONSocketUser:
     """
@@ -14,13 +33,80 @@ class JSONSocketUser:
     We wraps the message data into a Message object.
     For better performance(not indeed), you could set
     `pre_analyse` to be `False` to get raw data of message(dict).
+    Outbound frames go through a `SendScheduler`, which lets control
+    operations overtake queued messages and, if given rates, limits
+    frames per connection and per channel.
+    Lost connections are reopened following a `ReconnectPolicy`
+    (exponential backoff with jitter), and messages still queued
+    are replayed once the connection is back.
+    A websocket ping is sent every `ping_interval` seconds. If nothing,
+    pong included, arrives within `reconnect` seconds after a ping, the
+    connection is considered stalled (e.g. half-open TCP) and reopened.
+    Ping round trips are recorded in `self.rtt`.
+    With `lazy_decode`, only `code` (and `type_code`) of a received frame is
+    read first. Frames whose code is in `ignore_codes` are dropped without
+    being parsed, and the rest of a frame is parsed when a callback first
+    reads beyond `data['code']`.
+    With a `chunk_size` (e.g. `transfer.CHUNK_SIZE`), image and file bodies
+    larger than it, or given as bytes or binary files, are sent in chunks
+    (see `transfer`), a few at a time as the CCS acknowledges them, and
+    resumed after a reconnection. A transfer with no acknowledgement for
+    `transfer_timeout` seconds while connected is dropped. Chunked mode
+    needs a CCS relaying chunks (GoddessService) and recipients putting them
+    back together (JSONSocketUser), so it is off by default: bodies go
+    whole, and must be str. Bodies received in chunks are written to a
+    temporary file, on disk past `spill_size` bytes, and delivered once
+    complete.
     """
 
-    def __init__(self, path:str=None, reconnect:int=None, pre_analyse:bool=True) -> None:
+    def __init__(self, path:str=None, reconnect:int=None, pre_analyse:bool=True, send_scheduler:SendScheduler=None,
+                 reconnect_policy:ReconnectPolicy=None, ping_interval:float=20, lazy_decode:bool=False,
+                 ignore_codes=(), chunk_size:int=0, spill_size:int=SPILL_SIZE, transfer_timeout:float=60) -> None:
         self.path = path if path else 'wss://frog.4fun.chat/social'
         self.reconnect = reconnect if reconnect else 5
+        self.ping_interval = ping_interval
+        self.rtt = Histogram()
+        self._last_received = time.monotonic()
+        self._heartbeat_timer = None
+        self._stall_timer = None
+        # SIGINT handler of `run()`
+        self._interrupt = None
+        self.reconnect_policy = reconnect_policy if reconnect_policy else ReconnectPolicy()
         self.codes = codes
         self.pre_analyse = pre_analyse
+        self.lazy_decode = lazy_decode
+        self.ignore_codes = frozenset(ignore_codes)
+        self.send_scheduler = send_scheduler if send_scheduler is not None else SendScheduler()
+        self.chunk_size = chunk_size
+        self.spill_size = spill_size
+        self.transfer_timeout = transfer_timeout
+        self.max_incoming_transfers = 64
+        self.transfers_out = {}             # transfer id -> (OutgoingTransfer, args of its frames)
+        self.transfers_in = OrderedDict()   # (from_user_id, transfer id) -> IncomingTransfer, oldest first
+        self.connected = False
+        self._closing = False
+        self._drain_timer = None
+        self._reconnect_timer = None
+        self._transfer_timer = None
+        self.stats = {
+            'frames_received': 0,
+            'frames_dropped': 0,
+            'frames_sent': 0,
+            'send_failures': 0,
+            'handle_errors': 0,
+            'reconnects': 0,
+            'stalls': 0,
+            'transfers_dropped': 0,
+            'transfers_refused': 0,
+        }
+
+        # frames by code family, add middlewares with `self.router.use`; callbacks are
+        # looked up on each frame, so that ones assigned to the instance are called
+        self.router = Router(fallback=lambda data: self.on_receive_other(data))
+        self.router.add_family(4, lambda data: self.on_receive_command(data))
+        self.router.add_family(5, self._on_receive_message_frame)
+        self.router.add_family(6, lambda data: self.on_receive_status(data))
+        self.router.add(codes.COMMAND_DOWN_TRANSFER_ACK, self._on_transfer_ack)
 
         self.create_connection(self.path)
         print('created connection with {}'.format(self.path))
@@ -80,8 +166,115 @@ class JSONSocketUser:
             on_close : function : optional
                 Callback function execute when websocket connectoin breaks or closes.
         """
-        self.ws = self._create_websocket(uri, on_open, on_message, on_error, on_close)
-        self.ws.run_forever(dispatcher=rel, reconnect=self.reconnect)
+        on_open = on_open or self.on_open
+        on_close = on_close or self.on_close
+
+        def _on_open(ws):
+            self.connected = True
+            self._last_received = time.monotonic()
+            self.reconnect_policy.reset()
+            self._start_heartbeat()
+            # control frames queued while disconnected go after those of on_open, e.g. the login
+            held = self.send_scheduler.hold_control()
+            try:
+                on_open(ws)
+            finally:
+                self.send_scheduler.release_control(held)
+            # replay what was queued while disconnected
+            self._drain_send_queue()
+            self._resume_transfers()
+
+        def _on_close(ws, close_status_code, close_msg):
+            self.connected = False
+            self._stop_heartbeat()
+            self.send_scheduler.discard_control()
+            on_close(ws, close_status_code, close_msg)
+            self._schedule_reconnect()
+
+        self.ws = self._create_websocket(uri, _on_open, on_message, on_error, _on_close)
+        self.ws.on_pong = self._on_pong
+        self._run_websocket()
+
+    def _start_heartbeat(self):
+        if self.ping_interval and self._heartbeat_timer is None:
+            self._heartbeat_timer = rel.timeout(self.ping_interval, self._heartbeat)
+
+    def _stop_heartbeat(self):
+        if self._heartbeat_timer is not None:
+            self._heartbeat_timer.delete()
+            self._heartbeat_timer = None
+        if self._stall_timer is not None:
+            self._stall_timer.delete()
+            self._stall_timer = None
+
+    def _heartbeat(self):
+        """
+        Send a ping carrying its send time, and check for a stall `self.reconnect`
+        seconds later. Repeats every `self.ping_interval` seconds while connected.
+        """
+        if not self.connected or not self.ws.sock:
+            self._heartbeat_timer = None
+            return False
+        sent_at = time.monotonic()
+        try:
+            self.ws.sock.ping(repr(sent_at))
+        except Exception as e:
+            print('JSONSocketUser: ping failed', e)
+        # one check at a time: the pending one already covers this ping
+        if self._stall_timer is None:
+            self._stall_timer = rel.timeout(self.reconnect, self._check_stall, sent_at)
+        return True
+
+    def _check_stall(self, sent_at):
+        self._stall_timer = None
+        if self.connected and self._last_received < sent_at:
+            self.stats['stalls'] += 1
+            print(f'JSONSocketUser: nothing received {self.reconnect}s after ping, connection stalled, reconnecting')
+            self._force_reconnect()
+        return False
+
+    def _force_reconnect(self):
+        """
+        Shut the socket down so that the dispatcher sees it closed, which
+        tears it down and schedules a reconnection.
+        """
+        try:
+            self.ws.sock.sock.shutdown(socket.SHUT_RDWR)
+        except Exception as e:
+            print('JSONSocketUser: failed to shut down stalled socket', e)
+
+    def _on_pong(self, ws, data):
+        now = time.monotonic()
+        self._last_received = now
+        try:
+            self.rtt.add(now - float(data))
+        except (TypeError, ValueError):
+            pass    # not one of our pings
+
+    def _run_websocket(self):
+        # reconnect=0: the websocket tears down on failure and `_schedule_reconnect`
+        # decides when to try again, instead of websocket-client's fixed interval
+        self.ws.run_forever(dispatcher=rel, reconnect=0)
+        # websocket-client binds SIGINT to rel.abort on each connection
+        if self._interrupt is not None:
+            self._interrupt.add()
+
+    def _schedule_reconnect(self):
+        """
+        Arm a timer reopening the connection after the delay given by `self.reconnect_policy`.
+        """
+        if self._closing or self._reconnect_timer is not None:
+            return
+        delay = self.reconnect_policy.next_delay()
+        print(f'JSONSocketUser: reconnecting in {delay:.2f}s (attempt {self.reconnect_policy.attempts})')
+        self._reconnect_timer = rel.timeout(delay, self._on_reconnect_timer)
+
+    def _on_reconnect_timer(self):
+        self._reconnect_timer = None
+        if not self._closing:
+            self.stats['reconnects'] += 1
+            self._run_websocket()
+        return False
 
     def on_message(self, ws, message):
         """
@@ -166,7 +359,8 @@ class JSONSocketUser:
     
     def _send_data_to_ws(self, ws, code:int, **extra_args):
         """
-        Warp and format given params then send with websocket connection.
+        Warp and format given params then queue them for sending with websocket connection.
+        They are sent at once unless the rate limits of `self.send_scheduler` are reached.
 
         Args:
             ws : websocket.WebSocketApp
@@ -179,7 +373,34 @@ class JSONSocketUser:
 
         """
         data_dict = self._make_data_dict(code=code, **extra_args)
-        self._safe_send(ws, data_dict)
+        if self.send_scheduler.submit(ws, data_dict):
+            self._drain_send_queue()
+
+    def send_frame(self, frame:Frame):
+        """
+        Queue a typed frame (see `frames`) for sending, like `_send_data_to_ws`.
+
+        Args:
+            frame : Frame
+                Frame to send, already validated by its constructor.
+        """
+        self._send_data_to_ws(self.ws, frame.code, **frame.to_extra())
+
+    def _drain_send_queue(self):
+        """
+        Send queued frames allowed by the rate limits, and arm a timer
+        for the rest.
+        """
+        if not self.connected:
+            return
+        wait = self.send_scheduler.drain(self._safe_send)
+        if wait is not None and self._drain_timer is None:
+            self._drain_timer = rel.timeout(max(wait, 0.005), self._on_drain_timer)
+
+    def _on_drain_timer(self):
+        self._drain_timer = None
+        self._drain_send_queue()
+        return False
 
     def _safe_send(self, ws, data:dict):
         """
@@ -192,20 +413,30 @@ class JSONSocketUser:
             
             data : dict
                 Wrapped data object in format of that in `/code.md`. 
-        
+
+        Return:
+            True if sent, False if the connection is closed, None if data could not be sent.
         """
         try:
-            if isinstance(data, dict):
+            if data.__class__ is EncodedFrame:
+                data = data.text
+            elif isinstance(data, dict):
                 data = json.dumps(data)
+            elif isinstance(data, Frame):
+                data = data.encode()
             else:
                 pass
 
             ws.send(data)
+            self.stats['frames_sent'] += 1
             return True
         except websocket.WebSocketConnectionClosedException as e:
+            self.stats['send_failures'] += 1
             print('Bot: _safe_send: Connection Closed Exception', e)
+            return False
 
         except Exception as e:
+            self.stats['send_failures'] += 1
             traceback.print_exc()
             print('Bot: self._safe_send: Exception Occurs', e)
 
@@ -224,21 +455,43 @@ class JSONSocketUser:
         ct = datetime.datetime.now()
         print('before social bot _safe_handle current time:- ', ct)
 
+        self.stats['frames_received'] += 1
+        self._last_received = time.monotonic()
         try:
-            data = json.loads(message)
+            if self.lazy_decode:
+                data = decode(message, self._wants)
+            else:
+                data = json.loads(message)
             ct = datetime.datetime.now()
-            self._handle_data_dict(ws, data)
+            if data is None:
+                self.stats['frames_dropped'] += 1
+            else:
+                self._handle_data_dict(ws, data)
 
         except ValueError as e:
             print(f'Bot: _safe_handle received non-json message: {message}')
 
         except Exception as e:
+            self.stats['handle_errors'] += 1
             print('Bot: Server function error!', e)
             traceback.print_exc()
         
         ct = datetime.datetime.now()
         print('after social bot _safe_handle current time:- ', ct)
     
+    def _wants(self, code:int, type_code:int) -> bool:
+        """
+        Whether a frame is worth parsing, only asked with `lazy_decode`.
+        Override it to drop more than `ignore_codes`.
+
+        Args:
+            code : int
+                Code of the frame.
+            type_code : int
+                Type code of frames to/from CCS, None for other frames.
+        """
+        return code not in self.ignore_codes
+
     def _handle_data_dict(self, ws, data:dict):
         """
         Distribute message to matching handler by type code.
@@ -250,17 +503,96 @@ class JSONSocketUser:
                 Message object received from connection.
         
         """
-        code = data['code']
+        self.router.dispatch(data['code'], data)
+        print(f'Bot default: _handle_data_dict received {data} at websocket {ws}')
+
+    def _on_receive_message_frame(self, data:dict):
+        transfer = data['extra'].get('transfer')
+        if transfer is not None:
+            data = self._receive_chunk(data, transfer)
+            if data is None:
+                return
+        self.on_receive_message(message_from_raw(data) if self.pre_analyse else data)
+
+    def _receive_chunk(self, data:dict, transfer:dict):
+        """
+        Write a chunk of a body sent in chunked mode.
+
+        Args:
+            data : dict
+                Message frame of the chunk.
+            transfer : dict
+                `transfer` of the frame.
 
-        if code >= 40000 and code < 50000:
-            self.on_receive_command(data)
-        elif code >= 50000 and code < 60000:
-            self.on_receive_message(message_from_raw(data) if self.pre_analyse else data)
-        elif code >= 60000 and code < 70000:
-            self.on_receive_status(data)
+        Return:
+            Once every chunk is there, the frame with the body as a file in
+            `msg_file` instead of `msg_body`, else None.
+        """
+        extra = data['extra']
+        key = (extra.get('from_user_id'), transfer['id'])
+        incoming = self.transfers_in.get(key)
+        try:
+            if incoming is None:
+                incoming = self.transfers_in[key] = IncomingTransfer(transfer, self.spill_size)
+                if len(self.transfers_in) > self.max_incoming_transfers:
+                    self.transfers_in.popitem(last=False)[1].close()
+            if not incoming.add(extra['msg_body'], transfer):
+                return None
+        except Exception as e:
+            # the sender can't be trusted with this body, which is dropped
+            self.stats['transfers_refused'] += 1
+            print('JSONSocketUser: chunk refused,', e)
+            incoming = self.transfers_in.pop(key, None)
+            if incoming is not None:
+                incoming.close()
+            return None
+        del self.transfers_in[key]
+        del extra['msg_body']
+        extra['msg_file'] = incoming.open()
+        return data
+
+    def _on_transfer_ack(self, data:dict):
+        extra = data['extra']
+        entry = self.transfers_out.get(extra['transfer_id'])
+        if entry is None:
+            return
+        transfer = entry[0]
+        transfer.acknowledge(extra['received'], extra.get('rewind', False))
+        if transfer.dropped:
+            # the CCS forgot the chunks acknowledged so far
+            del self.transfers_out[transfer.id]
+            self.stats['transfers_dropped'] += 1
+            print('JSONSocketUser: transfer of {} lost by the CCS, dropped'.format(entry[1]['temp_msg_id']))
+        elif transfer.done:
+            del self.transfers_out[transfer.id]
         else:
-            self.on_receive_other(data)
-        print(f'Bot default: _handle_data_dict received {data} at websocket {ws}')
+            self._send_chunks(transfer.id)
+
+    def _watch_transfers(self):
+        if self._transfer_timer is None and self.transfer_timeout:
+            self._transfer_timer = rel.timeout(self.transfer_timeout / 2, self._check_transfers)
+
+    def _check_transfers(self):
+        # drop the transfers the CCS stopped acknowledging, e.g. one that doesn't relay chunks;
+        # while disconnected they wait to be resumed
+        if self.connected:
+            now = time.monotonic()
+            for transfer, args in list(self.transfers_out.values()):
+                if now - transfer.updated_at >= self.transfer_timeout:
+                    del self.transfers_out[transfer.id]
+                    transfer.dropped = True
+                    self.stats['transfers_dropped'] += 1
+                    print('JSONSocketUser: transfer of {} not acknowledged for {}s, dropped'.format(
+                        args['temp_msg_id'], self.transfer_timeout))
+        if self.transfers_out:
+            return True
+        self._transfer_timer = None
+        return False
+
+    def _resume_transfers(self):
+        for transfer, _ in self.transfers_out.values():
+            transfer.resume()
+            self._send_chunks(transfer.id)
 
     def _command_register(self, email, password):
         """
@@ -358,20 +690,35 @@ class JSONSocketUser:
         
         self._send_data_to_ws(self.ws, self.codes.OPERATION_LEAVE_CHANNEL, user_id=user_id, channel_id=channel_id)
 
-    def _command_fetch_offline_message(self, user_id):
+    def _command_fetch_offline_message(self, user_id, cursor=None, limit:int=None):
         """
         Fundamental API for user to fetch messages that sent to an account 
         when it's not online.
+        Without `limit`, they all come at once as message frames. With it,
+        they come a page at a time in STATUS_INFO_OFFLINE_MESSAGES, with the
+        `cursor` to fetch the next page with, an empty page meaning none is
+        left.
 
         Args:
             user_id : str
                 User ID of a account that already logged in.
+            cursor : any : optional
+                Cursor of the page to fetch, none for the first one. Messages
+                before it are acknowledged and won't be sent again.
+            limit : int : optional
+                Max number of messages in a page.
         """
 
         if not self.ws:
             raise Exception('error: fetch offline message before connection created!')
         
-        self._send_data_to_ws(self.ws, self.codes.OPERATION_FETCH_OFFLINE_MESSAGE, user_id=user_id)
+        if limit is None:
+            self._send_data_to_ws(self.ws, self.codes.OPERATION_FETCH_OFFLINE_MESSAGES, user_id=user_id)
+        elif cursor is None:
+            self._send_data_to_ws(self.ws, self.codes.OPERATION_FETCH_OFFLINE_MESSAGES, user_id=user_id, limit=limit)
+        else:
+            self._send_data_to_ws(self.ws, self.codes.OPERATION_FETCH_OFFLINE_MESSAGES, user_id=user_id,
+                                  cursor=cursor, limit=limit)
 
     def _command_fetch_user_channels(self, user_id):
         """
@@ -421,7 +768,31 @@ class JSONSocketUser:
         
         self._send_data_to_ws(self.ws, self.codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST, user_id=user_id, channel_id=channel_id)
 
-    def _command_fetch_channel_command_list(self, user_id, channel_id):
+    def _command_fetch_channel_user_lists(self, user_id, cursor=None, limit:int=None):
+        """
+        Fundamental API for user to fetch the user lists of every channel that
+        contains this account from the server, in pages of `limit` channels
+        answered with STATUS_INFO_CHANNEL_USER_LISTS, which carries the
+        `cursor` of the next page unless it is the last.
+
+        Args:
+            user_id : str
+                User ID of a account that already logged in.
+            cursor : any : optional
+                Cursor of the page to fetch, none for the first one.
+            limit : int : optional
+                Max number of channels in a page, all of them if not given.
+        """
+
+        if not self.ws:
+            raise Exception('error: fetch channel user lists before connection created!')
+
+        pages = {} if limit is None else {'limit': limit}
+        if cursor is not None:
+            pages['cursor'] = cursor
+        self._send_data_to_ws(self.ws, self.codes.OPERATION_GET_CHANNEL_USER_LISTS, user_id=user_id, **pages)
+
+    def _command_fetch_channel_command_list(self, user_id, channel_id, commands_version=None):
         """
         Fundamental API for user to fetch a list of features in a certain channel. 
         Will receive error code if trynna fetch a channel inexists.
@@ -431,12 +802,20 @@ class JSONSocketUser:
                 User ID of a account that already logged in.
             channel_id : str
                 ID of channel to fetch.
+            commands_version : str : optional
+                `commands_version` of the list cached for the channel. If it is
+                still the current one, the answer says `not_modified` instead
+                of carrying the list.
         """
 
         if not self.ws:
             raise Exception('error: fetch channel command list before connection created!')
         
-        self._send_data_to_ws(self.ws, self.codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST, user_id=user_id, channel_id=channel_id)
+        if commands_version is None:
+            self._send_data_to_ws(self.ws, self.codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST, user_id=user_id, channel_id=channel_id)
+        else:
+            self._send_data_to_ws(self.ws, self.codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST, user_id=user_id, channel_id=channel_id,
+                                  commands_version=commands_version)
 
     def _command_fetch_recipient_list(self, user_id, msg_id):
         """
@@ -454,6 +833,26 @@ class JSONSocketUser:
         
         self._send_data_to_ws(self.ws, self.codes.COMMAND_UP_FETCH_RECIPIENT_LIST, user_id=user_id, msg_id=msg_id)
 
+    def _command_fetch_media(self, user_id, channel_id, media_hash):
+        """
+        Fundamental API for user to fetch media that a command referred to by
+        hash (see `media`). Answered with COMMAND_DOWN_MEDIA.
+
+        Args:
+            user_id : str
+                User ID of a account that already logged in.
+            channel_id : str
+                ID of the channel of the command.
+            media_hash : str
+                Hash of the media.
+        """
+
+        if not self.ws:
+            raise Exception('error: fetch media before connection created!')
+
+        self._send_data_to_ws(self.ws, self.codes.COMMAND_UP_FETCH_MEDIA, user_id=user_id, channel_id=channel_id,
+                              media_hash=media_hash)
+
     def _command_send_message(self, temp_msg_id, message:Message):
         """
         Wrapped API for sending certain message to certain users in certain channel.
@@ -471,8 +870,68 @@ class JSONSocketUser:
         if message.type == MessageType.TEXT:
             self._send_message_text(message.channel, message.sender, message.to, temp_msg_id, message.body, message.origin)
         else:
-            #TODO:
-            pass
+            code = self.codes.MESSAGE_UP_IMAGE if message.type == MessageType.IMAGE else self.codes.MESSAGE_UP_FILE
+            if not self._chunked(message.body):
+                self._send_data_to_ws(self.ws, code, channel_id=message.channel, from_user_id=message.sender,
+                                      to_user_ids=message.to, temp_msg_id=temp_msg_id, msg_body=message.body,
+                                      origin=message.origin)
+            else:
+                self._send_message_chunked(code, message.channel, message.sender, message.to, temp_msg_id,
+                                           message.body, message.origin)
+
+    def _command_send_messages(self, temp_msg_ids, messages):
+        """
+        Wrapped API for sending many messages at once, as `_command_send_message`
+        would one by one. Their frames are built and queued together, and the
+        send queue drained once for all of them. The json text of each frame is
+        made from that of the fields common to the messages of the same channel,
+        sender and origin, encoded once.
+
+        Args:
+            temp_msg_ids : list
+                Temporary ID of each message.
+            messages : list
+                Message objects, in the same order.
+
+        Return:
+            Number of messages refused by the policy of the send queue.
+        """
+
+        if not self.ws:
+            raise Exception('error: send messages before connection created!')
+
+        ws = self.ws
+        submit = self.send_scheduler.submit
+        templates = {}      # (code, channel, sender, origin) -> (head, tail) of the json text
+        refused = 0
+        for temp_msg_id, message in zip(temp_msg_ids, messages):
+            if message.type == MessageType.TEXT:
+                code = self.codes.MESSAGE_UP_TEXT
+            else:
+                code = self.codes.MESSAGE_UP_IMAGE if message.type == MessageType.IMAGE else self.codes.MESSAGE_UP_FILE
+                body = message.body
+                if self._chunked(body):
+                    self._send_message_chunked(code, message.channel, message.sender, message.to, temp_msg_id,
+                                               body, message.origin)
+                    continue
+            channel_id, from_user_id, origin = message.channel, message.sender, message.origin
+            to_user_ids, msg_body = message.to, message.body
+            key = (code, channel_id, from_user_id, origin)
+            template = templates.get(key)
+            if template is None:
+                template = templates[key] = (
+                    f'{{"code": {code}, "extra": {{"channel_id": {_encode(channel_id)}, '
+                    f'"from_user_id": {_encode(from_user_id)}, "to_user_ids": ',
+                    f', "origin": {_encode(origin)}}}}}')
+            # the frame of _send_data_to_ws, keys in the same order
+            text = (f'{template[0]}{_encode(to_user_ids)}, "temp_msg_id": {_encode(temp_msg_id)}, '
+                    f'"msg_body": {_encode(msg_body)}{template[1]}')
+            if not submit(ws, EncodedFrame({'code': code, 'extra': {
+                    'channel_id': channel_id, 'from_user_id': from_user_id, 'to_user_ids': to_user_ids,
+                    'temp_msg_id': temp_msg_id, 'msg_body': msg_body, 'origin': origin}}, text)):
+                refused += 1
+        self._drain_send_queue()
+        return refused
 
     def _send_message_text(self, channel_id, from_user_id, to_user_ids, temp_msg_id, msg_body, origin):
         """
@@ -494,6 +953,54 @@ class JSONSocketUser:
         """
         print("Send text message: id-{}, body-{}".format(temp_msg_id, msg_body))
         self._send_data_to_ws(self.ws, self.codes.MESSAGE_UP_TEXT, channel_id=channel_id, from_user_id=from_user_id, to_user_ids=to_user_ids, temp_msg_id=temp_msg_id, msg_body=msg_body, origin=origin)
+
+    def _chunked(self, body) -> bool:
+        # whether an image or file body goes in chunks
+        if not self.chunk_size:
+            if not isinstance(body, str):
+                raise Exception('error: bytes and file bodies are only sent in chunked mode, see chunk_size')
+            return False
+        return not isinstance(body, str) or len(body) > self.chunk_size
+
+    def _send_message_chunked(self, code, channel_id, from_user_id, to_user_ids, temp_msg_id, msg_body, origin):
+        """
+        Fundamental API to send an image or file body in chunks, see `transfer`.
+
+        Args:
+            code : int
+                MESSAGE_UP_IMAGE or MESSAGE_UP_FILE.
+            channel_id : str
+                ID of channel to send.
+            from_user_id : str
+                ID of sender.
+            to_user_ids : list
+                List of recipients.
+            temp_msg_id : str
+                Not in use, will be removed in the future.
+            msg_body : str || bytes || file
+                Body to send, a file being read as its chunks are sent. It
+                must stay open until the transfer is done.
+            origin : str
+                Specifier for bot, server, god and goddess.
+
+        Return:
+            The `OutgoingTransfer`, done once the CCS acknowledged every chunk,
+            dropped if it stopped acknowledging them.
+        """
+        transfer = OutgoingTransfer(msg_body, self.chunk_size)
+        print('Send chunked message: id-{}, {} bytes in {} chunks'.format(temp_msg_id, transfer.size, transfer.count))
+        self.transfers_out[transfer.id] = (transfer, dict(
+            code=code, channel_id=channel_id, from_user_id=from_user_id, to_user_ids=to_user_ids,
+            temp_msg_id=temp_msg_id, origin=origin))
+        self._send_chunks(transfer.id)
+        self._watch_transfers()
+        return transfer
+
+    def _send_chunks(self, transfer_id):
+        # queue the chunks the window of the transfer allows
+        transfer, args = self.transfers_out[transfer_id]
+        for msg_body, chunk in transfer.chunks():
+            self._send_data_to_ws(self.ws, msg_body=msg_body, transfer=chunk, **args)
     
     def on_receive_command(self, data):
         """
@@ -541,18 +1048,58 @@ class JSONSocketUser:
         """
         raise Exception(f"Error happens, received {data}")
 
+    def get_stats(self) -> dict:
+        """
+        Snapshot of the counters of this connection.
+
+        Return:
+            A copy of `self.stats` with the stats of the send queue, safe to pickle
+            and send to other processes.
+        """
+        stats = dict(self.stats)
+        stats['send_queue'] = self.send_scheduler.stats()
+        stats['rtt'] = self.rtt.snapshot()
+        return stats
+
+    def close(self):
+        """
+        Close the websocket connection of this user for good, deleting
+        every timer it armed.
+        """
+        self._closing = True
+        self._stop_heartbeat()
+        for name in ('_reconnect_timer', '_drain_timer', '_transfer_timer'):
+            timer = getattr(self, name)
+            if timer is not None:
+                timer.delete()
+                setattr(self, name, None)
+        if self.ws:
+            self.ws.close()
+
     def run(self):
         """
         Default function to startup a bot.
         Basically it will bind an rel to reconnect when stalled too long.
         Override this if you want to make some change before connection is
         created!
+        SIGINT closes this user and stops the loop. Users sharing a loop,
+        like the bots of a `BotSupervisor` worker, are started without `run()`
+        and leave SIGINT to whoever runs the loop.
         """
-        rel.signal(2, rel.abort)
+        self._interrupt = rel.signal(signal.SIGINT, self._on_interrupt)
         print('rel created')
-        rel.dispatch()
+        try:
+            rel.dispatch()
+        finally:
+            self._interrupt.delete()
+            self._interrupt = None
         print('finished running')
 
+    def _on_interrupt(self):
+        print('JSONSocketUser: interrupted, closing')
+        self.close()
+        rel.abort()
+
 if __name__ == '__main__':
     websocket.enableTrace(True)
     service = JSONSocketUser()
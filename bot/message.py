@@ -8,25 +8,133 @@ class MessageType(Enum):
     TEXT = 1
     IMAGE = 2
     FILE = 3
-    
+
+
+# marks a field still to be read from the raw frame
+_LAZY = object()
+
+
+def _field(name, key, default=None):
+    """
+    Property reading `extra[key]` of the raw frame on first access, unless
+    the field was set explicitly. A callable `default` is called to build it.
+    """
+    slot = '_' + name
+
+    def fget(self):
+        value = getattr(self, slot)
+        if value is _LAZY:
+            value = self._raw['extra'].get(key, _LAZY)
+            if value is _LAZY:
+                value = default() if callable(default) else default
+            setattr(self, slot, value)
+        return value
+
+    def fset(self, value):
+        setattr(self, slot, value)
+
+    return property(fget, fset, doc=f'`{key}` of the frame.')
+
+
 class Message():
-    def __init__(self, type:MessageType, body=None, channel:str='', to:list=[], sender:str='', recipient_count:int=0,
+    """
+    A message, either built by a bot to be sent or received from the server.
+    Received messages keep the raw frame and only read a field from it when it
+    is accessed; call `decode()` to read them all and drop the raw frame.
+    Slotted, so no per-instance `__dict__` is allocated.
+    A body received in chunks (see `transfer`) is in `file`, on disk if large,
+    and only read into `body` when that is accessed.
+    """
+    FIELDS = ('body', 'channel', 'to', 'sender', 'recipient_count', 'id', 'origin', 'file')
+
+    __slots__ = ('type', '_raw') + tuple('_' + name for name in FIELDS)
+
+    def __init__(self, type:MessageType, body=None, channel:str='', to:list=None, sender:str='', recipient_count:int=0,
                  id:str='', origin:str='Bot', raw=None) -> None:
         self.type = type
-        self.body = body
-        self.channel = channel
-        self.to = to
-        self.sender = sender
-        self.recipient_count = recipient_count
-        self.id = id
-        self.origin = origin
-        self.raw = raw
+        self._body = body
+        self._channel = channel
+        self._to = to if to is not None else []
+        self._sender = sender
+        self._recipient_count = recipient_count
+        self._id = id
+        self._origin = origin
+        self._file = None
+        self._raw = raw
+
+    @classmethod
+    def from_raw(cls, type:MessageType, raw_data:dict) -> 'Message':
+        """
+        Wrap a raw frame without copying any field out of it.
+        """
+        msg = cls.__new__(cls)
+        msg.type = type
+        msg._raw = raw_data
+        msg._body = msg._channel = msg._to = msg._sender = _LAZY
+        msg._recipient_count = msg._id = msg._origin = msg._file = _LAZY
+        return msg
+
+    @property
+    def body(self):
+        """
+        `msg_body` of the frame, or the content of `file` for a body received in chunks.
+        """
+        if self._body is _LAZY:
+            file = self.file
+            if file is None:
+                self._body = self._raw['extra'].get('msg_body')
+            else:
+                self._body = file.read()
+                file.seek(0)
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        self._body = value
+
+    file = _field('file', 'msg_file')
+    channel = _field('channel', 'channel_id', '')
+    to = _field('to', 'to_user_ids', list)
+    sender = _field('sender', 'from_user_id', '')
+    recipient_count = _field('recipient_count', 'n_recipients', 0)
+    id = _field('id', 'msg_id', '')
+    origin = _field('origin', 'origin', 'Bot')
+
+    @property
+    def raw(self):
+        """
+        The raw frame this message was received as, None if built locally or dropped.
+        """
+        return self._raw
+
+    @raw.setter
+    def raw(self, value):
+        self._raw = value
+
+    def decode(self, drop_raw:bool=True) -> 'Message':
+        """
+        Read every field from the raw frame. A body received in chunks is left in `file`.
+
+        Args:
+            drop_raw : bool : optional
+                Release the raw frame afterwards, leaving the fields as the only copy.
+        """
+        for name in self.FIELDS:
+            if name != 'body' or self.file is None:
+                getattr(self, name)
+        if drop_raw:
+            self._raw = None
+        return self
+
+    def __repr__(self):
+        return 'Message(type={}, channel={!r}, sender={!r}, id={!r}, body={!r})'.format(
+            self.type, self.channel, self.sender, self.id, self.body)
 
 def message_from_raw(raw_data:dict) -> Message:
     code = raw_data['code']
     if code < codes.MESSAGE_DOWN_TEXT or code > codes.MESSAGE_DOWN_FILE:
         raise Exception('Analysed raw message unsupported: {}'.format(raw_data))
-    
+
     type = None
     if code == codes.MESSAGE_DOWN_TEXT:
         type = MessageType.TEXT
@@ -35,8 +143,4 @@ def message_from_raw(raw_data:dict) -> Message:
     else:
         type = MessageType.FILE
 
-    ret = Message(type=type, body=raw_data['extra']['msg_body'], channel=raw_data['extra']['channel_id'],
-                    sender=raw_data['extra']['from_user_id'], recipient_count=raw_data['extra']['n_recipients'],
-                    id=raw_data['extra']['msg_id'], origin=raw_data['extra']['origin'], raw=raw_data)
-
-    return ret
\ No newline at end of file
+    return Message.from_raw(type, raw_data)
@@ -0,0 +1,33 @@
+import threading
+import uuid
+
+
+class MessageIds:
+    """
+    Temporary message IDs, `temp_<session>_<n>`. `session` is random for
+    each generator, so IDs of bots in other processes, or of a bot started
+    again, don't collide with these; `n` increases by one with each ID, so
+    IDs of a generator are unique and in the order they were taken.
+    """
+
+    def __init__(self, session:str=None) -> None:
+        self.session = session or uuid.uuid4().hex[:12]
+        self.prefix = f'temp_{self.session}_'
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> str:
+        with self._lock:
+            n = self._next
+            self._next = n + 1
+        return self.prefix + str(n)
+
+    def take(self, n:int) -> list:
+        """
+        `n` consecutive IDs at once.
+        """
+        with self._lock:
+            start = self._next
+            self._next = start + n
+        prefix = self.prefix
+        return [prefix + str(i) for i in range(start, start + n)]
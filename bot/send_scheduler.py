@@ -0,0 +1,298 @@
+import time
+from collections import OrderedDict, deque
+
+from .. import codes
+from ..ratelimit import TokenBucket
+
+
+class EncodedFrame(dict):
+    """
+    Frame dict with its json text already made, in `text`, as `json.dumps`
+    would make it. Frames changed in the queue (see `merge`) are sent as
+    plain dicts again.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, data:dict, text:str) -> None:
+        super().__init__(data)
+        self.text = text
+
+
+class SendScheduler:
+    """
+    Outbound queue of a `JSONSocketUser`.
+    Given a `rate`, frames are released through a token bucket per
+    connection and, given a `channel_rate`, messages through one more per
+    channel; without them (the default) nothing is held back. Control frames
+    (operations like login or join, and up-commands) always leave before
+    queued messages and are never dropped by the queue policy. Messages are
+    bounded by `max_queue`; when full, `policy` decides:
+
+        'drop_oldest' : drop the oldest queued message (default).
+        'drop_newest' : refuse the new message.
+        'merge'       : append a text message to the last queued one with the same
+                        channel, sender and recipients, else drop the oldest.
+
+    Latencies from submit to socket are sampled for `stats()`.
+    When the connection is lost, queued messages are kept and replayed once
+    it is back; control frames belong to the lost session and are discarded.
+    Control frames queued while disconnected are sent once the connection is
+    back, after those of its `on_open` (see `hold_control`).
+    """
+
+    POLICIES = ('drop_oldest', 'drop_newest', 'merge')
+    # number of channel buckets from which idle ones are looked for
+    PRUNE_AT = 256
+
+    def __init__(self, rate:float=None, burst:float=None, channel_rate:float=None, channel_burst:float=None,
+                 max_queue:int=10000, policy:str='drop_oldest', latency_samples:int=1024) -> None:
+        """
+        Args:
+            rate : float : optional
+                Frames per second on the connection, None for no limit.
+                A server throttling bots at 50/s would want e.g. `rate=50, burst=100`.
+            burst : float : optional
+                Frames the connection may send at once after being idle,
+                twice `rate` if not given.
+            channel_rate : float : optional
+                Messages per second in a single channel, None for no limit.
+            channel_burst : float : optional
+                Messages a single channel may send at once after being idle,
+                twice `channel_rate` if not given.
+            max_queue : int : optional
+                Max number of queued messages.
+            policy : str : optional
+                What to do with a message when the queue is full, one of `POLICIES`.
+            latency_samples : int : optional
+                Number of most recent queue latencies kept for percentiles.
+        """
+        if policy not in self.POLICIES:
+            raise Exception(f'unknown send queue policy: {policy}')
+        self.bucket = TokenBucket(rate, burst or 2 * rate) if rate else None
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst or (2 * channel_rate if channel_rate else None)
+        # buckets of channels that sent recently; a full one is the same as a new one, see `_prune_buckets`
+        self.channel_buckets = {}
+        self._prune_at = self.PRUNE_AT
+        self.max_queue = max_queue
+        self.policy = policy
+
+        # entries are [enqueued_at, ws, data, replayed]
+        self.control = deque()
+        # control frames submitted since `hold_control`, None when nothing is held
+        self._since_hold = None
+        # channel_id -> deque of entries, rotated for fairness between channels
+        self.messages = OrderedDict()
+        self.n_messages = 0
+
+        self.latencies = deque(maxlen=latency_samples)
+        self.counters = {
+            'queued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'merged': 0,
+            'replayed': 0,
+        }
+
+    @staticmethod
+    def is_control(code:int) -> bool:
+        return code < codes.MESSAGE_TO_CCS
+
+    def __len__(self):
+        return len(self.control) + self.n_messages
+
+    def submit(self, ws, data:dict) -> bool:
+        """
+        Queue a frame. Returns False if it was refused by the queue policy.
+        """
+        now = time.monotonic()
+        self.counters['queued'] += 1
+        if self.is_control(data['code']):
+            self.control.append([now, ws, data, False])
+            if self._since_hold is not None:
+                self._since_hold.append(data)
+            return True
+
+        channel_id = data['extra'].get('channel_id')
+        if self.n_messages >= self.max_queue:
+            if self.policy == 'drop_newest':
+                self.counters['dropped'] += 1
+                return False
+            if self.policy == 'merge' and self._merge(channel_id, data):
+                self.counters['merged'] += 1
+                return True
+            self._drop_oldest()
+
+        queue = self.messages.get(channel_id)
+        if queue is None:
+            queue = self.messages[channel_id] = deque()
+        queue.append([now, ws, data, False])
+        self.n_messages += 1
+        return True
+
+    def _merge(self, channel_id, data:dict) -> bool:
+        queue = self.messages.get(channel_id)
+        if not queue or data['code'] != codes.MESSAGE_UP_TEXT:
+            return False
+        last = queue[-1][2]
+        if last['code'] != codes.MESSAGE_UP_TEXT:
+            return False
+        extra, last_extra = data['extra'], last['extra']
+        for key in ('from_user_id', 'to_user_ids', 'origin'):
+            if extra.get(key) != last_extra.get(key):
+                return False
+        if last.__class__ is EncodedFrame:
+            # its text would no longer be the frame
+            last_extra = dict(last_extra)
+            queue[-1][2] = {'code': last['code'], 'extra': last_extra}
+        last_extra['msg_body'] = f"{last_extra['msg_body']}\n{extra['msg_body']}"
+        return True
+
+    def _drop_oldest(self):
+        oldest = None
+        for channel_id, queue in self.messages.items():
+            if oldest is None or queue[0][0] < self.messages[oldest][0][0]:
+                oldest = channel_id
+        if oldest is None:
+            return
+        self._pop(oldest)
+        self.counters['dropped'] += 1
+
+    def _pop(self, channel_id):
+        queue = self.messages[channel_id]
+        entry = queue.popleft()
+        self.n_messages -= 1
+        if not queue:
+            del self.messages[channel_id]
+        return entry
+
+    def discard_control(self) -> int:
+        """
+        Forget queued control frames, e.g. when their session is lost.
+
+        Return:
+            Number of discarded frames.
+        """
+        n = len(self.control)
+        self.control.clear()
+        self.counters['dropped'] += n
+        return n
+
+    def hold_control(self) -> deque:
+        """
+        Take the queued control frames out of the queue, so that frames
+        queued next leave first, e.g. the login of a new connection ahead
+        of joins queued while disconnected. Give them back with `release_control`.
+        """
+        held = self.control
+        self.control = deque()
+        self._since_hold = []
+        return held
+
+    def release_control(self, held:deque):
+        """
+        Queue control frames taken by `hold_control` again, behind those
+        queued since. Held frames queued again since, e.g. a login, are dropped.
+        """
+        since, self._since_hold = self._since_hold or [], None
+        for entry in held:
+            if entry[2] in since:
+                self.counters['dropped'] += 1
+            else:
+                self.control.append(entry)
+
+    def _channel_bucket(self, channel_id) -> TokenBucket:
+        bucket = self.channel_buckets.get(channel_id)
+        if bucket is None:
+            if len(self.channel_buckets) >= self._prune_at:
+                self._prune_buckets()
+            bucket = self.channel_buckets[channel_id] = TokenBucket(self.channel_rate, self.channel_burst)
+        return bucket
+
+    def _prune_buckets(self):
+        # forget buckets refilled to their burst, as a new one would be, of channels with nothing queued
+        now = time.monotonic()
+        for channel_id, bucket in list(self.channel_buckets.items()):
+            if channel_id not in self.messages and bucket.is_full(now):
+                del self.channel_buckets[channel_id]
+        self._prune_at = max(self.PRUNE_AT, 2 * len(self.channel_buckets))
+
+    def drain(self, send) -> float:
+        """
+        Send everything the buckets allow right now.
+
+        Args:
+            send : function
+                `send(ws, data)` writing one frame to the socket. It returns False
+                if the connection is lost, then the frame is queued again in front
+                and draining stops.
+
+        Return:
+            Seconds until the next frame could leave, or None if the queue is empty
+            or the connection is lost.
+        """
+        now = time.monotonic()
+        bucket = self.bucket
+        while self.control:
+            if bucket is not None and not bucket.take(now):
+                return bucket.wait_time(now)
+            entry = self.control.popleft()
+            if not self._send(send, entry, now):
+                self.control.appendleft(entry)
+                return None
+
+        by_channel = bool(self.channel_rate)
+        progress = True
+        while self.messages and progress:
+            progress = False
+            for channel_id in list(self.messages):
+                if bucket is not None and not bucket.ready(now):
+                    return bucket.wait_time(now)
+                if by_channel and not self._channel_bucket(channel_id).take(now):
+                    continue
+                if bucket is not None:
+                    bucket.take(now)
+                entry = self._pop(channel_id)
+                if not self._send(send, entry, now):
+                    self._requeue(channel_id, entry)
+                    return None
+                if channel_id in self.messages:
+                    self.messages.move_to_end(channel_id)
+                progress = True
+
+        if not self.messages:
+            return None
+        # only channel buckets hold messages back here
+        return min(self._channel_bucket(channel_id).wait_time(now) for channel_id in self.messages)
+
+    def _requeue(self, channel_id, entry):
+        queue = self.messages.get(channel_id)
+        if queue is None:
+            queue = self.messages[channel_id] = deque()
+            self.messages.move_to_end(channel_id, last=False)
+        queue.appendleft(entry)
+        self.n_messages += 1
+        entry[3] = True
+
+    def _send(self, send, entry, now) -> bool:
+        if send(entry[1], entry[2]) is False:
+            return False
+        self.counters['sent'] += 1
+        if entry[3]:
+            self.counters['replayed'] += 1
+        self.latencies.append(now - entry[0])
+        return True
+
+    def stats(self) -> dict:
+        """
+        Queue depth, counters and queue latency (seconds) percentiles.
+        """
+        ret = dict(self.counters)
+        ret['queue_depth'] = len(self)
+        samples = sorted(self.latencies)
+        if samples:
+            ret['queue_latency_avg'] = sum(samples) / len(samples)
+            ret['queue_latency_p50'] = samples[len(samples) // 2]
+            ret['queue_latency_p99'] = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+            ret['queue_latency_max'] = samples[-1]
+        return ret
@@ -0,0 +1,284 @@
+import multiprocessing
+import os
+from multiprocessing.connection import wait
+import signal
+import time
+import traceback
+
+import rel
+
+from ..reconnect import ReconnectPolicy
+
+
+def _worker_main(index, specs, path, bot_kwargs, conn, stats_interval):
+    """
+    Entry of a worker process. Creates every bot of `specs` on one shared
+    `rel` event loop, reports stats over `conn` and stops when the
+    supervisor sends `'stop'`.
+
+    Args:
+        index : int
+            Index of this worker in the supervisor.
+        specs : list
+            `(user_id, password, class)` tuples of bots hosted by this worker.
+        path : str
+            Location of server the bots connect to.
+        bot_kwargs : dict
+            Extra keyword arguments passed to every bot class.
+        conn : multiprocessing.connection.Connection
+            Worker side of the pipe to the supervisor.
+        stats_interval : float
+            Seconds between two stats reports.
+    """
+    # a forked worker inherits the timers and signal handlers of the supervisor's loop
+    rel.init()
+    # SIGINT of the terminal reaches every process of its group; workers leave
+    # it to the supervisor, which asks them to stop through their pipe. Ignoring
+    # it wouldn't last: websocket-client binds it to rel.abort on each connection.
+    os.setpgrp()
+
+    bots = []
+    for user_id, password, bot_class in specs:
+        bots.append(bot_class(user_id, password, path=path, **bot_kwargs))
+
+    for bot in bots:
+        bot.start()
+
+    def report():
+        conn.send(('stats', index, {bot.user_id: bot.get_stats() for bot in bots}))
+
+    def poll():
+        try:
+            if conn.poll():
+                command = conn.recv()
+                if command == 'stop':
+                    for bot in bots:
+                        bot.close()
+                    report()
+                    rel.abort()
+                    return False
+            report()
+        except (EOFError, OSError):
+            # supervisor is gone, nobody to report to
+            rel.abort()
+            return False
+        return True
+
+    rel.timeout(stats_interval, poll)
+    rel.dispatch()
+    conn.close()
+
+
+class BotSupervisor:
+    """
+    Supervisor spreading bots across CPU cores.
+    Bot specs are partitioned round-robin across `n_workers` processes, each
+    hosting its bots on its own `rel` event loop. Crashed workers are restarted
+    together with their bots, stats of every worker are aggregated over a pipe,
+    and SIGINT stops all workers gracefully. The supervisor itself runs on a
+    `rel` loop too.
+    A crashed worker is restarted after `restart_delay` seconds, twice as
+    long after each crash in a row, up to `max_restart_delay`. After
+    `max_restarts` crashes in a row it is given up; a worker reporting its
+    stats is no longer counted as crashing.
+    """
+
+    # seconds between two looks at the pipes and processes of workers
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, specs:list, n_workers:int=None, path:str=None, bot_kwargs:dict=None,
+                 stats_interval:float=5, restart_delay:float=1, stop_timeout:float=10,
+                 max_restart_delay:float=60, max_restarts:int=10) -> None:
+        """
+        Args:
+            specs : list
+                `(user_id, password, class)` tuples, one per bot. `class` must be
+                a `BaseBot` subclass importable from worker processes.
+            n_workers : int : optional
+                Number of worker processes, default to number of CPU cores.
+            path : str : optional
+                Location of server all bots connect to.
+            bot_kwargs : dict : optional
+                Extra keyword arguments passed to every bot class.
+            stats_interval : float : optional
+                Seconds between two stats reports of a worker.
+            restart_delay : float : optional
+                Seconds to wait before restarting a worker after its first crash.
+            stop_timeout : float : optional
+                Seconds to wait for workers to exit before terminating them.
+            max_restart_delay : float : optional
+                Upper bound of the wait before a restart.
+            max_restarts : int : optional
+                Crashes in a row after which a worker is not restarted.
+        """
+        self.specs = list(specs)
+        self.n_workers = max(1, min(n_workers or multiprocessing.cpu_count(), len(self.specs)))
+        self.path = path
+        self.bot_kwargs = bot_kwargs or {}
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.max_restart_delay = max_restart_delay
+        self.max_restarts = max_restarts
+
+        self.partitions = self.partition(self.specs, self.n_workers)
+        self.workers = {}
+        self.worker_stats = {}
+        self.restarts = {index: 0 for index in range(self.n_workers)}
+        # crashes in a row of each worker, and the wait before its next restart
+        self.backoff = {index: ReconnectPolicy(restart_delay, max_delay=max_restart_delay, jitter=0)
+                        for index in range(self.n_workers)}
+        self._restart_timers = {}
+        self.given_up = set()
+        self.stopping = False
+        self._next_report = None
+
+    @staticmethod
+    def partition(specs:list, n_workers:int) -> list:
+        """
+        Split bot specs round-robin into `n_workers` lists.
+        """
+        return [specs[i::n_workers] for i in range(n_workers)]
+
+    def _start_worker(self, index):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(index, self.partitions[index], self.path, self.bot_kwargs, child_conn, self.stats_interval),
+            name=f'bot-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self.workers[index] = (process, parent_conn)
+        print(f'BotSupervisor: started worker {index} (pid {process.pid}) with {len(self.partitions[index])} bots')
+
+    def _collect(self, timeout):
+        conns = {conn: index for index, (process, conn) in self.workers.items()}
+        for conn in wait(list(conns), timeout):
+            try:
+                tag, index, stats = conn.recv()
+            except (EOFError, OSError):
+                continue
+            if tag == 'stats':
+                self.worker_stats[index] = stats
+                # it got its bots running: a crash from now on is a first one again
+                self.backoff[index].reset()
+
+    def _check_workers(self):
+        for index, (process, conn) in list(self.workers.items()):
+            if process.is_alive() or self.stopping:
+                continue
+            del self.workers[index]
+            conn.close()
+            backoff = self.backoff[index]
+            if backoff.attempts >= self.max_restarts:
+                print(f'BotSupervisor: worker {index} exited with code {process.exitcode} '
+                      f'after {backoff.attempts} restarts in a row, giving up')
+                self.given_up.add(index)
+                continue
+            delay = backoff.next_delay()
+            print(f'BotSupervisor: worker {index} exited with code {process.exitcode}, restarting in {delay:.2f}s')
+            self._restart_timers[index] = rel.timeout(delay, self._restart_worker, index)
+        if len(self.given_up) == self.n_workers:
+            print('BotSupervisor: every worker was given up')
+            self.stop()
+
+    def _restart_worker(self, index):
+        del self._restart_timers[index]
+        if not self.stopping:
+            self.restarts[index] += 1
+            self._start_worker(index)
+        return False
+
+    def _poll(self):
+        if self.stopping:
+            # stopped before the loop ran
+            self.stop()
+            return False
+        self._collect(0)
+        self._check_workers()
+        if time.monotonic() >= self._next_report:
+            self._next_report = time.monotonic() + self.stats_interval
+            self.on_stats(self.get_stats())
+        return not self.stopping
+
+    def get_stats(self) -> dict:
+        """
+        Stats of every worker and the sum over all bots.
+
+        Return:
+            dict with `workers` (worker index -> user_id -> bot stats),
+            `restarts` (worker index -> restart count) and `total` counters.
+        """
+        total = {}
+        for bots in self.worker_stats.values():
+            for stats in bots.values():
+                for key, value in stats.items():
+                    if isinstance(value, (int, float)):
+                        total[key] = total.get(key, 0) + value
+        return {
+            'workers': dict(self.worker_stats),
+            'restarts': dict(self.restarts),
+            'total': total,
+        }
+
+    def on_stats(self, stats:dict):
+        """
+        Callback with aggregated stats after each collection round.
+        Override this to export them; prints the totals by default.
+        """
+        print(f'BotSupervisor stats: {stats["total"]}')
+
+    def stop(self, *args):
+        """
+        Ask all workers to close their bots and exit. Also installed as
+        SIGINT handler by `run()`.
+        """
+        self.stopping = True
+        rel.abort()
+
+    def _shutdown(self):
+        for timer in self._restart_timers.values():
+            timer.delete()
+        self._restart_timers.clear()
+        for index, (process, conn) in self.workers.items():
+            try:
+                conn.send('stop')
+            except (BrokenPipeError, OSError):
+                pass
+
+        deadline = time.monotonic() + self.stop_timeout
+        while time.monotonic() < deadline and any(process.is_alive() for process, conn in self.workers.values()):
+            self._collect(0.1)
+
+        for index, (process, conn) in self.workers.items():
+            if process.is_alive():
+                print(f'BotSupervisor: worker {index} did not stop in time, terminating')
+                process.terminate()
+            process.join()
+            conn.close()
+
+    def run(self):
+        """
+        Start all workers and supervise them until SIGINT or `stop()`.
+        """
+        interrupt = rel.signal(signal.SIGINT, self.stop)
+        poll = None
+        try:
+            for index in range(self.n_workers):
+                self._start_worker(index)
+
+            self._next_report = time.monotonic() + self.stats_interval
+            poll = rel.timeout(self.POLL_INTERVAL, self._poll)
+            rel.dispatch()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.stopping = True
+            # back to the handler from before `run()`, and no timer left in a loop run again later
+            interrupt.delete()
+            if poll is not None:
+                poll.delete()
+            self._shutdown()
+            print('BotSupervisor: all workers stopped')
@@ -0,0 +1,348 @@
+"""
+Capture of the traffic of a CCS service, and its replay.
+
+A `TrafficRecorder` given to a service (`recorder=`) appends every frame the
+service receives (`_safe_handle`) and sends (`_safe_send`) to a capture file,
+one line per frame:
+
+    #socialization-capture 1 <unix time of the start>
+    <microseconds since start> <i|o> <connection> <frame>
+
+`i` is inbound, `o` outbound; `I`/`O` mark a frame holding a newline, stored
+json-quoted. Connections are numbered in order of appearance. Appending to
+an existing capture starts a new section with its own header.
+
+`TrafficReplayer` feeds the inbound frames of a capture into a service
+(`GoddessService`, `GodService` or any service of `ccs`) at 1x, Nx or
+maximum speed, collects what the service sends back and compares it with
+the outbound frames of the capture. Frames go to an active (rel) service
+from rel timers, so that its own timers run between them. State the service keeps outside of the
+frames (e.g. the file of its `DatabaseAgent`) should be what it was when the
+capture started for outbound frames to match.
+"""
+import asyncio
+import collections
+import inspect
+import json
+import time
+import weakref
+
+import rel
+
+from .stats import Histogram
+
+MAGIC = '#socialization-capture'
+VERSION = 1
+
+Record = collections.namedtuple('Record', 'time direction conn frame')
+
+
+class TrafficRecorder:
+    """
+    Append-only writer of timestamped inbound and outbound frames.
+    Writes are buffered and flushed at most every `flush_interval` seconds,
+    and on `close()`.
+    """
+
+    def __init__(self, path:str, flush_interval:float=1) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._file = open(path, 'a', encoding='utf-8', buffering=1 << 16)
+        self._file.write(f'{MAGIC} {VERSION} {time.time():.6f}\n')
+        self._start = time.perf_counter()
+        self._flushed_at = self._start
+        self._conns = weakref.WeakKeyDictionary()     # ws -> number in the capture
+        self._next_conn = 0
+
+    def _conn(self, ws):
+        conn = self._conns.get(ws)
+        if conn is None:
+            conn = self._conns[ws] = self._next_conn
+            self._next_conn += 1
+        return conn
+
+    def record(self, direction:str, ws, frame):
+        """
+        Append one frame.
+
+        Args:
+            direction : str
+                'i' for a received frame, 'o' for a sent one.
+            ws : object
+                Connection of the frame, numbered in the capture.
+            frame : str || bytes
+                Frame as it went over the wire.
+        """
+        if self._file is None:
+            return
+        now = time.perf_counter()
+        if isinstance(frame, (bytes, bytearray)):
+            frame = frame.decode('utf-8', 'replace')
+        if '\n' in frame:
+            direction = direction.upper()
+            frame = json.dumps(frame)
+        self._file.write(f'{int((now - self._start) * 1e6)} {direction} {self._conn(ws)} {frame}\n')
+        self.records += 1
+        if now - self._flushed_at >= self.flush_interval:
+            self._file.flush()
+            self._flushed_at = now
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(path:str):
+    """
+    Records of a capture, in file order. Sections of a capture appended to
+    several times follow each other: times are made consecutive and
+    connections of a section numbered after those of the previous ones.
+    """
+    offset = 0
+    last = 0
+    conn_offset = 0
+    conns = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            if line.startswith(MAGIC):
+                version = int(line.split()[1])
+                if version != VERSION:
+                    raise Exception(f'unsupported capture version {version} in {path}')
+                offset = last
+                conn_offset = conns
+                continue
+            t, direction, conn, frame = line.split(' ', 3)
+            if direction in ('I', 'O'):
+                direction = direction.lower()
+                frame = json.loads(frame)
+            last = offset + int(t) / 1e6
+            conn = conn_offset + int(conn)
+            conns = max(conns, conn + 1)
+            yield Record(last, direction, conn, frame)
+
+
+class _ReplaySocket:
+    """
+    One recorded connection, as seen by an active (rel) service:
+    what the service sends on it is collected by the replayer.
+    """
+
+    def __init__(self, conn, replayer) -> None:
+        self.conn = conn
+        self.sock = None
+        self._replayer = replayer
+
+    def send(self, data):
+        self._replayer._sent(self.conn, data)
+
+    def close(self, *args, **kwargs):
+        pass
+
+
+class _AsyncReplaySocket(_ReplaySocket):
+    """
+    One recorded connection, as seen by a passive (asyncio) service:
+    iterating it yields the inbound frames the replayer puts in its queue.
+    """
+
+    def __init__(self, conn, replayer) -> None:
+        super().__init__(conn, replayer)
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def send(self, data):
+        self._replayer._sent(self.conn, data)
+
+    async def ping(self, data=None):
+        pong = asyncio.get_event_loop().create_future()
+        pong.set_result(None)
+        return pong
+
+    async def close(self, *args, **kwargs):
+        self.queue.put_nowait(None)
+
+
+class TrafficReplayer:
+    """
+    Replay of the inbound frames of a capture into a service.
+
+    `speed` 1 keeps the recorded pacing, N plays N times faster, None (or 0)
+    feeds frames as fast as the service takes them. Outbound frames of the
+    replay are compared with the recorded ones as json, ignoring the keys
+    of `extra` listed in `ignore_keys` (e.g. timestamps); order doesn't
+    matter. Latency is, for the recording and the replay alike, the time
+    from the last inbound frame of a connection to each outbound frame on
+    that connection.
+    """
+
+    def __init__(self, path:str, speed:float=1, ignore_keys=(), settle:float=0.5) -> None:
+        """
+        Args:
+            path : str
+                Capture file written by `TrafficRecorder`.
+            speed : float : optional
+                Replay speed factor, None or 0 for maximum speed.
+            ignore_keys : iterable : optional
+                Keys of `extra` left out when comparing outbound frames.
+            settle : float : optional
+                Seconds without outbound frame after the last inbound one
+                before an asyncio service is considered done.
+        """
+        self.path = path
+        self.speed = speed
+        self.ignore_keys = frozenset(ignore_keys)
+        self.settle = settle
+        self.records = list(read_capture(path))
+        self._outbound = []     # (time, conn, frame) of the replay
+        self._last_in = {}      # conn -> time of its last inbound frame
+        self._latency = None
+
+    def replay(self, service) -> dict:
+        """
+        Replay into `service` and return the comparison (see `compare`).
+        Passive (asyncio) services are run in a new event loop, use
+        `replay_async` from a running one. Active (rel) services are run
+        in the rel loop until the last frame is fed.
+        """
+        if inspect.iscoroutinefunction(service._safe_handle):
+            return asyncio.run(self.replay_async(service))
+        self._reset()
+        sockets = {}
+        start = time.perf_counter()
+        inbound = collections.deque(self._inbound(start))
+
+        def feed():
+            # the frames that are due, then a timer for the next one
+            while inbound:
+                due, record = inbound[0]
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    rel.timeout(delay, feed)
+                    return False
+                inbound.popleft()
+                ws = sockets.get(record.conn)
+                if ws is None:
+                    ws = sockets[record.conn] = _ReplaySocket(record.conn, self)
+                self._last_in[record.conn] = time.perf_counter()
+                service._safe_handle(ws, record.frame)
+            rel.abort()
+            return False
+
+        if inbound:
+            rel.timeout(0, feed)
+            rel.dispatch()
+        return self.compare(time.perf_counter() - start)
+
+    async def replay_async(self, service) -> dict:
+        """
+        Replay into the passive `service`, each recorded connection going
+        through its `_safe_handle` as a connection of its own.
+        """
+        self._reset()
+        sockets = {}
+        tasks = []
+        start = time.perf_counter()
+        for due, record in self._inbound(start):
+            delay = due - time.perf_counter()
+            await asyncio.sleep(delay if delay > 0 else 0)
+            ws = sockets.get(record.conn)
+            if ws is None:
+                ws = sockets[record.conn] = _AsyncReplaySocket(record.conn, self)
+                tasks.append(asyncio.ensure_future(service._safe_handle(ws, '')))
+            self._last_in[record.conn] = time.perf_counter()
+            ws.queue.put_nowait(record.frame)
+
+        fed_at = time.perf_counter()
+        while True:
+            last = self._outbound[-1][0] if self._outbound else fed_at
+            idle = time.perf_counter() - max(last, fed_at)
+            if idle >= self.settle:
+                break
+            await asyncio.sleep(self.settle - idle)
+        for ws in sockets.values():
+            ws.queue.put_nowait(None)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        end = self._outbound[-1][0] if self._outbound else fed_at
+        return self.compare(max(end, fed_at) - start)
+
+    def _reset(self):
+        self._outbound = []
+        self._last_in = {}
+        self._latency = Histogram(Histogram.FINE_BOUNDS)
+
+    def _inbound(self, start):
+        # (due time, record) of the inbound frames
+        inbound = [r for r in self.records if r.direction == 'i']
+        if not inbound:
+            return
+        first = inbound[0].time
+        for record in inbound:
+            due = start + (record.time - first) / self.speed if self.speed else 0
+            yield due, record
+
+    def _sent(self, conn, data):
+        now = time.perf_counter()
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8', 'replace')
+        self._outbound.append((now, conn, data))
+        last_in = self._last_in.get(conn)
+        if last_in is not None:
+            self._latency.add(now - last_in)
+
+    def _key(self, frame):
+        try:
+            data = json.loads(frame)
+        except ValueError:
+            return frame
+        if self.ignore_keys and isinstance(data, dict) and isinstance(data.get('extra'), dict):
+            data['extra'] = {k: v for k, v in data['extra'].items() if k not in self.ignore_keys}
+        return json.dumps(data, sort_keys=True)
+
+    def compare(self, replay_duration:float) -> dict:
+        """
+        Outbound frames and latency of the last replay against the recording.
+
+        Return:
+            A dict with the frame counts (`inbound`, `recorded`, `replayed`,
+            `matched`), up to 10 `missing` (recorded, not replayed) and
+            `unexpected` (replayed, not recorded) frames, both durations and
+            both latency histograms.
+        """
+        recorded_latency = Histogram(Histogram.FINE_BOUNDS)
+        last_in = {}
+        recorded = collections.Counter()
+        for record in self.records:
+            if record.direction == 'i':
+                last_in[record.conn] = record.time
+            else:
+                recorded[self._key(record.frame)] += 1
+                if record.conn in last_in:
+                    recorded_latency.add(record.time - last_in[record.conn])
+        replayed = collections.Counter(self._key(frame) for _, _, frame in self._outbound)
+        missing = recorded - replayed
+        unexpected = replayed - recorded
+        return {
+            'inbound': sum(1 for r in self.records if r.direction == 'i'),
+            'recorded': sum(recorded.values()),
+            'replayed': sum(replayed.values()),
+            'matched': sum((recorded & replayed).values()),
+            'missing': list(missing.elements())[:10],
+            'unexpected': list(unexpected.elements())[:10],
+            'recorded_duration': self.records[-1].time - self.records[0].time if self.records else 0,
+            'replay_duration': replay_duration,
+            'recorded_latency': recorded_latency.snapshot(),
+            'replay_latency': self._latency.snapshot(),
+        }
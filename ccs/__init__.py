@@ -1,10 +1,33 @@
-from .base_god_service import BaseGodService
-from .base_goddess_service import BaseGoddessService
-from .json_ws_active_service import JSONWebsocketActiveService
-from .json_ws_passive_service import JSONWebsocketPassiveService
-from .god_service import GodService
-from .goddess_service import GoddessService
-from .database_agent import DatabaseAgent
+import importlib
+
 from ..import codes
 
-__all__ = ["BaseGodService", "BaseGoddessService", "JSONWebsocketActiveService", "JSONWebsocketPassiveService", "GodService", "GoddessService", "DatabaseAgent", "codes"]
\ No newline at end of file
+# name -> submodule defining it. Submodules are imported on first use, so that
+# GoddessService doesn't load the websocket-client stack of GodService, nor
+# GodService the asyncio one of GoddessService.
+_SUBMODULES = {
+    'BaseGodService': 'base_god_service',
+    'BaseGoddessService': 'base_goddess_service',
+    'JSONWebsocketActiveService': 'json_ws_active_service',
+    'JSONWebsocketPassiveService': 'json_ws_passive_service',
+    'GodService': 'god_service',
+    'GoddessService': 'goddess_service',
+    'GoddessSupervisor': 'goddess_supervisor',
+    'GoddessFront': 'goddess_front',
+    'HashRing': 'goddess_front',
+    'DatabaseAgent': 'database_agent',
+}
+
+__all__ = ["BaseGodService", "BaseGoddessService", "JSONWebsocketActiveService", "JSONWebsocketPassiveService", "GodService", "GoddessService", "GoddessSupervisor", "GoddessFront", "HashRing", "DatabaseAgent", "codes"]
+
+
+def __getattr__(name):
+    submodule = _SUBMODULES.get(name)
+    if submodule is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = getattr(importlib.import_module(f'.{submodule}', __name__), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
\ No newline at end of file
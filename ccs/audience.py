@@ -0,0 +1,213 @@
+"""
+Recipients of the channels of a CCS, as cached segments.
+
+Send helpers address everyone in a channel, everyone but the sender, or a
+group of its members. Reading the roster and building the list on every
+send costs a read of the `DatabaseAgent` and a copy; `Audience` keeps the
+segments of each channel built, as tuples shared by every send:
+
+    everyone(channel_id)               the roster, in joining order
+    all_except(channel_id, user_id)    the roster without user_id
+    group(channel_id, name)            members of a named group (a team, a
+                                       role...) that are in the channel
+
+Groups are defined by features with `define_group` / `add_to_group` /
+`remove_from_group`, apart from the roster: a member of a group who leaves
+the channel is out of its segment, and back in if they join again.
+
+The audience listens to its agent: a join or leave updates the segments of
+its channel in place, a roster set by a take-over or a user list rebuilds
+them on next use, and a file read again (written by another process of a
+shared agent, or restored) drops them all. With a shared agent, every read
+first checks whether the file changed.
+
+Segments are tuples so that they can't be changed by their users; json
+encodes them like lists.
+
+Whole channel audience form
+---------------------------
+`everyone` and `all_except` give `WholeChannel` segments. A frame down
+(COMMAND_FROM_CCS / MESSAGE_FROM_CCS) addressed to one of them can name its
+audience instead of listing it, so that a roster update doesn't carry every
+id twice, once in `to_user_ids` and once in `user_ids`:
+
+    "to_channel": true                  every member of channel_id, as Social
+                                        knows them, instead of to_user_ids
+    "except_user_ids": [...]            with to_channel: but these
+
+Social declares that it knows the form with `"extensions": ["to_channel"]`
+in NOTICE_TAKE_OVER; the services then `compact` what they send on that
+connection. Other peers get `to_user_ids` listed as before.
+"""
+from collections import OrderedDict
+
+TO_CHANNEL = 'to_channel'   # name of the extension
+
+
+class WholeChannel(tuple):
+    """
+    Segment of every member of a channel but `excepted`, listing their ids.
+    """
+
+    def __new__(cls, user_ids=(), excepted=()):
+        segment = tuple.__new__(cls, user_ids)
+        segment.excepted = excepted
+        return segment
+
+
+def compact(extra_args:dict) -> dict:
+    """
+    `extra_args` of a frame down with `to_user_ids` in the `to_channel`
+    form, if it is a `WholeChannel`.
+    """
+    to_user_ids = extra_args.get('to_user_ids')
+    if to_user_ids.__class__ is not WholeChannel:
+        return extra_args
+    extra_args = dict(extra_args, to_channel=True)
+    del extra_args['to_user_ids']
+    if to_user_ids.excepted:
+        extra_args['except_user_ids'] = list(to_user_ids.excepted)
+    return extra_args
+
+
+class _Segments:
+    __slots__ = ('members', 'everyone', 'excepts', 'groups')
+
+    def __init__(self, user_ids) -> None:
+        self.everyone = WholeChannel(dict.fromkeys(user_ids))
+        self.members = {user_id: i for i, user_id in enumerate(self.everyone)}  # -> position in everyone
+        self.excepts = OrderedDict()            # user_id -> roster without it, least recently used first
+        self.groups = {}                        # name -> members of the group in the channel
+
+
+class Audience:
+    # all_except segments kept per channel, the least recently used going first
+    MAX_EXCEPTS = 64
+
+    def __init__(self, agent) -> None:
+        self.agent = agent
+        self.definitions = {}   # channel_id -> {group name: dict of its user ids, as an ordered set}
+        self.stats = {'built': 0, 'updated': 0, 'dropped': 0}
+        self._channels = {}     # channel_id -> _Segments
+        agent.listen(self._roster_changed)
+
+    def _segments(self, channel_id) -> _Segments:
+        if self.agent.shared:
+            self.agent.state()  # reloading the file, if changed, drops the segments
+        segments = self._channels.get(channel_id)
+        if segments is None:
+            segments = self._channels[channel_id] = _Segments(self.agent.get_channel_user_list(channel_id))
+            self.stats['built'] += 1
+        return segments
+
+    def everyone(self, channel_id) -> tuple:
+        return self._segments(channel_id).everyone
+
+    def all_except(self, channel_id, user_id) -> tuple:
+        segments = self._segments(channel_id)
+        excepts = segments.excepts
+        segment = excepts.get(user_id)
+        if segment is None:
+            i = segments.members.get(user_id)
+            if i is None:
+                return segments.everyone
+            everyone = segments.everyone
+            segment = excepts[user_id] = WholeChannel(everyone[:i] + everyone[i + 1:], (user_id,))
+            if len(excepts) > self.MAX_EXCEPTS:
+                excepts.popitem(last=False)
+        else:
+            excepts.move_to_end(user_id)
+        return segment
+
+    def group(self, channel_id, name) -> tuple:
+        segments = self._segments(channel_id)
+        segment = segments.groups.get(name)
+        if segment is None:
+            definition = self.definitions.get(channel_id, {}).get(name, {})
+            members = segments.members
+            segment = segments.groups[name] = tuple(user_id for user_id in definition if user_id in members)
+        return segment
+
+    def groups(self, channel_id) -> list:
+        """
+        Names of the groups defined in a channel.
+        """
+        return list(self.definitions.get(channel_id, ()))
+
+    def define_group(self, channel_id, name, user_ids):
+        """
+        Define, or redefine, group `name` of a channel as `user_ids`.
+        """
+        self.definitions.setdefault(channel_id, {})[name] = dict.fromkeys(user_ids)
+        self._forget_group(channel_id, name)
+
+    def add_to_group(self, channel_id, name, user_id):
+        self.definitions.setdefault(channel_id, {}).setdefault(name, {})[user_id] = None
+        self._forget_group(channel_id, name)
+
+    def remove_from_group(self, channel_id, name, user_id):
+        definition = self.definitions.get(channel_id, {}).get(name)
+        if definition is not None and user_id in definition:
+            del definition[user_id]
+            self._forget_group(channel_id, name)
+
+    def drop_group(self, channel_id, name):
+        self.definitions.get(channel_id, {}).pop(name, None)
+        self._forget_group(channel_id, name)
+
+    def _forget_group(self, channel_id, name):
+        segments = self._channels.get(channel_id)
+        if segments is not None:
+            segments.groups.pop(name, None)
+
+    # called by the agent, see DatabaseAgent.listen
+
+    def _roster_changed(self, event, channel_id, user_id):
+        if event == 'reloaded':
+            self.stats['dropped'] += len(self._channels)
+            self._channels.clear()
+            return
+        segments = self._channels.get(channel_id)
+        if segments is None:
+            return
+        if event == 'joined':
+            self._joined(channel_id, segments, user_id)
+        elif event == 'left':
+            self._left(channel_id, segments, user_id)
+        else:
+            self.stats['dropped'] += 1
+            del self._channels[channel_id]
+
+    def _joined(self, channel_id, segments, user_id):
+        if user_id in segments.members:
+            return
+        segments.members[user_id] = len(segments.everyone)
+        segments.everyone = WholeChannel(segments.everyone + (user_id,))
+        for other, segment in segments.excepts.items():
+            segments.excepts[other] = WholeChannel(segment + (user_id,), segment.excepted)
+        self._update_groups(channel_id, segments, user_id)
+        self.stats['updated'] += 1
+
+    def _left(self, channel_id, segments, user_id):
+        if user_id not in segments.members:
+            return
+        members = segments.members
+        i = members.pop(user_id)
+        everyone = segments.everyone = WholeChannel(segments.everyone[:i] + segments.everyone[i + 1:])
+        for member in everyone[i:]:
+            members[member] -= 1
+        excepts = segments.excepts
+        excepts.pop(user_id, None)
+        for other, segment in excepts.items():
+            # in the roster without other, user_id is one place nearer if other was before it
+            j = i if i <= members[other] else i - 1
+            excepts[other] = WholeChannel(segment[:j] + segment[j + 1:], segment.excepted)
+        self._update_groups(channel_id, segments, user_id)
+        self.stats['updated'] += 1
+
+    def _update_groups(self, channel_id, segments, user_id):
+        # only the segments of the groups of user_id change
+        definitions = self.definitions.get(channel_id, {})
+        for name in list(segments.groups):
+            if user_id in definitions.get(name, ()):
+                del segments.groups[name]
@@ -1,15 +1,34 @@
+import weakref
+
 from .json_ws_active_service import JSONWebsocketActiveService
+from .audience import TO_CHANNEL, compact
 from .. import codes
+from ..router import Router
 
 class BaseGodService(JSONWebsocketActiveService):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, lazy_decode=False, recorder=None, tracer=None):
+        super().__init__(lazy_decode=lazy_decode, recorder=recorder, tracer=tracer)
         self.codes = codes
+        # commands by type_code, subclasses add exact routes that take precedence over these ranges
+        self.router = Router(fallback=type(self)._handle_unrouted)
+        self.router.add_range(20000, 29999, type(self)._handle_basic_command)
+        self.router.add_range(80000, 89999, type(self)._handle_notice)
+        self.router.add_range(90000, 99999, type(self)._handle_feature)
         self.path = '' # possible new route path for websocket
+        # connections whose NOTICE_TAKE_OVER declared the to_channel audience form, see audience.py
+        self.to_channel_peers = weakref.WeakSet()
         
     def on_open(self, ws):
         print('BaseGodService opened')
         
+    # frames that reach no branch of _handle_data_dict are dropped unparsed with lazy_decode
+    def _wants(self, code, type_code):
+        if code == self.codes.MESSAGE_TO_CCS:
+            return True
+        if code == self.codes.COMMAND_TO_CCS:
+            return type_code in self.router
+        return False
+
     # override this function to handle data
     def _handle_data_dict(self, data, ws):
         # print(f'BaseGodService: _handle_data_dict received {data} at websocket {ws}')
@@ -28,19 +47,14 @@ class BaseGodService(JSONWebsocketActiveService):
         self._send_data_to_ws(ws, self.codes.MESSAGE_FROM_CCS, **data['extra'])               
 
     def _handle_command_to_ccs(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if 20000 <= type_code <= 29999:
-            self._handle_basic_command(data, ws, path)
-        elif 80000 <= type_code <= 89999:
-            self._handle_notice(data, ws, path)
+        extra = data['extra']
+        if extra['type_code'] == self.codes.NOTICE_TAKE_OVER and TO_CHANNEL in (extra.get('extensions') or ()):
+            self.to_channel_peers.add(ws)
+        self.router.dispatch(data['extra']['type_code'], self, data, ws, path)
 
-        elif 90000 <= type_code <= 99999:
-            self._handle_feature(data, ws, path)
+    def _handle_unrouted(self, data, ws, path):
+        pass
 
-        else:
-            pass
-    
-    
     def _handle_basic_command(self, data, ws, path):
         pass
 
@@ -68,4 +82,6 @@ class BaseGodService(JSONWebsocketActiveService):
         #     pass
 
     def _send_command_down(self, ws, type_code, **kwargs):
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
         self._send_data_to_ws(ws, self.codes.COMMAND_FROM_CCS, type_code=type_code, **kwargs)
\ No newline at end of file
@@ -1,12 +1,32 @@
+import weakref
+
 from .json_ws_passive_service import JSONWebsocketPassiveService
+from .audience import TO_CHANNEL, compact
 from .. import codes
+from ..router import Router
 
 # todo: validate connection is from Social on handshake
 # no database dependency on this layer
 class BaseGoddessService(JSONWebsocketPassiveService):
-    def __init__(self, port=9000):
-        super().__init__(port=port)
+    def __init__(self, port=9000, ping_interval=20, ping_timeout=20, lazy_decode=False, recorder=None, tracer=None):
+        super().__init__(port=port, ping_interval=ping_interval, ping_timeout=ping_timeout, lazy_decode=lazy_decode,
+                         recorder=recorder, tracer=tracer)
         self.codes = codes
+        # commands by type_code, subclasses add exact routes that take precedence over these ranges
+        self.router = Router(fallback=type(self)._handle_unrouted)
+        self.router.add_range(20000, 29999, type(self)._handle_basic_command)
+        self.router.add_range(80000, 89999, type(self)._handle_notice)
+        self.router.add_range(90000, 99999, type(self)._handle_feature)
+        # connections whose NOTICE_TAKE_OVER declared the to_channel audience form, see audience.py
+        self.to_channel_peers = weakref.WeakSet()
+
+    # frames that reach no branch of _handle_data_dict are dropped unparsed with lazy_decode
+    def _wants(self, code, type_code):
+        if code == self.codes.MESSAGE_TO_CCS:
+            return True
+        if code == self.codes.COMMAND_TO_CCS:
+            return type_code in self.router
+        return False
 
     async def _handle_data_dict(self, data, ws, path):
         # print('BaseGoddessService _handle_data_dict: ', data)
@@ -27,18 +47,14 @@ class BaseGoddessService(JSONWebsocketPassiveService):
         await self._send_data_to_ws(ws, self.codes.MESSAGE_FROM_CCS, **data['extra'])               
 
     async def _handle_command_to_ccs(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        # print('BaseGoddessService _handle_command_to_ccs: ', data)
-        if 20000 <= type_code <= 29999:
-            await self._handle_basic_command(data, ws, path)
-        elif 80000 <= type_code <= 89999:
-            await self._handle_notice(data, ws, path)
-        elif 90000 <= type_code <= 99999:
-            await self._handle_feature(data, ws, path)
+        extra = data['extra']
+        if extra['type_code'] == self.codes.NOTICE_TAKE_OVER and TO_CHANNEL in (extra.get('extensions') or ()):
+            self.to_channel_peers.add(ws)
+        await self.router.dispatch(data['extra']['type_code'], self, data, ws, path)
+
+    async def _handle_unrouted(self, data, ws, path):
+        pass
 
-        else:
-            pass
-    
     async def _handle_basic_command(self, data, ws, path):
         pass
 
@@ -49,6 +65,8 @@ class BaseGoddessService(JSONWebsocketPassiveService):
         pass
 
     async def _send_command_down(self, ws, type_code, **kwargs):
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
         await self._send_data_to_ws(ws, self.codes.COMMAND_FROM_CCS, type_code=type_code, **kwargs)
 
     async def _send_ccs_operation(self, data, ws, path):
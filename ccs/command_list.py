@@ -0,0 +1,68 @@
+"""
+Versioned feature command list of a CCS.
+
+COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST goes out on every join, fetch and
+take-over with the whole list. `CommandList` keeps the list with its json
+text, encoded once per change, and a version: a hash of that text, so that
+services with the same features (restarted, or nodes of a cluster) share it.
+
+Every COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST carries `commands_version`. A
+client fetching with the version it has cached, `commands_version` in
+COMMAND_UP_FETCH_CCS_COMMAND_LIST, gets `not_modified: true` and no
+`commands` when it is still the current one.
+
+Change the list through `append`, `remove` or `replace` (or the
+`add_feature` / `remove_feature` of the services); after changing
+`commands` in place, call `changed`.
+"""
+import hashlib
+import json
+
+
+class CommandList:
+    def __init__(self, commands=()) -> None:
+        self.replace(commands)
+
+    def replace(self, commands):
+        self.commands = list(commands)
+        self.changed()
+
+    def append(self, command:dict):
+        self.commands.append(command)
+        self.changed()
+
+    def remove(self, code:int):
+        """
+        Remove the commands of feature `code`.
+        """
+        self.commands = [command for command in self.commands if command['code'] != code]
+        self.changed()
+
+    def changed(self):
+        self._text = None
+        self._version = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.commands)
+        return self._text
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = hashlib.sha1(self.text.encode('utf-8')).hexdigest()[:16]
+        return self._version
+
+    def frame(self, code:int, type_code:int, fetched_version:str=None, **extra_args) -> str:
+        """
+        Json text of a `code` frame with the list, as `_make_data_dict` and
+        `json.dumps` would give, the list coming from `text`. If
+        `fetched_version` is the current version, the list is left out and
+        the frame says `not_modified`.
+        """
+        head = json.dumps({'code': code, 'extra': dict(type_code=type_code, **extra_args,
+                                                       commands_version=self.version)})
+        if fetched_version == self.version:
+            return head[:-2] + ', "not_modified": true}}'
+        return head[:-2] + ', "commands": ' + self.text + '}}'
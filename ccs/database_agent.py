@@ -1,73 +1,189 @@
-# 一个虚假的dbagent，用的是json
+import contextlib
 import json
 import os
 
+from ..tracing import traced
 
+
+# every call is timed as the storage stage of the frame being traced, if any
+# the parsed file is kept in memory while the file stays the same (inode, mtime and size), so
+# that calls don't parse it again; a snapshot can prime it after a restart (see ccs/snapshot.py)
+# shared=True makes the file safe to share between processes (e.g. workers of a GoddessSupervisor):
+# read-modify-writes hold an exclusive lock on <path>.lock, reads a shared one, and the file is
+# replaced atomically so that it is never seen half written
+# listeners (see listen) hear of roster changes, e.g. to keep an Audience in step
 class DatabaseAgent:
-    def __init__(self, path):
+    def __init__(self, path, shared=False):
         self.path = path
+        self.shared = shared
+        self.listeners = []
+        self._cache = None
+        self._cache_key = None
 
         # create if not exist
-        if not os.path.exists(self.path):
+        with self._locked():
+            if not os.path.exists(self.path):
+                self._dump({})
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive=True):
+        lock = None
+        if self.shared:
+            import fcntl
+            lock = open(self.path + '.lock', 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        except BaseException:
+            # the cached data may have been changed and not written
+            self._cache_key = None
+            raise
+        finally:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+    def _file_key(self):
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        key = self._file_key()
+        if key != self._cache_key:
+            with open(self.path, 'r') as f:
+                self._cache = json.load(f)
+            self._cache_key = key
+            # written by another process, or first read: any roster may have changed
+            self._notify('reloaded', None)
+        return self._cache
+
+    def listen(self, listener):
+        """
+            Call listener(event, channel_id, user_id) on roster changes made through the agent:
+            'joined' / 'left' of user_id, 'reset' of the roster of channel_id, 'reloaded' when any
+            roster may have changed (file read again, replaced or primed; channel_id None).
+            Listeners are called holding the lock of a shared agent, so they must not call the agent.
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, event, channel_id, user_id=None):
+        for listener in self.listeners:
+            listener(event, channel_id, user_id)
+
+    def _dump(self, data):
+        self._cache_key = None
+        text = json.dumps(data)
+        if not self.shared:
             with open(self.path, 'w') as f:
-                json.dump({}, f)
+                f.write(text)
+        else:
+            temp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w') as f:
+                f.write(text)
+            os.replace(temp_path, self.path)
+        # what reading the file gives, e.g. int keys turned into str
+        self._cache = json.loads(text)
+        self._cache_key = self._file_key()
+
+    def state(self):
+        """
+            The whole content of the file, and the key (inode, mtime, size) of the file it was read from.
+        """
+        with self._locked(exclusive=False):
+            return self._load(), self._cache_key
+
+    def prime(self, data, key):
+        """
+            Use `data` as the parsed file if the file is still the one of `key`, e.g. after a restart.
+            Return whether it was used.
+        """
+        with self._locked(exclusive=False):
+            if key is None or tuple(key) != self._file_key():
+                return False
+            self._cache = data
+            self._cache_key = tuple(key)
+            self._notify('reloaded', None)
+            return True
 
+    def replace(self, data):
+        """
+            Write `data` as the whole content of the file.
+        """
+        with self._locked():
+            self._dump(data)
+            self._notify('reloaded', None)
+
+    @traced('storage')
     def leave_channel(self, channel_id, user_id):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
-        if not channel_id in data["user_list"]:
-            return
-        data["user_list"][channel_id].remove(user_id)
-        # write
-        with open(self.path, 'w') as f:
-            json.dump(data, f)
+        with self._locked():
+            data = self._load()
+            if not channel_id in data["user_list"]:
+                return
+            data["user_list"][channel_id].remove(user_id)
+            # write
+            self._dump(data)
+            self._notify('left', channel_id, user_id)
 
+    @traced('storage')
     def join_channel(self, channel_id, user_id):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
-        if not channel_id in data["user_list"]:
-            data["user_list"][channel_id] = []
-        if not user_id in data["user_list"][channel_id]:
+        with self._locked():
+            data = self._load()
+            if not channel_id in data["user_list"]:
+                data["user_list"][channel_id] = []
+            if user_id in data["user_list"][channel_id]:
+                return
             data["user_list"][channel_id].append(user_id)
-        # write
-        with open(self.path, 'w') as f:
-            json.dump(data, f)
+            # write
+            self._dump(data)
+            self._notify('joined', channel_id, user_id)
 
+    @traced('storage')
     def get_channel_user_list(self, channel_id):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
+        with self._locked(exclusive=False):
+            data = self._load()
         if not ("user_list" in data and channel_id in data["user_list"]):
             return []
-        return data["user_list"][channel_id]
+        return list(data["user_list"][channel_id])
 
+    @traced('storage')
     def init_user_id_list(self, channel_id, user_ids):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
-        data["user_list"] = {}
-        data["user_list"][channel_id] = user_ids or []
-        with open(self.path, 'w') as f:
-            json.dump(data, f)
+        """
+            Set the user list of `channel_id` to `user_ids`, e.g. on a take-over.
+            Only that channel is reset: the lists of the other channels of the file are kept, so that
+            one agent can serve many channels (e.g. a node of a GoddessFront). Before, every list was
+            dropped, and a file only ever held the channel taken over last.
+        """
+        with self._locked():
+            data = self._load()
+            data.setdefault("user_list", {})
+            data["user_list"][channel_id] = user_ids or []
+            self._dump(data)
+            self._notify('reset', channel_id)
 
+    @traced('storage')
     def init_whistle(self, channel_id):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
-        data["whistle"] = {}
-        data["whistle"][channel_id] = {}
-        with open(self.path, 'w') as f:
-            json.dump(data, f)
+        """
+            Forget the whistle recipients of `channel_id` only, keeping those of the other channels.
+        """
+        with self._locked():
+            data = self._load()
+            data.setdefault("whistle", {})
+            data["whistle"][channel_id] = {}
+            self._dump(data)
 
+    @traced('storage')
     def add_whistle_msg(self, channel_id, msg, recipients):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
-        if not channel_id in data["whistle"]:
-            data["whistle"][channel_id] = {}
-        data["whistle"][channel_id][msg] = recipients
-        with open(self.path, 'w') as f:
-            json.dump(data, f)
+        with self._locked():
+            data = self._load()
+            if not channel_id in data["whistle"]:
+                data["whistle"][channel_id] = {}
+            data["whistle"][channel_id][msg] = recipients
+            self._dump(data)
 
+    @traced('storage')
     def get_whistle_recipients(self, channel_id, msg):
-        with open(self.path, 'r') as f:
-            data = json.load(f)
+        with self._locked(exclusive=False):
+            data = self._load()
         if not ("whistle" in data and channel_id in data["whistle"] and msg in data["whistle"][channel_id]):
             return []
-        return data["whistle"][channel_id][msg]
\ No newline at end of file
+        return list(data["whistle"][channel_id][msg])
\ No newline at end of file
@@ -1,5 +1,10 @@
 from .base_god_service import BaseGodService
+from .audience import Audience, compact
+from .command_list import CommandList
 from .database_agent import DatabaseAgent
+from . import snapshot
+from ..media import MediaStore, image_args
+import base64
 import rel
 
 
@@ -9,17 +14,23 @@ class GodService(BaseGodService):
         CCS provides a various of features for users in corresponding channels to use.
     """
 
-    def __init__(self, name='GodService'):
-        super().__init__()
+    def __init__(self, name='GodService', lazy_decode=False, recorder=None, tracer=None, media_dir=None,
+                 media_max_bytes=256 << 20):
+        super().__init__(lazy_decode=lazy_decode, recorder=recorder, tracer=tracer)
         self.agent = DatabaseAgent(name+".json")
+        # images by hash, if given a directory, see media.py
+        self.media = MediaStore(media_dir, media_max_bytes) if media_dir else None
+        # cached recipient lists of the channels, see ccs/audience.py
+        self.audience = Audience(self.agent)
         self.uri = None
         self.name = 'GodService'
-        self.feature_commands = []
+        self.command_list = CommandList()
 
         self.basic_command_func_map = {
             self.codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST: handle_fetch_command,
             self.codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST: handle_fetch_user_list,
             self.codes.COMMAND_UP_FETCH_RECIPIENT_LIST: handle_fetch_recipient_list,
+            self.codes.COMMAND_UP_FETCH_MEDIA: handle_fetch_media,
         }
         self.notice_func_map = {
             self.codes.NOTICE_USER_JOINED: handle_join,
@@ -39,6 +50,13 @@ class GodService(BaseGodService):
         
         self.temp_msg_map = {}
 
+        # handlers get exact routes, the range routes of the base class end in _handle_basic_command,
+        # _handle_notice and _handle_feature, which are left with codes that have no handler
+        for func_map in (self.basic_command_func_map, self.notice_func_map, self.feature_func_map,
+                         self.message_func_map):
+            for code, func in func_map.items():
+                self.router.add(code, func)
+
     def on_open(self, ws):
         """
             Default behavior "on_open" for websocket.
@@ -62,20 +80,57 @@ class GodService(BaseGodService):
             If one feature with no handler is triggered, an exception will be raised.
             You can use set_feature_handle to set a handler for a feature.
         """
-        self.feature_commands.append(
+        self.command_list.append(
             {'name': name, 'code': code, 'prompts': [prompts] if prompts else []})
         self.prompt[code] = prompts
         if func:
             self.feature_func_map[code] = func
+            self.router.add(code, func)
 
     def remove_feature(self, code):
         """
             Remove a feature from the service.
             The feature is specified by its code.
         """
-        self.feature_commands = list(
-            filter(lambda x: x['code'] != code, self.feature_commands))
+        self.command_list.remove(code)
         self.feature_func_map.pop(code, None)
+        self.router.remove(code)
+
+    @property
+    def feature_commands(self):
+        """
+            The feature commands, see add_feature. After changing them in place, call command_list.changed().
+        """
+        return self.command_list.commands
+
+    @feature_commands.setter
+    def feature_commands(self, commands):
+        self.command_list.replace(commands)
+
+    def save_snapshot(self, path):
+        """
+            Write a warm-start snapshot of the service (rosters, feature commands, pending acks) to path.
+        """
+        snapshot.write_snapshot(path, snapshot.capture(self))
+
+    def load_snapshot(self, path):
+        """
+            Restore a snapshot written by save_snapshot, e.g. right after a restart, before run().
+            Returns what was restored; see ccs/snapshot.py.
+        """
+        return snapshot.restore(self, snapshot.read_snapshot(path))
+
+    def start_snapshots(self, path, interval=60):
+        """
+            Save a snapshot to path every interval seconds, in the rel loop.
+        """
+        def save():
+            try:
+                self.save_snapshot(path)
+            except Exception as e:
+                print('GodService: snapshot failed', e)
+            return True
+        rel.timeout(interval, save)
 
     def set_basic_command_handle(self, code, func):
         """
@@ -84,6 +139,7 @@ class GodService(BaseGodService):
             Some commands will be like "help", "quit".
         """
         self.basic_command_func_map[code] = func
+        self.router.add(code, func)
 
     def set_notice_handle(self, code, func):
         """
@@ -92,6 +148,7 @@ class GodService(BaseGodService):
             Some notices will be like "user joined the channel", "user left the channel".
         """
         self.notice_func_map[code] = func
+        self.router.add(code, func)
 
     def set_feature_handle(self, code, func):
         """
@@ -99,6 +156,7 @@ class GodService(BaseGodService):
             The feature is specified by its code.
         """
         self.feature_func_map[code] = func
+        self.router.add(code, func)
 
     def set_message_handle(self, code, func):
         """
@@ -107,6 +165,15 @@ class GodService(BaseGodService):
             For example, text messages are MESSAGE_UP_TEXT.
         """
         self.message_func_map[code] = func
+        self.router.add(code, func)
+
+    # with lazy_decode, frames no handler is routed for are dropped unparsed
+    def _wants(self, code, type_code):
+        if type_code is None:
+            return code in (self.codes.MESSAGE_TO_CCS, self.codes.COMMAND_TO_CCS)
+        if code in (self.codes.MESSAGE_TO_CCS, self.codes.COMMAND_TO_CCS):
+            return type_code in self.router.exact
+        return False
 
     def _handle_data_dict(self, data, ws):
         print(
@@ -126,43 +193,21 @@ class GodService(BaseGodService):
             raise Exception('no handler for code', data['code'])
 
     def _handle_message_to_ccs(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.message_func_map:
-            self.message_func_map[type_code](self, data, ws, path)
-        else:
-            raise Exception('no message function for code', type_code)
-
-    def _handle_command_to_ccs(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if 20000 <= type_code <= 29999:
-            self._handle_basic_command(data, ws, path)
-        elif 80000 <= type_code <= 89999:
-            self._handle_notice(data, ws, path)
-        elif 90000 <= type_code <= 99999:
-            self._handle_feature(data, ws, path)
-        else:
-            raise Exception('no command function for code', type_code)
+        # type codes of messages (3xxxx) and commands (2xxxx, 8xxxx, 9xxxx) don't overlap,
+        # so messages share the router of commands
+        self.router.dispatch(data['extra']['type_code'], self, data, ws, path)
 
     def _handle_basic_command(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.basic_command_func_map:
-            self.basic_command_func_map[type_code](self, data, ws, path)
-        else:
-            raise Exception('no basic command function for code', type_code)
+        raise Exception('no basic command function for code', data['extra']['type_code'])
 
     def _handle_notice(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.notice_func_map:
-            self.notice_func_map[type_code](self, data, ws, path)
-        else:
-            raise Exception('no notice function for code', type_code)
+        raise Exception('no notice function for code', data['extra']['type_code'])
 
     def _handle_feature(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.feature_func_map:
-            self.feature_func_map[type_code](self, data, ws, path)
-        else:
-            raise Exception('no feature function for code', type_code)
+        raise Exception('no feature function for code', data['extra']['type_code'])
+
+    def _handle_unrouted(self, data, ws, path):
+        raise Exception('no function for code', data['extra']['type_code'])
 
     def _send_ccs_operation(self, data, ws, path):
         print('WrappedGodService ccs_operation: ', data)
@@ -176,42 +221,57 @@ class GodService(BaseGodService):
             raise Exception('no ccs operation for code', code)
 
     def _send_command_down(self, ws, type_code, **kwargs):
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
         self._send_data_to_ws(ws, self.codes.COMMAND_FROM_CCS,
                               type_code=type_code, **kwargs)
 
-    def _send_message_down(self, ws, type_code, channel_id, from_user_id, to_user_ids, origin, temp_msg_id, **kwargs):
-        self._send_data_to_ws(ws, self.codes.MESSAGE_FROM_CCS,
-                              type_code=type_code, channel_id=channel_id, from_user_id=from_user_id,
-                              to_user_ids=to_user_ids, origin=origin, temp_msg_id=temp_msg_id, **kwargs)
+    def _send_command_list(self, ws, fetched_version=None, **kwargs):
+        # COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST, just not_modified if the client has fetched_version
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
+        self._safe_send(ws, self.command_list.frame(self.codes.COMMAND_FROM_CCS, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
+                                                    fetched_version, **kwargs))
 
-    def broadcast_command_text(self, data, ws, text, clear=False):
+    def _send_message_down(self, ws, type_code, channel_id, from_user_id, to_user_ids, origin, temp_msg_id, **kwargs):
+        kwargs = dict(kwargs, type_code=type_code, channel_id=channel_id, from_user_id=from_user_id,
+                      to_user_ids=to_user_ids, origin=origin, temp_msg_id=temp_msg_id)
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
+        self._send_data_to_ws(ws, self.codes.MESSAGE_FROM_CCS, **kwargs)
+
+    def _recipients(self, channel_id, group):
+        if group is None:
+            return self.audience.everyone(channel_id)
+        return self.audience.group(channel_id, group)
+
+    def broadcast_command_text(self, data, ws, text, clear=False, group=None):
         """
-            Broadcast a text to all users in a channel.
+            Broadcast a text to all users in a channel, or to the members of a group of it (see audience).
         """
         channel_id = data['extra']['channel_id']
         self._send_command_down(
             ws,
             self.codes.COMMAND_DOWN_DISPLAY_TEXT,
             channel_id=channel_id,
-            to_user_ids=self.agent.get_channel_user_list(channel_id),
+            to_user_ids=self._recipients(channel_id, group),
             args={'text': text, 'clear': clear}
         )
 
-    def broadcast_command_image(self, data, ws, url):
+    def broadcast_command_image(self, data, ws, url, group=None):
         """
-            Broadcast an image to all users in a channel.
+            Broadcast an image to all users in a channel, or to the members of a group of it (see audience).
+            url: an URL, or the image as bytes, sent by hash to users who already got it (see media.py)
         """
         channel_id = data['extra']['channel_id']
-        self._send_command_down(
-            ws,
-            self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
-            channel_id=channel_id,
-            to_user_ids=self.agent.get_channel_user_list(channel_id),
-            args={
-                'type': 'url',
-                'image': url
-            }
-        )
+        for to_user_ids, args in image_args(self.media, self._recipients(channel_id, group), url):
+            self._send_command_down(
+                ws,
+                self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
+                channel_id=channel_id,
+                to_user_ids=to_user_ids,
+                args=args
+            )
 
     def reply_command_text(self, data, ws, text, clear=False):
         """
@@ -228,14 +288,16 @@ class GodService(BaseGodService):
     def reply_command_image(self, data, ws, url):
         """
             Reply an image to a single user.
+            url: an URL, or the image as bytes, sent by hash if the user already got it (see media.py)
         """
-        self._send_command_down(
-            ws,
-            self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
-            channel_id=data['extra']['channel_id'],
-            to_user_ids=[data['extra']['user_id']],
-            args={'type': 'url',  'image': url}
-        )
+        for to_user_ids, args in image_args(self.media, [data['extra']['user_id']], url):
+            self._send_command_down(
+                ws,
+                self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
+                channel_id=data['extra']['channel_id'],
+                to_user_ids=to_user_ids,
+                args=args
+            )
 
     def whistle_sender_command_text(
         self, data, ws, *,
@@ -259,8 +321,7 @@ class GodService(BaseGodService):
             ws,
             self.codes.COMMAND_DOWN_DISPLAY_TEXT,
             channel_id=channel_id,
-            to_user_ids=list(set(self.agent.get_channel_user_list(
-                channel_id)) - {data['extra']['user_id']}),
+            to_user_ids=self.audience.all_except(channel_id, data['extra']['user_id']),
             args={'text': text_to_others, 'clear': clear_others}
         )
 
@@ -291,8 +352,7 @@ def handle_fetch_command(self, data, ws, path):
     """
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
-    self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-                            channel_id=channel_id, to_user_ids=[user_id], commands=self.feature_commands)
+    self._send_command_list(ws, data['extra'].get('commands_version'), channel_id=channel_id, to_user_ids=[user_id])
 
 
 def handle_fetch_user_list(self, data, ws, path):
@@ -303,7 +363,7 @@ def handle_fetch_user_list(self, data, ws, path):
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
     self.agent.join_channel(channel_id, user_id)
-    user_ids = self.agent.get_channel_user_list(channel_id)
+    user_ids = self.audience.everyone(channel_id)
     self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
                             channel_id=channel_id, to_user_ids=[user_id], user_ids=user_ids)
 
@@ -323,6 +383,25 @@ def handle_fetch_recipient_list(self, data, ws, path):
                             channel_id=channel_id, msg_id=msg_id, to_user_ids=[user_id], recipients=recipient_list)
 
 
+def handle_fetch_media(self, data, ws, path):
+    """
+        A function that handles the "fetch media" command.
+        A client asks for media sent to it by hash that it doesn't have (see media.py).
+        This can be the default behavior.
+    """
+    channel_id = data['extra']['channel_id']
+    user_id = data['extra']['user_id']
+    media_hash = data['extra']['media_hash']
+    media = self.media.get(media_hash) if self.media is not None else None
+    if media is None:
+        self._send_command_down(ws, self.codes.COMMAND_DOWN_MEDIA,
+                                channel_id=channel_id, to_user_ids=[user_id], media_hash=media_hash)
+        return
+    self.media.mark_known(media_hash, [user_id])
+    self._send_command_down(ws, self.codes.COMMAND_DOWN_MEDIA, channel_id=channel_id, to_user_ids=[user_id],
+                            media_hash=media_hash, media=base64.b64encode(media).decode('ascii'))
+
+
 def handle_receive_user_list(self, data, ws, path):
     """
         A function that handles the "get channel user list" notice, which indicates that you received some user list.
@@ -341,11 +420,10 @@ def handle_join(self, data, ws, path):
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
     self.agent.join_channel(channel_id, user_id)
-    user_ids = self.agent.get_channel_user_list(channel_id)
+    user_ids = self.audience.everyone(channel_id)
     self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
                             channel_id=channel_id, to_user_ids=user_ids, user_ids=user_ids)
-    self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-                            channel_id=channel_id, to_user_ids=[user_id], commands=self.feature_commands)
+    self._send_command_list(ws, channel_id=channel_id, to_user_ids=[user_id])
 
 
 def handle_left(self, data, ws, path):
@@ -356,7 +434,7 @@ def handle_left(self, data, ws, path):
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
     self.agent.leave_channel(channel_id, user_id)
-    user_ids = self.agent.get_channel_user_list(channel_id)
+    user_ids = self.audience.everyone(channel_id)
     self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
                             channel_id=channel_id, to_user_ids=user_ids, user_ids=user_ids)
 
@@ -373,10 +451,10 @@ def handle_notice_take_over(self, data, ws, path):
     user_ids = data["extra"]["target_user_ids"]
     self.agent.init_user_id_list(target_channel_id, user_ids)
     self.agent.init_whistle(target_channel_id)
+    to_user_ids = self.audience.everyone(target_channel_id)
     self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
-                            channel_id=target_channel_id, to_user_ids=user_ids, user_ids=user_ids)
-    self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-                            channel_id=target_channel_id, to_user_ids=user_ids, user_ids=user_ids, commands=self.feature_commands)
+                            channel_id=target_channel_id, to_user_ids=to_user_ids, user_ids=user_ids)
+    self._send_command_list(ws, channel_id=target_channel_id, to_user_ids=to_user_ids, user_ids=user_ids)
 
 
 def handle_notice_release(self, data, ws, path):
@@ -0,0 +1,318 @@
+import asyncio
+import bisect
+import hashlib
+import traceback
+
+import websockets
+
+from .json_ws_passive_service import JSONWebsocketPassiveService
+from .. import codes
+from ..reconnect import ReconnectPolicy
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Each node gets `vnodes` points on
+    the ring, so that adding or removing a node only moves the keys of its
+    share, spread over the other nodes.
+    """
+
+    def __init__(self, nodes=(), vnodes:int=64) -> None:
+        self.vnodes = vnodes
+        self.nodes = set()
+        self._points = []   # sorted hashes
+        self._owners = []   # node of each point
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key) -> int:
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = self._hash(f'{node}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, owner in kept]
+        self._owners = [owner for point, owner in kept]
+
+    def node_for(self, key):
+        """
+        Node owning `key`, None for an empty ring.
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+# Front of a cluster of Goddess nodes (GoddessService listening each on its own URI).
+# Social connects to the front, which routes every frame by the hash of its channel_id
+# (target_channel_id for NOTICE_TAKE_OVER/NOTICE_RELEASE) to the node owning the channel,
+# so that the state of a channel stays on one node. Each Social connection gets its own
+# connection to every node it has frames for, and what a node sends on it goes back to
+# that Social connection.
+# Channel members are followed from the notices going through, so that when nodes join
+# (add_worker) or leave (remove_worker, or their connection drops) the channels changing
+# owner are handed over: NOTICE_RELEASE to the former owner, if still there, and
+# NOTICE_TAKE_OVER with the members to the new one. A node that dropped is probed with
+# reconnect_policy and takes its share back once it answers.
+# stop() ends the probes and the connections to the nodes; the server is closed by its owner.
+class GoddessFront(JSONWebsocketPassiveService):
+    def __init__(self, port=9000, workers=(), ping_interval=20, ping_timeout=20, vnodes=64,
+                 reconnect_policy=None, recorder=None, tracer=None):
+        super().__init__(port=port, ping_interval=ping_interval, ping_timeout=ping_timeout, recorder=recorder,
+                         tracer=tracer)
+        self.ring = HashRing(workers, vnodes)
+        self.reconnect_policy = reconnect_policy or ReconnectPolicy()
+        self.channels = {}      # channel_id -> {'owner', 'members', 'name', 'timestamp', 'ws'}
+        self.links = {}         # Social ws -> {worker uri: ws to the worker}
+        self.worker_stats = {uri: self._new_worker_stats() for uri in workers}
+        self.stats.update({'frames_unroutable': 0, 'rebalances': 0, 'channels_moved': 0})
+        self._pumps = {}        # link to a worker -> task sending its frames back to Social
+        self._watches = {}      # worker uri -> task probing it
+
+    @staticmethod
+    def _new_worker_stats():
+        return {'frames_up': 0, 'frames_down': 0, 'lost': 0}
+
+    def get_stats(self):
+        stats = super().get_stats()
+        owned = {}
+        for info in self.channels.values():
+            owned[info['owner']] = owned.get(info['owner'], 0) + 1
+        stats['workers'] = {
+            uri: dict(worker_stats, channels=owned.get(uri, 0), up=uri in self.ring)
+            for uri, worker_stats in self.worker_stats.items()
+        }
+        return stats
+
+    # routing
+
+    @staticmethod
+    def _channel_of(extra):
+        channel_id = extra.get('channel_id')
+        return channel_id if channel_id is not None else extra.get('target_channel_id')
+
+    async def _handle_data_dict(self, data, ws, path):
+        extra = data.get('extra') or {}
+        channel_id = self._channel_of(extra)
+        if channel_id is not None:
+            self._follow(data, extra, channel_id, ws)
+        # frames without channel all go to one node
+        key = channel_id if channel_id is not None else ''
+        while True:
+            uri = self.ring.node_for(key)
+            if uri is None:
+                self.stats['frames_unroutable'] += 1
+                print('GoddessFront: no worker to route to, frame dropped', data.get('code'))
+                return
+            link = await self._link(ws, uri)
+            if link is not None:
+                break
+            if ws not in self.links:
+                return
+            # could not connect: the worker left, route again on the ring without it
+        if channel_id is not None and channel_id in self.channels:
+            self.channels[channel_id]['owner'] = uri
+        self.worker_stats[uri]['frames_up'] += 1
+        await self._safe_send(link, data)
+
+    def _follow(self, data, extra, channel_id, ws):
+        # members of the channels, to hand them over when they change owner
+        if data.get('code') != codes.COMMAND_TO_CCS:
+            return
+        type_code = extra.get('type_code')
+        if type_code == codes.NOTICE_TAKE_OVER:
+            self.channels[channel_id] = {
+                'owner': None, 'members': list(extra.get('target_user_ids') or []),
+                'name': extra.get('target_channel_name'), 'timestamp': extra.get('target_channel_timestamp'),
+                'extensions': extra.get('extensions'), 'ws': ws,
+            }
+            return
+        if type_code == codes.NOTICE_RELEASE:
+            self.channels.pop(channel_id, None)
+            return
+        info = self.channels.get(channel_id)
+        if info is None:
+            return
+        info['ws'] = ws
+        if type_code == codes.NOTICE_USER_JOINED:
+            if extra.get('user_id') not in info['members']:
+                info['members'].append(extra.get('user_id'))
+        elif type_code == codes.NOTICE_USER_LEFT:
+            if extra.get('user_id') in info['members']:
+                info['members'].remove(extra.get('user_id'))
+        elif type_code == codes.NOTICE_GET_CHANNEL_USER_LIST:
+            info['members'] = list(extra.get('user_ids') or [])
+
+    async def _link(self, ws, uri):
+        """
+        Connection to worker `uri` for the Social connection `ws`, opened on
+        first use. None if the worker can't be reached, which then leaves,
+        or if the Social connection is gone.
+        """
+        links = self.links.get(ws)
+        if links is None:
+            return None
+        link = links.get(uri)
+        if link is not None:
+            return link
+        try:
+            link = await websockets.connect(uri, ping_interval=self.ping_interval, ping_timeout=self.ping_timeout)
+        except (OSError, websockets.InvalidHandshake, asyncio.TimeoutError) as e:
+            print(f'GoddessFront: cannot connect to worker {uri}', e)
+            await self._lost(uri)
+            return None
+        # Social may have left, or another frame connected first, while connecting
+        if self.links.get(ws) is not links or uri in links:
+            await link.close()
+            return links.get(uri)
+        links[uri] = link
+        self._pumps[link] = asyncio.ensure_future(self._pump(ws, uri, link))
+        return link
+
+    async def _close_link(self, link):
+        pump = self._pumps.pop(link, None)
+        if pump is not None and pump is not asyncio.current_task():
+            pump.cancel()
+        await link.close()
+
+    async def _pump(self, ws, uri, link):
+        # frames of the worker go back to the Social connection they are for; the pump of a
+        # link closed by the front is cancelled, so one that ends here lost its worker
+        try:
+            async for message in link:
+                self.worker_stats[uri]['frames_down'] += 1
+                await self._safe_send(ws, message)
+        except websockets.ConnectionClosed:
+            pass
+        except Exception:
+            traceback.print_exc()
+        self._pumps.pop(link, None)
+        links = self.links.get(ws)
+        if links is not None and links.get(uri) is link:
+            del links[uri]
+        print(f'GoddessFront: connection to worker {uri} dropped')
+        await self._lost(uri)
+
+    async def _safe_handle(self, ws, path):
+        self.links[ws] = {}
+        try:
+            await super()._safe_handle(ws, path)
+        finally:
+            for link in self.links.pop(ws, {}).values():
+                await self._close_link(link)
+
+    async def stop(self):
+        """
+        Stop probing lost workers and close the connections to the workers.
+        """
+        for watch in self._watches.values():
+            watch.cancel()
+        self._watches.clear()
+        for links in list(self.links.values()):
+            for link in list(links.values()):
+                await self._close_link(link)
+            links.clear()
+
+    # membership
+
+    async def add_worker(self, uri):
+        """
+        Add the Goddess listening at `uri` and hand over the channels it now owns.
+        """
+        watch = self._watches.pop(uri, None)
+        if watch is not None and watch is not asyncio.current_task():
+            watch.cancel()
+        if uri in self.ring:
+            return
+        self.worker_stats.setdefault(uri, self._new_worker_stats())
+        self.ring.add(uri)
+        print(f'GoddessFront: worker {uri} joined, {len(self.ring)} workers')
+        await self._rebalance()
+
+    async def remove_worker(self, uri):
+        """
+        Stop routing to the Goddess at `uri`, hand its channels over to the
+        others and close the connections to it.
+        """
+        if uri not in self.ring:
+            return
+        self.ring.remove(uri)
+        print(f'GoddessFront: worker {uri} left, {len(self.ring)} workers')
+        await self._rebalance()
+        for links in list(self.links.values()):
+            link = links.pop(uri, None)
+            if link is not None:
+                await self._close_link(link)
+
+    async def _lost(self, uri):
+        if uri not in self.ring:
+            return
+        self.worker_stats[uri]['lost'] += 1
+        await self.remove_worker(uri)
+        self._watches[uri] = asyncio.ensure_future(self._watch(uri))
+
+    async def _watch(self, uri):
+        # probe a lost worker until it answers, then give it its channels back
+        policy = self.reconnect_policy.copy()
+        while True:
+            await asyncio.sleep(policy.next_delay())
+            try:
+                probe = await websockets.connect(uri, ping_interval=None)
+            except (OSError, websockets.InvalidHandshake, asyncio.TimeoutError):
+                continue
+            await probe.close()
+            await self.add_worker(uri)
+            return
+
+    async def _rebalance(self):
+        self.stats['rebalances'] += 1
+        for channel_id, info in list(self.channels.items()):
+            owner = self.ring.node_for(channel_id)
+            if owner == info['owner'] or owner is None:
+                continue
+            if info['ws'] not in self.links:
+                # Social is gone, it takes the channel over again when it reconnects
+                continue
+            await self._hand_over(channel_id, info, owner)
+
+    async def _hand_over(self, channel_id, info, owner):
+        ws = info['ws']
+        former = info['owner']
+        info['owner'] = owner
+        self.stats['channels_moved'] += 1
+        if former is not None:
+            if former in self.ring:
+                link = await self._link(ws, former)
+            else:
+                # a node leaving: released on the connection still open to it, none if it dropped
+                link = self.links.get(ws, {}).get(former)
+            if link is not None:
+                await self._safe_send(link, self._make_data_dict(
+                    codes.COMMAND_TO_CCS, type_code=codes.NOTICE_RELEASE, target_channel_id=channel_id,
+                    target_user_ids=info['members']))
+        link = await self._link(ws, owner)
+        if link is not None:
+            await self._safe_send(link, self._make_data_dict(
+                codes.COMMAND_TO_CCS, type_code=codes.NOTICE_TAKE_OVER, target_channel_id=channel_id,
+                target_user_ids=info['members'], target_channel_name=info['name'],
+                target_channel_timestamp=info['timestamp'], extensions=info['extensions']))
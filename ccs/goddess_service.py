@@ -1,8 +1,14 @@
 from .base_goddess_service import BaseGoddessService
+from .audience import Audience, compact
+from .command_list import CommandList
 from .database_agent import DatabaseAgent
-import rel
+from . import snapshot
+from .. import tracing
+from ..transfer import ChunkRelay
+from ..media import MediaStore, image_args
 import asyncio
-import time
+import base64
+import json
 import datetime
 
 class GoddessService(BaseGoddessService):
@@ -11,23 +17,33 @@ class GoddessService(BaseGoddessService):
         CCS provides a various of features for users in corresponding channels to use.
     """
 
-    def __init__(self, port, uri, token, dbfile, name='GoddessService'):
+    def __init__(self, port, uri, token, dbfile, name='GoddessService', lazy_decode=False, recorder=None,
+                 tracer=None, shared_db=False, media_dir=None, media_max_bytes=256 << 20):
         """
             Args:
                 dbfile: path to the dbfile
+                media_dir: directory of the media store (see media.py), none to keep no media
+                media_max_bytes: size of the media store, least recently used media evicted beyond it
+                shared_db: lock the dbfile for processes sharing it, e.g. workers of a GoddessSupervisor
+                lazy_decode: read code/type_code first, drop frames without handler unparsed
+                recorder: capture.TrafficRecorder getting every frame received and sent
+                tracer: tracing.Tracer timing every frame per stage and type_code
         """
-        super().__init__(port)
-        self.agent = DatabaseAgent(dbfile)
+        super().__init__(port, lazy_decode=lazy_decode, recorder=recorder, tracer=tracer)
+        self.agent = DatabaseAgent(dbfile, shared=shared_db)
+        # cached recipient lists of the channels, see ccs/audience.py
+        self.audience = Audience(self.agent)
         self.uri = uri
         self.token = token
         self.name = name
         
-        self.feature_commands = []
+        self.command_list = CommandList()
 
         self.basic_command_func_map = {
             self.codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST: handle_command_fetch_user_list,
             self.codes.COMMAND_UP_FETCH_RECIPIENT_LIST: handle_command_fetch_recipient_list,
             self.codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST: handle_command_fetch_cmd_list,
+            self.codes.COMMAND_UP_FETCH_MEDIA: handle_command_fetch_media,
         }
         
         self.notice_func_map = {
@@ -50,6 +66,17 @@ class GoddessService(BaseGoddessService):
         }
         
         self.temp_msg_map = {}
+        # progress of the chunked transfers going through, see transfer.py
+        self.chunk_relay = ChunkRelay()
+        # images and files by hash, if given a directory, see media.py
+        self.media = MediaStore(media_dir, media_max_bytes) if media_dir else None
+
+        # handlers get exact routes, the range routes of the base class end in _handle_basic_command,
+        # _handle_notice and _handle_feature, which are left with codes that have no handler
+        for func_map in (self.basic_command_func_map, self.notice_func_map, self.feature_func_map,
+                         self.message_func_map):
+            for code, func in func_map.items():
+                self.router.add(code, func)
 
 
     def add_feature(self, name, code, prompts, func=None):
@@ -63,20 +90,56 @@ class GoddessService(BaseGoddessService):
             If one feature with no handler is triggered, an exception will be raised.
             You can use set_feature_handle to set a handler for a feature.
         """
-        self.feature_commands.append(
+        self.command_list.append(
             {'name': name, 'code': code, 'prompts': prompts})
         self.prompt[code] = prompts
         if func:
             self.feature_func_map[code] = func
+            self.router.add(code, func)
     
     def remove_feature(self, code):
         """
             Remove a feature from the service.
             The feature is specified by its code.
         """
-        self.feature_commands = list(
-            filter(lambda x: x['code'] != code, self.feature_commands))
+        self.command_list.remove(code)
         self.feature_func_map.pop(code, None)
+        self.router.remove(code)
+
+    @property
+    def feature_commands(self):
+        """
+            The feature commands, see add_feature. After changing them in place, call command_list.changed().
+        """
+        return self.command_list.commands
+
+    @feature_commands.setter
+    def feature_commands(self, commands):
+        self.command_list.replace(commands)
+
+    def save_snapshot(self, path):
+        """
+            Write a warm-start snapshot of the service (rosters, feature commands, pending acks) to path.
+        """
+        snapshot.write_snapshot(path, snapshot.capture(self))
+
+    def load_snapshot(self, path):
+        """
+            Restore a snapshot written by save_snapshot, e.g. right after a restart, before serving.
+            Returns what was restored; see ccs/snapshot.py.
+        """
+        return snapshot.restore(self, snapshot.read_snapshot(path))
+
+    async def start_snapshots(self, path, interval=60):
+        """
+            Save a snapshot to path every interval seconds; run it as a task of the event loop.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save_snapshot(path)
+            except Exception as e:
+                print('GoddessService: snapshot failed', e)
 
     def set_basic_command_handle(self, code, func):
         """
@@ -85,6 +148,7 @@ class GoddessService(BaseGoddessService):
             Some commands will be like "help", "quit".
         """
         self.basic_command_func_map[code] = func
+        self.router.add(code, func)
 
     def set_notice_handle(self, code, func):
         """
@@ -93,6 +157,7 @@ class GoddessService(BaseGoddessService):
             Some notices will be like "user joined the channel", "user left the channel".
         """
         self.notice_func_map[code] = func
+        self.router.add(code, func)
 
     def set_feature_handle(self, code, func):
         """
@@ -100,6 +165,7 @@ class GoddessService(BaseGoddessService):
             The feature is specified by its code.
         """
         self.feature_func_map[code] = func
+        self.router.add(code, func)
 
     def set_message_handle(self, code, func):
         """
@@ -108,8 +174,18 @@ class GoddessService(BaseGoddessService):
             For example, text messages are MESSAGE_UP_TEXT.
         """
         self.message_func_map[code] = func
+        self.router.add(code, func)
+
+    # with lazy_decode, frames no handler is routed for are dropped unparsed
+    def _wants(self, code, type_code):
+        if type_code is None:
+            return code in (self.codes.MESSAGE_TO_CCS, self.codes.COMMAND_TO_CCS)
+        if code in (self.codes.MESSAGE_TO_CCS, self.codes.COMMAND_TO_CCS):
+            return type_code in self.router.exact
+        return False
 
     async def _handle_data_dict_core(self, data, ws, path):
+        tracing.lap('queue')
         print(f'GoddessService: _handle_data_dict received {data}.')
         if data['code'] == self.codes.MESSAGE_TO_CCS:
             await self._handle_message_to_ccs(data, ws, path)
@@ -119,49 +195,29 @@ class GoddessService(BaseGoddessService):
             pass
         
     async def _handle_data_dict(self, data, ws, path):
-        asyncio.ensure_future(self._handle_data_dict_core(data, ws, path))
+        # the task carries the trace of the frame along, which stays open until the task is done
+        trace = tracing.hold()
+        task = asyncio.ensure_future(self._handle_data_dict_core(data, ws, path))
+        if trace is not None:
+            task.add_done_callback(lambda task: trace.release())
 
     async def _handle_message_to_ccs(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.message_func_map:
-            await self.message_func_map[type_code](self, data, ws, path)
-        else:
-            print('no message function for code', type_code)
-
-    async def _handle_command_to_ccs(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if 20000 <= type_code <= 29999:
-            await self._handle_basic_command(data, ws, path)
-        elif 80000 <= type_code <= 89999:
-            await self._handle_notice(data, ws, path)
-        elif 90000 <= type_code <= 99999:
-            await self._handle_feature(data, ws, path)
-        else:
-            pass
+        # type codes of messages (3xxxx) and commands (2xxxx, 8xxxx, 9xxxx) don't overlap,
+        # so messages share the router of commands
+        await self.router.dispatch(data['extra']['type_code'], self, data, ws, path)
 
     async def _handle_basic_command(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.basic_command_func_map:
-            await self.basic_command_func_map[type_code](self, data, ws, path)
-        else:
-            print('no basic_command function for code', type_code)
+        print('no basic_command function for code', data['extra']['type_code'])
 
     async def _handle_notice(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        
         print('receive notice:' + str(data))
-
-        if type_code in self.notice_func_map:
-            await self.notice_func_map[type_code](self, data, ws, path)
-        else:
-            print('no notice function for code', type_code)
+        print('no notice function for code', data['extra']['type_code'])
 
     async def _handle_feature(self, data, ws, path):
-        type_code = data['extra']['type_code']
-        if type_code in self.feature_func_map:
-            await self.feature_func_map[type_code](self, data, ws, path)
-        else:
-            print('no feature function for code', type_code)
+        print('no feature function for code', data['extra']['type_code'])
+
+    async def _handle_unrouted(self, data, ws, path):
+        print('no function for code', data['extra']['type_code'])
 
     async def _send_ccs_operation(self, data, ws, path):
         print('WrappedGoddessService ccs_operation: ', data)
@@ -175,40 +231,93 @@ class GoddessService(BaseGoddessService):
             pass
 
     async def _send_command_down(self, ws, type_code, **kwargs):
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
         await self._send_data_to_ws(ws, self.codes.COMMAND_FROM_CCS,
                               type_code=type_code, **kwargs)
     
+    async def _send_command_list(self, ws, fetched_version=None, **kwargs):
+        # COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST, just not_modified if the client has fetched_version
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
+        await self._safe_send(ws, self.command_list.frame(self.codes.COMMAND_FROM_CCS, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
+                                                          fetched_version, **kwargs))
+
     async def _send_message_down(self, ws, type_code, channel_id, from_user_id, to_user_ids, origin, temp_msg_id, **kwargs):
-        await self._send_data_to_ws(ws, self.codes.MESSAGE_FROM_CCS,
-                              type_code=type_code, channel_id=channel_id, from_user_id=from_user_id,
-                              to_user_ids=to_user_ids, origin=origin, temp_msg_id=temp_msg_id, **kwargs)
+        kwargs = dict(kwargs, type_code=type_code, channel_id=channel_id, from_user_id=from_user_id,
+                      to_user_ids=to_user_ids, origin=origin, temp_msg_id=temp_msg_id)
+        if ws in self.to_channel_peers:
+            kwargs = compact(kwargs)
+        await self._send_data_to_ws(ws, self.codes.MESSAGE_FROM_CCS, **kwargs)
     
+    async def _relay_chunk(self, data, ws):
+        # forward a chunk of a body in chunked mode, and acknowledge it to the sender
+        extra = data['extra']
+        channel_id = extra['channel_id']
+        from_user_id = extra['from_user_id']
+        transfer = extra['transfer']
+        forward, received, rewind = self.chunk_relay.accept(from_user_id, transfer)
+        if forward:
+            # a single message for FETCH_RECIPIENT_LIST, that of the last chunk
+            temp_msg_id = None
+            if transfer['index'] == transfer['count'] - 1:
+                temp_msg_id = extra['msg_id']
+                self.temp_msg_map[(channel_id, temp_msg_id)] = extra['to_user_ids']
+            await self._send_message_down(ws, extra['type_code']+20000, channel_id, from_user_id, extra['to_user_ids'],
+                                          extra['origin'], msg_body=extra['msg_body'], temp_msg_id=temp_msg_id,
+                                          transfer=transfer)
+        if received is not None:
+            await self._send_command_down(ws, self.codes.COMMAND_DOWN_TRANSFER_ACK, channel_id=channel_id,
+                                          to_user_ids=[from_user_id], transfer_id=transfer['id'], received=received,
+                                          rewind=rewind)
+
     ### Some wrapped functions, use them to make your work easier!
     
+    def _recipients(self, channel_id, group):
+        if group is None:
+            return self.audience.everyone(channel_id)
+        return self.audience.group(channel_id, group)
+
     # broadcast to all users
-    async def broadcast_command_text(self, channel_id, ws, text, clear=False):
+    async def broadcast_command_text(self, channel_id, ws, text, clear=False, group=None):
         """
-            Broadcast a text to all users in a channel.
+            Broadcast a text to all users in a channel, or to the members of a group of it (see audience).
         """
         await self._send_command_down(
             ws, 
             self.codes.COMMAND_DOWN_DISPLAY_TEXT,
             channel_id=channel_id, 
-            to_user_ids=self.agent.get_channel_user_list(channel_id), 
+            to_user_ids=self._recipients(channel_id, group), 
             args={'text': text, 'clear': clear}
         )
     
-    async def broadcast_command_image(self, channel_id, ws, url, clear=False):
+    async def _put_media(self, data):
+        # hash of data, stored if the service keeps media; hashing and writing are done off the event loop
+        if self.media is None:
+            return await asyncio.get_running_loop().run_in_executor(None, MediaStore.key, data)
+        return await self.media.put_async(data)
+
+    async def _store_body(self, msg_body):
+        # media_hash of an uploaded image or file body, to pass on with it, if the service keeps media
+        if self.media is None:
+            return {}
+        body = msg_body.encode('utf-8') if isinstance(msg_body, str) else json.dumps(msg_body).encode('utf-8')
+        return {'media_hash': await self.media.put_async(body)}
+
+    async def broadcast_command_image(self, channel_id, ws, url, clear=False, group=None):
         """
-            Broadcast an image to all users in a channel.
+            Broadcast an image to all users in a channel, or to the members of a group of it (see audience).
+            url: an URL, or the image as bytes, sent by hash to users who already got it (see media.py)
         """
-        await self._send_command_down(
-            ws, 
-            self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
-            channel_id=channel_id, 
-            to_user_ids=self.agent.get_channel_user_list(channel_id), 
-            args={'type':'url', 'image': url}
-        )
+        media_hash = None if isinstance(url, str) else await self._put_media(url)
+        for to_user_ids, args in image_args(self.media, self._recipients(channel_id, group), url, media_hash):
+            await self._send_command_down(
+                ws, 
+                self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
+                channel_id=channel_id, 
+                to_user_ids=to_user_ids, 
+                args=args
+            )
     
     # only reply to the sender
     async def reply_command_text(self, data, ws, text, clear=False):
@@ -227,14 +336,17 @@ class GoddessService(BaseGoddessService):
     async def reply_command_image(self, data, ws, url, clear=False):
         """
             Reply an image to a single user.
+            url: an URL, or the image as bytes, sent by hash if the user already got it (see media.py)
         """
-        await self._send_command_down(
-            ws, 
-            self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
-            channel_id = data['extra']['channel_id'], 
-            to_user_ids = [data['extra']['user_id']], 
-            args={'type':'url', 'image': url}
-        )
+        media_hash = None if isinstance(url, str) else await self._put_media(url)
+        for to_user_ids, args in image_args(self.media, [data['extra']['user_id']], url, media_hash):
+            await self._send_command_down(
+                ws, 
+                self.codes.COMMAND_DOWN_DISPLAY_IMAGE,
+                channel_id = data['extra']['channel_id'], 
+                to_user_ids = to_user_ids, 
+                args=args
+            )
     
     # two texts, one for sender, one for others
     async def whistle_sender_command_text(
@@ -254,12 +366,11 @@ class GoddessService(BaseGoddessService):
             args = {'text': text_to_sender, 'clear': clear_sender}
         )
         # to others
-        user_ids = self.agent.get_channel_user_list(data['extra']['channel_id'])
         await self._send_command_down(
             ws, 
             self.codes.COMMAND_DOWN_DISPLAY_TEXT,
             channel_id = data['extra']['channel_id'], 
-            to_user_ids = list(set(user_ids) - {data['extra']['user_id']}), 
+            to_user_ids = self.audience.all_except(data['extra']['channel_id'], data['extra']['user_id']), 
             args = {'text': text_to_others, 'clear': clear_others}
         )
     
@@ -273,8 +384,7 @@ async def handle_fetch_command(self, data, ws, path):
     """
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
-    await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-        channel_id=channel_id, to_user_ids=[user_id], commands=self.feature_commands)
+    await self._send_command_list(ws, data['extra'].get('commands_version'), channel_id=channel_id, to_user_ids=[user_id])
 
 async def handle_notice_auth_token(self, data, ws, path):
     print('yellow 502 ask notice auth token', data)
@@ -294,10 +404,10 @@ async def handle_notice_take_over(self, data, ws, path):
     target_channel_timestamp = datetime.datetime.fromtimestamp(target_channel_timestamp)
     self.agent.init_user_id_list(target_channel_id, user_ids)
     self.agent.init_whistle(target_channel_id)
+    to_user_ids = self.audience.everyone(target_channel_id)
     await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
-                                    channel_id=target_channel_id, to_user_ids=user_ids, user_ids=user_ids)
-    await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-                                    channel_id=target_channel_id, to_user_ids=user_ids, user_ids=user_ids, commands=self.feature_commands)
+                                    channel_id=target_channel_id, to_user_ids=to_user_ids, user_ids=user_ids)
+    await self._send_command_list(ws, channel_id=target_channel_id, to_user_ids=to_user_ids, user_ids=user_ids)
 
 async def handle_notice_release(self, data, ws, path):
     target_channel_id = data['extra']['target_channel_id']
@@ -314,13 +424,12 @@ async def handle_notice_user_joined(self, data, ws, path):
     # In the case of Social default Goddess, the database has been updated on OPERATION_JOIN
     user_id = data['extra']['user_id']
     self.agent.join_channel(channel_id, user_id)
-    user_ids = self.agent.get_channel_user_list(channel_id)
+    user_ids = self.audience.everyone(channel_id)
 
     await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
         channel_id=channel_id, to_user_ids=user_ids, user_ids=user_ids) 
     
-    await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-        channel_id=channel_id, to_user_ids=[user_id], commands=self.feature_commands)
+    await self._send_command_list(ws, channel_id=channel_id, to_user_ids=[user_id])
 
 async def handle_notice_user_left(self, data, ws, path):
     """
@@ -330,7 +439,7 @@ async def handle_notice_user_left(self, data, ws, path):
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
     self.agent.leave_channel(channel_id, user_id)
-    user_ids = self.agent.get_channel_user_list(channel_id)
+    user_ids = self.audience.everyone(channel_id)
     await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
                             channel_id=channel_id, to_user_ids=user_ids, user_ids=user_ids)
 
@@ -341,7 +450,7 @@ async def handle_command_fetch_user_list(self, data, ws, path):
     """
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
-    user_list = self.agent.get_channel_user_list(channel_id)
+    user_list = self.audience.everyone(channel_id)
     
     await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST,
         channel_id=data['extra']['channel_id'], to_user_ids=[user_id], user_ids=user_list)
@@ -353,8 +462,25 @@ async def handle_command_fetch_cmd_list(self, data, ws, path):
     """
     channel_id = data['extra']['channel_id']
     user_id = data['extra']['user_id']
-    await self._send_command_down(ws, self.codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST,
-        channel_id=channel_id, to_user_ids=[user_id], commands=self.feature_commands)
+    await self._send_command_list(ws, data['extra'].get('commands_version'), channel_id=channel_id, to_user_ids=[user_id])
+
+async def handle_command_fetch_media(self, data, ws, path):
+    """
+        A function that handles the "fetch media" command.
+        A client asks for media sent to it by hash that it doesn't have (see media.py).
+        This can be the default behavior.
+    """
+    channel_id = data['extra']['channel_id']
+    user_id = data['extra']['user_id']
+    media_hash = data['extra']['media_hash']
+    media = self.media.get(media_hash) if self.media is not None else None
+    if media is None:
+        await self._send_command_down(ws, self.codes.COMMAND_DOWN_MEDIA, channel_id=channel_id, to_user_ids=[user_id],
+                                      media_hash=media_hash)
+        return
+    self.media.mark_known(media_hash, [user_id])
+    await self._send_command_down(ws, self.codes.COMMAND_DOWN_MEDIA, channel_id=channel_id, to_user_ids=[user_id],
+                                  media_hash=media_hash, media=base64.b64encode(media).decode('ascii'))
 
 async def handle_command_fetch_recipient_list(self, data, ws, path):
     """
@@ -404,14 +530,21 @@ async def handle_message_up_image(self, data, ws, path):
         MESSAGE_UP_TEXT is for text messages, and other types are not implemented yet.
         This triggers a "copy ccs message" notice.
         See the function above.
+        A chunk of a body sent in chunked mode is forwarded as it comes, see transfer.py.
     """
+    if data['extra'].get('transfer') is not None:
+        await self._relay_chunk(data, ws)
+        return
     channel_id = data['extra']['channel_id']
     from_user_id = data['extra']['from_user_id']
     to_user_ids = data['extra']['to_user_ids']
     temp_msg_id = data['extra']['msg_id']
+    msg_body = data['extra']['msg_body']
+    # stored once whatever the number of uploads, see media.py
+    media = await self._store_body(msg_body)
     self.temp_msg_map[(channel_id, temp_msg_id)] = to_user_ids
     await self._send_message_down(ws, data['extra']['type_code']+20000, channel_id, from_user_id, to_user_ids,
-                            data['extra']['origin'], msg_body=data['extra']['msg_body'], temp_msg_id=temp_msg_id)
+                            data['extra']['origin'], msg_body=msg_body, temp_msg_id=temp_msg_id, **media)
 
 async def handle_message_up_file(self, data, ws, path):
     """
@@ -421,14 +554,21 @@ async def handle_message_up_file(self, data, ws, path):
         MESSAGE_UP_TEXT is for text messages, and other types are not implemented yet.
         This triggers a "copy ccs message" notice.
         See the function above.
+        A chunk of a body sent in chunked mode is forwarded as it comes, see transfer.py.
     """
+    if data['extra'].get('transfer') is not None:
+        await self._relay_chunk(data, ws)
+        return
     channel_id = data['extra']['channel_id']
     from_user_id = data['extra']['from_user_id']
     to_user_ids = data['extra']['to_user_ids']
     temp_msg_id = data['extra']['msg_id']
+    msg_body = data['extra']['msg_body']
+    # stored once whatever the number of uploads, see media.py
+    media = await self._store_body(msg_body)
     self.temp_msg_map[(channel_id, temp_msg_id)] = to_user_ids
     await self._send_message_down(ws, data['extra']['type_code']+20000, channel_id, from_user_id, to_user_ids,
-                            data['extra']['origin'], msg_body=data['extra']['msg_body'], temp_msg_id=temp_msg_id)
+                            data['extra']['origin'], msg_body=msg_body, temp_msg_id=temp_msg_id, **media)
 
 async def handle_notice_copy_ccs(self, data, ws, path):
     """
@@ -439,5 +579,7 @@ async def handle_notice_copy_ccs(self, data, ws, path):
     channel_id = data['extra']['channel_id']
     temp_msg_id = data['extra']['ccs_temp_msg_id']
     true_msg_id = data['extra']['msg_id']
-    self.agent.add_whistle_msg(channel_id, true_msg_id, self.temp_msg_map[(channel_id, temp_msg_id)])
-    self.temp_msg_map.pop((channel_id, temp_msg_id))
+    to_user_ids = self.temp_msg_map.pop((channel_id, temp_msg_id), None)
+    if to_user_ids is None:
+        return  # a chunk of a transfer but the last one
+    self.agent.add_whistle_msg(channel_id, true_msg_id, to_user_ids)
@@ -0,0 +1,266 @@
+import asyncio
+import multiprocessing
+from multiprocessing.connection import wait
+import signal
+import socket
+import time
+import traceback
+
+from ..stats import Histogram
+
+
+def _worker_main(index, factory, port, conn, stats_interval):
+    """
+    Entry of a worker process. Builds its service with `factory`, listens on
+    `port` next to the other workers and reports stats over `conn` until the
+    supervisor sends `'stop'`.
+
+    Args:
+        index : int
+            Index of this worker in the supervisor.
+        factory : callable
+            `factory(index)` returning the `GoddessService` of this worker.
+        port : int
+            Port shared by all workers.
+        conn : multiprocessing.connection.Connection
+            Worker side of the pipe to the supervisor.
+        stats_interval : float
+            Seconds between two stats reports.
+    """
+    # SIGINT is left to the supervisor, which asks workers to stop through their pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(index, factory, port, conn, stats_interval))
+    conn.close()
+
+
+async def _serve(index, factory, port, conn, stats_interval):
+    service = factory(index)
+    service.port = port
+    server = await service.get_server_coroutine(reuse_port=True)
+
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+
+    def on_command():
+        try:
+            command = conn.recv()
+        except (EOFError, OSError):
+            # supervisor is gone, nobody to serve for
+            command = 'stop'
+        if command == 'stop' and not stopped.done():
+            loop.remove_reader(conn.fileno())
+            stopped.set_result(None)
+
+    def report():
+        try:
+            conn.send(('stats', index, service.get_stats(), service.rtt))
+        except (BrokenPipeError, OSError):
+            pass
+
+    loop.add_reader(conn.fileno(), on_command)
+    while not stopped.done():
+        report()
+        await asyncio.wait([stopped], timeout=stats_interval)
+    server.close()
+    await server.wait_closed()
+    report()
+
+
+class GoddessSupervisor:
+    """
+    Supervisor running a Goddess on several CPU cores.
+    `n_workers` processes each run their own `GoddessService` on its own event
+    loop, all listening on one port with SO_REUSEPORT: the kernel spreads
+    incoming connections (not frames) across them. Crashed workers are
+    restarted, stats of every worker are aggregated over a pipe, and SIGINT
+    stops all workers gracefully.
+
+    State of a service lives in its worker: channel state shared between
+    workers must go through storage safe across processes, e.g.
+    `GoddessService(..., shared_db=True)` on one dbfile. What a service keeps
+    in memory per connection (e.g. `temp_msg_map`) stays valid as long as
+    Social sends the frames that depend on each other on one connection.
+    """
+
+    def __init__(self, factory, n_workers:int=None, port:int=9000, host:str='localhost',
+                 stats_interval:float=5, restart_delay:float=1, stop_timeout:float=10) -> None:
+        """
+        Args:
+            factory : callable
+                `factory(index)` returning the `GoddessService` of worker `index`;
+                its port is replaced by the shared one. Must be importable from
+                worker processes, like a module-level function.
+            n_workers : int : optional
+                Number of worker processes, default to number of CPU cores.
+            port : int : optional
+                Port all workers listen on, 0 for any free one (see `self.port`).
+            host : str : optional
+                Interface used to reserve the port, where workers listen.
+            stats_interval : float : optional
+                Seconds between two stats reports of a worker.
+            restart_delay : float : optional
+                Seconds to wait before restarting a crashed worker.
+            stop_timeout : float : optional
+                Seconds to wait for workers to exit before terminating them.
+        """
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise Exception('GoddessSupervisor needs SO_REUSEPORT, not available on this platform')
+        self.factory = factory
+        self.n_workers = max(1, n_workers or multiprocessing.cpu_count())
+        self.port = port
+        self.host = host
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+
+        self.workers = {}
+        self.worker_stats = {}
+        self.worker_rtt = {}
+        self.restarts = {index: 0 for index in range(self.n_workers)}
+        self.stopping = False
+        self._reservation = None
+
+    def _reserve_port(self):
+        # a bound socket that never listens keeps the port in the SO_REUSEPORT group of the
+        # workers without taking connections, also across worker restarts
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        self._reservation = sock
+
+    def _start_worker(self, index):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(index, self.factory, self.port, child_conn, self.stats_interval),
+            name=f'goddess-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self.workers[index] = (process, parent_conn)
+        print(f'GoddessSupervisor: started worker {index} (pid {process.pid}) on port {self.port}')
+
+    def _collect(self, timeout):
+        conns = {conn: index for index, (process, conn) in self.workers.items()}
+        for conn in wait(list(conns), timeout):
+            try:
+                tag, index, stats, rtt = conn.recv()
+            except (EOFError, OSError):
+                continue
+            if tag == 'stats':
+                self.worker_stats[index] = stats
+                self.worker_rtt[index] = rtt
+
+    def _check_workers(self):
+        for index, (process, conn) in list(self.workers.items()):
+            if process.is_alive() or self.stopping:
+                continue
+            print(f'GoddessSupervisor: worker {index} exited with code {process.exitcode}, restarting')
+            conn.close()
+            self.restarts[index] += 1
+            time.sleep(self.restart_delay)
+            self._start_worker(index)
+
+    def get_stats(self) -> dict:
+        """
+        Stats of every worker and their aggregate.
+
+        Return:
+            dict with `workers` (worker index -> `get_stats()` of its service),
+            `restarts` (worker index -> restart count) and `total`: counters
+            summed over workers, and `rtt` merged.
+        """
+        total = {}
+        for stats in self.worker_stats.values():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    total[key] = total.get(key, 0) + value
+        rtt = Histogram()
+        for worker_rtt in self.worker_rtt.values():
+            rtt.merge(worker_rtt)
+        total['rtt'] = rtt.snapshot()
+        return {
+            'workers': dict(self.worker_stats),
+            'restarts': dict(self.restarts),
+            'total': total,
+        }
+
+    def on_stats(self, stats:dict):
+        """
+        Callback with aggregated stats after each collection round.
+        Override this to export them; prints the totals by default.
+        """
+        counters = {key: value for key, value in stats['total'].items() if key != 'rtt'}
+        print(f'GoddessSupervisor stats: {counters}')
+
+    def start(self):
+        """
+        Reserve the port and start all workers, without supervising them:
+        call `poll()` regularly, then `shutdown()`. `run()` does all of it.
+        """
+        self.stopping = False
+        self._reserve_port()
+        for index in range(self.n_workers):
+            self._start_worker(index)
+
+    def poll(self, timeout:float=0.5):
+        """
+        Collect stats for up to `timeout` seconds and restart crashed workers.
+        """
+        self._collect(timeout)
+        self._check_workers()
+
+    def stop(self, *args):
+        """
+        Ask `run()` to stop all workers. Also installed as its SIGINT handler.
+        """
+        self.stopping = True
+
+    def shutdown(self):
+        """
+        Stop all workers, terminating those that don't exit in time, and
+        release the port.
+        """
+        self.stopping = True
+        for index, (process, conn) in self.workers.items():
+            try:
+                conn.send('stop')
+            except (BrokenPipeError, OSError):
+                pass
+
+        deadline = time.monotonic() + self.stop_timeout
+        while time.monotonic() < deadline and any(process.is_alive() for process, conn in self.workers.values()):
+            self._collect(0.1)
+
+        for index, (process, conn) in self.workers.items():
+            if process.is_alive():
+                print(f'GoddessSupervisor: worker {index} did not stop in time, terminating')
+                process.terminate()
+            process.join()
+            conn.close()
+        self.workers = {}
+        if self._reservation is not None:
+            self._reservation.close()
+            self._reservation = None
+
+    def run(self):
+        """
+        Start all workers and supervise them until SIGINT or `stop()`.
+        """
+        previous_handler = signal.signal(signal.SIGINT, self.stop)
+        try:
+            self.start()
+            next_report = time.monotonic() + self.stats_interval
+            while not self.stopping:
+                self.poll(0.5)
+                if time.monotonic() >= next_report:
+                    next_report = time.monotonic() + self.stats_interval
+                    self.on_stats(self.get_stats())
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.shutdown()
+            signal.signal(signal.SIGINT, previous_handler)
+            print('GoddessSupervisor: all workers stopped')
@@ -9,6 +9,14 @@ import time
 # import _thread
 import gc
 import _thread
+import socket
+from collections import deque
+
+from ..envelope import decode
+from ..frames import Frame
+from ..reconnect import ReconnectPolicy
+from ..stats import Histogram
+from ..tracing import span
 # A manager of connections that facilitates
 # 1. actively establishing new connections to specific uri
 # 2. once the connection is established, they follow the same on_xxx rules
@@ -18,9 +26,33 @@ import _thread
 
 # This framework is unable to send data at random time from outside on_XXX functions,
 # but it is enough for our purpose, as long as we can use on_open for initial connection.
+
+# Lost connections are reopened with exponential backoff and jitter (see ReconnectPolicy),
+# so that all services dropped by a Social restart don't come back in lockstep.
+# Frames that failed to send on a closed connection are kept and replayed after on_open.
+# Every connection is pinged each ping_interval seconds; if nothing (pong included) arrives
+# within stall_timeout seconds after a ping, the connection is stalled and gets reopened.
+# With lazy_decode, only code/type_code of a frame are read first: frames _wants refuses are
+# dropped unparsed and the rest of a frame (extra) is parsed when a handler first reads it.
+# A recorder (capture.TrafficRecorder) gets every frame received and sent, for later replay.
+# A tracer (tracing.Tracer) times every frame from receive to sends, per stage and type_code.
 class JSONWebsocketActiveService:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, reconnect_policy=None, max_unsent=1000, ping_interval=20, stall_timeout=10,
+                 lazy_decode=False, recorder=None, tracer=None) -> None:
+        self.reconnect_policy = reconnect_policy or ReconnectPolicy()
+        self.max_unsent = max_unsent
+        self.unsent = {}    # ws -> frames waiting for the connection to come back
+        self._closing = set()
+
+        self.ping_interval = ping_interval
+        self.stall_timeout = stall_timeout
+        self.rtt = Histogram()
+        self.lazy_decode = lazy_decode
+        self.recorder = recorder
+        self.tracer = tracer
+        self.stats = {'reconnects': 0, 'stalls': 0, 'frames_dropped': 0}
+        self._last_received = {}    # ws -> time.monotonic() of the last frame
+        self._heartbeat_timers = {}
     
     # new websocket, do not try to connect
     def create_websocket(self, uri, on_open=None, on_message=None, on_error=None, on_close=None):
@@ -42,9 +74,36 @@ class JSONWebsocketActiveService:
         #     on_error=on_error or self.on_error,
         #     on_close=on_close or self.on_close
         # )
-        ws = self.create_websocket(uri, on_open, on_message, on_error, on_close)
+        on_open = on_open or self.on_open
+        on_close = on_close or self.on_close
+        policy = self.reconnect_policy.copy()
+
+        def _on_open(ws):
+            policy.reset()
+            self._last_received[ws] = time.monotonic()
+            if self.ping_interval and ws not in self._heartbeat_timers:
+                self._heartbeat_timers[ws] = rel.timeout(self.ping_interval, self._heartbeat, ws)
+            on_open(ws)
+            self._replay_unsent(ws)
+
+        def _on_close(ws, close_status_code, close_msg):
+            timer = self._heartbeat_timers.pop(ws, None)
+            if timer is not None:
+                timer.delete()
+            on_close(ws, close_status_code, close_msg)
+            if ws in self._closing:
+                self._closing.discard(ws)
+                self.unsent.pop(ws, None)
+                self._last_received.pop(ws, None)
+                return
+            delay = policy.next_delay()
+            print(f'Male: reconnecting in {delay:.2f}s (attempt {policy.attempts})')
+            rel.timeout(delay, self._reconnect, ws)
+
+        ws = self.create_websocket(uri, _on_open, on_message, on_error, _on_close)
+        ws.on_pong = self._on_pong
         # ws.run_forever(reconnect=5)
-        ws.run_forever(skip_utf8_validation=True, dispatcher=rel, reconnect=5)
+        self._run_websocket(ws)
         # print('before yield ws run_forever')
         # yield ws
         # print('start run_forever')
@@ -59,6 +118,75 @@ class JSONWebsocketActiveService:
         #     time.sleep(5)
         return ws
 
+    # reconnect=0: the websocket tears down on failure and _on_close schedules the next attempt
+    def _run_websocket(self, ws):
+        ws.run_forever(skip_utf8_validation=True, dispatcher=rel, reconnect=0)
+
+    def _reconnect(self, ws):
+        if ws not in self._closing:
+            self.stats['reconnects'] += 1
+            self._run_websocket(ws)
+        return False
+
+    # ping with the send time as payload, and check for a stall stall_timeout seconds later
+    def _heartbeat(self, ws):
+        if not ws.sock:
+            self._heartbeat_timers.pop(ws, None)
+            return False
+        sent_at = time.monotonic()
+        try:
+            ws.sock.ping(repr(sent_at))
+        except Exception as e:
+            print('Male: ping failed', e)
+        rel.timeout(self.stall_timeout, self._check_stall, ws, sent_at)
+        return True
+
+    def _check_stall(self, ws, sent_at):
+        if ws.sock and self._last_received.get(ws, 0) < sent_at:
+            self.stats['stalls'] += 1
+            print(f'Male: nothing received {self.stall_timeout}s after ping, connection stalled, reconnecting')
+            try:
+                # the dispatcher sees the socket closed, tears it down and on_close reconnects
+                ws.sock.sock.shutdown(socket.SHUT_RDWR)
+            except Exception as e:
+                print('Male: failed to shut down stalled socket', e)
+        return False
+
+    def _on_pong(self, ws, data):
+        now = time.monotonic()
+        self._last_received[ws] = now
+        try:
+            self.rtt.add(now - float(data))
+        except (TypeError, ValueError):
+            pass    # not one of our pings
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['rtt'] = self.rtt.snapshot()
+        if self.tracer is not None:
+            stats['trace'] = self.tracer.snapshot()
+        return stats
+
+    # profiling commands on the unix socket path, results written to directory (see profiling.py)
+    # e.g. echo 'cprofile 10' | nc -U path; call before rel.dispatch()
+    def serve_profiling(self, path, directory='.'):
+        from ..profiling import ProfilingControl    # only loaded by services serving it
+        self.profiling = ProfilingControl(self, directory)
+        return self.profiling.serve_rel(path)
+
+    def _replay_unsent(self, ws):
+        frames = self.unsent.pop(ws, None)
+        while frames:
+            if not self._safe_send(ws, frames.popleft()) and ws in self.unsent:
+                # lost again, keep the rest behind the failed frame for the next connection
+                self.unsent[ws].extend(frames)
+                break
+
+    # close a connection for good, without reconnecting
+    def close_connection(self, ws):
+        self._closing.add(ws)
+        ws.close()
+
     def on_message(self, ws, message):
         import datetime
         ct = datetime.datetime.now()
@@ -91,19 +219,23 @@ class JSONWebsocketActiveService:
 
     def _safe_send(self, ws, data):
         try:
-            if isinstance(data, dict):
-                data = json.dumps(data)
-            else:
-                pass
-            import datetime;
-            ct = datetime.datetime.now()
-            print("active send", ct)
-            ws.send(data)
+            with span('serialize'):
+                if isinstance(data, dict):
+                    data = json.dumps(data)
+                elif isinstance(data, Frame):
+                    data = data.encode()
+                else:
+                    pass
+            with span('socket'):
+                ws.send(data)
+            if self.recorder is not None:
+                self.recorder.record('o', ws, data)
             return True
 
         except websocket.WebSocketConnectionClosedException as e:
             print('Male: _safe_send: Connection Closed Exception.', e)
-            
+            if ws not in self._closing:
+                self.unsent.setdefault(ws, deque(maxlen=self.max_unsent)).append(data)
             return False
         except Exception as e:
             traceback.print_exc()
@@ -117,17 +249,24 @@ class JSONWebsocketActiveService:
         self._safe_send(ws, message)
 
     def _safe_handle(self, ws, message):
-        
-        import datetime;
+        self._last_received[ws] = time.monotonic()
+        if self.recorder is not None:
+            self.recorder.record('i', ws, message)
+        trace = token = None
+        if self.tracer is not None:
+            trace, token = self.tracer.start(int(time.time() * 1e6))
 
-        # # ct stores current time
-        
         try:
-            ct = datetime.datetime.now()
-            print("before social active _safe_handle current time:-", ct)
-            data = json.loads(message)
-            # ct = datetime.datetime.now()
-            # print('data', data, ct)
+            if self.lazy_decode:
+                data = decode(message, self._wants)
+                if data is None:
+                    self.stats['frames_dropped'] += 1
+                    return
+            else:
+                data = json.loads(message)
+            if trace is not None:
+                trace.lap('decode')
+                trace.set_frame(data)
             self._handle_data_dict(data, ws)
 
         except ValueError as e:
@@ -137,6 +276,10 @@ class JSONWebsocketActiveService:
         except Exception as e:
             print('Male: Server function error!')
             traceback.print_exc()
+
+        finally:
+            if trace is not None:
+                self.tracer.end(trace, token)
         
         # import datetime;
 
@@ -144,6 +287,11 @@ class JSONWebsocketActiveService:
         # ct = datetime.datetime.now()
         # print("after social active _safe_handle current time:-", ct)
 
+    # override this function to drop frames without handler before parsing them (lazy_decode only)
+    # type_code is None when it couldn't be read from the envelope
+    def _wants(self, code, type_code):
+        return True
+
     # override this function to handle data
     def _handle_data_dict(self, data, ws):
         print(f'Male default: _handle_data_dict received {data} at websocket {ws}')
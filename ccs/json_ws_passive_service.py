@@ -1,8 +1,15 @@
 import websockets
+import asyncio
 import json
+import time
 import traceback
 from datetime import datetime, timezone, timedelta
 
+from ..envelope import decode
+from ..frames import Frame
+from ..stats import Histogram
+from ..tracing import span
+
 import logging  # todo: 日志
 # logging.basicConfig(format="%(message)s", level=logging.DEBUG)
 
@@ -11,9 +18,23 @@ import logging  # todo: 日志
 # Once the connection is established, the business logic can be controlled bidirectionally.
 
 # Basic Server
+# Every connection is pinged each ping_interval seconds. A connection whose pong doesn't come
+# back within ping_timeout seconds is stalled and gets closed, so that Social reconnects.
+# With lazy_decode, only code/type_code of a frame are read first: frames _wants refuses are
+# dropped unparsed and the rest of a frame (extra) is parsed when a handler first reads it.
+# A recorder (capture.TrafficRecorder) gets every frame received and sent, for later replay.
+# A tracer (tracing.Tracer) times every frame from receive to sends, per stage and type_code.
 class JSONWebsocketPassiveService:
-    def __init__(self, port=7654):
+    def __init__(self, port=7654, ping_interval=20, ping_timeout=20, lazy_decode=False, recorder=None,
+                 tracer=None):
         self.port = port
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.lazy_decode = lazy_decode
+        self.recorder = recorder
+        self.tracer = tracer
+        self.rtt = Histogram()
+        self.stats = {'connections': 0, 'stalls': 0, 'frames_received': 0, 'frames_dropped': 0}
 
     @property
     def _timestamp(self):
@@ -36,12 +57,18 @@ class JSONWebsocketPassiveService:
         # print("before social passive _safe_sendcurrent time:-", ct, data)
         
         try:
-            if isinstance(data, dict):
-                data = json.dumps(data)
-            else:
-                pass
+            with span('serialize'):
+                if isinstance(data, dict):
+                    data = json.dumps(data)
+                elif isinstance(data, Frame):
+                    data = data.encode()
+                else:
+                    pass
             
-            await ws.send(data)
+            with span('socket'):
+                await ws.send(data)
+            if self.recorder is not None:
+                self.recorder.record('o', ws, data)
             # ct stores current time
             # ct = datetime.datetime.now()
             # print("after social passive _safe_sendcurrent time:-", ct)
@@ -70,29 +97,84 @@ class JSONWebsocketPassiveService:
         message = "I got your message: {}".format(message)
         await self._safe_send(ws, message)
 
+    async def _heartbeat(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            sent_at = time.monotonic()
+            try:
+                pong = await ws.ping()
+                await asyncio.wait_for(pong, self.ping_timeout)
+            except asyncio.TimeoutError:
+                self.stats['stalls'] += 1
+                print(f'Female: no pong within {self.ping_timeout}s, connection stalled, closing')
+                await ws.close(1011, 'ping timeout')
+                return
+            except websockets.ConnectionClosed:
+                return
+            self.rtt.add(time.monotonic() - sent_at)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['rtt'] = self.rtt.snapshot()
+        if self.tracer is not None:
+            stats['trace'] = self.tracer.snapshot()
+        return stats
+
+    # profiling commands on the unix socket path, results written to directory (see profiling.py)
+    # e.g. echo 'cprofile 10' | nc -U path; await it in the event loop of the service
+    async def serve_profiling(self, path, directory='.'):
+        from ..profiling import ProfilingControl    # only loaded by services serving it
+        self.profiling = ProfilingControl(self, directory)
+        return await self.profiling.serve_asyncio(path)
+
     async def _safe_handle(self, ws, path):
         # import datetime;
 
         # ct stores current time
         # ct = datetime.datetime.now()
         # print("before social passive _safe_handle current time:-", ct)
+        self.stats['connections'] += 1
+        heartbeat = asyncio.ensure_future(self._heartbeat(ws)) if self.ping_interval else None
         try:    # This websocket may be closed
             async for message in ws:
+                self.stats['frames_received'] += 1
+                if self.recorder is not None:
+                    self.recorder.record('i', ws, message)
+                trace = token = None
+                if self.tracer is not None:
+                    trace, token = self.tracer.start(self._timestamp)
                 try:
-                    import datetime
-                    ct = datetime.datetime.now()
-                    print("passive handle", ct, message)
-                    data = json.loads(message)
+                    if self.lazy_decode:
+                        data = decode(message, self._wants)
+                        if data is None:
+                            self.stats['frames_dropped'] += 1
+                            continue
+                    else:
+                        data = json.loads(message)
+                    if trace is not None:
+                        trace.lap('decode')
+                        trace.set_frame(data)
                     await self._handle_data_dict(data, ws, path)
 
                 
                 except Exception as e:
                     traceback.print_exc()
                     await self._handle_internal_error(e, ws, path)
+                finally:
+                    if trace is not None:
+                        self.tracer.end(trace, token)
             # ct = datetime.datetime.now()
             # print("after social passive _safe_handle current time:-", ct)
         except Exception as e:
             print('Exception in handle(): ', e)
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+
+    # override this function to drop frames without handler before parsing them (lazy_decode only)
+    # type_code is None for frames not to/from CCS
+    def _wants(self, code, type_code):
+        return True
 
     async def _handle_data_dict(self, data, ws, path):
         await self._safe_send(ws, 'Female: _handle_data_dict Not Implemented')
@@ -101,5 +183,8 @@ class JSONWebsocketPassiveService:
         await self._safe_send(ws, f'Female._handle_internal_error: {e}')
 
     # call this for the coroutine to start
-    def get_server_coroutine(self):
-        return websockets.serve(self._safe_handle, 'localhost', self.port)
+    # the built-in keepalive of websockets is replaced by _heartbeat, which also measures RTT
+    # reuse_port lets several processes listen on the port (SO_REUSEPORT), see GoddessSupervisor
+    def get_server_coroutine(self, reuse_port=False):
+        return websockets.serve(self._safe_handle, 'localhost', self.port, ping_interval=None,
+                                reuse_port=reuse_port)
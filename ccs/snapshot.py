@@ -0,0 +1,304 @@
+"""
+Warm-start snapshots of `GodService` / `GoddessService`.
+
+A snapshot holds what a restarted service needs to answer at once, before
+Social resends NOTICE_TAKE_OVER / NOTICE_GET_CHANNEL_USER_LIST:
+
+    database   the content of the `DatabaseAgent` file (rosters, whistles)
+               and the key of the file it was read from
+    features   feature command list and prompts
+    pending    `temp_msg_map`, messages sent down whose NOTICE_COPY_CCS
+               hasn't come back yet
+
+File format, little-endian:
+
+    magic 'SOCSNAP\\0' | version u16 | flags u16 | meta length u64 | blocks length u64 | crc32 u32
+    meta    pickle (protocol 5) of the state, the database content apart
+    blocks  json of the value of every key of every dict at the top of the
+            database content (e.g. the roster of each channel of `user_list`),
+            one after the other; meta holds their offsets
+
+The file is read through mmap. Only meta is unpickled at once: the dicts of
+the database are `LazySection`s, which hold their keys and decode a value
+from its block when it is first read, so that loading costs milliseconds
+whatever the number of channels. The file is written to a temporary file
+and renamed, so a crash never leaves half a snapshot.
+
+On restore, the database part primes the parse cache of the agent if the
+file is still the one the snapshot was taken from, and is written back if
+the file is missing or empty; a file changed since the snapshot is newer
+and wins. Restored rosters are then reconciled against the notices Social
+sends after the restart (see `Reconcile`).
+"""
+import inspect
+import json
+import mmap
+import os
+import pickle
+import struct
+import time
+import zlib
+
+from .. import codes
+
+MAGIC = b'SOCSNAP\0'
+VERSION = 1
+_HEADER = struct.Struct('<8sHHQQI')
+_UNREAD = object()
+
+
+class LazySection(dict):
+    """
+    A dict of the database content of a snapshot. Its keys are all there
+    from the start; a value is decoded from its block of the snapshot when
+    first read. Listing values or items (e.g. by `json.dumps`) decodes them
+    all, and so does a copy (`dict(section)`, `{**section}`, `|`).
+    """
+    __slots__ = ('_blocks', '_index')
+
+    def __init__(self, blocks, index:dict) -> None:
+        super().__init__(dict.fromkeys(index, _UNREAD))
+        self._blocks = blocks
+        self._index = index     # key -> (offset, length) in blocks
+
+    def _decode(self, key):
+        offset, length = self._index[key]
+        value = json.loads(bytes(self._blocks[offset:offset + length]))
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value is _UNREAD:
+            value = self._decode(key)
+        return value
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            dict.__setitem__(self, key, default)
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            self[key]
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        if self:
+            self[next(reversed(dict.keys(self)))]
+        return dict.popitem(self)
+
+    # not the iterator of dict: dict(), update() and ** then copy through keys() and __getitem__,
+    # instead of the stored values
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def load(self):
+        """
+        Decode every value now, and let the snapshot go.
+        """
+        if self._blocks is not None:
+            for key, value in dict.items(self):
+                if value is _UNREAD:
+                    self._decode(key)
+            self._blocks = None
+            self._index = None
+        return self
+
+    def values(self):
+        return dict.values(self.load())
+
+    def items(self):
+        return dict.items(self.load())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        merged = self.copy()
+        merged.update(other)
+        return merged
+
+    def __eq__(self, other):
+        return dict.__eq__(self.load(), other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+    def __repr__(self):
+        return f'LazySection({len(self)} keys)'
+
+
+def write_snapshot(path:str, state:dict):
+    """
+    Write `state` (picklable, as returned by `capture`) as a snapshot file
+    at `path`, atomically.
+    """
+    database = state['database']
+    blocks = bytearray()
+    plain = {}
+    sections = {}
+    for name, value in database['data'].items():
+        if not isinstance(value, dict):
+            plain[name] = value
+            continue
+        index = sections[name] = {}
+        for key, item in value.items():
+            block = json.dumps(item).encode('utf-8')
+            index[key] = (len(blocks), len(block))
+            blocks += block
+    meta = pickle.dumps(dict(state, database=dict(database, data=plain, sections=sections)), protocol=5)
+    crc = zlib.crc32(blocks, zlib.crc32(meta))
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, len(meta), len(blocks), crc))
+        f.write(meta)
+        f.write(blocks)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path:str) -> dict:
+    """
+    Read the state of a snapshot file, checking its version and crc. The
+    dicts of its database content are `LazySection`s mapping the file.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mapped) < _HEADER.size:
+        raise Exception(f'{path} is not a snapshot, too short')
+    magic, version, flags, meta_length, blocks_length, crc = _HEADER.unpack_from(mapped)
+    if magic != MAGIC:
+        raise Exception(f'{path} is not a snapshot')
+    if version != VERSION:
+        raise Exception(f'unsupported snapshot version {version} in {path}')
+    view = memoryview(mapped)
+    meta = view[_HEADER.size:_HEADER.size + meta_length]
+    blocks = view[_HEADER.size + meta_length:_HEADER.size + meta_length + blocks_length]
+    if len(blocks) != blocks_length or zlib.crc32(blocks, zlib.crc32(meta)) != crc:
+        raise Exception(f'snapshot {path} is truncated or corrupted')
+    state = pickle.loads(meta)
+    database = state['database']
+    data = database['data']
+    for name, index in database.pop('sections').items():
+        data[name] = LazySection(blocks, index)
+    return state
+
+
+def capture(service) -> dict:
+    """
+    State of `service` to write in a snapshot.
+    """
+    data, key = service.agent.state()
+    return {
+        'service': service.name,
+        'taken_at': time.time(),
+        'database': {'path': os.path.abspath(service.agent.path), 'key': key, 'data': data},
+        'features': {'commands': service.feature_commands, 'prompt': service.prompt},
+        'pending': service.temp_msg_map,
+    }
+
+
+def restore(service, state:dict) -> dict:
+    """
+    Restore a captured state into `service`, see the module doc.
+    Feature commands are only restored if the service has none yet, those
+    registered by code being newer.
+
+    Return:
+        What was restored, also kept as `service.warm_start`.
+    """
+    agent = service.agent
+    database = state['database']
+    if agent.prime(database['data'], database['key']):
+        database_restored = 'primed'
+    elif agent.state()[0] == {}:
+        agent.replace(database['data'])
+        database_restored = 'written'
+    else:
+        database_restored = 'file newer'
+
+    features = state['features']
+    features_restored = not service.feature_commands and bool(features['commands'])
+    if features_restored:
+        service.feature_commands = list(features['commands'])
+        service.prompt.update(features['prompt'])
+
+    for key, to_user_ids in state['pending'].items():
+        service.temp_msg_map.setdefault(key, to_user_ids)
+
+    rosters = agent.state()[0].get('user_list', {})
+    reconcile = Reconcile(service, rosters)
+    if rosters:
+        service.router.use(reconcile)
+    warm_start = {
+        'taken_at': state['taken_at'],
+        'database': database_restored,
+        'channels': len(rosters),
+        'features': len(service.feature_commands) if features_restored else 0,
+        'pending': len(state['pending']),
+        'reconcile': reconcile.stats,
+    }
+    service.warm_start = warm_start
+    return warm_start
+
+
+class Reconcile:
+    """
+    Router middleware following restored rosters until Social confirms them:
+    a channel is `confirmed` when NOTICE_TAKE_OVER or
+    NOTICE_GET_CHANNEL_USER_LIST brings the same members, `changed` when the
+    members differ (the handler then stores them), `released` on
+    NOTICE_RELEASE. Channels not heard of yet stay `stale`, served from the
+    snapshot. The middleware removes itself once no channel is stale.
+    """
+
+    def __init__(self, service, rosters:dict) -> None:
+        self.service = service
+        self.rosters = rosters      # as restored, read only when compared
+        self.stale = set(rosters)
+        self.stats = {'stale': len(self.stale), 'confirmed': 0, 'changed': 0, 'released': 0}
+        self._codes = {
+            codes.NOTICE_TAKE_OVER: ('target_channel_id', 'target_user_ids'),
+            codes.NOTICE_GET_CHANNEL_USER_LIST: ('channel_id', 'user_ids'),
+            codes.NOTICE_RELEASE: ('target_channel_id', None),
+        }
+
+    def _see(self, code, data):
+        keys = self._codes.get(code)
+        if keys is None:
+            return
+        extra = data['extra']
+        channel_id = extra.get(keys[0])
+        if channel_id not in self.stale:
+            return
+        self.stale.discard(channel_id)
+        if keys[1] is None:
+            self.stats['released'] += 1
+        elif set(extra.get(keys[1]) or ()) == set(self.rosters[channel_id]):
+            self.stats['confirmed'] += 1
+        else:
+            self.stats['changed'] += 1
+        self.stats['stale'] = len(self.stale)
+        if not self.stale:
+            self.service.router.unuse(self)
+
+    def __call__(self, handler):
+        see = self._see
+        if inspect.iscoroutinefunction(handler):
+            async def reconciled(code, service, data, *args):
+                see(code, data)
+                return await handler(code, service, data, *args)
+        else:
+            def reconciled(code, service, data, *args):
+                see(code, data)
+                return handler(code, service, data, *args)
+        return reconciled
@@ -7,6 +7,7 @@ OPERATION_JOIN_CHANNEL = 11001
 OPERATION_LEAVE_CHANNEL = 11002
 OPERATION_GET_USER_CHANNEL_LIST = 11003
 OPERATION_CREATE_CHANNEL = 11004
+OPERATION_GET_CHANNEL_USER_LISTS = 11005
 
 OPERATION_COPY_SERVER = 12001
 OPERATION_FETCH_OFFLINE_MESSAGES = 13001
@@ -15,6 +16,7 @@ COMMAND_TO_CCS = 20000
 COMMAND_UP_FETCH_CHANNEL_USER_LIST = 20001
 COMMAND_UP_FETCH_CCS_COMMAND_LIST = 20002
 COMMAND_UP_FETCH_RECIPIENT_LIST = 20003
+COMMAND_UP_FETCH_MEDIA = 20004
 
 MESSAGE_TO_CCS = 30000
 MESSAGE_UP_TEXT = 30001
@@ -27,6 +29,8 @@ COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST = 40002
 COMMAND_DOWN_UPDATE_RECIPIENT_LIST = 40003
 COMMAND_DOWN_DISPLAY_TEXT = 40004
 COMMAND_DOWN_DISPLAY_IMAGE = 40005
+COMMAND_DOWN_TRANSFER_ACK = 40006
+COMMAND_DOWN_MEDIA = 40007
 
 COMMAND_DOWN_CALL_PLUGIN = 49999
 
@@ -41,11 +45,13 @@ STATUS_INFO_FORCED_LOGOUT = 60003
 STATUS_INFO_COPY_CLIENT = 60004
 STATUS_INFO_REGISTER_EMAIL_SENT = 60005
 STATUS_INFO_RESET_EMAIL_SENT = 60006
+STATUS_INFO_OFFLINE_MESSAGES = 60007
 
 STATUS_INFO_JOIN_SUCCESS = 60101
 STATUS_INFO_LEAVE_SUCCESS = 60102
 STATUS_INFO_USER_CHANNEL_LIST = 60103
 STATUS_INFO_CREATE_CHANNEL_SUCCESS = 60104
+STATUS_INFO_CHANNEL_USER_LISTS = 60105
 
 # STATUS_INFO_CCS_LOGOUT_SUCCESS = 60201
 # STATUS_INFO_CCS_LOGIN_SUCCESS = 60202
@@ -0,0 +1,161 @@
+import json
+import re
+
+from . import codes
+
+# `_make_data_dict(code, type_code=..., ...)` dumped by json.dumps, read in one match
+_FAST = re.compile(r'\{"code": (-?\d+), "extra": \{"type_code": (-?\d+)(?=[,}])')
+# `{"code": N` at the very start of the frame, as written by json.dumps of `_make_data_dict`
+_HEAD = re.compile(r'\s*\{\s*"code"\s*:\s*(-?\d+)\s*[,}]')
+# the same with `type_code` as the first key of `extra`, the only place it is known to be at depth 1
+_ENVELOPE = re.compile(r'\s*\{\s*"code"\s*:\s*(-?\d+)\s*,\s*"extra"\s*:\s*\{\s*"type_code"\s*:\s*(-?\d+)\s*[,}]')
+
+# codes whose `extra` carries a `type_code`
+TYPE_CODE_CARRIERS = frozenset((
+    codes.COMMAND_TO_CCS,
+    codes.MESSAGE_TO_CCS,
+    codes.COMMAND_FROM_CCS,
+    codes.MESSAGE_FROM_CCS,
+))
+
+
+def peek(message):
+    """
+    Read `code` and, for frames to/from CCS, `type_code` of a json frame
+    without parsing it.
+
+    Only frames starting with the `code` key are recognized, which is how
+    `_make_data_dict` frames are dumped. For frames to/from CCS, `type_code`
+    must also be the first key of `extra`, right after `code`: a `type_code`
+    found further on may belong to a dict nested in `msg_body` or `args`.
+    Frames with duplicate keys, which `json.loads` reads as the last one,
+    are not looked for.
+
+    Args:
+        message : str || bytes
+            Raw frame received from websocket.
+
+    Return:
+        `(code, type_code)`, `type_code` being None for frames not to/from CCS;
+        `(None, None)` if the envelope could not be read this way.
+    """
+    if isinstance(message, (bytes, bytearray)):
+        message = message.decode('utf-8')
+    fast = _FAST.match(message)
+    if fast:
+        return int(fast.group(1)), int(fast.group(2))
+    head = _HEAD.match(message)
+    if not head:
+        return None, None
+    code = int(head.group(1))
+    if code not in TYPE_CODE_CARRIERS:
+        return code, None
+    envelope = _ENVELOPE.match(message)
+    if not envelope:
+        return None, None
+    return code, int(envelope.group(2))
+
+
+class LazyFrame(dict):
+    """
+    A frame whose envelope (`code`, `type_code`) is known but whose body is
+    only parsed when something reads beyond `data['code']`, e.g.
+    `data['extra']`. Behaves as the dict `json.loads` would have returned.
+    """
+    __slots__ = ('raw', 'type_code', '_loaded')
+
+    def __init__(self, raw, code, type_code=None) -> None:
+        super().__init__(code=code)
+        self.raw = raw
+        self.type_code = type_code
+        self._loaded = False
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Wrap a raw frame, or return None if its envelope can't be peeked.
+        """
+        code, type_code = peek(message)
+        if code is None:
+            return None
+        return cls(message, code, type_code)
+
+    @property
+    def code(self):
+        return dict.__getitem__(self, 'code')
+
+    def load(self):
+        """
+        Parse the whole frame now.
+        """
+        if not self._loaded:
+            self._loaded = True
+            data = json.loads(self.raw)
+            dict.update(self, data)
+            self.raw = None
+        return self
+
+    def __missing__(self, key):
+        self.load()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or dict.__contains__(self.load(), key)
+
+    def __iter__(self):
+        return dict.__iter__(self.load())
+
+    def __len__(self):
+        return dict.__len__(self.load())
+
+    def keys(self):
+        return dict.keys(self.load())
+
+    def values(self):
+        return dict.values(self.load())
+
+    def items(self):
+        return dict.items(self.load())
+
+    def copy(self):
+        return dict(self.load())
+
+    def __eq__(self, other):
+        return dict.__eq__(self.load(), other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        # debug prints of a frame shouldn't parse it
+        if self._loaded:
+            return dict.__repr__(self)
+        return f'LazyFrame(code={self.code}, type_code={self.type_code}, unparsed={len(self.raw)})'
+
+
+def decode(message, wants=None):
+    """
+    Envelope-first decoding of a json frame.
+
+    Args:
+        message : str || bytes
+            Raw frame received from websocket.
+        wants : function : optional
+            `wants(code, type_code)` returning False for frames nobody handles.
+            `type_code` is None for frames not to/from CCS.
+
+    Return:
+        A `LazyFrame`, a plain dict if the envelope couldn't be peeked, or None
+        if `wants` refused the frame, which then is never parsed.
+        A non-json frame raises ValueError, for a `LazyFrame` only once its body is read.
+    """
+    frame = LazyFrame.from_message(message)
+    if frame is None:
+        return json.loads(message)
+    if wants is not None and not wants(frame.code, frame.type_code):
+        return None
+    return frame
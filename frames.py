@@ -0,0 +1,495 @@
+"""
+Typed frames.
+
+A slotted class is generated for every code of `codes.py` (operations,
+commands, messages, statuses, CCS operations and notices), named after the
+constant in CamelCase, e.g. `codes.MESSAGE_UP_TEXT` -> `MessageUpText`.
+Classes are generated on first use, by name or by `frame_type(code)`.
+Fields known from the protocol are declared in `SCHEMA`; any other key of
+`extra` is kept in `frame.rest`, so no frame loses data going through.
+
+    frame = MessageUpText(channel_id='c', from_user_id='u', to_user_ids=[], msg_body='hi')
+    ws.send(frame.encode())
+    frame = decode_frame(message)   # e.g. a NoticeUserJoined for a 20000/80001 frame
+    frame.channel_id
+
+Frames are immutable, slot-less tuples like `collections.namedtuple`.
+Constructors validate field presence and types; decoding trusts the wire
+and doesn't. `encode()` writes the json text directly and gives the same
+output as `json.dumps` of the `_make_data_dict` dict.
+
+Frames that travel wrapped, like notices inside `COMMAND_TO_CCS`, keep the
+wire code in `code` while `type_code` is the code of their class.
+
+Handlers receive frame dicts unless they opt in with `typed`. Decoding a
+typed frame is `json.loads` and then building the frame, so it costs more
+than indexing the dict (see `benchmarks/typed_frames.py`); encoding costs
+less, which can pay it back in a handler that replies.
+"""
+import json
+import inspect
+import functools
+from json.encoder import encode_basestring_ascii as _encode_str
+from operator import itemgetter
+
+try:
+    from _collections import _tuplegetter
+except ImportError:
+    def _tuplegetter(index, doc):
+        return property(itemgetter(index), doc=doc)
+
+from . import codes
+from .envelope import TYPE_CODE_CARRIERS
+
+
+class FrameError(ValueError):
+    pass
+
+
+_TYPES = {
+    'str': str,
+    'int': int,
+    'float': (int, float),
+    'bool': bool,
+    'list': list,
+    'dict': dict,
+    'any': object,
+}
+
+# transfer: chunk of a body sent in chunked mode, see transfer.py; media_hash: of the body, see media.py
+_MESSAGE_UP = ('channel_id:str from_user_id:str to_user_ids:list msg_body:any origin:str? temp_msg_id:any? msg_id:any? '
+               'transfer:dict?')
+_MESSAGE_DOWN = ('channel_id:str from_user_id:str to_user_ids:list? msg_id:any? msg_body:any n_recipients:int? '
+                 'origin:str? temp_msg_id:any? to_channel:bool? except_user_ids:list? transfer:dict? media_hash:str?')
+_USER = 'user_id:str'
+_USER_CHANNEL = 'user_id:str channel_id:str'
+_CHANNEL = 'channel_id:str'
+_CHANNEL_USER = 'channel_id:str user_id:str'
+# to_channel / except_user_ids instead of to_user_ids: the whole channel audience form, see ccs/audience.py
+_COMMAND_DOWN = 'channel_id:str to_user_ids:list? to_channel:bool? except_user_ids:list?'
+
+# type code -> `name:type` of its fields in wire order, `?` marking optional ones
+SCHEMA = {
+    codes.OPERATION_LOGIN: 'user_id:str password:str',
+    codes.OPERATION_LOGOUT: _USER,
+    codes.OPERATION_REGISTER: 'email:str password:str',
+    codes.OPERATION_RESET_PASSWORD: 'email:str password:str',
+    codes.OPERATION_JOIN_CHANNEL: _USER_CHANNEL,
+    codes.OPERATION_LEAVE_CHANNEL: _USER_CHANNEL,
+    codes.OPERATION_GET_USER_CHANNEL_LIST: _USER,
+    codes.OPERATION_CREATE_CHANNEL: _USER_CHANNEL,
+    # user lists of every channel of user_id, limit channels per page
+    codes.OPERATION_GET_CHANNEL_USER_LISTS: _USER + ' cursor:any? limit:int?',
+    # cursor: of the page to fetch, acknowledging those before it; limit: messages per page
+    codes.OPERATION_FETCH_OFFLINE_MESSAGES: _USER + ' cursor:any? limit:int?',
+
+    codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST: _USER_CHANNEL,
+    codes.COMMAND_UP_FETCH_CCS_COMMAND_LIST: _USER_CHANNEL + ' commands_version:str?',
+    codes.COMMAND_UP_FETCH_RECIPIENT_LIST: 'user_id:str msg_id:any channel_id:str?',
+    codes.COMMAND_UP_FETCH_MEDIA: _USER_CHANNEL + ' media_hash:str',
+
+    codes.MESSAGE_UP_TEXT: _MESSAGE_UP,
+    codes.MESSAGE_UP_IMAGE: _MESSAGE_UP,
+    codes.MESSAGE_UP_FILE: _MESSAGE_UP,
+
+    codes.COMMAND_DOWN_UPDATE_CCS_COMMAND_LIST: (_COMMAND_DOWN + ' commands:list? user_ids:list? commands_version:str? '
+                                                 'not_modified:bool?'),
+    codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST: _COMMAND_DOWN + ' user_ids:list',
+    codes.COMMAND_DOWN_UPDATE_RECIPIENT_LIST: _COMMAND_DOWN + ' msg_id:any recipients:list',
+    codes.COMMAND_DOWN_DISPLAY_TEXT: _COMMAND_DOWN + ' args:dict',
+    codes.COMMAND_DOWN_DISPLAY_IMAGE: _COMMAND_DOWN + ' args:dict',
+    codes.COMMAND_DOWN_TRANSFER_ACK: _COMMAND_DOWN + ' transfer_id:str received:int rewind:bool?',
+    codes.COMMAND_DOWN_MEDIA: _COMMAND_DOWN + ' media_hash:str media:str?',
+
+    codes.MESSAGE_DOWN_TEXT: _MESSAGE_DOWN,
+    codes.MESSAGE_DOWN_IMAGE: _MESSAGE_DOWN,
+    codes.MESSAGE_DOWN_FILE: _MESSAGE_DOWN,
+
+    codes.STATUS_INFO_JOIN_SUCCESS: _CHANNEL,
+    codes.STATUS_INFO_LEAVE_SUCCESS: _CHANNEL,
+    codes.STATUS_INFO_USER_CHANNEL_LIST: 'channel_ids:list',
+    # a page of message frames and the cursor after it, empty once none is left
+    codes.STATUS_INFO_OFFLINE_MESSAGES: 'messages:list cursor:any?',
+    codes.STATUS_INFO_CREATE_CHANNEL_SUCCESS: _CHANNEL,
+    # channel_id -> user ids, cursor of the next page unless it is the last
+    codes.STATUS_INFO_CHANNEL_USER_LISTS: 'user_lists:dict cursor:any?',
+
+    codes.COPERATION_CONFIRM_AUTH_TOKEN: _USER_CHANNEL + ' to_user_ids:list target_channel_id:str uri:str token:str',
+    codes.COPERATION_GOD_RECONNECT: 'user_id:str password:str',
+
+    codes.NOTICE_USER_JOINED: _CHANNEL_USER,
+    codes.NOTICE_USER_LEFT: _CHANNEL_USER,
+    codes.NOTICE_GET_CHANNEL_USER_LIST: 'channel_id:str user_ids:list',
+    codes.NOTICE_ASK_AUTH_TOKEN: _USER_CHANNEL + ' target_channel_id:str',
+    codes.NOTICE_TAKE_OVER: 'target_channel_id:str target_user_ids:list target_channel_name:str? target_channel_timestamp:any? '
+                             'extensions:list?',
+    codes.NOTICE_RELEASE: 'target_channel_id:str target_user_ids:list',
+    codes.NOTICE_COPY_CCS: 'channel_id:str ccs_temp_msg_id:any msg_id:any',
+}
+
+_PREFIXES = ('OPERATION_', 'COPERATION_', 'COMMAND_', 'MESSAGE_', 'STATUS_', 'NOTICE_')
+
+# leading digit of a type code -> code of the frame carrying it to/from CCS
+CARRIERS = {
+    2: codes.COMMAND_TO_CCS,
+    3: codes.MESSAGE_TO_CCS,
+    4: codes.COMMAND_FROM_CCS,
+    5: codes.MESSAGE_FROM_CCS,
+    8: codes.COMMAND_TO_CCS,
+    9: codes.COMMAND_TO_CCS,
+}
+
+
+def _encode_value(value):
+    cls = value.__class__
+    if cls is str:
+        return _encode_str(value)
+    if cls is int:
+        return int.__repr__(value)
+    if cls is list:
+        for item in value:
+            if item.__class__ is not str:
+                return json.dumps(value)
+        return '[' + ', '.join(map(_encode_str, value)) + ']'
+    return json.dumps(value)
+
+
+def _rebuild(cls, values):
+    return tuple.__new__(cls, values)
+
+
+class Frame(tuple):
+    """
+    Base of the generated frame classes. Frames are immutable tuples of
+    `(code, *FIELDS, extra)`, `extra` being the received `extra` dict or the
+    unknown keyword arguments of the constructor; use `replace` to change fields.
+    """
+    __slots__ = ()
+
+    TYPE_CODE = None
+    FIELDS = ()
+    REQUIRED = frozenset()
+    TYPES = {}
+    # keys of `extra` that aren't kept in `rest`
+    _KNOWN = frozenset(('type_code',))
+
+    code = _tuplegetter(0, 'Code of the frame on the wire, the carrier code for wrapped frames.')
+
+    @property
+    def type_code(self):
+        return self.TYPE_CODE
+
+    @property
+    def carrier(self):
+        """
+        Code of the frame carrying this type to/from CCS, or None.
+        """
+        return CARRIERS.get(self.TYPE_CODE // 10000)
+
+    @property
+    def rest(self):
+        """
+        Keys of `extra` that are not declared fields, None if there are none.
+        """
+        extra = tuple.__getitem__(self, -1)
+        if not extra or extra.keys() <= self._KNOWN:
+            return None
+        return {key: value for key, value in extra.items() if key not in self._KNOWN}
+
+    def validate(self) -> 'Frame':
+        """
+        Check required fields are set and fields have their declared types.
+        Raises FrameError otherwise. Constructors already do it, decoded frames don't.
+        """
+        if self.code != self.TYPE_CODE and self.code != self.carrier:
+            raise FrameError(f'{type(self).__name__} can\'t travel as code {self.code}')
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is None:
+                if name in self.REQUIRED:
+                    raise FrameError(f'{type(self).__name__}.{name} is required')
+            elif not isinstance(value, self.TYPES[name]) or (value.__class__ is bool and self.TYPES[name] is int):
+                raise FrameError(f'{type(self).__name__}.{name} must be {self.TYPES[name]}, got {value!r}')
+        return self
+
+    def fields(self) -> dict:
+        """
+        Declared fields that are set, by name.
+        """
+        return {name: value for name, value in zip(self.FIELDS, tuple.__iter__(self[1:-1])) if value is not None}
+
+    def replace(self, **changes) -> 'Frame':
+        """
+        New frame with some fields, or `code`, changed.
+        """
+        kwargs = self.fields()
+        kwargs['code'] = self.code
+        rest = self.rest
+        if rest:
+            kwargs.update(rest)
+        kwargs.update(changes)
+        return type(self)(**kwargs)
+
+    def to_extra(self) -> dict:
+        extra = {}
+        if self.code != self.TYPE_CODE:
+            extra['type_code'] = self.TYPE_CODE
+        extra.update(self.fields())
+        rest = self.rest
+        if rest:
+            extra.update(rest)
+        return extra
+
+    def to_dict(self) -> dict:
+        """
+        The frame as `_make_data_dict` would build it.
+        """
+        return {'code': self.code, 'extra': self.to_extra()}
+
+    @classmethod
+    def from_dict(cls, data:dict) -> 'Frame':
+        return cls._from_extra(data['code'], data['extra'])
+
+    def encode(self) -> str:
+        """
+        Json text of the frame, ready for `ws.send`.
+        """
+        return json.dumps(self.to_dict())
+
+    def __getitem__(self, key):
+        # read-only compatibility with code written for frame dicts
+        if key == 'code':
+            return self.code
+        if key == 'extra':
+            return self.to_extra()
+        if key.__class__ is str:
+            raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Frame):
+            return NotImplemented
+        return type(self) is type(other) and self.code == other.code and self.to_extra() == other.to_extra()
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return _rebuild, (type(self), tuple(self))
+
+    def __repr__(self):
+        fields = [f'{name}={value!r}' for name, value in self.fields().items()]
+        if self.code != self.TYPE_CODE:
+            fields.insert(0, f'code={self.code}')
+        rest = self.rest
+        if rest:
+            fields.append(f'rest={rest!r}')
+        return f'{type(self).__name__}({", ".join(fields)})'
+
+
+def _parse_schema(spec):
+    fields = []
+    for item in spec.split():
+        name, type_name = item.split(':')
+        optional = type_name.endswith('?')
+        fields.append((name, type_name.rstrip('?'), optional))
+    return fields
+
+
+def _class_name(constant):
+    return ''.join(word.capitalize() for word in constant.split('_'))
+
+
+def _make_frame_class(constant, type_code, spec):
+    """
+    Generate the frame class of `type_code`: a keyword-only validating
+    `__new__`, `_from_extra` and `encode`, as source specialized for its
+    fields, the way `collections.namedtuple` does.
+    """
+    fields = _parse_schema(spec)
+    names = tuple(name for name, _, _ in fields)
+    if {'code', 'rest', 'type_code', 'extra'} & set(names) or any(name.startswith('_') for name in names):
+        raise Exception(f'reserved field name in schema of {constant}')
+    cls_name = _class_name(constant)
+    carrier = CARRIERS.get(type_code // 10000)
+    required = [name for name, _, optional in fields if not optional]
+    optional = [name for name, _, opt in fields if opt]
+    values = ''.join(f'{name}, ' for name in names)
+
+    params = ''.join(f'{name}, ' for name in required) + ''.join(f'{name}=None, ' for name in optional)
+    lines = [f'def __new__(cls, *, {params}code={type_code}, **rest):',
+             f'    if code != {type_code} and code != {carrier}:',
+             f'        raise FrameError(f"{cls_name} can\'t travel as code {{code}}")']
+    for name, type_name, opt in fields:
+        check = None
+        if type_name != 'any':
+            check = f'not isinstance({name}, _TYPES[{type_name!r}])'
+            if type_name in ('int', 'float'):
+                check += f' or {name}.__class__ is bool'
+        if not opt:
+            lines += [f'    if {name} is None:',
+                      f'        raise FrameError("{cls_name}.{name} is required")']
+            if check:
+                lines += [f'    if {check}:']
+        elif check:
+            lines += [f'    if {name} is not None and ({check}):']
+        if check:
+            lines += [f'        raise FrameError(f"{cls_name}.{name} must be {type_name}, got {{{name}!r}}")']
+    lines += [f'    return _tuple_new(cls, (code, {values}rest or None))', '']
+
+    lines += ['def _from_extra(cls, code, extra):',
+              '    get = extra.get',
+              '    return _tuple_new(cls, (code, ' + ''.join(f'get({name!r}), ' for name in names) + 'extra))', '']
+
+    lines += ['def encode(self):',
+              f'    code, {values}extra = self',
+              '    parts = []']
+    for name in names:
+        key = f'"{name}": '
+        lines += [f'    if {name} is not None:',
+                  f'        parts.append({key!r} + (_encode_str({name}) if {name}.__class__ is str else _encode_value({name})))']
+    lines += ['    if extra and not extra.keys() <= _known:',
+              '        for k, v in extra.items():',
+              '            if k not in _known:',
+              "                parts.append(_encode_str(k) + ': ' + _encode_value(v))",
+              f'    if code == {type_code}:',
+              f'        return \'{{"code": {type_code}, "extra": {{\' + \', \'.join(parts) + \'}}}}\'',
+              f'    if parts:',
+              f'        return \'{{"code": \' + int.__repr__(code) + \', "extra": {{"type_code": {type_code}, \' + \', \'.join(parts) + \'}}}}\'',
+              f'    return \'{{"code": \' + int.__repr__(code) + \', "extra": {{"type_code": {type_code}}}}}\'']
+
+    known = frozenset(names) | {'type_code'}
+    namespace = {
+        '_tuple_new': tuple.__new__,
+        '_known': known,
+        '_TYPES': _TYPES,
+        '_encode_str': _encode_str,
+        '_encode_value': _encode_value,
+        'FrameError': FrameError,
+    }
+    exec('\n'.join(lines), namespace)
+
+    attrs = {
+        '__slots__': (),
+        '__module__': __name__,
+        'TYPE_CODE': type_code,
+        'FIELDS': names,
+        'REQUIRED': frozenset(required),
+        'TYPES': {name: _TYPES[type_name] for name, type_name, _ in fields},
+        '_KNOWN': known,
+        '__new__': namespace['__new__'],
+        '_from_extra': classmethod(namespace['_from_extra']),
+        'encode': namespace['encode'],
+    }
+    for index, name in enumerate(names, 1):
+        attrs[name] = _tuplegetter(index, f'`{name}` of the frame.')
+    return type(cls_name, (Frame,), attrs)
+
+
+# type code -> frame class, filled as classes are generated: generating them
+# all takes tens of milliseconds, so each is made on first use (`frame_type`,
+# or importing it by name) rather than at import
+FRAME_TYPES = {}
+_CONSTANTS = {}         # type code -> name of its constant in codes.py
+_CLASS_CONSTANTS = {}   # class name -> name of its constant
+
+for _constant, _code in list(vars(codes).items()):
+    if not _constant.startswith(_PREFIXES) or _code in TYPE_CODE_CARRIERS:
+        continue
+    _CONSTANTS[_code] = _CLASS_CONSTANTS[_class_name(_constant)] = _constant
+del _constant, _code
+
+
+def _class_of(constant):
+    name = _class_name(constant)
+    cls = globals().get(name)
+    if cls is None:
+        code = getattr(codes, constant)
+        cls = globals()[name] = _make_frame_class(constant, code, SCHEMA.get(code, ''))
+        FRAME_TYPES[code] = cls
+    return cls
+
+
+def frame_type(type_code:int):
+    """
+    Frame class of `type_code`, None if it has none.
+    """
+    cls = FRAME_TYPES.get(type_code)
+    if cls is None:
+        constant = _CONSTANTS.get(type_code)
+        if constant is None:
+            return None
+        cls = _class_of(constant)
+    return cls
+
+
+def __getattr__(name):
+    constant = _CLASS_CONSTANTS.get(name)
+    if constant is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return _class_of(constant)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_CLASS_CONSTANTS))
+
+
+def frame_from_dict(data:dict) -> Frame:
+    """
+    Typed frame of a frame dict, e.g. `json.loads` of a received message.
+    Frames to/from CCS get the class of their `type_code`.
+    """
+    code = data['code']
+    extra = data['extra']
+    type_code = extra.get('type_code') if code in TYPE_CODE_CARRIERS else code
+    cls = FRAME_TYPES.get(type_code) or frame_type(type_code)
+    if cls is None:
+        raise FrameError(f'no frame type for code {type_code}')
+    return cls._from_extra(code, extra)
+
+
+def decode_frame(message, _loads=json.loads) -> Frame:
+    """
+    Typed frame of a received json message (str or bytes).
+    """
+    data = _loads(message)
+    code = data['code']
+    extra = data['extra']
+    type_code = extra.get('type_code') if code in TYPE_CODE_CARRIERS else code
+    cls = FRAME_TYPES.get(type_code) or frame_type(type_code)
+    if cls is None:
+        raise FrameError(f'no frame type for code {code}')
+    return cls._from_extra(code, extra)
+
+
+def typed(handler):
+    """
+    Decorator making a handler receive a typed frame as its `data` argument
+    instead of the frame dict, e.g.
+
+        @typed
+        async def handle_notice_user_joined(self, data, ws, path):
+            data.channel_id
+    """
+    position = list(inspect.signature(handler).parameters).index('data')
+
+    def convert(args):
+        data = args[position]
+        if isinstance(data, Frame):
+            return args
+        args = list(args)
+        args[position] = frame_from_dict(data)
+        return args
+
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            return await handler(*convert(args), **kwargs)
+    else:
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            return handler(*convert(args), **kwargs)
+    return wrapper
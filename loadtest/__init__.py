@@ -0,0 +1,4 @@
+from .social import StandInSocial
+from .generator import LoadGenerator, SimulatedUser
+
+__all__ = ['LoadGenerator', 'SimulatedUser', 'StandInSocial']
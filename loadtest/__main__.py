@@ -0,0 +1,135 @@
+"""
+Load test of a CCS, or of bots, against a `StandInSocial`.
+
+    python -m socialization.loadtest [--users 100] [--channels 10] [--rate 1000] [--duration 10]
+                                     [--ccs none|goddess|cluster|ws://...] [--nodes 3] [--port 0] [--wait 0]
+                                     [--member ID ...] [--to-channel]
+
+`--ccs goddess` runs a `GoddessService` in this process, `cluster` runs
+`--nodes` of them behind a `GoddessFront` routing channels to them, a URI
+connects to a Goddess running elsewhere, `none` lets the stand-in deliver
+messages itself.
+For a God or bots, give a fixed `--port`, point them at ws://localhost:<port>
+and `--wait` long enough for them to connect and join the channels
+(CH0000, CH0001...); bots given with `--member` receive the load as well.
+
+Reported: throughput, p50/p99/p999 latency from due send time to delivery,
+and the fan-out cost of the stand-in per channel. Output of the services is
+silenced unless `--verbose`. With `--to-channel`, the stand-in lets the CCS
+address whole channels without listing their members (see ccs/audience.py);
+compare the kB received from the CCS.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import socket
+import sys
+import tempfile
+
+from .generator import LoadGenerator
+from .social import StandInSocial
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+async def _start_goddess(social, directory):
+    from ..ccs import GoddessService
+    port = _free_port()
+    goddess = GoddessService(port, uri='', token='', dbfile=os.path.join(directory, 'goddess.json'))
+    await goddess.get_server_coroutine()
+    await social.connect_ccs(f'ws://localhost:{port}')
+    return goddess
+
+
+async def _start_cluster(social, directory, n_nodes):
+    from ..ccs import GoddessFront, GoddessService
+    nodes = []
+    for i in range(n_nodes):
+        port = _free_port()
+        node = GoddessService(port, uri='', token='', dbfile=os.path.join(directory, f'goddess{i}.json'))
+        await node.get_server_coroutine()
+        nodes.append(f'ws://localhost:{port}')
+    port = _free_port()
+    front = GoddessFront(port, workers=nodes)
+    await front.get_server_coroutine()
+    await social.connect_ccs(f'ws://localhost:{port}')
+    return front
+
+
+async def _run(args, out):
+    social = StandInSocial(port=args.port, channels=LoadGenerator.channel_ids(args.channels),
+                           to_channel=args.to_channel)
+    await social.start()
+    print(f'stand-in Social at {social.uri}', file=out)
+    with tempfile.TemporaryDirectory() as directory:
+        if args.ccs == 'goddess':
+            await _start_goddess(social, directory)
+        elif args.ccs == 'cluster':
+            front = await _start_cluster(social, directory, args.nodes)
+        elif args.ccs != 'none':
+            await social.connect_ccs(args.ccs)
+        if args.wait:
+            print(f'waiting {args.wait}s for services and bots to connect', file=out)
+            await asyncio.sleep(args.wait)
+
+        generator = LoadGenerator(social.uri, n_users=args.users, n_channels=args.channels, rate=args.rate,
+                                  duration=args.duration, extra_members=args.member)
+        await generator.setup()
+        report = await generator.run()
+        await generator.close()
+        await social.stop()
+    print(f'{social.stats["bytes_from_ccs"] / 1e3:.0f} kB received from the CCS', file=out)
+    if args.ccs == 'cluster':
+        for uri, stats in front.get_stats()['workers'].items():
+            print(f'node {uri}: {stats["channels"]} channels, {stats["frames_up"]} frames in, '
+                  f'{stats["frames_down"]} out', file=out)
+    return report, social.fanout_report()
+
+
+def _print_report(report, fanout, out):
+    print('{users} users, {channels} channels'.format(**report), file=out)
+    print('sent      {sent} messages at {send_rate:.0f}/s'.format(**report), file=out)
+    print('delivered {delivered} (lost {lost}) at {delivery_rate:.0f}/s'.format(
+        **dict(report, delivery_rate=report['delivery_rate'] or 0)), file=out)
+    latency = report['latency']
+    if latency['count']:
+        print('latency ms: p50 {:.2f}  p99 {:.2f}  p999 {:.2f}  max {:.2f}'.format(
+            *(latency[k] * 1e3 for k in ('p50', 'p99', 'p999', 'max'))), file=out)
+    print(f'{"channel":<10} {"fanouts":>8} {"recipients":>10} {"p50 us":>8} {"p99 us":>8} {"us/recipient":>13}',
+          file=out)
+    for channel_id, row in sorted(fanout.items(), key=lambda item: str(item[0])):
+        print('{:<10} {:>8} {:>10.1f} {:>8.0f} {:>8.0f} {:>13.1f}'.format(
+            str(channel_id), row['fanouts'], row['recipients'], row['p50'] * 1e6, row['p99'] * 1e6,
+            (row['per_recipient'] or 0) * 1e6), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m socialization.loadtest')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second, all users together')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--ccs', default='none',
+                        help='none, goddess (in process), cluster (in process) or the URI of a Goddess')
+    parser.add_argument('--nodes', type=int, default=3, help='Goddess nodes of --ccs cluster')
+    parser.add_argument('--port', type=int, default=0, help='port of the stand-in Social, 0 for any')
+    parser.add_argument('--wait', type=float, default=0, help='seconds to wait before the load starts')
+    parser.add_argument('--member', action='append', default=[], help='bot receiving the load too')
+    parser.add_argument('--to-channel', action='store_true', help='let the CCS address whole channels')
+    parser.add_argument('--verbose', action='store_true', help='keep the output of the services')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(out if args.verbose else devnull):
+            report, fanout = asyncio.run(_run(args, out))
+    _print_report(report, fanout, out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+
+import websockets
+
+from .. import codes
+from ..stats import Histogram
+
+
+class SimulatedUser:
+    """
+    A user on its own websocket connection, speaking just enough of the
+    protocol to log in, join a channel, send text messages and time the
+    ones it receives.
+
+    Bodies of sent messages are `'<seq> <send time>'`, the send time being
+    `time.perf_counter()` of this process, so any receiver of the same
+    process reads the latency off the body.
+    """
+
+    def __init__(self, user_id:str, channel_id:str, latency:Histogram, counters:dict) -> None:
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.latency = latency
+        self.counters = counters
+        self.ws = None
+        self._waiting = {}      # status code -> future
+        self._receiver = None
+
+    async def connect(self, uri:str):
+        self.ws = await websockets.connect(uri, ping_interval=None, max_size=None)
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._receiver is not None:
+            await self._receiver
+
+    async def _request(self, code, answer, timeout, **extra):
+        future = self._waiting[answer] = asyncio.get_event_loop().create_future()
+        await self.ws.send(json.dumps({'code': code, 'extra': extra}))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiting.pop(answer, None)
+
+    async def login_and_join(self, timeout:float=10):
+        await self._request(codes.OPERATION_LOGIN, codes.STATUS_INFO_LOGIN_SUCCESS, timeout,
+                            user_id=self.user_id, password='')
+        await self._request(codes.OPERATION_JOIN_CHANNEL, codes.STATUS_INFO_JOIN_SUCCESS, timeout,
+                            user_id=self.user_id, channel_id=self.channel_id)
+
+    async def send_text(self, to_user_ids:list, seq:int, sent_at:float):
+        await self.ws.send(json.dumps({'code': codes.MESSAGE_UP_TEXT, 'extra': {
+            'channel_id': self.channel_id,
+            'from_user_id': self.user_id,
+            'to_user_ids': to_user_ids,
+            'temp_msg_id': seq,
+            'msg_body': f'{seq} {sent_at!r}',
+            'origin': 'Bot',
+        }}))
+
+    async def _receive(self):
+        try:
+            async for message in self.ws:
+                received_at = time.perf_counter()
+                data = json.loads(message)
+                code = data['code']
+                if code == codes.MESSAGE_DOWN_TEXT:
+                    try:
+                        sent_at = float(data['extra']['msg_body'].split(' ', 1)[1])
+                    except (IndexError, ValueError, AttributeError):
+                        self.counters['other'] += 1     # not sent by a simulated user
+                        continue
+                    self.latency.add(received_at - sent_at)
+                    self.counters['delivered'] += 1
+                    self.counters['last_delivered_at'] = received_at
+                elif code in self._waiting:
+                    future = self._waiting.pop(code)
+                    if not future.done():
+                        future.set_result(data)
+                else:
+                    self.counters['other'] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+
+class LoadGenerator:
+    """
+    Drives `n_users` simulated users spread over `n_channels` channels, which
+    together send `rate` text messages per second for `duration` seconds to
+    every member of their channel.
+
+    Sending is open loop: message i is due at `start + i / rate` whatever
+    happened to the previous ones, and its latency is counted from that due
+    time, so a server falling behind shows up in the latency instead of
+    slowing the load down.
+
+    Channels are `CH0000`, `CH0001`... and must exist on the server (see
+    `StandInSocial(channels=...)`). Users are `load0000`, `load0001`...,
+    user i joining channel `i % n_channels`. `extra_members` (e.g. bots
+    joined to the channels) are added to every message's recipients but
+    are not timed.
+    """
+
+    def __init__(self, uri:str, n_users:int=100, n_channels:int=10, rate:float=1000, duration:float=10,
+                 extra_members=(), drain_timeout:float=5) -> None:
+        self.uri = uri
+        self.n_users = n_users
+        self.n_channels = n_channels
+        self.rate = rate
+        self.duration = duration
+        self.extra_members = list(extra_members)
+        self.drain_timeout = drain_timeout
+        self.latency = Histogram(Histogram.FINE_BOUNDS)
+        self.counters = {'sent': 0, 'delivered': 0, 'expected': 0, 'other': 0, 'last_delivered_at': None}
+        self.users = []
+        self._started_at = None
+        self._sent_until = None
+
+    @staticmethod
+    def channel_ids(n_channels:int) -> list:
+        return [f'CH{i:04d}' for i in range(n_channels)]
+
+    async def setup(self, batch:int=100):
+        """
+        Connect, log in and join every user, `batch` at a time.
+        """
+        channel_ids = self.channel_ids(self.n_channels)
+        self.users = [
+            SimulatedUser(f'load{i:04d}', channel_ids[i % self.n_channels], self.latency, self.counters)
+            for i in range(self.n_users)
+        ]
+        for i in range(0, self.n_users, batch):
+            users = self.users[i:i + batch]
+            await asyncio.gather(*(user.connect(self.uri) for user in users))
+            await asyncio.gather(*(user.login_and_join() for user in users))
+
+    async def run(self) -> dict:
+        """
+        Send the load, wait for deliveries to settle and return the report.
+        """
+        members = {}
+        for user in self.users:
+            members.setdefault(user.channel_id, []).append(user.user_id)
+        recipients = {channel_id: ids + self.extra_members for channel_id, ids in members.items()}
+        timed = {channel_id: len(ids) for channel_id, ids in members.items()}
+
+        users = self.users
+        n_users = len(users)
+        rate = self.rate
+        total = int(self.rate * self.duration)
+        counters = self.counters
+        clock = time.perf_counter
+        start = self._started_at = clock()
+        i = 0
+        while i < total:
+            due = min(int((clock() - start) * rate) + 1, total)
+            while i < due:
+                user = users[i % n_users]
+                await user.send_text(recipients[user.channel_id], i, start + i / rate)
+                counters['expected'] += timed[user.channel_id]
+                i += 1
+            counters['sent'] = i
+            await asyncio.sleep(max(start + i / rate - clock(), 0))
+        self._sent_until = clock()
+
+        deadline = self._sent_until + self.drain_timeout
+        while counters['delivered'] < counters['expected'] and clock() < deadline:
+            await asyncio.sleep(0.01)
+        return self.report()
+
+    async def close(self):
+        await asyncio.gather(*(user.close() for user in self.users))
+
+    def report(self) -> dict:
+        counters = self.counters
+        send_time = self._sent_until - self._started_at
+        last = counters['last_delivered_at']
+        delivery_time = last - self._started_at if last else None
+        return {
+            'users': self.n_users,
+            'channels': self.n_channels,
+            'sent': counters['sent'],
+            'send_rate': counters['sent'] / send_time if send_time else None,
+            'delivered': counters['delivered'],
+            'lost': counters['expected'] - counters['delivered'],
+            'delivery_rate': counters['delivered'] / delivery_time if delivery_time else None,
+            'latency': self.latency.snapshot(),
+        }
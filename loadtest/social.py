@@ -0,0 +1,364 @@
+import asyncio
+import itertools
+import json
+import time
+import traceback
+from collections import deque
+
+import websockets
+
+from .. import codes
+from ..router import Router
+from ..stats import Histogram
+
+
+class StandInSocial:
+    """
+    In-process stand-in for the Social server, so that `GoddessService`,
+    `GodService` and bots can be run and measured without
+    `wss://frog.4fun.chat/social`.
+
+    It speaks the part of `codes.py` they use:
+        users      : login/logout, create/join/leave channel, channel list,
+                     user lists of every channel of a user, by pages
+        up         : commands (2xxxx) and messages (3xxxx) forwarded to the CCS
+                     as COMMAND_TO_CCS / MESSAGE_TO_CCS
+        down       : COMMAND_FROM_CCS / MESSAGE_FROM_CCS fanned out to `to_user_ids`,
+                     or with `to_channel: true` to the members of the channel but
+                     `except_user_ids`, messages getting their msg_id followed by
+                     NOTICE_COPY_CCS
+        notices    : NOTICE_TAKE_OVER of every channel when the CCS connects,
+                     NOTICE_USER_JOINED / NOTICE_USER_LEFT
+        offline    : messages to recipients not logged in, kept (the last
+                     `max_offline` of each) for OPERATION_FETCH_OFFLINE_MESSAGES,
+                     all at once or a page at a time, by msg_id as cursor
+    Passwords are not checked and nothing is persisted.
+
+    One CCS serves every channel: a Goddess the stand-in connects to (see
+    `connect_ccs`), or a God connecting in with COPERATION_GOD_RECONNECT.
+    Without CCS, messages are delivered to their recipients directly.
+
+    With `to_channel`, NOTICE_TAKE_OVER declares the whole channel audience
+    form (`extensions: ["to_channel"]`, see ccs/audience.py); users get
+    frames with `to_user_ids` listed either way.
+
+    Every fan-out (encoding a frame once, then sending it to each online
+    recipient) is timed into `self.fanout[channel_id]`, its recipients
+    counted in `self.fanout_recipients[channel_id]`.
+    """
+
+    def __init__(self, port:int=0, host:str='localhost', channels=(), to_channel:bool=False,
+                 max_offline:int=10000) -> None:
+        """
+        Args:
+            port : int : optional
+                Port to listen on, 0 for any free one (see `uri`).
+            host : str : optional
+                Interface to listen on.
+            channels : iterable : optional
+                IDs of channels existing from the start.
+            to_channel : bool : optional
+                Let the CCS address whole channels with `to_channel`.
+            max_offline : int : optional
+                Messages kept for each user while not logged in.
+        """
+        self.host = host
+        self.port = port
+        self.users = {}         # user_id -> ws
+        self.channels = {c: {} for c in channels}   # channel_id -> {user_id: None}, in join order
+        self.ccs = None
+        self.to_channel = to_channel
+        self.fanout = {}
+        self.fanout_recipients = {}
+        self.max_offline = max_offline
+        self.offline = {}       # user_id -> deque of (msg_id, message frame), oldest first
+        self.stats = {'frames_received': 0, 'frames_sent': 0, 'messages_up': 0, 'messages_down': 0,
+                      'bytes_from_ccs': 0}
+        self._user_of = {}      # ws -> user_id
+        self._msg_ids = itertools.count(1)
+        self._temp_msg_ids = itertools.count(1)
+        self._server = None
+        self._ccs_client = None     # connection to a Goddess, see connect_ccs
+
+        self.router = Router(fallback=self._unsupported)
+        self.router.add(codes.OPERATION_LOGIN, self._login)
+        self.router.add(codes.OPERATION_LOGOUT, self._logout)
+        self.router.add(codes.OPERATION_CREATE_CHANNEL, self._create_channel)
+        self.router.add(codes.OPERATION_JOIN_CHANNEL, self._join_channel)
+        self.router.add(codes.OPERATION_LEAVE_CHANNEL, self._leave_channel)
+        self.router.add(codes.OPERATION_GET_USER_CHANNEL_LIST, self._user_channel_list)
+        self.router.add(codes.OPERATION_GET_CHANNEL_USER_LISTS, self._channel_user_lists)
+        self.router.add(codes.OPERATION_FETCH_OFFLINE_MESSAGES, self._fetch_offline)
+        self.router.add_family(2, self._command_up)
+        self.router.add_family(3, self._message_up)
+        self.router.add(codes.COMMAND_FROM_CCS, self._command_down)
+        self.router.add(codes.MESSAGE_FROM_CCS, self._message_down)
+        self.router.add(codes.COPERATION_GOD_RECONNECT, self._god_reconnect)
+        self.router.add_family(7, self._ignored)
+
+    @property
+    def uri(self):
+        return f'ws://{self.host}:{self.port}'
+
+    async def start(self):
+        """
+        Start listening. With port 0, `self.port` is the one picked.
+        """
+        self._server = await websockets.serve(self._receive, self.host, self.port, ping_interval=None, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        # closing the server closes the connections it accepted, a God included
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._ccs_client is not None:
+            await self._ccs_client.close()
+
+    async def connect_ccs(self, uri:str):
+        """
+        Connect to a Goddess listening at `uri`, which then serves every channel.
+        """
+        ws = self._ccs_client = await websockets.connect(uri, ping_interval=None, max_size=None)
+        await self._attach_ccs(ws)
+        asyncio.ensure_future(self._receive(ws, ''))
+
+    async def _attach_ccs(self, ws):
+        self.ccs = ws
+        for channel_id, members in self.channels.items():
+            await self._take_over(channel_id, members)
+
+    async def _receive(self, ws, path):
+        try:
+            async for message in ws:
+                self.stats['frames_received'] += 1
+                if ws is self.ccs:
+                    self.stats['bytes_from_ccs'] += len(message)
+                try:
+                    data = json.loads(message)
+                    await self.router.dispatch(data['code'], data['code'], data['extra'], ws)
+                except Exception as e:
+                    traceback.print_exc()
+                    print('StandInSocial: failed to handle frame', e)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            user_id = self._user_of.pop(ws, None)
+            if user_id is not None and self.users.get(user_id) is ws:
+                del self.users[user_id]
+            if ws is self.ccs:
+                self.ccs = None
+
+    async def _send(self, ws, code, **extra):
+        try:
+            await ws.send(json.dumps({'code': code, 'extra': extra}))
+            self.stats['frames_sent'] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _send_ccs(self, code, **extra):
+        if self.ccs is not None:
+            await self._send(self.ccs, code, **extra)
+
+    def _recipients(self, extra) -> list:
+        """
+        `extra['to_user_ids']` of a frame down, listed from the channel if it
+        came with `to_channel` (then in `extra` in its place).
+        """
+        if not extra.pop('to_channel', False):
+            return extra.get('to_user_ids', ())
+        excepted = set(extra.pop('except_user_ids', None) or ())
+        to_user_ids = extra['to_user_ids'] = [user_id for user_id in self.channels.get(extra.get('channel_id'), ())
+                                              if user_id not in excepted]
+        return to_user_ids
+
+    async def _fanout(self, code, extra, keep_offline=False):
+        """
+        Send one frame to every online recipient (see `_recipients`), and time it.
+        With `keep_offline`, it is kept for the others.
+        """
+        channel_id = extra.get('channel_id')
+        started_at = time.perf_counter()
+        to_user_ids = self._recipients(extra)
+        message = json.dumps({'code': code, 'extra': extra})
+        sent = 0
+        for user_id in to_user_ids:
+            ws = self.users.get(user_id)
+            if ws is None:
+                if keep_offline:
+                    self._keep_offline(user_id, extra['msg_id'], {'code': code, 'extra': extra})
+                continue
+            try:
+                await ws.send(message)
+                sent += 1
+            except websockets.ConnectionClosed:
+                pass
+        elapsed = time.perf_counter() - started_at
+        histogram = self.fanout.get(channel_id)
+        if histogram is None:
+            histogram = self.fanout[channel_id] = Histogram(Histogram.FINE_BOUNDS)
+        histogram.add(elapsed)
+        self.fanout_recipients[channel_id] = self.fanout_recipients.get(channel_id, 0) + sent
+        self.stats['frames_sent'] += sent
+
+    def _keep_offline(self, user_id, msg_id, frame):
+        queue = self.offline.get(user_id)
+        if queue is None:
+            queue = self.offline[user_id] = deque(maxlen=self.max_offline)
+        queue.append((msg_id, frame))
+
+    def fanout_report(self) -> dict:
+        """
+        Per channel: fan-outs, recipients per fan-out, p50/p99 time and time per recipient.
+        """
+        report = {}
+        for channel_id, histogram in self.fanout.items():
+            recipients = self.fanout_recipients[channel_id]
+            report[channel_id] = {
+                'fanouts': histogram.count,
+                'recipients': recipients / histogram.count,
+                'p50': histogram.percentile(50),
+                'p99': histogram.percentile(99),
+                'per_recipient': histogram.total / recipients if recipients else None,
+            }
+        return report
+
+    async def _take_over(self, channel_id, members):
+        extensions = {'extensions': ['to_channel']} if self.to_channel else {}
+        await self._send_ccs(codes.COMMAND_TO_CCS, type_code=codes.NOTICE_TAKE_OVER, target_channel_id=channel_id,
+                             target_user_ids=list(members), target_channel_name=channel_id,
+                             target_channel_timestamp=time.time(), **extensions)
+
+    # users
+
+    async def _login(self, code, extra, ws):
+        user_id = extra['user_id']
+        self.users[user_id] = ws
+        self._user_of[ws] = user_id
+        await self._send(ws, codes.STATUS_INFO_LOGIN_SUCCESS)
+
+    async def _logout(self, code, extra, ws):
+        user_id = self._user_of.pop(ws, None)
+        self.users.pop(user_id, None)
+        await self._send(ws, codes.STATUS_INFO_LOGOUT_SUCCESS)
+
+    async def _create_channel(self, code, extra, ws):
+        channel_id = extra['channel_id']
+        if channel_id in self.channels:
+            await self._send(ws, codes.STATUS_ERROR_DUPLICATE_CHANNEL_ID, channel_id=channel_id)
+            return
+        self.channels[channel_id] = {extra['user_id']: None}
+        await self._send(ws, codes.STATUS_INFO_CREATE_CHANNEL_SUCCESS, channel_id=channel_id)
+        await self._take_over(channel_id, self.channels[channel_id])
+
+    async def _join_channel(self, code, extra, ws):
+        channel_id = extra['channel_id']
+        user_id = extra['user_id']
+        members = self.channels.get(channel_id)
+        if members is None:
+            await self._send(ws, codes.STATUS_ERROR_JOIN_FAIL_NO_SUCH_CHANNEL, channel_id=channel_id)
+        elif user_id in members:
+            await self._send(ws, codes.STATUS_ERROR_JOIN_FAIL_REPETITIVE_JOIN, channel_id=channel_id)
+        else:
+            members[user_id] = None
+            await self._send(ws, codes.STATUS_INFO_JOIN_SUCCESS, channel_id=channel_id)
+            await self._send_ccs(codes.COMMAND_TO_CCS, type_code=codes.NOTICE_USER_JOINED, channel_id=channel_id,
+                                 user_id=user_id)
+
+    async def _leave_channel(self, code, extra, ws):
+        channel_id = extra['channel_id']
+        user_id = extra['user_id']
+        members = self.channels.get(channel_id)
+        if members is None or user_id not in members:
+            await self._send(ws, codes.STATUS_ERROR_LEAVE_FAIL_REPETITIVE_LEAVE, channel_id=channel_id)
+        else:
+            del members[user_id]
+            await self._send(ws, codes.STATUS_INFO_LEAVE_SUCCESS, channel_id=channel_id)
+            await self._send_ccs(codes.COMMAND_TO_CCS, type_code=codes.NOTICE_USER_LEFT, channel_id=channel_id,
+                                 user_id=user_id)
+
+    async def _channel_user_lists(self, code, extra, ws):
+        # the cursor is the position of the next page in the channels of the user
+        user_id = extra['user_id']
+        channel_ids = [c for c, members in self.channels.items() if user_id in members]
+        start = extra.get('cursor') or 0
+        limit = extra.get('limit') or len(channel_ids)
+        page = channel_ids[start:start + limit]
+        user_lists = {c: list(self.channels[c]) for c in page}
+        if start + limit < len(channel_ids):
+            await self._send(ws, codes.STATUS_INFO_CHANNEL_USER_LISTS, user_lists=user_lists, cursor=start + limit)
+        else:
+            await self._send(ws, codes.STATUS_INFO_CHANNEL_USER_LISTS, user_lists=user_lists)
+
+    async def _fetch_offline(self, code, extra, ws):
+        user_id = extra['user_id']
+        queue = self.offline.get(user_id, ())
+        limit = extra.get('limit')
+        if limit is None:
+            self.offline.pop(user_id, None)
+            for _, frame in queue:
+                await self._send(ws, frame['code'], **frame['extra'])
+            return
+        # the cursor is the msg_id of the last message of the page before, acknowledging it
+        cursor = extra.get('cursor')
+        if cursor is not None:
+            while queue and queue[0][0] <= cursor:
+                queue.popleft()
+        page = [frame for _, frame in itertools.islice(queue, limit)]
+        if not queue:
+            self.offline.pop(user_id, None)
+        if page:
+            await self._send(ws, codes.STATUS_INFO_OFFLINE_MESSAGES, messages=page, cursor=page[-1]['extra']['msg_id'])
+        else:
+            await self._send(ws, codes.STATUS_INFO_OFFLINE_MESSAGES, messages=page)
+
+    async def _user_channel_list(self, code, extra, ws):
+        user_id = extra['user_id']
+        channel_ids = [c for c, members in self.channels.items() if user_id in members]
+        await self._send(ws, codes.STATUS_INFO_USER_CHANNEL_LIST, channel_ids=channel_ids)
+
+    async def _command_up(self, code, extra, ws):
+        if self.ccs is None:
+            await self._send(ws, codes.STATUS_ERROR_NO_CCS_SERVICE)
+            return
+        await self._send(self.ccs, codes.COMMAND_TO_CCS, type_code=code, **extra)
+
+    async def _message_up(self, code, extra, ws):
+        self.stats['messages_up'] += 1
+        extra = dict(extra, msg_id=next(self._temp_msg_ids))
+        if self.ccs is None:
+            extra.pop('temp_msg_id', None)
+            await self._deliver_message(code + 20000, extra)
+            return
+        await self._send(self.ccs, codes.MESSAGE_TO_CCS, type_code=code, **extra)
+
+    # CCS
+
+    async def _god_reconnect(self, code, extra, ws):
+        await self._send(ws, codes.STATUS_INFO_GOD_RECONNECT_SUCCESS)
+        await self._attach_ccs(ws)
+
+    async def _command_down(self, code, extra, ws):
+        type_code = extra.pop('type_code')
+        await self._fanout(type_code, extra)
+
+    async def _message_down(self, code, extra, ws):
+        type_code = extra.pop('type_code')
+        temp_msg_id = extra.pop('temp_msg_id', None)
+        msg_id = await self._deliver_message(type_code, extra)
+        await self._send_ccs(codes.COMMAND_TO_CCS, type_code=codes.NOTICE_COPY_CCS, channel_id=extra.get('channel_id'),
+                             ccs_temp_msg_id=temp_msg_id, msg_id=msg_id)
+
+    async def _deliver_message(self, code, extra):
+        msg_id = next(self._msg_ids)
+        extra['msg_id'] = msg_id
+        extra['n_recipients'] = len(self._recipients(extra))
+        self.stats['messages_down'] += 1
+        await self._fanout(code, extra, keep_offline=True)
+        return msg_id
+
+    async def _ignored(self, code, extra, ws):
+        pass
+
+    async def _unsupported(self, code, extra, ws):
+        await self._send(ws, codes.STATUS_ERROR_UNSUPPORTED_CODE, type_code=code)
@@ -0,0 +1,225 @@
+"""
+Content-addressed media store.
+
+Images and files are kept under the sha256 of their bytes, so the same
+media uploaded or sent again is stored once. The store is bounded by
+`max_bytes`: putting more evicts the least recently used media. With a
+`directory`, media are files there (`<directory>/<2 first hex>/<hash>`),
+their modification time keeping the recency order across restarts;
+without one, they are held in memory.
+
+Services keep media only when given a `media_dir`; without one they send
+images given as bytes inline every time (`image_args` with no store).
+`put_async` hashes and writes in the default executor, so that an asyncio
+service doesn't stall on large media.
+
+`stats` counts lookups (`put` of media already there and `get` that finds
+them are hits), bytes not stored again (`bytes_saved`, to which the
+services add the bytes of media they didn't send, see `image_args`) and
+evictions; `get_stats` adds `hit_ratio`.
+
+Media by hash in COMMAND_DOWN_DISPLAY_IMAGE
+-------------------------------------------
+An image given to the services as bytes goes in `args` as
+
+    {"type": "media", "media_hash": ..., "image": base64 of the bytes}
+
+to the users it wasn't sent to yet, and without `image` to those it was
+(`MediaStore.known`); services without a store send `image` to all of
+them. A client missing it asks with COMMAND_UP_FETCH_MEDIA
+(`media_hash`) and gets COMMAND_DOWN_MEDIA (`media_hash`, `media` in
+base64, none if the CCS no longer has it). `BaseBot` does so before
+calling `on_receive_command`.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class MediaStore:
+    def __init__(self, directory:str=None, max_bytes:int=256 << 20) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = OrderedDict()  # hash -> size, least recently used first
+        self.size = 0
+        self.known = {}             # hash -> ids of the users it was sent to
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'evictions': 0}
+        self._blobs = {} if directory is None else None
+        if directory is not None and os.path.isdir(directory):
+            self._scan()
+
+    @staticmethod
+    def key(data:bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, media_hash:str) -> str:
+        return os.path.join(self.directory, media_hash[:2], media_hash)
+
+    def _scan(self):
+        # media left by a previous run, in recency order
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                for media in os.scandir(entry.path):
+                    if media.is_file() and not media.name.endswith('.tmp'):
+                        stat = media.stat()
+                        found.append((stat.st_mtime, media.name, stat.st_size))
+        for _, media_hash, size in sorted(found):
+            self.sizes[media_hash] = size
+            self.size += size
+        self._evict()
+
+    def __contains__(self, media_hash):
+        return media_hash in self.sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def put(self, data:bytes) -> str:
+        """
+        Store `data` unless already there.
+
+        Return:
+            Its hash.
+        """
+        media_hash = self.key(data)
+        if self._wanted(media_hash, data):
+            if self._blobs is None:
+                self._write(media_hash, data)
+            self._added(media_hash, data)
+        return media_hash
+
+    async def put_async(self, data:bytes) -> str:
+        """
+        `put`, hashing and writing to disk in the default executor of the
+        running loop. The bookkeeping stays on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        media_hash = await loop.run_in_executor(None, self.key, data)
+        if self._wanted(media_hash, data):
+            if self._blobs is None:
+                await loop.run_in_executor(None, self._write, media_hash, data)
+            self._added(media_hash, data)
+        return media_hash
+
+    def _wanted(self, media_hash, data):
+        # counts the lookup, whether data is to be stored
+        if media_hash in self.sizes:
+            self.stats['hits'] += 1
+            self.stats['bytes_saved'] += len(data)
+            self._used(media_hash)
+            return False
+        self.stats['misses'] += 1
+        # larger would evict everything and not fit anyway
+        return len(data) <= self.max_bytes
+
+    def _write(self, media_hash, data):
+        path = self.path(media_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _added(self, media_hash, data):
+        if media_hash in self.sizes:
+            return      # stored meanwhile by another put_async
+        if self._blobs is not None:
+            self._blobs[media_hash] = bytes(data)
+        self.sizes[media_hash] = len(data)
+        self.size += len(data)
+        self._evict()
+
+    def get(self, media_hash:str) -> bytes:
+        """
+        The media of `media_hash`, None if not there.
+        """
+        if media_hash not in self.sizes:
+            self.stats['misses'] += 1
+            return None
+        if self._blobs is not None:
+            data = self._blobs[media_hash]
+        else:
+            try:
+                with open(self.path(media_hash), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # removed behind our back
+                self._forget(media_hash)
+                self.stats['misses'] += 1
+                return None
+        self.stats['hits'] += 1
+        self._used(media_hash)
+        return data
+
+    def _used(self, media_hash):
+        self.sizes.move_to_end(media_hash)
+        if self._blobs is None:
+            try:
+                os.utime(self.path(media_hash))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.sizes:
+            media_hash = next(iter(self.sizes))
+            self._forget(media_hash)
+            if self._blobs is None:
+                try:
+                    os.remove(self.path(media_hash))
+                except FileNotFoundError:
+                    pass
+            self.stats['evictions'] += 1
+
+    def _forget(self, media_hash):
+        self.size -= self.sizes.pop(media_hash)
+        self.known.pop(media_hash, None)
+        if self._blobs is not None:
+            self._blobs.pop(media_hash, None)
+
+    def mark_known(self, media_hash:str, user_ids):
+        """
+        Record that `user_ids` were sent the media of `media_hash`.
+        """
+        if media_hash in self.sizes:
+            self.known.setdefault(media_hash, set()).update(user_ids)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats, media=len(self.sizes), bytes_stored=self.size)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else None
+        return stats
+
+
+def image_args(store:MediaStore, to_user_ids, image, media_hash:str=None) -> list:
+    """
+    `(to_user_ids, args)` of the COMMAND_DOWN_DISPLAY_IMAGE frames showing
+    `image` to `to_user_ids`: an URL as before, or bytes by hash, see the
+    module doc. `media_hash` is that of `image` if already put in `store`.
+    Without `store`, bytes go inline to everyone.
+    """
+    if isinstance(image, str):
+        return [(to_user_ids, {'type': 'url', 'image': image})]
+    if media_hash is None:
+        media_hash = store.put(image) if store is not None else MediaStore.key(image)
+    if store is None:
+        return [(to_user_ids, {'type': 'media', 'media_hash': media_hash,
+                               'image': base64.b64encode(image).decode('ascii')})]
+    known = store.known.get(media_hash, ())
+    missing = [user_id for user_id in to_user_ids if user_id not in known]
+    if not missing:
+        store.stats['bytes_saved'] += len(image)
+        return [(to_user_ids, {'type': 'media', 'media_hash': media_hash})]
+    if len(missing) == len(to_user_ids):
+        missing = to_user_ids
+    frames = [(missing, {'type': 'media', 'media_hash': media_hash,
+                         'image': base64.b64encode(image).decode('ascii')})]
+    if len(missing) < len(to_user_ids):
+        store.stats['bytes_saved'] += len(image)
+        frames.append(([user_id for user_id in to_user_ids if user_id in known],
+                       {'type': 'media', 'media_hash': media_hash}))
+    store.mark_known(media_hash, missing)
+    return frames
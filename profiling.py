@@ -0,0 +1,333 @@
+"""
+Profiling of a live service, driven through a local admin socket or signals.
+
+    echo 'cprofile 10' | nc -U /tmp/goddess.sock
+
+Commands (one per connection, answered with one line):
+    cprofile <seconds>                 cProfile of the event loop thread, with a
+                                       table of the routed handlers
+    sample <seconds> [interval ms]     sampling profiler of the event loop thread,
+                                       from a thread of its own
+    tracemalloc start [frames]         start tracing allocations
+    tracemalloc snapshot [top]         top allocators, and growth since the previous snapshot
+    tracemalloc stop
+    trace                              per-stage latency of the service's tracer
+    status
+Results are written to files in `directory`, named after the kind of
+profile and the time it was taken; the answer gives their path.
+
+cProfile only sees the thread that enables it, so commands run on the thread
+of the event loop: `serve_asyncio` for asyncio services (Goddess), `serve_rel`
+for rel ones (God, bots). Signals are an alternative without socket:
+`install_signals` makes SIGUSR1 run `cprofile` and SIGUSR2 take a
+`tracemalloc snapshot`.
+"""
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class ProfilingControl:
+    """
+    Runs profiling commands against the process of `service` and writes the
+    results to `directory`. `service` is only used to find the handlers of
+    its `router`, and may be None.
+    """
+
+    def __init__(self, service=None, directory:str='.', default_seconds:float=10) -> None:
+        self.service = service
+        self.directory = directory
+        self.default_seconds = default_seconds
+        self.thread_id = threading.get_ident()
+        self._call_later = None
+        self._cprofile = None
+        self._sampler = None
+        self._snapshot = None
+        os.makedirs(directory, exist_ok=True)
+
+    # transports
+
+    async def serve_asyncio(self, path:str):
+        """
+        Listen for commands on the unix socket `path`, in the running event loop.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        self.thread_id = threading.get_ident()
+        self._call_later = loop.call_later
+
+        async def handle(reader, writer):
+            line = await reader.readline()
+            writer.write((self.command(line.decode('utf-8', 'replace')) + '\n').encode('utf-8'))
+            await writer.drain()
+            writer.close()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        return await asyncio.start_unix_server(handle, path)
+
+    def serve_rel(self, path:str):
+        """
+        Listen for commands on the unix socket `path`, in the rel dispatcher.
+        """
+        import rel
+        self.thread_id = threading.get_ident()
+        self._call_later = lambda delay, callback: rel.timeout(delay, lambda: callback() and False)
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(4)
+        sock.setblocking(False)
+        rel.read(sock, self._on_rel_connection, sock)
+        return sock
+
+    def _on_rel_connection(self, sock):
+        try:
+            conn, _ = sock.accept()
+        except BlockingIOError:
+            return True
+        with conn:
+            conn.settimeout(1)
+            try:
+                line = conn.recv(1024).decode('utf-8', 'replace')
+                conn.sendall((self.command(line) + '\n').encode('utf-8'))
+            except OSError as e:
+                print('ProfilingControl: admin connection failed', e)
+        return True
+
+    def install_signals(self, loop=None):
+        """
+        SIGUSR1 runs `cprofile <default_seconds>`, SIGUSR2 a `tracemalloc snapshot`.
+        Give the asyncio `loop` for asyncio services, rel is used otherwise.
+        """
+        def on_cprofile(*args):
+            print('ProfilingControl:', self.command(f'cprofile {self.default_seconds}'))
+
+        def on_snapshot(*args):
+            print('ProfilingControl:', self.command('tracemalloc snapshot'))
+
+        self.thread_id = threading.get_ident()
+        if loop is not None:
+            self._call_later = loop.call_later
+            loop.add_signal_handler(signal.SIGUSR1, on_cprofile)
+            loop.add_signal_handler(signal.SIGUSR2, on_snapshot)
+        else:
+            import rel
+            self._call_later = lambda delay, callback: rel.timeout(delay, lambda: callback() and False)
+            rel.signal(signal.SIGUSR1, on_cprofile)
+            rel.signal(signal.SIGUSR2, on_snapshot)
+
+    # commands
+
+    def command(self, line:str) -> str:
+        """
+        Run one command line and return the answer.
+        """
+        words = line.split()
+        if not words:
+            return 'error: empty command'
+        try:
+            name, args = words[0], words[1:]
+            if name == 'cprofile':
+                return self.start_cprofile(float(args[0]) if args else self.default_seconds)
+            if name == 'sample':
+                seconds = float(args[0]) if args else self.default_seconds
+                interval = float(args[1]) / 1000 if len(args) > 1 else 0.005
+                return self.start_sampling(seconds, interval)
+            if name == 'tracemalloc':
+                action = args[0] if args else 'snapshot'
+                if action == 'start':
+                    return self.start_tracemalloc(int(args[1]) if len(args) > 1 else 1)
+                if action == 'snapshot':
+                    return self.tracemalloc_snapshot(int(args[1]) if len(args) > 1 else 25)
+                if action == 'stop':
+                    return self.stop_tracemalloc()
+            if name == 'trace':
+                return self.write_trace()
+            if name == 'status':
+                return self.status()
+            return f'error: unknown command {line.strip()!r}'
+        except Exception as e:
+            return f'error: {e}'
+
+    def status(self) -> str:
+        return 'cprofile {}, sampling {}, tracemalloc {}'.format(
+            'running' if self._cprofile else 'off',
+            'running' if self._sampler and self._sampler.is_alive() else 'off',
+            'tracing' if tracemalloc.is_tracing() else 'off')
+
+    def _path(self, kind, extension):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.directory, f'{kind}-{stamp}-{os.getpid()}.{extension}')
+
+    # cProfile
+
+    def start_cprofile(self, seconds:float) -> str:
+        if self._cprofile is not None:
+            return 'error: cprofile already running'
+        if self._call_later is None:
+            raise Exception('no event loop to stop the profile, serve commands first')
+        if threading.get_ident() != self.thread_id:
+            raise Exception('cprofile must be started from the event loop thread')
+        path = self._path('cprofile', 'prof')
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+        self._call_later(seconds, lambda: self._stop_cprofile(path))
+        return f'cprofile running for {seconds}s, writing {path} and {path[:-4]}txt'
+
+    def _stop_cprofile(self, path):
+        profile, self._cprofile = self._cprofile, None
+        profile.disable()
+        profile.dump_stats(path)
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        self._write_handler_table(stats, out)
+        print('\nslowest functions, by cumulative time', file=out)
+        stats.sort_stats('cumulative').print_stats(40)
+        with open(path[:-4] + 'txt', 'w') as f:
+            f.write(out.getvalue())
+
+    def _handlers(self):
+        # routed handler functions of the service, with the codes they serve
+        router = getattr(self.service, 'router', None)
+        handlers = {}
+        if router is None:
+            return handlers
+        routes = [(str(code), h) for code, h in router.exact.items()]
+        routes += [(f'{low}-{high}', h) for low, high, h in router.ranges]
+        if router.fallback:
+            routes.append(('fallback', router.fallback))
+        for code, handler in routes:
+            code_object = getattr(getattr(handler, '__func__', handler), '__code__', None)
+            if code_object is not None:
+                key = (code_object.co_filename, code_object.co_firstlineno, code_object.co_name)
+                handlers.setdefault(key, []).append(code)
+        return handlers
+
+    def _write_handler_table(self, stats, out):
+        """
+        One line per routed handler that ran: calls, own time, cumulative time.
+        Coroutine handlers count one call per resumption and exclude the time
+        they spent suspended.
+        """
+        rows = []
+        for key, codes in self._handlers().items():
+            entry = stats.stats.get(key)
+            if entry is not None:
+                primitive, calls, tottime, cumtime, callers = entry
+                rows.append((cumtime, tottime, calls, key[2], ','.join(codes)))
+        print('handlers, by cumulative time', file=out)
+        print(f'{"cumtime":>10} {"tottime":>10} {"calls":>8}  handler (codes)', file=out)
+        for cumtime, tottime, calls, name, codes in sorted(rows, reverse=True):
+            print(f'{cumtime:>10.4f} {tottime:>10.4f} {calls:>8}  {name} ({codes})', file=out)
+
+    # sampling
+
+    def start_sampling(self, seconds:float, interval:float=0.005) -> str:
+        if self._sampler is not None and self._sampler.is_alive():
+            return 'error: sampling already running'
+        path = self._path('samples', 'folded')
+        self._sampler = threading.Thread(target=self._sample, args=(seconds, interval, path), daemon=True)
+        self._sampler.start()
+        return f'sampling every {interval * 1000:g}ms for {seconds}s, writing {path} and {path[:-6]}txt'
+
+    def _sample(self, seconds, interval, path):
+        """
+        Read the stack of the loop thread every `interval` from this thread.
+        Costs the loop one GIL switch per sample, whatever the load.
+        """
+        stacks = collections.Counter()
+        target = self.thread_id
+        end = time.perf_counter() + seconds
+        samples = 0
+        while time.perf_counter() < end:
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stacks[';'.join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+
+        # folded stacks, e.g. for flamegraph.pl or speedscope
+        with open(path, 'w') as f:
+            for stack, n in stacks.most_common():
+                f.write(f'{stack} {n}\n')
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, n in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += n
+            for name in set(frames):
+                total[name] += n
+        with open(path[:-6] + 'txt', 'w') as f:
+            f.write(f'{samples} samples every {interval * 1000:g}ms\n\n')
+            for title, counter in (('own', own), ('total', total)):
+                f.write(f'top functions by {title} samples\n')
+                for name, n in counter.most_common(30):
+                    f.write(f'{n / samples * 100 if samples else 0:6.1f}%  {name}\n')
+                f.write('\n')
+
+    # tracing
+
+    def write_trace(self) -> str:
+        tracer = getattr(self.service, 'tracer', None)
+        if tracer is None:
+            return 'error: the service has no tracer'
+        path = self._path('trace', 'json')
+        with open(path, 'w') as f:
+            json.dump(tracer.snapshot(), f, indent=1)
+        with open(path[:-4] + 'txt', 'w') as f:
+            f.write(tracer.report() + '\n')
+        return f'trace written to {path} and {path[:-4]}txt'
+
+    # tracemalloc
+
+    def start_tracemalloc(self, frames:int=1) -> str:
+        if tracemalloc.is_tracing():
+            return 'tracemalloc already tracing'
+        tracemalloc.start(frames)
+        self._snapshot = None
+        return f'tracemalloc tracing with {frames} frame(s)'
+
+    def tracemalloc_snapshot(self, top:int=25) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            return 'tracemalloc was off, now tracing; take a snapshot later'
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        path = self._path('tracemalloc', 'dump')
+        snapshot.dump(path)
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path[:-4] + 'txt', 'w') as f:
+            f.write(f'traced {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB\n\n')
+            f.write(f'top {top} allocators\n')
+            for stat in snapshot.statistics('lineno')[:top]:
+                f.write(f'{stat}\n')
+            if self._snapshot is not None:
+                f.write(f'\ntop {top} growths since the previous snapshot\n')
+                for stat in snapshot.compare_to(self._snapshot, 'lineno')[:top]:
+                    f.write(f'{stat}\n')
+        self._snapshot = snapshot
+        return f'tracemalloc snapshot written to {path} and {path[:-4]}txt'
+
+    def stop_tracemalloc(self) -> str:
+        tracemalloc.stop()
+        self._snapshot = None
+        return 'tracemalloc stopped'
@@ -0,0 +1,42 @@
+import time
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, at most `burst` in store.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate:float, burst:float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now:float):
+        # `now` may be older than a bucket made since it was read
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def ready(self, now:float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now:float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now:float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def wait_time(self, now:float) -> float:
+        """
+        Seconds until one token is available.
+        """
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
@@ -0,0 +1,48 @@
+import random
+
+
+class ReconnectPolicy:
+    """
+    Exponential backoff with jitter between reconnection attempts.
+    The n-th consecutive attempt waits `base * factor ** (n - 1)` seconds, capped
+    at `max_delay`, of which a random `jitter` fraction is drawn uniformly, so that
+    clients dropped together by a server restart don't come back in lockstep.
+    Call `reset()` once a connection is established.
+    """
+
+    def __init__(self, base:float=1, factor:float=2, max_delay:float=60, jitter:float=0.5) -> None:
+        """
+        Args:
+            base : float : optional
+                Seconds to wait before the first attempt.
+            factor : float : optional
+                Growth of the delay after each failed attempt.
+            max_delay : float : optional
+                Upper bound of the delay, before jitter.
+            jitter : float : optional
+                Fraction of the delay that is randomized, from 0 (none) to 1 (full jitter).
+        """
+        if not 0 <= jitter <= 1:
+            raise Exception(f'jitter must be between 0 and 1, got {jitter}')
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """
+        Count an attempt and return the seconds to wait before it.
+        """
+        self.attempts += 1
+        delay = min(self.max_delay, self.base * self.factor ** (self.attempts - 1))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    def reset(self):
+        self.attempts = 0
+
+    def copy(self) -> 'ReconnectPolicy':
+        """
+        Same policy with its own attempt counter, for another connection.
+        """
+        return ReconnectPolicy(self.base, self.factor, self.max_delay, self.jitter)
@@ -0,0 +1,300 @@
+import inspect
+import time
+import traceback
+
+from .ratelimit import TokenBucket
+from .stats import Histogram
+
+
+class Router:
+    """
+    Dispatch of frames to handlers by code.
+
+    Handlers are registered for an exact code, a range of codes or a code
+    family (all codes sharing their leading digit, e.g. 9 for 9xxxx).
+    Registrations are compiled into a dict of the exact codes and a table
+    by family (`code // FAMILY_WIDTH`): a family covered by one route maps
+    to its handler, others to their ranges, narrowest first. Dispatching is
+    one lookup for an exact code, two for a family route, whatever the
+    number of routes, and the tables hold one entry per route, not per
+    code. An exact code wins over a range, a narrower range over a wider
+    one, a range over a family; among equals the last registered wins.
+    Codes with no route go to the fallback handler, if any.
+
+    Middlewares wrap every route when compiling, in the order they are added,
+    the first one being the outermost. A middleware is a callable
+    `middleware(handler)` returning a new handler; handlers, as compiled, are
+    called `handler(code, *args)`, so one wrapper serves a whole range.
+    Coroutine handlers must be wrapped into coroutine functions. Without
+    middlewares, the table holds the registered handlers as they are.
+
+    The router doesn't know what a handler takes: `dispatch(code, *args)`
+    calls the handler registered for `code` with `*args`.
+    """
+
+    FAMILY_WIDTH = 10000
+
+    def __init__(self, fallback=None) -> None:
+        """
+        Args:
+            fallback : function : optional
+                Handler called for codes with no route. Without one, `dispatch`
+                returns None for them.
+        """
+        self.exact = {}
+        self.ranges = []    # (low, high, handler), high included
+        self.middlewares = []
+        self.fallback = fallback
+        self._table = None
+        self._families = None   # family -> handler, or list of (low, high, handler) narrowest first
+        self._fallback = None
+
+    def add(self, code:int, handler):
+        """
+        Route a single code to `handler`.
+        """
+        self.exact[code] = handler
+        self._table = None
+
+    def remove(self, code:int):
+        """
+        Forget the exact route of `code`, if any.
+        """
+        self.exact.pop(code, None)
+        self._table = None
+
+    def add_range(self, low:int, high:int, handler):
+        """
+        Route every code from `low` to `high`, both included, to `handler`.
+        """
+        if low > high:
+            raise Exception(f'empty code range: {low} to {high}')
+        self.ranges.append((low, high, handler))
+        self._table = None
+
+    def add_family(self, family:int, handler):
+        """
+        Route the codes `family`xxxx, e.g. family 9 is 90000 to 99999, to `handler`.
+        """
+        low = family * self.FAMILY_WIDTH
+        self.add_range(low, low + self.FAMILY_WIDTH - 1, handler)
+
+    def set_fallback(self, handler):
+        self.fallback = handler
+        self._table = None
+
+    def use(self, middleware):
+        """
+        Append a middleware to the chain.
+        """
+        self.middlewares.append(middleware)
+        self._table = None
+
+    def unuse(self, middleware):
+        """
+        Remove a middleware from the chain, if there.
+        """
+        if middleware in self.middlewares:
+            self.middlewares.remove(middleware)
+            self._table = None
+
+    def _chain(self, handler):
+        if not self.middlewares:
+            return handler
+
+        def call(code, *args):
+            return handler(*args)
+        if inspect.iscoroutinefunction(handler):
+            async def call(code, *args):
+                return await handler(*args)
+        for middleware in reversed(self.middlewares):
+            call = middleware(call)
+        return call
+
+    def compile(self):
+        """
+        Build the tables. Called on first dispatch after any change.
+        """
+        chains = {}
+
+        def chain(handler):
+            # one wrapper per distinct handler, shared by all of its codes
+            key = id(handler)
+            if key not in chains:
+                chains[key] = (handler, self._chain(handler))
+            return chains[key][1]
+
+        width = self.FAMILY_WIDTH
+        pieces = {}
+        # narrowest first, the last registered first among equals; a range over
+        # several families is cut into one piece per family, keeping its width
+        order = sorted(enumerate(self.ranges), key=lambda r: (r[1][1] - r[1][0], -r[0]))
+        for _, (low, high, handler) in order:
+            wrapped = chain(handler)
+            for family in range(low // width, high // width + 1):
+                pieces.setdefault(family, []).append(
+                    (max(low, family * width), min(high, family * width + width - 1), wrapped))
+        families = {}
+        for family, ranges in pieces.items():
+            low, high, wrapped = ranges[0]
+            # the narrowest piece spans the family: it wins for every code of it
+            whole = low == family * width and high == family * width + width - 1
+            families[family] = wrapped if whole else ranges
+        self._families = families
+        self._fallback = chain(self.fallback) if self.fallback else None
+        self._table = table = {code: chain(handler) for code, handler in self.exact.items()}
+        return table
+
+    def _route(self, code:int):
+        # compiled handler of the range or family route of `code`, None if none
+        route = self._families.get(code // self.FAMILY_WIDTH)
+        if route.__class__ is list:
+            for low, high, handler in route:
+                if low <= code <= high:
+                    return handler
+            return None
+        return route
+
+    def resolve(self, code:int):
+        """
+        The compiled handler of `code`, the fallback one, or None.
+        """
+        if self._table is None:
+            self.compile()
+        handler = self._table.get(code)
+        if handler is None:
+            handler = self._route(code)
+        return handler if handler is not None else self._fallback
+
+    def __contains__(self, code:int):
+        if self._table is None:
+            self.compile()
+        return code in self._table or self._route(code) is not None
+
+    def dispatch(self, code:int, *args):
+        """
+        Call the handler of `code` with `*args` and return what it returns
+        (a coroutine for coroutine handlers), None if there is no handler.
+        """
+        table = self._table
+        if table is None:
+            table = self.compile()
+        handler = table.get(code)
+        if handler is None:
+            handler = self._families.get(code // self.FAMILY_WIDTH)
+            if handler.__class__ is list:
+                handler = self._route(code)
+            if handler is None:
+                handler = self._fallback
+                if handler is None:
+                    return None
+        if self.middlewares:
+            return handler(code, *args)
+        # without middlewares the table holds the handlers themselves
+        return handler(*args)
+
+
+class Timing:
+    """
+    Middleware recording the time spent in handlers, one histogram per code.
+    Coroutine handlers are timed until they return, awaits included.
+    """
+
+    def __init__(self) -> None:
+        self.histograms = {}
+
+    def _record(self, code, elapsed):
+        histogram = self.histograms.get(code)
+        if histogram is None:
+            histogram = self.histograms[code] = Histogram()
+        histogram.add(elapsed)
+
+    def __call__(self, handler):
+        clock = time.perf_counter
+        record = self._record
+        if inspect.iscoroutinefunction(handler):
+            async def timed(code, *args):
+                started_at = clock()
+                try:
+                    return await handler(code, *args)
+                finally:
+                    record(code, clock() - started_at)
+        else:
+            def timed(code, *args):
+                started_at = clock()
+                try:
+                    return handler(code, *args)
+                finally:
+                    record(code, clock() - started_at)
+        return timed
+
+    def snapshot(self) -> dict:
+        return {code: histogram.snapshot() for code, histogram in self.histograms.items()}
+
+
+class RateLimit:
+    """
+    Middleware dropping frames of a code beyond `rate` per second (token
+    bucket of `burst`, one per code). Dropped frames are counted in `dropped`.
+    """
+
+    def __init__(self, rate:float, burst:float=None) -> None:
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self.buckets = {}
+        self.dropped = {}
+
+    def _allow(self, code) -> bool:
+        bucket = self.buckets.get(code)
+        if bucket is None:
+            bucket = self.buckets[code] = TokenBucket(self.rate, self.burst)
+        if bucket.take(time.monotonic()):
+            return True
+        self.dropped[code] = self.dropped.get(code, 0) + 1
+        return False
+
+    def __call__(self, handler):
+        allow = self._allow
+        if inspect.iscoroutinefunction(handler):
+            async def limited(code, *args):
+                if allow(code):
+                    return await handler(code, *args)
+        else:
+            def limited(code, *args):
+                if allow(code):
+                    return handler(code, *args)
+        return limited
+
+
+class CatchErrors:
+    """
+    Middleware stopping exceptions of handlers, which are printed and counted
+    in `errors`, then passed to `on_error(code, error)` if given.
+    """
+
+    def __init__(self, on_error=None) -> None:
+        self.on_error = on_error
+        self.errors = {}
+
+    def _failed(self, code, error):
+        self.errors[code] = self.errors.get(code, 0) + 1
+        print(f'Router: handler of {code} failed:', error)
+        traceback.print_exc()
+        if self.on_error:
+            self.on_error(code, error)
+
+    def __call__(self, handler):
+        failed = self._failed
+        if inspect.iscoroutinefunction(handler):
+            async def caught(code, *args):
+                try:
+                    return await handler(code, *args)
+                except Exception as e:
+                    failed(code, e)
+        else:
+            def caught(code, *args):
+                try:
+                    return handler(code, *args)
+                except Exception as e:
+                    failed(code, e)
+        return caught
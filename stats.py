@@ -0,0 +1,92 @@
+import bisect
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations in seconds, cheap enough to record
+    every sample. Buckets grow in a 1-2-5 sequence from 0.1ms to 60s;
+    percentiles are read as the upper bound of the bucket they fall in.
+    """
+
+    BOUNDS = (
+        0.0001, 0.0002, 0.0005,
+        0.001, 0.002, 0.005,
+        0.01, 0.02, 0.05,
+        0.1, 0.2, 0.5,
+        1, 2, 5,
+        10, 20, 60,
+    )
+
+    # for latencies read at p99.9 or below 0.1ms, e.g. by load tests:
+    # 10 buckets per decade from 10us to 80s
+    FINE_BOUNDS = tuple(
+        round(m * 10 ** e, 6)
+        for e in range(-5, 2)
+        for m in (1, 1.2, 1.5, 2, 2.5, 3, 4, 5, 6, 8)
+    )
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds:tuple=None) -> None:
+        self.bounds = tuple(bounds) if bounds else self.BOUNDS
+        # one more bucket for samples above the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value:float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p:float) -> float:
+        """
+        Upper bound of the bucket holding the `p`-th percentile (0 < p <= 100),
+        capped by the max sample.
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def merge(self, other:'Histogram'):
+        """
+        Add the samples of another histogram with the same bounds.
+        """
+        if other.bounds != self.bounds:
+            raise Exception('cannot merge histograms with different bounds')
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def snapshot(self) -> dict:
+        """
+        Plain dict of the histogram, safe to pickle or dump as json.
+        """
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'buckets': {str(bound): n for bound, n in zip(self.bounds + ('inf',), self.counts) if n},
+        }
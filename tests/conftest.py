@@ -0,0 +1,50 @@
+import contextlib
+import json
+import os
+
+import pytest
+
+from ..bot import BaseBot
+
+
+class FakeSocket:
+    """
+    Socket of a bot that never connects, keeping the frames sent.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def send(self, data):
+        self.frames.append(json.loads(data))
+
+    def close(self):
+        pass
+
+
+class UnconnectedBot(BaseBot):
+    # no connection to `path` on creation, nor reconnection: frames go to a FakeSocket
+    def create_connection(self, uri, on_open=None, on_message=None, on_error=None, on_close=None):
+        self.ws = FakeSocket()
+        self.connected = True
+
+
+@pytest.fixture
+def quiet():
+    # bots and services print every frame
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@pytest.fixture
+def make_bot(quiet):
+    bots = []
+
+    def make(**kwargs):
+        bot = UnconnectedBot('bot', 'password', ping_interval=0, **kwargs)
+        bots.append(bot)
+        return bot
+
+    yield make
+    for bot in bots:
+        bot.close()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from .. import codes
+from ..bot import AsyncBaseBot, Message, MessageType, StatusError
+from ..loadtest.social import StandInSocial
+
+
+class _Bot(AsyncBaseBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.received = []
+
+    async def on_receive_message(self, data):
+        self.received.append(data)
+
+
+def _run(test, **social_kwargs):
+    async def main():
+        social = StandInSocial(**social_kwargs)
+        await social.start()
+        try:
+            await test(social)
+        finally:
+            await social.stop()
+    asyncio.run(main())
+
+
+async def _bot(social, user_id='bot', **kwargs):
+    bot = _Bot(user_id, 'password', path=social.uri, timeout=2, **kwargs)
+    await bot.start()
+    return bot
+
+
+def test_requests_and_errors_by_channel(quiet):
+    async def test(social):
+        bot = await _bot(social)
+        assert bot.channel_list == []
+        joined, missing = await asyncio.gather(bot.join_channel('CH0'), bot.join_channel('CH9'),
+                                               return_exceptions=True)
+        assert joined['extra']['channel_id'] == 'CH0'
+        assert isinstance(missing, StatusError) and missing.data['extra']['channel_id'] == 'CH9'
+        assert missing.code == codes.STATUS_ERROR_JOIN_FAIL_NO_SUCH_CHANNEL
+        assert await bot.fetch_bot_channels() == ['CH0']
+        assert not bot._pending and not bot._pending_errors
+        await bot.close()
+    _run(test, channels=['CH0'])
+
+
+def test_commands_without_ccs_fail(quiet):
+    async def test(social):
+        bot = await _bot(social)
+        with pytest.raises(StatusError) as error:
+            await bot.fetch_channel_user_list('CH0', timeout=1)
+        assert error.value.code == codes.STATUS_ERROR_NO_CCS_SERVICE
+        await bot.close()
+    _run(test, channels=['CH0'])
+
+
+async def _offline(social, n):
+    # messages to `bot` sent by `user0` before it logged in
+    social.channels['CH0'].update(dict.fromkeys(['bot', 'user0']))
+    sender = await _bot(social, 'user0')
+    temp_msg_ids = [await sender.send_message(Message(MessageType.TEXT, f'm{i}', 'CH0', ['bot'], 'user0'))
+                    for i in range(n)]
+    await sender.fetch_bot_channels()
+    await sender.close()
+    return temp_msg_ids
+
+
+def test_offline_messages_all_at_once_by_default(quiet):
+    async def test(social):
+        temp_msg_ids = await _offline(social, 3)
+        assert len(set(temp_msg_ids)) == 3
+        bot = await _bot(social)
+        assert [message async for message in bot.offline_messages()] == []
+        await bot.fetch_bot_channels()
+        assert [message.body for message in bot.received] == ['m0', 'm1', 'm2']
+        await bot.close()
+    _run(test, channels=['CH0'])
+
+
+def test_offline_messages_by_pages(quiet):
+    async def test(social):
+        await _offline(social, 5)
+        bot = await _bot(social, offline_page_size=2)
+        assert [message.body async for message in bot.offline_messages()] == ['m0', 'm1', 'm2', 'm3', 'm4']
+        assert bot.received == []
+        await bot.close()
+    _run(test, channels=['CH0'])
+
+
+def test_callback_errors_are_reported(capsys):
+    class _Failing(AsyncBaseBot):
+        async def on_receive_status(self, data):
+            raise ValueError('broken callback')
+
+    async def test(social):
+        bot = _Failing('bot', 'password', path=social.uri, timeout=2)
+        await bot.start()
+        assert bot.channel_list == []
+        await asyncio.sleep(0.05)
+        assert not bot._tasks
+        await bot.close()
+    _run(test)
+    assert 'AsyncBot: callback error! broken callback' in capsys.readouterr().out
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from .. import codes
+from ..ccs import GoddessService
+from ..ccs.audience import Audience, WholeChannel
+from ..ccs.database_agent import DatabaseAgent
+
+
+class _Connection:
+    """
+    Connection of Social to a service, keeping the frames sent down.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, data):
+        self.frames.append(json.loads(data))
+
+
+def _take_over(channel_id, user_ids, extensions=None):
+    extra = {'type_code': codes.NOTICE_TAKE_OVER, 'target_channel_id': channel_id, 'target_user_ids': user_ids,
+             'target_channel_name': channel_id, 'target_channel_timestamp': 0}
+    if extensions is not None:
+        extra['extensions'] = extensions
+    return {'code': codes.COMMAND_TO_CCS, 'extra': extra}
+
+
+def test_segments_follow_joins_and_leaves(tmp_path):
+    agent = DatabaseAgent(str(tmp_path / 'db.json'))
+    roster = [f'user{i}' for i in range(6)]
+    agent.init_user_id_list('CH0', roster)
+    audience = Audience(agent)
+    rng = random.Random(0)
+    for _ in range(200):
+        # segments of every member, and of some who left, kept across the changes
+        for user_id in roster + ['user6', 'user7']:
+            audience.all_except('CH0', user_id)
+        user_id = f'user{rng.randrange(8)}'
+        if user_id in roster:
+            agent.leave_channel('CH0', user_id)
+            roster.remove(user_id)
+        else:
+            agent.join_channel('CH0', user_id)
+            roster.append(user_id)
+        assert audience.everyone('CH0') == tuple(roster)
+        for other, segment in audience._channels['CH0'].excepts.items():
+            assert segment.__class__ is WholeChannel
+            assert segment == tuple(u for u in roster if u != other)
+            assert segment.excepted == (other,)
+    assert audience.stats['built'] == 1
+
+
+@pytest.fixture
+def service(tmp_path, quiet):
+    return GoddessService(0, uri='', token='', dbfile=str(tmp_path / 'goddess.json'))
+
+
+def test_to_channel_only_for_peers_declaring_it(service):
+    declaring, other = _Connection(), _Connection()
+
+    async def run():
+        await service._handle_data_dict_core(_take_over('CH0', ['a', 'b', 'c'], ['to_channel']), declaring, '')
+        await service._handle_data_dict_core(_take_over('CH1', ['a', 'b', 'c']), other, '')
+        for channel_id, ws in (('CH0', declaring), ('CH1', other)):
+            await service.broadcast_command_text(channel_id, ws, 'hello')
+            data = {'extra': {'channel_id': channel_id, 'user_id': 'b'}}
+            await service.whistle_sender_command_text(data, ws, text_to_sender='you', text_to_others='them')
+
+    asyncio.run(run())
+    roster, command_list, broadcast, to_sender, to_others = [frame['extra'] for frame in declaring.frames]
+    assert roster['to_channel'] is True and 'to_user_ids' not in roster
+    assert roster['user_ids'] == ['a', 'b', 'c']
+    assert command_list['to_channel'] is True
+    assert broadcast['to_channel'] is True and 'except_user_ids' not in broadcast
+    assert to_sender['to_user_ids'] == ['b'] and 'to_channel' not in to_sender
+    assert to_others['to_channel'] is True and to_others['except_user_ids'] == ['b']
+    assert 'to_user_ids' not in to_others
+
+    roster, command_list, broadcast, to_sender, to_others = [frame['extra'] for frame in other.frames]
+    for extra in (roster, command_list, broadcast, to_sender, to_others):
+        assert 'to_channel' not in extra and 'except_user_ids' not in extra
+    assert roster['to_user_ids'] == ['a', 'b', 'c']
+    assert broadcast['to_user_ids'] == ['a', 'b', 'c']
+    assert to_sender['to_user_ids'] == ['b']
+    assert to_others['to_user_ids'] == ['a', 'c']
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import re
+
+import rel
+
+from .. import codes
+from ..capture import MAGIC, TrafficRecorder, TrafficReplayer, read_capture
+from ..ccs import GoddessService
+from ..ccs.god_service import GodService
+
+
+def _command(type_code, **extra):
+    return {'code': codes.COMMAND_TO_CCS, 'extra': dict(extra, type_code=type_code)}
+
+
+TAKE_OVER = _command(codes.NOTICE_TAKE_OVER, target_channel_id='CH0', target_user_ids=['a', 'b'],
+                     target_channel_name='CH0', target_channel_timestamp=0)
+JOINED = _command(codes.NOTICE_USER_JOINED, channel_id='CH0', user_id='c')
+TEXT = {'code': codes.MESSAGE_TO_CCS, 'extra': {
+    'type_code': codes.MESSAGE_UP_TEXT, 'channel_id': 'CH0', 'from_user_id': 'a', 'to_user_ids': ['b', 'c'],
+    'msg_id': 'm0', 'msg_body': 'hi', 'origin': 'user'}}
+
+
+class _Connection:
+    """
+    Connection of Social to a passive service, bringing `messages` then closed.
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # the task handling the previous frame runs first
+        await asyncio.sleep(0.01)
+        if not self.messages:
+            raise StopAsyncIteration
+        return self.messages.pop(0)
+
+    async def send(self, data):
+        pass
+
+
+def _record(tmp_path):
+    # a take-over, a join (a frame holding newlines) and a message through a recorded Goddess
+    path = str(tmp_path / 'goddess.capture')
+    recorder = TrafficRecorder(path)
+    service = GoddessService(0, uri='', token='', dbfile=str(tmp_path / 'recorded.json'), recorder=recorder)
+    messages = [json.dumps(TAKE_OVER), json.dumps(JOINED, indent=1), json.dumps(TEXT)]
+    asyncio.run(service._safe_handle(_Connection(messages), ''))
+    recorder.close()
+    return path
+
+
+def _replay(tmp_path, path, **kwargs):
+    service = GoddessService(0, uri='', token='', dbfile=str(tmp_path / 'replayed.json'))
+    return TrafficReplayer(path, speed=None, settle=0.1, **kwargs).replay(service)
+
+
+def test_capture_file_format(tmp_path, quiet):
+    path = _record(tmp_path)
+    with open(path) as f:
+        header, *lines = f.read().splitlines()
+    assert re.fullmatch(re.escape(MAGIC) + r' 1 \d+\.\d{6}', header)
+    fields = [line.split(' ', 3) for line in lines]
+    # the user list and command list after the take-over and the join, the message sent down
+    assert [direction for _, direction, _, _ in fields] == ['i', 'o', 'o', 'I', 'o', 'o', 'i', 'o']
+    assert {conn for _, _, conn, _ in fields} == {'0'}
+    times = [int(t) for t, _, _, _ in fields]
+    assert times == sorted(times)
+    assert json.loads(json.loads(fields[3][3])) == JOINED
+
+    records = list(read_capture(path))
+    assert [record.direction for record in records] == ['i', 'o', 'o', 'i', 'o', 'o', 'i', 'o']
+    assert json.loads(records[3].frame) == JOINED
+    assert json.loads(records[-1].frame)['code'] == codes.MESSAGE_FROM_CCS
+
+    # a capture appended to gets a section of its own, read after the first one
+    recorder = TrafficRecorder(path)
+    recorder.record('i', _Connection([]), json.dumps(TEXT))
+    recorder.close()
+    appended = list(read_capture(path))
+    assert len(appended) == len(records) + 1
+    assert appended[-1].conn == 1 and appended[-1].time >= records[-1].time
+
+
+def test_replay_matches_the_recording(tmp_path, quiet):
+    result = _replay(tmp_path, _record(tmp_path))
+    assert (result['inbound'], result['recorded'], result['replayed'], result['matched']) == (3, 5, 5, 5)
+    assert result['missing'] == [] and result['unexpected'] == []
+    assert result['replay_latency']['count'] == 5
+
+
+def test_replay_matches_frames_as_counted_json(tmp_path, quiet):
+    path = _record(tmp_path)
+    with open(path) as f:
+        header, *lines = f.read().splitlines()
+    outbound = [i for i, line in enumerate(lines) if line.split(' ', 2)[1] == 'o']
+    first, second, third = outbound[:3]
+    t, direction, conn, frame = lines[first].split(' ', 3)
+    # keys in another order are the same frame
+    lines[first] = ' '.join((t, direction, conn, json.dumps(dict(reversed(json.loads(frame).items())))))
+    t, direction, conn, frame = lines[second].split(' ', 3)
+    data = json.loads(frame)
+    data['extra']['stamp'] = 1
+    lines[second] = ' '.join((t, direction, conn, json.dumps(data)))
+    # recorded twice, replayed once
+    lines.insert(third, lines[third])
+    with open(path, 'w') as f:
+        f.write('\n'.join([header] + lines) + '\n')
+
+    result = _replay(tmp_path, path, ignore_keys=('stamp',))
+    assert (result['recorded'], result['replayed'], result['matched']) == (6, 5, 5)
+    assert len(result['missing']) == 1 and result['unexpected'] == []
+    result = _replay(tmp_path, path)
+    assert (result['recorded'], result['replayed'], result['matched']) == (6, 5, 4)
+    assert len(result['missing']) == 2 and len(result['unexpected']) == 1
+
+
+def test_replay_into_a_rel_service_keeps_its_timers(tmp_path, quiet, monkeypatch):
+    monkeypatch.chdir(tmp_path)    # the database file of the service
+    path = str(tmp_path / 'god.capture')
+    with open(path, 'w') as f:
+        f.write(f'{MAGIC} 1 0.000000\n')
+        f.write(f'0 i 0 {json.dumps(TAKE_OVER)}\n')
+        f.write(f'300000 i 0 {json.dumps(JOINED)}\n')
+    replayer = TrafficReplayer(path)
+    god = GodService()
+    answered = []
+    # between the two frames
+    rel.timeout(0.15, lambda: answered.append(len(replayer._outbound)))
+    result = replayer.replay(god)
+    # the user list and command list of the take-over, the join not fed yet
+    assert answered == [2]
+    assert result['inbound'] == 2 and result['replayed'] == 4
+    assert 0.3 <= result['replay_duration'] < 0.6
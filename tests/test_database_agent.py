@@ -0,0 +1,29 @@
+from ..ccs.database_agent import DatabaseAgent
+
+
+def test_init_resets_only_the_given_channel(tmp_path):
+    agent = DatabaseAgent(str(tmp_path / 'db.json'))
+    agent.init_user_id_list('CH0', ['a', 'b'])
+    agent.init_whistle('CH0')
+    agent.add_whistle_msg('CH0', 'm0', ['a'])
+    agent.init_user_id_list('CH1', ['c'])
+    agent.init_whistle('CH1')
+    agent.add_whistle_msg('CH1', 'm1', ['c'])
+
+    agent.init_user_id_list('CH0', ['b', 'd'])
+    agent.init_whistle('CH0')
+    assert agent.get_channel_user_list('CH0') == ['b', 'd']
+    assert agent.get_whistle_recipients('CH0', 'm0') == []
+    assert agent.get_channel_user_list('CH1') == ['c']
+    assert agent.get_whistle_recipients('CH1', 'm1') == ['c']
+
+    # and so for another agent reading the file
+    agent = DatabaseAgent(agent.path)
+    assert agent.get_channel_user_list('CH0') == ['b', 'd']
+    assert agent.get_channel_user_list('CH1') == ['c']
+
+
+def test_init_without_user_ids(tmp_path):
+    agent = DatabaseAgent(str(tmp_path / 'db.json'))
+    agent.init_user_id_list('CH0', None)
+    assert agent.get_channel_user_list('CH0') == []
@@ -0,0 +1,46 @@
+import json
+
+from .. import codes
+from ..envelope import LazyFrame, decode, peek
+
+
+def _frame(code, **extra):
+    return json.dumps({'code': code, 'extra': extra})
+
+
+def test_peek_as_dumped():
+    message = _frame(codes.COMMAND_TO_CCS, type_code=codes.NOTICE_USER_JOINED, user_id='u1', channel_id='CH0')
+    assert peek(message) == (codes.COMMAND_TO_CCS, codes.NOTICE_USER_JOINED)
+    assert peek(message.encode()) == (codes.COMMAND_TO_CCS, codes.NOTICE_USER_JOINED)
+    assert peek(_frame(codes.MESSAGE_DOWN_TEXT, channel_id='CH0')) == (codes.MESSAGE_DOWN_TEXT, None)
+
+
+def test_peek_with_spacing():
+    message = ' { "code" : %d , "extra" : { "type_code" : %d , "user_id": "u1"}}' % (
+        codes.COMMAND_TO_CCS, codes.NOTICE_USER_JOINED)
+    assert peek(message) == (codes.COMMAND_TO_CCS, codes.NOTICE_USER_JOINED)
+
+
+def test_nested_type_code_is_not_taken():
+    # type_code of a dict in msg_body, the frame's own type_code coming later
+    message = json.dumps({'code': codes.MESSAGE_TO_CCS, 'extra': {
+        'msg_body': {'type_code': codes.NOTICE_USER_LEFT}, 'type_code': codes.MESSAGE_UP_TEXT}})
+    assert peek(message) == (None, None)
+    data = decode(message, lambda code, type_code: False)
+    assert type(data) is dict
+    assert data['extra']['type_code'] == codes.MESSAGE_UP_TEXT
+
+
+def test_type_code_must_be_an_integer():
+    message = '{"code": %d, "extra": {"type_code": 10.5}}' % codes.COMMAND_TO_CCS
+    assert peek(message) == (None, None)
+
+
+def test_lazy_frame_parses_on_read():
+    message = _frame(codes.COMMAND_TO_CCS, type_code=codes.NOTICE_USER_JOINED, user_id='u1')
+    data = decode(message)
+    assert isinstance(data, LazyFrame)
+    assert data['code'] == codes.COMMAND_TO_CCS and not data._loaded
+    assert data['extra']['user_id'] == 'u1'
+    assert data == json.loads(message)
+    assert decode(message, lambda code, type_code: type_code != codes.NOTICE_USER_JOINED) is None
@@ -0,0 +1,46 @@
+import json
+
+from .. import codes
+from ..frames import MessageDownText, Frame, decode_frame, typed
+from .conftest import UnconnectedBot
+
+
+def _channel_list():
+    return json.dumps({'code': codes.STATUS_INFO_USER_CHANNEL_LIST, 'extra': {'channel_ids': ['CH0']}})
+
+
+class _Bot(UnconnectedBot):
+    def on_receive_status(self, data):
+        self.received = data
+
+
+class _TypedBot(UnconnectedBot):
+    @typed
+    def on_receive_status(self, data):
+        self.received = data
+
+
+def test_handlers_get_dicts_by_default(quiet):
+    bot = _Bot('bot', 'password', ping_interval=0)
+    bot.on_message(bot.ws, _channel_list())
+    bot.close()
+    assert type(bot.received) is dict
+    assert bot.received['extra']['channel_ids'] == ['CH0']
+
+
+def test_typed_handlers_get_frames(quiet):
+    bot = _TypedBot('bot', 'password', ping_interval=0)
+    bot.on_message(bot.ws, _channel_list())
+    bot.close()
+    assert isinstance(bot.received, Frame)
+    assert bot.received.channel_ids == ['CH0']
+
+
+def test_encode_matches_the_dict():
+    frame = MessageDownText(code=codes.MESSAGE_FROM_CCS, channel_id='CH0', from_user_id='u1', to_user_ids=['u2'],
+                            msg_body='hi', origin='Bot', temp_msg_id=3, custom={'k': 1})
+    assert json.loads(frame.encode()) == frame.to_dict()
+    assert frame.to_dict()['extra'] == {
+        'type_code': codes.MESSAGE_DOWN_TEXT, 'channel_id': 'CH0', 'from_user_id': 'u1', 'to_user_ids': ['u2'],
+        'msg_body': 'hi', 'origin': 'Bot', 'temp_msg_id': 3, 'custom': {'k': 1}}
+    assert decode_frame(frame.encode()) == frame
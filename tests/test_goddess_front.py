@@ -0,0 +1,142 @@
+import asyncio
+import json
+import socket
+
+import websockets
+
+from .. import codes
+from ..ccs import GoddessService
+from ..ccs.goddess_front import GoddessFront
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+class _Worker(GoddessService):
+    # channels this node holds, from the take-overs and releases it got
+    def __init__(self, port, dbfile):
+        super().__init__(port, uri='', token='', dbfile=dbfile)
+        self.uri = f'ws://localhost:{port}'
+        self.held = {}      # channel_id -> members at the take-over
+
+    async def _handle_command_to_ccs(self, data, ws, path):
+        extra = data['extra']
+        if extra['type_code'] == codes.NOTICE_TAKE_OVER:
+            self.held[extra['target_channel_id']] = extra['target_user_ids']
+        elif extra['type_code'] == codes.NOTICE_RELEASE:
+            self.held.pop(extra['target_channel_id'], None)
+        await super()._handle_command_to_ccs(data, ws, path)
+
+
+async def _until(condition, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+async def _read(ws):
+    async for message in ws:
+        pass
+
+
+def _holders(workers, channel_id):
+    return [worker.uri for worker in workers if channel_id in worker.held]
+
+
+def _one_owner_each(front, workers, channel_ids):
+    # every channel held by exactly one node, the one the ring gives
+    return all(_holders(workers, channel_id) == [front.ring.node_for(channel_id)] for channel_id in channel_ids)
+
+
+def test_channels_have_one_owner_and_move_with_workers(tmp_path, quiet):
+    channel_ids = [f'CH{c:02}' for c in range(40)]
+
+    async def run():
+        workers = []
+        for i in range(3):
+            worker = _Worker(_free_port(), str(tmp_path / f'goddess{i}.json'))
+            await worker.get_server_coroutine()
+            workers.append(worker)
+        first, second, third = workers
+        front = GoddessFront(port=_free_port(), workers=[first.uri, second.uri], ping_interval=None)
+        await front.get_server_coroutine()
+        social = await websockets.connect(f'ws://localhost:{front.port}', ping_interval=None)
+        # frames of the workers come back, read so that the front is never blocked sending them
+        reading = asyncio.ensure_future(_read(social))
+
+        async def send(**extra):
+            await social.send(json.dumps({'code': codes.COMMAND_TO_CCS, 'extra': extra}))
+
+        for channel_id in channel_ids:
+            await send(type_code=codes.NOTICE_TAKE_OVER, target_channel_id=channel_id, target_user_ids=['a', 'b'],
+                       target_channel_name=channel_id, target_channel_timestamp=0)
+        await _until(lambda: _one_owner_each(front, workers, channel_ids))
+        assert not third.held
+        assert first.held and second.held
+        for channel_id in channel_ids:
+            await send(type_code=codes.NOTICE_USER_JOINED, channel_id=channel_id, user_id='c')
+        await _until(lambda: all(front.channels[channel_id]['members'] == ['a', 'b', 'c']
+                                 for channel_id in channel_ids))
+
+        await front.add_worker(third.uri)
+        await _until(lambda: _one_owner_each(front, workers, channel_ids))
+        moved = [channel_id for channel_id in channel_ids if channel_id in third.held]
+        assert moved
+        assert front.stats['channels_moved'] == len(moved)
+        # the members that joined meanwhile go along
+        assert all(third.held[channel_id] == ['a', 'b', 'c'] for channel_id in moved)
+
+        await front.remove_worker(first.uri)
+        await _until(lambda: _one_owner_each(front, workers, channel_ids))
+        assert not first.held
+        assert all(front.channels[channel_id]['owner'] in (second.uri, third.uri) for channel_id in channel_ids)
+
+        await social.close()
+        await reading
+
+    asyncio.run(run())
+
+
+def test_tasks_end_with_their_connections(tmp_path, quiet):
+    async def run():
+        worker = _Worker(_free_port(), str(tmp_path / 'goddess.json'))
+        await worker.get_server_coroutine()
+        front = GoddessFront(port=_free_port(), workers=[worker.uri], ping_interval=None)
+        await front.get_server_coroutine()
+        socials, readings = [], []
+        for i in range(2):
+            social = await websockets.connect(f'ws://localhost:{front.port}', ping_interval=None)
+            readings.append(asyncio.ensure_future(_read(social)))
+            await social.send(json.dumps({'code': codes.COMMAND_TO_CCS, 'extra': {
+                'type_code': codes.NOTICE_USER_JOINED, 'channel_id': f'CH{i}', 'user_id': 'a'}}))
+            socials.append(social)
+        await _until(lambda: len(front._pumps) == 2)
+        first, second = front._pumps.values()
+
+        # the pump of each link to a worker ends with its Social connection
+        await socials[0].close()
+        await _until(first.done)
+        assert first.cancelled() and list(front._pumps.values()) == [second]
+        assert worker.uri in front.ring
+
+        # a node that can't be reached is probed until the front stops
+        gone = f'ws://localhost:{_free_port()}'
+        await front.add_worker(gone)
+        channel_id = next(f'CH{c}' for c in range(100) if front.ring.node_for(f'CH{c}') == gone)
+        await socials[1].send(json.dumps({'code': codes.COMMAND_TO_CCS, 'extra': {
+            'type_code': codes.NOTICE_USER_JOINED, 'channel_id': channel_id, 'user_id': 'a'}}))
+        await _until(lambda: gone in front._watches)
+        watch = front._watches[gone]
+        await front.stop()
+        await _until(lambda: watch.done() and second.done())
+        assert watch.cancelled() and second.cancelled()
+        assert not front._pumps and not front._watches
+
+        await socials[1].close()
+        await asyncio.gather(*readings)
+
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import threading
+
+from .. import codes
+from ..ccs import GoddessService
+from ..media import MediaStore
+
+
+class _Connection:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, data):
+        self.frames.append(json.loads(data))
+
+
+class _ThreadRecordingStore(MediaStore):
+    # threads that hashed and wrote media
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = []
+
+    def key(self, data):
+        self.threads.append(threading.get_ident())
+        return super().key(data)
+
+    def _write(self, media_hash, data):
+        self.threads.append(threading.get_ident())
+        super()._write(media_hash, data)
+
+
+def test_put_async_off_the_loop(tmp_path):
+    store = _ThreadRecordingStore(str(tmp_path / 'media'))
+    data = os.urandom(1000)
+
+    async def run():
+        return await asyncio.gather(*[store.put_async(data) for _ in range(3)])
+
+    hashes = asyncio.run(run())
+    assert len(set(hashes)) == 1
+    assert threading.get_ident() not in store.threads
+    assert len(store) == 1 and store.size == 1000
+    assert store.get(hashes[0]) == data
+    assert not [name for name in os.listdir(os.path.dirname(store.path(hashes[0]))) if name.endswith('.tmp')]
+
+
+def _service(tmp_path, media_dir=None):
+    path = str(tmp_path / 'goddess.json')
+    with open(path, 'w') as f:
+        json.dump({'user_list': {'CH0': ['a', 'b']}, 'whistle': {}}, f)
+    return GoddessService(0, uri='', token='', dbfile=path, media_dir=media_dir)
+
+
+def test_no_media_kept_by_default(tmp_path, quiet):
+    service = _service(tmp_path)
+    assert service.media is None
+    ws = _Connection()
+    image = os.urandom(100)
+    upload = {'code': codes.MESSAGE_TO_CCS, 'extra': {
+        'type_code': codes.MESSAGE_UP_IMAGE, 'channel_id': 'CH0', 'from_user_id': 'a', 'to_user_ids': ['b'],
+        'msg_id': 'temp_0', 'msg_body': 'aW1hZ2U=', 'origin': 'user'}}
+
+    async def run():
+        await service.broadcast_command_image('CH0', ws, image)
+        await service.broadcast_command_image('CH0', ws, image)
+        await service._handle_data_dict_core(upload, ws, '')
+
+    asyncio.run(run())
+    first, second, message = [frame['extra'] for frame in ws.frames]
+    # inline every time, nothing written next to the dbfile
+    assert first['args'] == second['args']
+    assert first['args']['image'] and first['to_user_ids'] == ['a', 'b']
+    assert 'media_hash' not in message
+    assert os.listdir(tmp_path) == ['goddess.json']
+
+
+def test_media_by_hash_with_a_directory(tmp_path, quiet):
+    service = _service(tmp_path, media_dir=str(tmp_path / 'media'))
+    ws = _Connection()
+    image = os.urandom(100)
+
+    async def run():
+        await service.broadcast_command_image('CH0', ws, image)
+        await service.broadcast_command_image('CH0', ws, image)
+
+    asyncio.run(run())
+    first, second = [frame['extra']['args'] for frame in ws.frames]
+    assert first['image'] and first['media_hash'] == second['media_hash']
+    assert 'image' not in second
+    assert service.media.get(first['media_hash']) == image
@@ -0,0 +1,34 @@
+import pytest
+
+from .. import codes
+
+
+@pytest.fixture
+def bot(make_bot):
+    return make_bot()
+
+
+def test_single_fetch_by_default(bot):
+    bot.fetch_offline_message()
+    frame, = bot.ws.frames
+    assert frame['code'] == codes.OPERATION_FETCH_OFFLINE_MESSAGES
+    assert 'limit' not in frame['extra']
+    assert 'cursor' not in frame['extra']
+
+
+def test_pages_when_asked(bot):
+    received = []
+    done = []
+    bot.on_receive_message = received.append
+    bot.on_offline_messages_done = lambda: done.append(True)
+    bot.fetch_offline_message(page_size=2)
+    assert bot.ws.frames[-1]['extra']['limit'] == 2
+    message = {'code': codes.MESSAGE_DOWN_TEXT, 'extra': {
+        'msg_id': 'm0', 'channel_id': 'CH0', 'from_user_id': 'user0', 'to_user_ids': ['bot'],
+        'msg_body': 'hello', 'origin': 'user', 'timestamp': 0}}
+    bot._on_offline_messages({'code': codes.STATUS_INFO_OFFLINE_MESSAGES,
+                              'extra': {'messages': [message, message], 'cursor': 'c2'}})
+    assert len(received) == 2
+    assert bot.ws.frames[-1]['extra'] == {'user_id': 'bot', 'cursor': 'c2', 'limit': 2}
+    bot._on_offline_messages({'code': codes.STATUS_INFO_OFFLINE_MESSAGES, 'extra': {'messages': [], 'cursor': 'c2'}})
+    assert done == [True]
@@ -0,0 +1,184 @@
+import asyncio
+import http
+import json
+import socket
+import threading
+import time
+import types
+
+import rel
+import websockets
+
+from .. import codes
+from ..bot import BaseBot, Message, MessageType
+from ..bot.send_scheduler import SendScheduler
+from ..ccs.god_service import GodService
+from ..reconnect import ReconnectPolicy
+
+
+class _DroppingServer:
+    """
+    Stand-in Social dropping the first connection once it got the login,
+    then refusing `refusals` handshakes, then keeping the connection and
+    answering frames by code with `replies`.
+    """
+
+    def __init__(self, refusals, expected_frames, replies=None):
+        self.refusals = refusals
+        self.expected_frames = expected_frames
+        self.replies = replies or {}
+        self.attempts = []      # monotonic time of each handshake
+        self.sessions = []      # frames received, one list per accepted connection
+        self.done = threading.Event()
+        with socket.socket() as s:
+            s.bind(('localhost', 0))
+            self.port = s.getsockname()[1]
+        self.uri = f'ws://localhost:{self.port}'
+        self._ready = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+        assert self._ready.wait(5)
+
+    async def _process_request(self, path, headers):
+        self.attempts.append(time.monotonic())
+        if 1 < len(self.attempts) <= 1 + self.refusals:
+            return http.HTTPStatus.SERVICE_UNAVAILABLE, [], b'restarting\n'
+
+    async def _handle(self, ws, path):
+        frames = []
+        self.sessions.append(frames)
+        async for message in ws:
+            frame = json.loads(message)
+            frames.append(frame)
+            if len(self.sessions) == 1:
+                await ws.close()
+                return
+            for code, extra in self.replies.get(frame['code'], ()):
+                await ws.send(json.dumps({'code': code, 'extra': extra}))
+            if sum(map(len, self.sessions[1:])) >= self.expected_frames:
+                self.done.set()
+
+    def _serve(self):
+        loop = asyncio.new_event_loop()
+
+        async def start():
+            await websockets.serve(self._handle, 'localhost', self.port, process_request=self._process_request)
+            self._ready.set()
+
+        loop.run_until_complete(start())
+        loop.run_forever()
+
+
+def _dispatch_until(server, timeout=10):
+    def check():
+        if server.done.is_set() or time.monotonic() > deadline:
+            rel.abort()
+            return False
+        return True
+
+    deadline = time.monotonic() + timeout
+    rel.timeout(0.05, check)
+    rel.dispatch()
+
+
+def _gaps(server):
+    return [later - earlier for earlier, later in zip(server.attempts, server.attempts[1:])]
+
+
+class _Bot(BaseBot):
+    def on_close(self, ws, close_status_code, close_msg):
+        # sent while disconnected: queued until a connection is back
+        if not self.sent_while_down:
+            self.sent_while_down = [Message(MessageType.TEXT, f'message {i}', 'CH0', ['user0'], 'bot')
+                                    for i in range(3)]
+            for message in self.sent_while_down:
+                self.send_message(message)
+
+
+def test_reconnects_with_backoff_and_replays_frames(quiet):
+    base = 0.2
+    server = _DroppingServer(refusals=2, expected_frames=8, replies={
+        codes.OPERATION_LOGIN: [(codes.STATUS_INFO_LOGIN_SUCCESS, {})],
+        codes.OPERATION_GET_USER_CHANNEL_LIST: [(codes.STATUS_INFO_USER_CHANNEL_LIST, {'channel_ids': ['CH0', 'CH1']})],
+    })
+    bot = _Bot('bot', 'password', path=server.uri, ping_interval=0,
+               reconnect_policy=ReconnectPolicy(base=base, factor=2, jitter=0))
+    bot.sent_while_down = []
+
+    bot.login()
+    _dispatch_until(server)
+    bot.close()
+
+    assert server.done.is_set()
+    # first connection, two refused handshakes, then the one kept
+    assert len(server.attempts) == 4
+    assert bot.stats['reconnects'] == 3
+    for gap, expected in zip(_gaps(server), (base, base * 2, base * 4)):
+        assert expected * 0.9 <= gap <= expected + 0.3
+    assert server.sessions[0][0]['code'] == codes.OPERATION_LOGIN
+    # the login again, then every frame queued while down, once and in order
+    replayed = server.sessions[1]
+    assert replayed[0]['code'] == codes.OPERATION_LOGIN
+    assert [frame['extra']['msg_body'] for frame in replayed[1:4]] == ['message 0', 'message 1', 'message 2']
+    assert len({frame['extra']['temp_msg_id'] for frame in replayed[1:4]}) == 3
+    # the login answered, a resync: channel list and offline messages, then the user list of each channel
+    assert [frame['code'] for frame in replayed[4:6]] == [codes.OPERATION_GET_USER_CHANNEL_LIST,
+                                                          codes.OPERATION_FETCH_OFFLINE_MESSAGES]
+    assert [(frame['code'], frame['extra']['channel_id']) for frame in replayed[6:]] == [
+        (codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST, 'CH0'), (codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST, 'CH1')]
+    assert bot.channel_list == ['CH0', 'CH1']
+
+
+class _God(GodService):
+    def on_close(self, ws, close_status_code, close_msg):
+        # sent while disconnected: kept in unsent until the connection is back
+        if not self.sent_while_down:
+            self.sent_while_down = True
+            self._send_command_down(ws, codes.COMMAND_DOWN_DISPLAY_TEXT, channel_id='CH0', text='while down')
+
+
+def test_god_service_reconnects_and_replays_unsent(quiet, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)    # the database file of the service
+    base = 0.1
+    server = _DroppingServer(refusals=1, expected_frames=2)
+    god = _God()
+    god.set_account('god', 'password')
+    god.ping_interval = 0
+    god.reconnect_policy = ReconnectPolicy(base=base, factor=2, jitter=0)
+    god.sent_while_down = False
+
+    ws = god.create_connection(server.uri)
+    _dispatch_until(server)
+    god.close_connection(ws)
+
+    assert server.done.is_set()
+    assert len(server.attempts) == 3
+    assert god.stats['reconnects'] == 2
+    for gap, expected in zip(_gaps(server), (base, base * 2)):
+        assert expected * 0.9 <= gap <= expected + 0.3
+    assert server.sessions[0][0]['code'] == codes.COPERATION_GOD_RECONNECT
+    # the God logs in again, then the frame that failed while down is replayed
+    reconnect, replayed = server.sessions[1]
+    assert reconnect == {'code': codes.COPERATION_GOD_RECONNECT, 'extra': {'user_id': 'god', 'password': 'password'}}
+    assert replayed['code'] == codes.COMMAND_FROM_CCS
+    assert replayed['extra'] == {'type_code': codes.COMMAND_DOWN_DISPLAY_TEXT, 'channel_id': 'CH0', 'text': 'while down'}
+    assert not god.unsent
+
+
+def test_close_deletes_every_timer(make_bot):
+    bot = make_bot(roster_page_size=200, send_scheduler=SendScheduler(channel_rate=1, channel_burst=1))
+    bot.ping_interval = 20
+    bot.ws.sock = types.SimpleNamespace(ping=lambda payload: None)
+    bot._start_heartbeat()
+    bot._heartbeat()
+    for i in range(2):
+        bot.send_message(Message(MessageType.TEXT, f'message {i}', 'CH0', ['user0'], 'bot'))
+    bot._watch_transfers()
+    bot.on_receive_status({'code': codes.STATUS_INFO_USER_CHANNEL_LIST, 'extra': {'channel_ids': ['CH0']}})
+    bot._schedule_reconnect()
+    names = ('_heartbeat_timer', '_stall_timer', '_drain_timer', '_transfer_timer', '_roster_timer', '_reconnect_timer')
+    timers = [getattr(bot, name) for name in names]
+    assert all(timer is not None and timer.pending() for timer in timers)
+
+    bot.close()
+    assert [getattr(bot, name) for name in names] == [None] * len(names)
+    assert not any(timer.pending() for timer in timers)
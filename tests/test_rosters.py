@@ -0,0 +1,60 @@
+import rel
+
+from .. import codes
+
+
+def _sent_codes(bot):
+    return [frame['code'] for frame in bot.ws.frames]
+
+
+def _channel_list(bot, channel_ids):
+    bot.on_receive_status({'code': codes.STATUS_INFO_USER_CHANNEL_LIST, 'extra': {'channel_ids': channel_ids}})
+
+
+def test_one_channel_at_a_time_by_default(make_bot):
+    bot = make_bot()
+    _channel_list(bot, ['CH0', 'CH1'])
+    assert _sent_codes(bot) == [codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST] * 2
+    assert bot._roster_timer is None
+
+
+def test_bulk_falls_back_on_timeout(make_bot):
+    bot = make_bot(roster_page_size=200, roster_timeout=0.05)
+    _channel_list(bot, ['CH0', 'CH1'])
+    assert _sent_codes(bot) == [codes.OPERATION_GET_CHANNEL_USER_LISTS]
+    assert bot._roster_timer is not None
+    rel.timeout(0.2, rel.abort)
+    rel.dispatch()
+    assert bot._roster_timer is None
+    assert _sent_codes(bot)[1:] == [codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST] * 2
+    assert not bot._bulk_rosters
+
+
+def test_bulk_falls_back_only_on_its_own_unsupported(make_bot):
+    bot = make_bot(roster_page_size=200)
+    _channel_list(bot, ['CH0', 'CH1'])
+    unsupported = {'code': codes.STATUS_ERROR_UNSUPPORTED_CODE, 'extra': {}}
+    unsupported['extra']['type_code'] = codes.OPERATION_FETCH_OFFLINE_MESSAGES
+    bot.on_receive_status(unsupported)
+    assert bot._bulk_rosters
+    unsupported['extra']['type_code'] = codes.OPERATION_GET_CHANNEL_USER_LISTS
+    bot.on_receive_status(unsupported)
+    assert not bot._bulk_rosters
+    assert bot._roster_timer is None
+    assert _sent_codes(bot)[1:] == [codes.COMMAND_UP_FETCH_CHANNEL_USER_LIST] * 2
+
+
+def test_bulk_pages(make_bot):
+    bot = make_bot(roster_page_size=1)
+    ready = []
+    bot.on_user_lists_ready = lambda: ready.append(True)
+    _channel_list(bot, ['CH0', 'CH1'])
+    page = {'code': codes.STATUS_INFO_CHANNEL_USER_LISTS, 'extra': {'user_lists': {'CH0': ['bot']}, 'cursor': 1}}
+    bot._update_user_lists_page(page)
+    assert _sent_codes(bot) == [codes.OPERATION_GET_CHANNEL_USER_LISTS] * 2
+    assert bot.ws.frames[1]['extra']['cursor'] == 1
+    page = {'code': codes.STATUS_INFO_CHANNEL_USER_LISTS, 'extra': {'user_lists': {'CH1': ['bot', 'user0']}}}
+    bot._update_user_lists_page(page)
+    assert ready == [True]
+    assert bot.user_lists == {'CH0': ['bot'], 'CH1': ['bot', 'user0']}
+    assert bot._roster_timer is None
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from .. import codes
+from ..router import CatchErrors, Router
+
+
+def _returning(value):
+    return lambda *args: value
+
+
+def test_exact_beats_range_beats_family():
+    router = Router()
+    router.add_family(4, _returning('family'))
+    router.add_range(40000, 40099, _returning('wide'))
+    router.add_range(40000, 40009, _returning('narrow'))
+    router.add(40001, _returning('exact'))
+    assert router.dispatch(40001) == 'exact'
+    assert router.dispatch(40002) == 'narrow'
+    assert router.dispatch(40050) == 'wide'
+    assert router.dispatch(49999) == 'family'
+    assert router.dispatch(50000) is None
+
+
+def test_last_registered_wins_among_equals():
+    router = Router()
+    router.add_range(20000, 20009, _returning('first'))
+    router.add_range(20000, 20009, _returning('second'))
+    router.add_family(2, _returning('first family'))
+    router.add_family(2, _returning('second family'))
+    assert router.dispatch(20005) == 'second'
+    assert router.dispatch(21000) == 'second family'
+
+
+def test_range_over_several_families():
+    router = Router()
+    router.add_range(15000, 34999, _returning('range'))
+    router.add_family(2, _returning('family'))
+    assert router.dispatch(14999) is None
+    assert router.dispatch(15000) == 'range'
+    assert router.dispatch(19999) == 'range'
+    # the family is narrower than the range
+    assert router.dispatch(25000) == 'family'
+    assert router.dispatch(34999) == 'range'
+    assert router.dispatch(35000) is None
+
+
+def test_fallback_and_contains():
+    router = Router(fallback=_returning('fallback'))
+    router.add(20001, _returning('exact'))
+    router.add_range(90000, 90010, _returning('range'))
+    assert router.dispatch(12345) == 'fallback'
+    assert 20001 in router
+    assert 90010 in router
+    assert 90011 not in router
+    assert router.resolve(90011)() == 'fallback'
+
+
+def test_changes_recompile():
+    router = Router()
+    handler = _returning('range')
+    router.add_range(60000, 60099, handler)
+    assert router.dispatch(60001) == 'range'
+    router.add(60001, _returning('exact'))
+    assert router.dispatch(60001) == 'exact'
+    router.remove(60001)
+    assert router.dispatch(60001) == 'range'
+
+
+def test_tables_hold_one_entry_per_route():
+    router = Router()
+    for family in range(10):
+        router.add_family(family, _returning(family))
+    router.add_range(20000, 29998, _returning('range'))
+    router.add(20001, _returning('exact'))
+    router.compile()
+    assert len(router._table) == 1
+    assert len(router._families) == 10
+
+
+def test_middlewares_get_the_code():
+    router = Router()
+    seen = []
+    router.add_family(5, lambda data: seen.append(data))
+    router.use(lambda handler: lambda code, *args: handler(code, *args) or seen.append(code))
+    router.dispatch(50001, 'data')
+    assert seen == ['data', 50001]
+
+
+def test_catch_errors():
+    router = Router()
+
+    def fail(data):
+        raise ValueError(data)
+
+    router.add_range(40000, 40009, fail)
+    errors = CatchErrors()
+    router.use(errors)
+    router.dispatch(40001, 'data')
+    assert errors.errors == {40001: 1}
+    router.unuse(errors)
+    with pytest.raises(ValueError):
+        router.dispatch(40001, 'data')
+
+
+def test_bot_calls_callbacks_assigned_to_the_instance(make_bot):
+    bot = make_bot()
+    received = []
+    bot.on_receive_command = lambda data: received.append(('command', data['code']))
+    bot.on_receive_status = lambda data: received.append(('status', data['code']))
+    bot.on_receive_other = lambda data: received.append(('other', data['code']))
+    for code in (codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST, codes.STATUS_INFO_LOGOUT_SUCCESS, 90000):
+        bot.on_message(bot.ws, json.dumps({'code': code, 'extra': {'channel_id': 'CH0', 'user_ids': []}}))
+    assert received == [('command', codes.COMMAND_DOWN_UPDATE_CHANNEL_USER_LIST),
+                        ('status', codes.STATUS_INFO_LOGOUT_SUCCESS), ('other', 90000)]
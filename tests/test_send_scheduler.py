@@ -0,0 +1,84 @@
+from .. import codes
+from ..bot import BaseBot
+from ..bot.send_scheduler import SendScheduler
+from .conftest import FakeSocket
+
+
+def _message(channel_id):
+    return {'code': codes.MESSAGE_UP_TEXT, 'extra': {'channel_id': channel_id, 'msg_body': 'hi'}}
+
+
+def _drain(scheduler):
+    sent = []
+    wait = scheduler.drain(lambda ws, data: sent.append(data))
+    return sent, wait
+
+
+def test_no_limits_by_default():
+    scheduler = SendScheduler()
+    for i in range(1000):
+        scheduler.submit(None, _message('CH0'))
+    sent, wait = _drain(scheduler)
+    assert len(sent) == 1000 and wait is None
+    assert scheduler.bucket is None and not scheduler.channel_buckets
+
+
+def test_limits_when_given():
+    scheduler = SendScheduler(rate=1000, channel_rate=5)
+    for i in range(20):
+        scheduler.submit(None, _message('CH0'))
+    scheduler.submit(None, {'code': codes.OPERATION_JOIN_CHANNEL, 'extra': {'channel_id': 'CH1'}})
+    sent, wait = _drain(scheduler)
+    assert sent[0]['code'] == codes.OPERATION_JOIN_CHANNEL
+    # the burst of a channel, twice its rate
+    assert len(sent) == 1 + 10
+    assert 0 < wait <= 0.2
+
+
+def test_idle_channel_buckets_are_pruned():
+    scheduler = SendScheduler(channel_rate=10 ** 9)
+    for i in range(10 * SendScheduler.PRUNE_AT):
+        scheduler.submit(None, _message(f'CH{i}'))
+        _drain(scheduler)
+    assert len(scheduler.channel_buckets) <= SendScheduler.PRUNE_AT
+    assert scheduler.counters['sent'] == 10 * SendScheduler.PRUNE_AT
+
+
+def test_bot_keeps_the_given_scheduler(make_bot):
+    # an empty scheduler has no length
+    scheduler = SendScheduler(channel_rate=1, channel_burst=1)
+    bot = make_bot(send_scheduler=scheduler)
+    assert bot.send_scheduler is scheduler
+    for i in range(2):
+        bot._send_data_to_ws(bot.ws, codes.MESSAGE_UP_TEXT, **_message('CH0')['extra'])
+    assert len(bot.ws.frames) == 1 and len(scheduler) == 1
+    assert bot._drain_timer is not None
+
+
+class _Bot(BaseBot):
+    # a connection opened and closed by the test
+    def _create_websocket(self, uri, on_open=None, on_message=None, on_error=None, on_close=None):
+        ws = FakeSocket()
+        ws.on_open, ws.on_close = on_open, on_close
+        return ws
+
+    def _run_websocket(self):
+        pass
+
+
+def test_on_open_frames_leave_before_the_backlog(quiet):
+    bot = _Bot('bot', 'password', ping_interval=0)
+    try:
+        ws = bot.ws
+        bot.start()
+        assert ws.frames == []
+        ws.on_open(ws)
+        # the login of on_open, the one of start being dropped
+        assert [frame['code'] for frame in ws.frames] == [codes.OPERATION_LOGIN, codes.OPERATION_GET_USER_CHANNEL_LIST]
+        ws.on_close(ws, None, None)
+        bot.join_channel('CH1')
+        ws.frames.clear()
+        ws.on_open(ws)
+        assert [frame['code'] for frame in ws.frames] == [codes.OPERATION_LOGIN, codes.OPERATION_JOIN_CHANNEL]
+    finally:
+        bot.close()
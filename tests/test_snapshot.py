@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+
+from .. import codes
+from ..ccs import GoddessService
+from ..ccs import snapshot
+
+
+ROSTERS = {'CH0': ['a', 'b'], 'CH1': ['c'], 'CH2': ['d']}
+
+
+class _Connection:
+    async def send(self, data):
+        pass
+
+
+def _service(tmp_path):
+    return GoddessService(0, uri='', token='', dbfile=str(tmp_path / 'goddess.json'))
+
+
+def _saved(tmp_path):
+    # a service with rosters, a feature and a message waiting for its ack, snapshotted
+    service = _service(tmp_path)
+    for channel_id, user_ids in ROSTERS.items():
+        service.agent.init_user_id_list(channel_id, user_ids)
+    service.add_feature('echo', 90001, 'text')
+    service.temp_msg_map[('CH0', 'temp0')] = ['b']
+    path = str(tmp_path / 'goddess.snap')
+    service.save_snapshot(path)
+    return service, path
+
+
+def _notice(type_code, **extra):
+    return {'code': codes.COMMAND_TO_CCS, 'extra': dict(extra, type_code=type_code)}
+
+
+def test_primed_and_reconciled(tmp_path, quiet):
+    _, path = _saved(tmp_path)
+    service = _service(tmp_path)
+    warm_start = service.load_snapshot(path)
+    assert warm_start['database'] == 'primed'
+    assert (warm_start['channels'], warm_start['features'], warm_start['pending']) == (3, 1, 1)
+    assert service.agent.get_channel_user_list('CH0') == ['a', 'b']
+    assert [command['code'] for command in service.feature_commands] == [90001]
+    assert service.temp_msg_map == {('CH0', 'temp0'): ['b']}
+    assert warm_start['reconcile'] == {'stale': 3, 'confirmed': 0, 'changed': 0, 'released': 0}
+
+    ws = _Connection()
+
+    async def run():
+        await service._handle_data_dict_core(_notice(
+            codes.NOTICE_TAKE_OVER, target_channel_id='CH0', target_user_ids=['b', 'a'], target_channel_name='CH0',
+            target_channel_timestamp=0), ws, '')
+        await service._handle_data_dict_core(_notice(
+            codes.NOTICE_GET_CHANNEL_USER_LIST, channel_id='CH1', user_ids=['c', 'e']), ws, '')
+        await service._handle_data_dict_core(_notice(
+            codes.NOTICE_RELEASE, target_channel_id='CH2', target_user_ids=['d']), ws, '')
+
+    asyncio.run(run())
+    assert warm_start['reconcile'] == {'stale': 0, 'confirmed': 1, 'changed': 1, 'released': 1}
+    assert service.agent.get_channel_user_list('CH1') == ['c', 'e']
+    # nothing stale is left to follow
+    assert not service.router.middlewares
+
+
+def test_written_when_the_file_is_gone(tmp_path, quiet):
+    original, path = _saved(tmp_path)
+    os.remove(original.agent.path)
+    service = _service(tmp_path)
+    assert service.load_snapshot(path)['database'] == 'written'
+    with open(service.agent.path) as f:
+        assert json.load(f)['user_list'] == ROSTERS
+
+
+def test_file_newer_wins(tmp_path, quiet):
+    original, path = _saved(tmp_path)
+    original.agent.join_channel('CH0', 'e')
+    service = _service(tmp_path)
+    assert service.load_snapshot(path)['database'] == 'file newer'
+    assert service.agent.get_channel_user_list('CH0') == ['a', 'b', 'e']
+
+
+def test_sections_decode_when_copied(tmp_path, quiet):
+    _, path = _saved(tmp_path)
+
+    def section():
+        return snapshot.read_snapshot(path)['database']['data']['user_list']
+
+    assert repr(section()) == 'LazySection(3 keys)'
+    merged = {}
+    merged.update(section())
+    for copied in (dict(section()), {**section()}, section() | {}, {} | section(), section().copy(), merged):
+        assert copied == ROSTERS and type(copied) is dict
+    assert section().popitem() == ('CH2', ['d'])
+    assert json.loads(json.dumps(section())) == ROSTERS
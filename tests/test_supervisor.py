@@ -0,0 +1,65 @@
+import os
+import signal
+import time
+
+import rel
+
+from ..bot.supervisor import BotSupervisor
+from .conftest import UnconnectedBot
+
+
+class _CrashingBot:
+    # takes its worker down as soon as it starts
+    def __init__(self, user_id, password, path=None):
+        self.user_id = user_id
+
+    def start(self):
+        os._exit(3)
+
+
+class _IdleBot:
+    def __init__(self, user_id, password, path=None):
+        self.user_id = user_id
+
+    def start(self):
+        pass
+
+    def get_stats(self):
+        return {'frames_sent': 1}
+
+    def close(self):
+        pass
+
+
+def test_crashing_worker_backs_off_and_is_given_up(quiet):
+    supervisor = BotSupervisor([('bot', 'password', _CrashingBot)], n_workers=1, restart_delay=0.1, max_restarts=3)
+    supervisor.POLL_INTERVAL = 0.02
+    started_at = time.monotonic()
+    supervisor.run()
+    elapsed = time.monotonic() - started_at
+    assert supervisor.restarts == {0: 3}
+    assert supervisor.given_up == {0}
+    # waits of 0.1, 0.2 and 0.4 s, not a blocking sleep of the loop
+    assert 0.7 <= elapsed < 5
+
+
+def test_stop_collects_stats_and_stops_workers(quiet):
+    supervisor = BotSupervisor([('bot0', 'password', _IdleBot), ('bot1', 'password', _IdleBot)], n_workers=2,
+                               stats_interval=0.1)
+    supervisor.POLL_INTERVAL = 0.02
+    handler = signal.getsignal(signal.SIGINT)
+    rel.timeout(1, supervisor.stop)
+    supervisor.run()
+    assert supervisor.get_stats()['total'] == {'frames_sent': 2}
+    assert all(process.exitcode == 0 for process, conn in supervisor.workers.values())
+    assert supervisor.restarts == {0: 0, 1: 0}
+    assert signal.getsignal(signal.SIGINT) is handler
+
+
+def test_run_closes_the_bot_on_interrupt(quiet):
+    bot = UnconnectedBot('bot', 'password', ping_interval=0)
+    handler = signal.getsignal(signal.SIGINT)
+    rel.timeout(0.1, os.kill, os.getpid(), signal.SIGINT)
+    bot.run()
+    assert bot._closing
+    assert signal.getsignal(signal.SIGINT) is handler
@@ -0,0 +1,152 @@
+import random
+
+import pytest
+
+from .. import codes
+from ..bot import Message, MessageType
+from ..transfer import ChunkRelay, IncomingTransfer, OutgoingTransfer
+
+
+def _chunks(body, chunk_size=10):
+    return list(OutgoingTransfer(body, chunk_size, window=10 ** 9).chunks())
+
+
+def test_chunks_in_any_order():
+    body = bytes(range(256)) * 3
+    chunks = _chunks(body)
+    random.Random(0).shuffle(chunks)
+    incoming = IncomingTransfer(chunks[0][1])
+    completes = [incoming.add(msg_body, transfer) for msg_body, transfer in chunks + chunks[:3]]
+    assert completes[:len(chunks) - 1] == [False] * (len(chunks) - 1)
+    assert all(completes[len(chunks) - 1:])
+    assert incoming.open().read() == body
+
+
+def test_text_and_empty_bodies():
+    for body in ('héllo wörld', ''):
+        (msg_body, transfer), *rest = _chunks(body, 4)
+        incoming = IncomingTransfer(transfer)
+        for msg_body, transfer in [(msg_body, transfer)] + rest:
+            incoming.add(msg_body, transfer)
+        assert incoming.complete
+        assert incoming.open().read() == body
+
+
+@pytest.mark.parametrize('change', [
+    {'size': 31},                   # another size than the first chunk
+    {'count': 5},                   # another count
+    {'offset': 25},                 # past the end of the body
+    {'offset': -1},
+    {'offset': 5},                  # over the first chunk
+    {'index': 3},                   # no such chunk
+    {'index': '1'},
+])
+def test_chunks_disagreeing_with_the_body_are_refused(change):
+    (first_body, first), (msg_body, transfer), _ = _chunks(bytes(30))
+    incoming = IncomingTransfer(first)
+    incoming.add(first_body, first)
+    with pytest.raises(Exception):
+        incoming.add(msg_body, dict(transfer, **change))
+
+
+@pytest.mark.parametrize('transfer', [
+    {'id': 't', 'count': 0, 'size': 10},
+    {'id': 't', 'count': 11, 'size': 10},
+    {'id': 't', 'count': 1, 'size': -1},
+    {'id': 't', 'count': 1.5, 'size': 10},
+])
+def test_invalid_declarations_are_refused(transfer):
+    with pytest.raises(Exception):
+        IncomingTransfer(transfer)
+
+
+def test_bodies_go_whole_by_default(make_bot):
+    bot = make_bot()
+    bot.send_message(Message(MessageType.IMAGE, 'x' * 100000, 'CH0', ['user0'], 'bot'))
+    frame, = bot.ws.frames
+    assert frame['code'] == codes.MESSAGE_UP_IMAGE and 'transfer' not in frame['extra']
+    with pytest.raises(Exception):
+        bot.send_message(Message(MessageType.FILE, b'bytes', 'CH0', ['user0'], 'bot'))
+    assert not bot.transfers_out
+
+
+def test_stalled_transfers_are_dropped(make_bot):
+    bot = make_bot(chunk_size=10)
+    bot.send_message(Message(MessageType.FILE, bytes(100), 'CH0', ['user0'], 'bot'))
+    transfer, _ = next(iter(bot.transfers_out.values()))
+    assert len(bot.ws.frames) == 8     # the window
+    assert bot._transfer_timer is not None
+
+    bot._on_transfer_ack({'code': codes.COMMAND_DOWN_TRANSFER_ACK,
+                          'extra': {'transfer_id': transfer.id, 'received': 4}})
+    assert bot._check_transfers()
+    assert transfer.id in bot.transfers_out
+
+    transfer.updated_at -= bot.transfer_timeout
+    bot.connected = False
+    assert bot._check_transfers()
+    assert transfer.id in bot.transfers_out     # waiting for the connection
+    bot.connected = True
+    assert not bot._check_transfers()
+    assert transfer.dropped and not bot.transfers_out
+    assert bot.stats['transfers_dropped'] == 1
+    assert bot._transfer_timer is None
+
+
+def test_received_chunks_refused_when_inconsistent(make_bot):
+    bot = make_bot()
+    received = []
+    bot.on_receive_message = received.append
+    chunks = _chunks(bytes(30))
+
+    def frame(msg_body, transfer):
+        return {'code': codes.MESSAGE_DOWN_FILE, 'extra': {
+            'channel_id': 'CH0', 'from_user_id': 'user0', 'to_user_ids': ['bot'], 'msg_id': 'm0',
+            'origin': 'user', 'timestamp': 0, 'msg_body': msg_body, 'transfer': transfer}}
+
+    bot._on_receive_message_frame(frame(*chunks[0]))
+    msg_body, transfer = chunks[1]
+    bot._on_receive_message_frame(frame(msg_body, dict(transfer, offset=1000)))
+    assert bot.stats['transfers_refused'] == 1
+    assert not bot.transfers_in
+    for chunk in chunks:
+        bot._on_receive_message_frame(frame(*chunk))
+    assert len(received) == 1
+    assert received[0].file.read() == bytes(30)
+
+
+def _relay(relay, outgoing):
+    # chunks the window allows through the relay, and the acknowledgements back
+    for msg_body, transfer in list(outgoing.chunks()):
+        forward, received, rewind = relay.accept('user0', transfer)
+        if received is not None:
+            outgoing.acknowledge(received, rewind)
+
+
+def test_resume_after_the_last_ack_was_lost():
+    relay = ChunkRelay(ack_every=4)
+    outgoing = OutgoingTransfer(bytes(50), chunk_size=10)
+    chunks = list(outgoing.chunks())
+    for msg_body, transfer in chunks:
+        forward, received, rewind = relay.accept('user0', transfer)
+        # the acknowledgement of the last chunk is lost with the connection
+        if received is not None and received < outgoing.count:
+            outgoing.acknowledge(received, rewind)
+    assert outgoing.acked == 4 and not outgoing.done
+    outgoing.resume()
+    _relay(relay, outgoing)
+    assert outgoing.done and not outgoing.dropped
+    assert relay.stats['rewinds'] == 0
+
+
+def test_transfer_forgotten_by_the_relay_is_dropped(make_bot):
+    bot = make_bot(chunk_size=10)
+    bot.send_message(Message(MessageType.FILE, bytes(100), 'CH0', ['user0'], 'bot'))
+    transfer, _ = next(iter(bot.transfers_out.values()))
+    ack = {'code': codes.COMMAND_DOWN_TRANSFER_ACK, 'extra': {'transfer_id': transfer.id, 'received': 4}}
+    bot._on_transfer_ack(ack)
+    # the relay expired it, and asks again for the first chunk
+    bot._on_transfer_ack({'code': codes.COMMAND_DOWN_TRANSFER_ACK,
+                          'extra': {'transfer_id': transfer.id, 'received': 0, 'rewind': True}})
+    assert transfer.dropped and not bot.transfers_out
+    assert bot.stats['transfers_dropped'] == 1
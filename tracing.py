@@ -0,0 +1,234 @@
+"""
+Lightweight tracing of a frame through a service, from the moment it is
+received to the last frame sent because of it.
+
+A service with a `Tracer` opens a `Trace` per inbound frame in
+`_safe_handle` and makes it current (a contextvar, so asyncio tasks created
+while handling the frame carry it along). Stages then add their time to the
+current trace:
+
+    decode     json.loads of the frame
+    queue      waiting for the event loop before the handler runs
+    storage    `DatabaseAgent` calls (anything wrapped in `span('storage')`)
+    serialize  encoding outbound frames in `_safe_send`
+    socket     writing outbound frames to the websocket
+    handler    the rest: the handler's own code
+    total      receive to the end of handling
+
+When the frame is handled, the trace is folded into per-`type_code`
+histograms of each stage. With no current trace, `span` costs one
+contextvar lookup.
+"""
+import contextvars
+import functools
+import random
+import time
+
+from .envelope import TYPE_CODE_CARRIERS
+from .stats import Histogram
+
+STAGES = ('decode', 'queue', 'storage', 'serialize', 'socket', 'handler', 'total')
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """
+    Times of the stages of one inbound frame, in seconds.
+    """
+    __slots__ = ('tracer', 'received_at', 'timestamp', 'code', 'type_code', 'stages', '_lap', '_holds')
+
+    def __init__(self, tracer, timestamp=None) -> None:
+        self.tracer = tracer
+        self.received_at = self._lap = time.perf_counter()
+        self.timestamp = timestamp
+        self.code = None
+        self.type_code = None
+        self.stages = dict.fromkeys(STAGES[:-2], 0.0)
+        self._holds = 1
+
+    def set_frame(self, data):
+        """
+        Take code and type_code from the decoded frame, without parsing the
+        rest of a `LazyFrame`.
+        """
+        self.code = data['code']
+        type_code = getattr(data, 'type_code', None)
+        if type_code is None and self.code in TYPE_CODE_CARRIERS:
+            type_code = data['extra'].get('type_code')
+        self.type_code = type_code
+
+    def add(self, stage, elapsed):
+        self.stages[stage] += elapsed
+
+    def lap(self, stage):
+        """
+        Add the time since the previous lap (or the receive) to `stage`.
+        """
+        now = time.perf_counter()
+        self.stages[stage] += now - self._lap
+        self._lap = now
+
+    def hold(self):
+        """
+        Keep the trace open until a matching `release`, e.g. for a task
+        handling the frame after `_safe_handle` returned.
+        """
+        self._holds += 1
+
+    def release(self):
+        self._holds -= 1
+        if self._holds == 0:
+            self.tracer._finish(self, time.perf_counter())
+
+
+class Tracer:
+    """
+    Collects the traces of a service into per-type_code stage histograms.
+    `sample_rate` is the fraction of frames traced.
+    """
+
+    def __init__(self, sample_rate:float=1.0) -> None:
+        self.sample_rate = sample_rate
+        self.histograms = {}    # type_code -> {stage: Histogram}
+        self.slowest = {}       # type_code -> (total, timestamp, stages) of its slowest trace
+
+    def start(self, timestamp=None):
+        """
+        Open a trace for a frame just received and make it current.
+
+        Return:
+            `(trace, token)`, token being given back to `end`; `(None, None)`
+            for a frame left out by sampling.
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None, None
+        trace = Trace(self, timestamp)
+        return trace, _current.set(trace)
+
+    def end(self, trace, token):
+        """
+        Drop the hold `start` took and make the trace no longer current.
+        """
+        if trace is not None:
+            _current.reset(token)
+            trace.release()
+
+    def _finish(self, trace, now):
+        total = now - trace.received_at
+        stages = trace.stages
+        stages['handler'] = max(total - sum(stages.values()), 0.0)
+        stages['total'] = total
+        key = trace.type_code if trace.type_code is not None else trace.code
+        histograms = self.histograms.get(key)
+        if histograms is None:
+            histograms = self.histograms[key] = {stage: Histogram(Histogram.FINE_BOUNDS) for stage in STAGES}
+        for stage in STAGES:
+            histograms[stage].add(stages[stage])
+        slowest = self.slowest.get(key)
+        if slowest is None or total > slowest[0]:
+            self.slowest[key] = (total, trace.timestamp, dict(stages))
+
+    def snapshot(self) -> dict:
+        """
+        Per type_code and stage: count, avg, p50, p99, max; plus the stages of
+        the slowest trace and its receive `timestamp`.
+        """
+        snapshot = {}
+        for key, histograms in self.histograms.items():
+            snapshot[key] = {
+                stage: {
+                    'count': h.count,
+                    'avg': h.total / h.count if h.count else None,
+                    'p50': h.percentile(50),
+                    'p99': h.percentile(99),
+                    'max': h.max,
+                } for stage, h in histograms.items()
+            }
+            total, timestamp, stages = self.slowest[key]
+            snapshot[key]['slowest'] = {'timestamp': timestamp, 'stages': stages}
+        return snapshot
+
+    def report(self) -> str:
+        """
+        Text table of the average and p99 of each stage, in ms, per type_code.
+        """
+        lines = ['{:<8} {:>7}  {}'.format('type', 'count', '  '.join(f'{s:>15}' for s in STAGES)),
+                 '{:<8} {:>7}  {}'.format('', '', '  '.join(f'{"avg / p99 ms":>15}' for s in STAGES))]
+        for key in sorted(self.histograms, key=str):
+            histograms = self.histograms[key]
+            cells = []
+            for stage in STAGES:
+                h = histograms[stage]
+                cells.append(f'{h.total / h.count * 1e3:>7.3f}/{h.percentile(99) * 1e3:<7.3f}')
+            lines.append('{:<8} {:>7}  {}'.format(str(key), histograms['total'].count, '  '.join(cells)))
+        return '\n'.join(lines)
+
+
+def current():
+    """
+    The trace of the frame being handled, None if not traced.
+    """
+    return _current.get()
+
+
+def hold():
+    """
+    Hold the current trace open (see `Trace.hold`) and return it, None if not traced.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.hold()
+    return trace
+
+
+class span:
+    """
+    Add the time of a block to a stage of the current trace:
+
+        with span('storage'):
+            ...
+    """
+    __slots__ = ('stage', 'trace', 'started_at')
+
+    def __init__(self, stage:str) -> None:
+        self.stage = stage
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.stages[self.stage] += time.perf_counter() - self.started_at
+        return False
+
+
+def lap(stage:str):
+    """
+    `Trace.lap` of the current trace, if any.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.lap(stage)
+
+
+def traced(stage:str):
+    """
+    Decorator adding the time of every call to a stage of the current trace.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.stages[stage] += time.perf_counter() - started_at
+        return wrapper
+    return decorator
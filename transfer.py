@@ -0,0 +1,273 @@
+"""
+Chunked transfer of MESSAGE_UP_IMAGE / MESSAGE_UP_FILE bodies.
+
+A body sent whole is held several times over on its way: as the text of
+the frame, as the parsed dict and as the frame sent down again, and
+STATUS_ERROR_UPLOAD_FILE_TOO_LARGE is the only limit. In chunked mode the
+body goes as a series of ordinary message frames of the same type code,
+each with a slice of it in `msg_body` (base64) and a `transfer` dict:
+
+    id      transfer ID, chosen by the sender
+    index   of the chunk, from 0
+    count   chunks of the body
+    size    of the body in bytes
+    offset  of the chunk in the body
+    text    whether the body is a str (utf-8 encoded for the transfer)
+
+The CCS forwards each chunk down as soon as it arrives (`ChunkRelay`), so
+it holds no body at all, and acknowledges them to the sender with
+COMMAND_DOWN_TRANSFER_ACK: `received` is the number of chunks it has, in
+order. A sender keeps at most `WINDOW` chunks unacknowledged, reading them
+from the body when they are sent (`OutgoingTransfer`); a chunk missing
+(dropped by a send queue, or lost with a connection) makes the CCS drop the
+ones after it and answer `rewind: true`, and the sender goes back to
+`received`. After a reconnection, the sender resumes from the last
+acknowledged chunk, the CCS dropping those it already has, or answering
+`received: count` for a transfer it completed. A rewind to before the
+last acknowledged chunk means the CCS lost the transfer (e.g. it expired),
+and the sender drops it.
+
+Receivers write chunks at their offset into a spooled temporary file
+(`IncomingTransfer`), which moves to disk past `SPILL_SIZE`, and get the
+message once every chunk is there, the file in `msg_file` instead of
+`msg_body`. A chunk disagreeing with the first one on `count` or `size`,
+or outside the body, or over another, fails the transfer.
+
+Only GoddessService relays chunks, and only JSONSocketUser puts them back
+together, so senders use chunked mode when asked to (`chunk_size`), and
+drop a transfer the CCS stops acknowledging.
+"""
+import base64
+import bisect
+import io
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+
+CHUNK_SIZE = 48 * 1024      # bytes of body per chunk, 64 KiB once in base64
+WINDOW = 8                  # chunks a sender sends ahead of the last acknowledgement
+ACK_EVERY = 4               # chunks between acknowledgements of the CCS
+SPILL_SIZE = 1 << 20        # body size from which a receiver writes it to disk
+
+
+def new_transfer_id() -> str:
+    return uuid.uuid4().hex
+
+
+class OutgoingTransfer:
+    """
+    Sending side of a transfer. The body is a str, bytes or a binary file
+    opened for reading (at its start), read one chunk at a time.
+    """
+
+    def __init__(self, body, chunk_size:int=CHUNK_SIZE, window:int=WINDOW, transfer_id:str=None) -> None:
+        self.id = transfer_id or new_transfer_id()
+        self.text = isinstance(body, str)
+        if self.text:
+            body = body.encode('utf-8')
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            body = io.BytesIO(body)
+        self.file = body
+        self.size = body.seek(0, os.SEEK_END)
+        self.chunk_size = chunk_size
+        self.window = window
+        self.count = max(1, -(-self.size // chunk_size))
+        self.acked = 0      # chunks acknowledged by the CCS
+        self.sent = 0       # chunks sent, acknowledged or not
+        self.dropped = False
+        self.updated_at = time.monotonic()  # of the last acknowledgement, or resume
+
+    @property
+    def done(self) -> bool:
+        return self.acked >= self.count
+
+    def chunks(self):
+        """
+        Chunks the window allows to send now, as (msg_body, transfer) pairs.
+        """
+        while self.sent < min(self.count, self.acked + self.window):
+            index = self.sent
+            offset = index * self.chunk_size
+            self.file.seek(offset)
+            chunk = self.file.read(self.chunk_size)
+            self.sent += 1
+            yield base64.b64encode(chunk).decode('ascii'), {
+                'id': self.id, 'index': index, 'count': self.count, 'size': self.size, 'offset': offset,
+                'text': self.text,
+            }
+
+    def acknowledge(self, received:int, rewind:bool=False):
+        """
+        Account for an acknowledgement of the CCS. A rewind to before
+        `acked` can't be served, chunks before it being forgotten: the
+        transfer is `dropped`.
+        """
+        if rewind and received < self.acked:
+            self.dropped = True
+            return
+        self.updated_at = time.monotonic()
+        self.acked = max(self.acked, min(received, self.count))
+        if rewind:
+            self.sent = self.acked
+
+    def resume(self):
+        """
+        Send again from the last acknowledged chunk, e.g. after a reconnection.
+        """
+        self.updated_at = time.monotonic()
+        self.sent = self.acked
+
+
+class IncomingTransfer:
+    """
+    Receiving side of a transfer, chunks written at their offset, in any
+    order, into a `SpooledTemporaryFile`. The chunks must cover the body
+    declared by the first one, each byte once.
+    """
+
+    def __init__(self, transfer:dict, spill_size:int=SPILL_SIZE) -> None:
+        self.id = transfer['id']
+        self.count = transfer['count']
+        self.size = transfer['size']
+        if not (_is_int(self.count) and _is_int(self.size) and self.size >= 0 and 1 <= self.count <= max(1, self.size)):
+            raise Exception(f'transfer {self.id}: invalid count {self.count!r} or size {self.size!r}')
+        self.text = transfer.get('text', False)
+        self.file = tempfile.SpooledTemporaryFile(max_size=spill_size)
+        self.received = set()
+        self.extents = []   # (offset, end) of the chunks written, sorted
+        self.written = 0
+        self.updated_at = time.monotonic()
+
+    @property
+    def complete(self) -> bool:
+        return len(self.received) == self.count and self.written == self.size
+
+    def add(self, msg_body:str, transfer:dict) -> bool:
+        """
+        Write a chunk, a duplicate being ignored.
+
+        Return:
+            Whether every chunk is there.
+        """
+        self.updated_at = time.monotonic()
+        index = transfer.get('index')
+        offset = transfer.get('offset')
+        if transfer.get('count') != self.count or transfer.get('size') != self.size:
+            raise Exception(f'transfer {self.id}: chunk {index!r} declares another count or size')
+        if not (_is_int(index) and 0 <= index < self.count and _is_int(offset)):
+            raise Exception(f'transfer {self.id}: invalid chunk index {index!r} or offset {offset!r}')
+        if index in self.received:
+            return self.complete
+        chunk = base64.b64decode(msg_body, validate=True)
+        end = offset + len(chunk)
+        if offset < 0 or end > self.size or (not chunk and self.size):
+            raise Exception(f'transfer {self.id}: chunk {index} at {offset}-{end} outside the body of {self.size} bytes')
+        extents = self.extents
+        i = bisect.bisect(extents, (offset, end))
+        if (i and extents[i - 1][1] > offset) or (i < len(extents) and extents[i][0] < end):
+            raise Exception(f'transfer {self.id}: chunk {index} at {offset}-{end} overlaps another')
+        extents.insert(i, (offset, end))
+        self.file.seek(offset)
+        self.file.write(chunk)
+        self.written += len(chunk)
+        self.received.add(index)
+        return self.complete
+
+    def open(self):
+        """
+        The file of the body, at its start, a text file for a str body. Only
+        call once complete.
+        """
+        self.file.seek(0)
+        if self.text:
+            return io.TextIOWrapper(self.file, encoding='utf-8')
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class ChunkRelay:
+    """
+    Progress of the transfers going through a CCS: for each, the next chunk
+    expected. Nothing of the bodies is kept, and transfers not heard of for
+    `timeout` seconds, or beyond `max_transfers`, are forgotten (the oldest
+    first). The last `max_transfers` completed transfers are remembered, so
+    that a sender resuming one whose last acknowledgement was lost is told
+    it is complete.
+    """
+
+    def __init__(self, max_transfers:int=1024, timeout:float=300, ack_every:int=ACK_EVERY) -> None:
+        self.max_transfers = max_transfers
+        self.timeout = timeout
+        self.ack_every = ack_every
+        self.transfers = OrderedDict()  # (from_user_id, transfer id) -> [next index, chunk that caused the rewind]
+        self.completed = OrderedDict()  # (from_user_id, transfer id) -> None, the oldest first
+        self.stats = {'forwarded': 0, 'duplicates': 0, 'rewinds': 0, 'completed': 0, 'expired': 0}
+        self._seen_at = {}
+
+    def accept(self, from_user_id:str, transfer:dict):
+        """
+        Account for a chunk arriving.
+
+        Return:
+            (forward, received, rewind): whether to forward the chunk, and the
+            acknowledgement to send, `received` being None for none.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        key = (from_user_id, transfer['id'])
+        if key in self.completed:
+            self.stats['duplicates'] += 1
+            return False, transfer['count'], False
+        state = self.transfers.get(key)
+        if state is None:
+            state = self.transfers[key] = [0, None]
+        self.transfers.move_to_end(key)
+        self._seen_at[key] = now
+
+        index = transfer['index']
+        count = transfer['count']
+        expected = state[0]
+        if index < expected:
+            self.stats['duplicates'] += 1
+            return False, expected, False
+        if index > expected:
+            # one rewind per gap, the chunks in flight after the first dropped quietly;
+            # that one coming again means the chunks sent after the rewind were lost too
+            if state[1] is not None and index > state[1]:
+                return False, None, False
+            state[1] = index
+            self.stats['rewinds'] += 1
+            return False, expected, True
+
+        state[0] = received = expected + 1
+        state[1] = None
+        self.stats['forwarded'] += 1
+        if received >= count:
+            self._forget(key)
+            self.completed[key] = None
+            if len(self.completed) > self.max_transfers:
+                self.completed.popitem(last=False)
+            self.stats['completed'] += 1
+            return True, received, False
+        return True, received if received % self.ack_every == 0 else None, False
+
+    def _forget(self, key):
+        self.transfers.pop(key, None)
+        self._seen_at.pop(key, None)
+
+    def _expire(self, now):
+        transfers = self.transfers
+        while transfers:
+            key = next(iter(transfers))
+            if len(transfers) <= self.max_transfers and now - self._seen_at[key] < self.timeout:
+                break
+            self._forget(key)
+            self.stats['expired'] += 1